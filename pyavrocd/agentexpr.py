@@ -0,0 +1,315 @@
+"""
+This module implements an interpreter for GDB agent expressions, which are used
+for evaluating breakpoint conditions and breakpoint commands (dprintf) on the server side.
+"""
+
+# args, logging
+from logging import getLogger
+import re
+
+# Errors
+from pyavrocd.errors import AgentExpressionError
+
+# opcodes of the agent expression bytecode (see GDB's ax.def)
+OP_ADD = 0x02
+OP_SUB = 0x03
+OP_MUL = 0x04
+OP_DIV_SIGNED = 0x05
+OP_DIV_UNSIGNED = 0x06
+OP_REM_SIGNED = 0x07
+OP_REM_UNSIGNED = 0x08
+OP_LSH = 0x09
+OP_RSH_SIGNED = 0x0A
+OP_RSH_UNSIGNED = 0x0B
+OP_LOG_NOT = 0x0E
+OP_BIT_AND = 0x0F
+OP_BIT_OR = 0x10
+OP_BIT_XOR = 0x11
+OP_BIT_NOT = 0x12
+OP_EQUAL = 0x13
+OP_LESS_SIGNED = 0x14
+OP_LESS_UNSIGNED = 0x15
+OP_EXT = 0x16
+OP_REF8 = 0x17
+OP_REF16 = 0x18
+OP_REF32 = 0x19
+OP_REF64 = 0x1A
+OP_IF_GOTO = 0x20
+OP_GOTO = 0x21
+OP_CONST8 = 0x22
+OP_CONST16 = 0x23
+OP_CONST32 = 0x24
+OP_CONST64 = 0x25
+OP_REG = 0x26
+OP_END = 0x27
+OP_DUP = 0x28
+OP_POP = 0x29
+OP_ZERO_EXT = 0x2A
+OP_SWAP = 0x2B
+OP_GETV = 0x2C
+OP_SETV = 0x2D
+OP_TRACEV = 0x2E
+OP_PICK = 0x32
+OP_ROT = 0x33
+OP_PRINTF = 0x34
+
+MASK64 = (1 << 64) - 1
+MAXSTEPS = 10000 # upper bound for executed bytecodes (protection against endless loops)
+MAXSTRING = 256 # maximal length of strings printed with %s
+
+# C escape sequences in format strings
+ESCAPES = { 'a' : '\a', 'b' : '\b', 'e' : '\x1b', 'f' : '\f', 'n' : '\n', 'r' : '\r',
+            't' : '\t', 'v' : '\v', '\\' : '\\', '"' : '"', "'" : "'", '?' : '?' }
+
+# conversion specifications of printf
+CONVSPEC = re.compile(r'%([-+ #0]*)(\d*)((?:\.\d*)?)(hh|h|ll|l|j|z|t)?([diouxXcsp%])')
+
+# sizes in bits of integer arguments on AVR, depending on the length modifier
+ARGBITS = { None : 16, 'hh' : 8, 'h' : 16, 'l' : 32, 'll' : 64, 'j' : 64, 'z' : 16, 't' : 16 }
+
+def _signed(value):
+    """
+    Interpret a 64-bit value as a signed number
+    """
+    return value - (1 << 64) if value & (1 << 63) else value
+
+class AgentExpression():
+    """
+    A single agent expression. The bytecode is executed by evaluate using
+    a function for reading registers and one for reading memory.
+    """
+
+    def __init__(self, code):
+        self.code = bytes(code)
+        self.logger = getLogger('pyavrocd.agentexpr')
+
+    @staticmethod
+    def parse_list(text):
+        """
+        Parse a sequence of agent expressions in the form 'Xlen,hexbytes' as
+        used in Z packets and return the list of expressions.
+        Raises AgentExpressionError if the syntax is not correct.
+        """
+        exprs = []
+        while text:
+            if text[0] != 'X' or ',' not in text:
+                raise AgentExpressionError("Ill-formed agent expression: %s" % text)
+            length, text = text[1:].split(',', 1)
+            try:
+                size = int(length, 16)
+                code = bytes.fromhex(text[:2*size])
+            except ValueError as e:
+                raise AgentExpressionError("Ill-formed agent expression: %s" % text) from e
+            if len(code) != size:
+                raise AgentExpressionError("Agent expression too short")
+            exprs.append(AgentExpression(code))
+            text = text[2*size:]
+        return exprs
+
+    @staticmethod
+    def parse_params(params):
+        """
+        Parse the parameters following the address in a Z packet, i.e., conditions
+        'Xlen,hexbytes...' and commands 'cmds:persist,Xlen,hexbytes...' (the persist
+        flag is ignored), and return the lists of conditions and commands.
+        Raises AgentExpressionError if the syntax is not correct.
+        """
+        conditions = []
+        commands = []
+        for param in params:
+            if param.startswith("X"): # conditions to be evaluated by the server
+                conditions += AgentExpression.parse_list(param)
+            elif param.startswith("cmds:"):
+                commands += AgentExpression.parse_list(param[7:])
+        return conditions, commands
+
+    def evaluate(self, read_register, read_memory, output=None): #pylint: disable=too-many-branches
+        """
+        Execute the bytecode and return the value on top of the stack when the
+        end opcode is reached. read_register(num) returns the value of GDB register num,
+        read_memory(addr, size) returns size bytes at addr (GDB address space), and
+        output(text) is used by the printf opcode.
+        Raises AgentExpressionError if the expression cannot be evaluated.
+        """
+        stack = []
+        pc = 0
+        steps = 0
+        try:
+            while True:
+                steps += 1
+                if steps > MAXSTEPS:
+                    raise AgentExpressionError("Agent expression does not terminate")
+                op = self.code[pc]
+                pc += 1
+                if op == OP_END:
+                    return stack[-1] if stack else 0
+                if OP_ADD <= op <= OP_RSH_UNSIGNED or OP_BIT_AND <= op <= OP_BIT_XOR or \
+                  OP_EQUAL <= op <= OP_LESS_UNSIGNED:
+                    b = stack.pop()
+                    a = stack.pop()
+                    stack.append(self._binary_op(op, a, b) & MASK64)
+                elif op == OP_LOG_NOT:
+                    stack.append(int(stack.pop() == 0))
+                elif op == OP_BIT_NOT:
+                    stack.append(~stack.pop() & MASK64)
+                elif op in (OP_EXT, OP_ZERO_EXT):
+                    bits = self.code[pc]
+                    pc += 1
+                    value = stack.pop() & ((1 << bits) - 1)
+                    if op == OP_EXT and value & (1 << (bits - 1)):
+                        value = (value - (1 << bits)) & MASK64
+                    stack.append(value)
+                elif OP_REF8 <= op <= OP_REF64:
+                    size = 1 << (op - OP_REF8)
+                    data = read_memory(stack.pop(), size)
+                    if len(data) != size:
+                        raise AgentExpressionError("Memory not readable")
+                    stack.append(int.from_bytes(data, byteorder='little'))
+                elif op in (OP_IF_GOTO, OP_GOTO):
+                    target = int.from_bytes(self.code[pc:pc+2], byteorder='big')
+                    pc += 2
+                    if op == OP_GOTO or stack.pop():
+                        pc = target
+                elif OP_CONST8 <= op <= OP_CONST64:
+                    size = 1 << (op - OP_CONST8)
+                    stack.append(int.from_bytes(self.code[pc:pc+size], byteorder='big'))
+                    pc += size
+                elif op == OP_REG:
+                    stack.append(read_register(int.from_bytes(self.code[pc:pc+2], byteorder='big')))
+                    pc += 2
+                elif op == OP_DUP:
+                    stack.append(stack[-1])
+                elif op == OP_POP:
+                    stack.pop()
+                elif op == OP_SWAP:
+                    stack[-1], stack[-2] = stack[-2], stack[-1]
+                elif op == OP_PICK:
+                    stack.append(stack[-1 - self.code[pc]])
+                    pc += 1
+                elif op == OP_ROT:
+                    stack[-3], stack[-2], stack[-1] = stack[-1], stack[-3], stack[-2]
+                elif op == OP_PRINTF:
+                    nargs = self.code[pc]
+                    slen = int.from_bytes(self.code[pc+1:pc+3], byteorder='big')
+                    fmt = self.code[pc+3:pc+3+slen]
+                    pc += 3 + slen
+                    if len(fmt) != slen or not fmt or fmt[-1] != 0:
+                        raise AgentExpressionError("Unterminated format string in printf")
+                    stack.pop() # function
+                    stack.pop() # channel
+                    args = [ stack.pop() for _ in range(nargs) ]
+                    text = self.format(fmt[:-1].decode('latin-1'), args, read_memory)
+                    if output:
+                        output(text)
+                elif op in (OP_GETV, OP_SETV, OP_TRACEV):
+                    raise AgentExpressionError("Trace state variables are not supported")
+                else:
+                    raise AgentExpressionError("Unsupported agent expression opcode 0x%02X" % op)
+        except IndexError as e:
+            raise AgentExpressionError("Stack underflow or bytecode overrun") from e
+        except ZeroDivisionError as e:
+            raise AgentExpressionError("Division by zero") from e
+
+    @staticmethod
+    def _binary_op(op, a, b): #pylint: disable=too-many-return-statements
+        """
+        Compute the result of a binary operation, with b being the top of the stack
+        """
+        if op == OP_ADD:
+            return a + b
+        if op == OP_SUB:
+            return a - b
+        if op == OP_MUL:
+            return a * b
+        if op == OP_DIV_SIGNED:
+            quot = abs(_signed(a)) // abs(_signed(b)) # C semantics: truncate toward zero
+            return -quot if (_signed(a) < 0) != (_signed(b) < 0) else quot
+        if op == OP_DIV_UNSIGNED:
+            return a // b
+        if op == OP_REM_SIGNED:
+            rem = abs(_signed(a)) % abs(_signed(b))
+            return -rem if _signed(a) < 0 else rem
+        if op == OP_REM_UNSIGNED:
+            return a % b
+        if op == OP_LSH:
+            return a << (b & 0x3F)
+        if op == OP_RSH_SIGNED:
+            return _signed(a) >> (b & 0x3F)
+        if op == OP_RSH_UNSIGNED:
+            return a >> (b & 0x3F)
+        if op == OP_BIT_AND:
+            return a & b
+        if op == OP_BIT_OR:
+            return a | b
+        if op == OP_BIT_XOR:
+            return a ^ b
+        if op == OP_EQUAL:
+            return int(a == b)
+        if op == OP_LESS_SIGNED:
+            return int(_signed(a) < _signed(b))
+        return int(a < b) # OP_LESS_UNSIGNED
+
+    @staticmethod
+    def format(fmt, args, read_memory):
+        """
+        Format the arguments according to the C format string fmt, interpreting
+        integer arguments with the type sizes of AVR-GCC. Strings (%s) are read
+        from SRAM by using read_memory.
+        """
+        fmt = AgentExpression._unescape(fmt)
+        args = list(args)
+        result = ""
+        pos = 0
+        for match in CONVSPEC.finditer(fmt):
+            result += fmt[pos:match.start()]
+            pos = match.end()
+            flags, width, precision, length, conv = match.groups()
+            if conv == '%':
+                result += '%'
+                continue
+            if not args:
+                raise AgentExpressionError("Too few arguments for printf")
+            value = args.pop(0)
+            spec = '%' + flags + width + precision
+            if conv == 's':
+                addr = 0x800000 + (value & 0xFFFF)
+                text = bytearray()
+                while len(text) < MAXSTRING:
+                    char = read_memory(addr + len(text), 1)
+                    if not char or char[0] == 0:
+                        break
+                    text += char
+                result += (spec + 's') % text.decode('latin-1')
+            elif conv == 'c':
+                result += (spec + 'c') % chr(value & 0xFF)
+            elif conv == 'p':
+                result += (spec + 's') % ("0x%x" % (value & 0xFFFF))
+            else:
+                bits = ARGBITS[length]
+                value &= (1 << bits) - 1
+                if conv in 'di' and value & (1 << (bits - 1)):
+                    value -= 1 << bits
+                result += (spec + ('d' if conv in 'diu' else conv)) % value
+        return result + fmt[pos:]
+
+    @staticmethod
+    def _unescape(text):
+        """
+        Replace C escape sequences in text
+        """
+        result = ""
+        i = 0
+        while i < len(text):
+            if text[i] == '\\' and i + 1 < len(text):
+                if text[i+1] in ESCAPES:
+                    result += ESCAPES[text[i+1]]
+                    i += 2
+                    continue
+                octal = re.match(r'[0-7]{1,3}', text[i+1:])
+                if octal:
+                    result += chr(int(octal.group(0), 8))
+                    i += 1 + len(octal.group(0))
+                    continue
+            result += text[i]
+            i += 1
+        return result
@@ -0,0 +1,486 @@
+"""
+This module implements the CPU of a classic AVR core for the instruction-set simulator.
+"""
+
+# modes of data breakpoints
+from pyavrocd.xavr8target import HWBP_DATA_READ, HWBP_DATA_WRITE
+
+BREAKCODE = 0x9598
+
+SREG = 0x5F
+SPH = 0x5E
+SPL = 0x5D
+EIND = 0x5C
+RAMPZ = 0x5B
+
+# SREG bits
+C = 0x01
+Z = 0x02
+N = 0x04
+V = 0x08
+S = 0x10
+H = 0x20
+T = 0x40
+I = 0x80
+
+class AvrCore():
+    """
+    The CPU of a classic AVR (avr2 to avr6 instruction sets): register file, I/O space,
+    and SRAM in one data space, flash, and EEPROM. Peripherals and interrupts are not
+    simulated. The PC is a word address. step executes one instruction and returns
+    'break' if a BREAK instruction has been reached (without executing it), else None.
+    If watch is set to a dict mapping data addresses to HWBP_DATA_* modes, matching
+    accesses are recorded in watch_hit.
+    """
+    #pylint: disable=too-many-instance-attributes
+    def __init__(self, flash_size, sram_start, sram_size, eeprom_size):
+        self.flash = bytearray([0xFF]*flash_size)
+        self.sram_start = sram_start
+        self.data = bytearray(sram_start + sram_size)
+        self.eeprom = bytearray([0xFF]*eeprom_size)
+        self.big_flash = flash_size > 128*1024
+        self.pc = 0
+        self.cycles = 0
+        self.watch = {}
+        self.watch_hit = None
+
+    def reset(self):
+        """
+        Reset registers, I/O space, SP, and PC; SRAM keeps its contents
+        """
+        self.data[:self.sram_start] = bytes(self.sram_start)
+        sp = len(self.data) - 1
+        self.data[SPL] = sp & 0xFF
+        self.data[SPH] = sp >> 8
+        self.pc = 0
+
+    def word(self, pc):
+        """
+        Returns the flash word at word address pc
+        """
+        addr = (pc << 1) % len(self.flash)
+        return self.flash[addr] | (self.flash[addr+1] << 8)
+
+    @staticmethod
+    def two_word(opcode):
+        """
+        Returns True iff opcode is the first word of LDS, STS, JMP, or CALL
+        """
+        return (opcode & 0xFC0F) == 0x9000 or (opcode & 0xFE0C) == 0x940C
+
+    def read_data(self, addr):
+        """
+        Read a byte from data space
+        """
+        if self.watch and addr in self.watch and self.watch[addr] != HWBP_DATA_WRITE:
+            self.watch_hit = addr
+        if addr < len(self.data):
+            return self.data[addr]
+        return 0
+
+    def write_data(self, addr, value):
+        """
+        Write a byte into data space
+        """
+        if self.watch and addr in self.watch and self.watch[addr] != HWBP_DATA_READ:
+            self.watch_hit = addr
+        if addr < len(self.data):
+            self.data[addr] = value & 0xFF
+
+    def sp(self):
+        """
+        Returns the stack pointer
+        """
+        return self.data[SPL] | (self.data[SPH] << 8)
+
+    def _set_sp(self, value):
+        value &= 0xFFFF
+        self.data[SPL] = value & 0xFF
+        self.data[SPH] = value >> 8
+
+    def _push(self, value):
+        sp = self.sp()
+        self.write_data(sp, value)
+        self._set_sp(sp - 1)
+
+    def _pop(self):
+        sp = self.sp() + 1
+        self._set_sp(sp)
+        return self.read_data(sp)
+
+    def _push_pc(self, pc):
+        self._push(pc & 0xFF)
+        self._push((pc >> 8) & 0xFF)
+        if self.big_flash:
+            self._push((pc >> 16) & 0xFF)
+
+    def _pop_pc(self):
+        pc = 0
+        if self.big_flash:
+            pc = self._pop() << 16
+        pc |= self._pop() << 8
+        return pc | self._pop()
+
+    def _reg16(self, num):
+        return self.data[num] | (self.data[num+1] << 8)
+
+    def _set_reg16(self, num, value):
+        self.data[num] = value & 0xFF
+        self.data[num+1] = (value >> 8) & 0xFF
+
+    def _set_flags(self, mask, flags):
+        """
+        Replace the SREG bits in mask with flags, computing S from N and V if S is in mask
+        """
+        if mask & S:
+            flags = (flags & ~S) | (S if bool(flags & N) != bool(flags & V) else 0)
+        self.data[SREG] = (self.data[SREG] & ~mask & 0xFF) | (flags & mask)
+
+    @staticmethod
+    def _nz(res):
+        return (Z if res == 0 else 0) | (N if res & 0x80 else 0)
+
+    def _add(self, rd, rr, carry):
+        res = (rd + rr + carry) & 0xFF
+        cbits = (rd & rr) | (rr & ~res) | (~res & rd)
+        vbit = ((rd & rr & ~res) | (~rd & ~rr & res)) & 0x80
+        self._set_flags(H|S|V|N|Z|C, (H if cbits & 0x08 else 0) | (V if vbit else 0) |
+                            (C if cbits & 0x80 else 0) | self._nz(res))
+        return res
+
+    def _sub(self, rd, rr, carry, keep_z=False):
+        res = (rd - rr - carry) & 0xFF
+        bbits = (~rd & rr) | (rr & res) | (res & ~rd)
+        vbit = ((rd & ~rr & ~res) | (~rd & rr & res)) & 0x80
+        flags = (H if bbits & 0x08 else 0) | (V if vbit else 0) | \
+          (C if bbits & 0x80 else 0) | self._nz(res)
+        if keep_z and res == 0:
+            flags = (flags & ~Z) | (self.data[SREG] & Z)
+        self._set_flags(H|S|V|N|Z|C, flags)
+        return res
+
+    def _logic(self, res):
+        self._set_flags(S|V|N|Z, self._nz(res))
+        return res
+
+    def _skip(self):
+        """
+        Skip the next instruction, returns the additional cycles
+        """
+        words = 2 if self.two_word(self.word(self.pc)) else 1
+        self.pc += words
+        return words
+
+    def _index(self, opcode):
+        """
+        Returns the base register of a LD/ST instruction with X, Y, or Z
+        """
+        return { 0x0C: 26, 0x08: 28, 0x00: 30, 0x04: 30 }[opcode & 0x0C]
+
+    def _indirect(self, opcode):
+        """
+        Computes the address of LD/ST X/Y/Z with pre-decrement or post-increment
+        and updates the index register
+        """
+        base = self._index(opcode)
+        addr = self._reg16(base)
+        mode = opcode & 0x03
+        if mode == 2:
+            addr = (addr - 1) & 0xFFFF
+            self._set_reg16(base, addr)
+        elif mode == 1:
+            self._set_reg16(base, addr + 1)
+        return addr
+
+    def _mul(self, rd, rr, fractional=False):
+        res = (rd * rr) & 0xFFFF
+        carry = bool(res & 0x8000)
+        if fractional:
+            res = (res << 1) & 0xFFFF
+        self._set_reg16(0, res)
+        self._set_flags(Z|C, (Z if res == 0 else 0) | (C if carry else 0))
+
+    @staticmethod
+    def _signed(value):
+        return value - 0x100 if value & 0x80 else value
+
+    #pylint: disable=too-many-return-statements,too-many-branches,too-many-statements,too-many-locals
+    def step(self, opcode=None):
+        """
+        Execute the instruction at PC, or opcode if given (e.g., the original instruction
+        at a software breakpoint)
+        """
+        data = self.data
+        if opcode is None:
+            opcode = self.word(self.pc)
+        if opcode == BREAKCODE:
+            return 'break'
+        pc = self.pc
+        self.pc += 1
+        cycles = 1
+        d = (opcode >> 4) & 0x1F
+        rr = (opcode & 0x0F) | ((opcode >> 5) & 0x10)
+        hi = opcode >> 12
+        if hi == 0:
+            sel = (opcode >> 10) & 0x03
+            if sel == 0:
+                if opcode & 0x0300 == 0x0100: # MOVW
+                    dd, rr = ((opcode >> 4) & 0x0F) << 1, (opcode & 0x0F) << 1
+                    data[dd:dd+2] = data[rr:rr+2]
+                elif opcode & 0x0300 == 0x0200: # MULS
+                    self._mul(self._signed(data[16 + ((opcode >> 4) & 0x0F)]),
+                                  self._signed(data[16 + (opcode & 0x0F)]))
+                    cycles = 2
+                elif opcode & 0x0300 == 0x0300: # MULSU, FMUL, FMULS, FMULSU
+                    rd, rr = data[16 + ((opcode >> 4) & 0x07)], data[16 + (opcode & 0x07)]
+                    kind = opcode & 0x88
+                    if kind == 0x00:
+                        self._mul(self._signed(rd), rr)
+                    elif kind == 0x08:
+                        self._mul(rd, rr, fractional=True)
+                    elif kind == 0x80:
+                        self._mul(self._signed(rd), self._signed(rr), fractional=True)
+                    else:
+                        self._mul(self._signed(rd), rr, fractional=True)
+                    cycles = 2
+                # else NOP
+            elif sel == 1: # CPC
+                self._sub(data[d], data[rr], data[SREG] & C, keep_z=True)
+            elif sel == 2: # SBC
+                data[d] = self._sub(data[d], data[rr], data[SREG] & C, keep_z=True)
+            else: # ADD
+                data[d] = self._add(data[d], data[rr], 0)
+        elif hi == 1:
+            sel = (opcode >> 10) & 0x03
+            if sel == 0: # CPSE
+                if data[d] == data[rr]:
+                    cycles += self._skip()
+            elif sel == 1: # CP
+                self._sub(data[d], data[rr], 0)
+            elif sel == 2: # SUB
+                data[d] = self._sub(data[d], data[rr], 0)
+            else: # ADC
+                data[d] = self._add(data[d], data[rr], data[SREG] & C)
+        elif hi == 2:
+            sel = (opcode >> 10) & 0x03
+            if sel == 0: # AND
+                data[d] = self._logic(data[d] & data[rr])
+            elif sel == 1: # EOR
+                data[d] = self._logic(data[d] ^ data[rr])
+            elif sel == 2: # OR
+                data[d] = self._logic(data[d] | data[rr])
+            else: # MOV
+                data[d] = data[rr]
+        elif hi in (3, 4, 5, 6, 7, 14):
+            rd = 16 + ((opcode >> 4) & 0x0F)
+            k = ((opcode >> 4) & 0xF0) | (opcode & 0x0F)
+            if hi == 3: # CPI
+                self._sub(data[rd], k, 0)
+            elif hi == 4: # SBCI
+                data[rd] = self._sub(data[rd], k, data[SREG] & C, keep_z=True)
+            elif hi == 5: # SUBI
+                data[rd] = self._sub(data[rd], k, 0)
+            elif hi == 6: # ORI
+                data[rd] = self._logic(data[rd] | k)
+            elif hi == 7: # ANDI
+                data[rd] = self._logic(data[rd] & k)
+            else: # LDI
+                data[rd] = k
+        elif hi in (8, 10): # LDD/STD
+            disp = ((opcode >> 8) & 0x20) | ((opcode >> 7) & 0x18) | (opcode & 0x07)
+            addr = (self._reg16(28 if opcode & 0x08 else 30) + disp) & 0xFFFF
+            if opcode & 0x0200:
+                self.write_data(addr, data[d])
+            else:
+                data[d] = self.read_data(addr)
+            cycles = 2
+        elif hi == 9:
+            cycles = self._step_9xxx(opcode, pc, d)
+            if cycles is None:
+                return None
+        elif hi == 11: # IN/OUT
+            addr = 0x20 + (((opcode >> 5) & 0x30) | (opcode & 0x0F))
+            if opcode & 0x0800:
+                self.write_data(addr, data[d])
+            else:
+                data[d] = self.read_data(addr)
+        elif hi == 12: # RJMP
+            self.pc = pc + 1 + (((opcode & 0x0FFF) ^ 0x800) - 0x800)
+            cycles = 2
+        elif hi == 13: # RCALL
+            self._push_pc(pc + 1)
+            self.pc = pc + 1 + (((opcode & 0x0FFF) ^ 0x800) - 0x800)
+            cycles = 4 if self.big_flash else 3
+        else: # hi == 15
+            bit = opcode & 0x07
+            if opcode & 0x0800 == 0: # BRBS, BRBC
+                taken = bool(data[SREG] & (1 << bit)) != bool(opcode & 0x0400)
+                if taken:
+                    self.pc = pc + 1 + ((((opcode >> 3) & 0x7F) ^ 0x40) - 0x40)
+                    cycles = 2
+            elif opcode & 0x0600 == 0x0000: # BLD
+                data[d] = (data[d] & ~(1 << bit) & 0xFF) | ((1 << bit) if data[SREG] & T else 0)
+            elif opcode & 0x0600 == 0x0200: # BST
+                self._set_flags(T, T if data[d] & (1 << bit) else 0)
+            else: # SBRC, SBRS
+                if bool(data[d] & (1 << bit)) == bool(opcode & 0x0200):
+                    cycles += self._skip()
+        self.cycles += cycles
+        return None
+
+    def _step_9xxx(self, opcode, pc, d):
+        """
+        Instructions with opcodes 0x9000-0x9FFF. Returns the number of cycles.
+        """
+        data = self.data
+        sub = opcode & 0x0F
+        if opcode & 0x0C00 == 0x0000: # loads and stores
+            store = opcode & 0x0200
+            if sub == 0: # LDS, STS
+                addr = self.word(self.pc)
+                self.pc += 1
+                if store:
+                    self.write_data(addr, data[d])
+                else:
+                    data[d] = self.read_data(addr)
+                return 2
+            if sub == 0x0F: # PUSH, POP
+                if store:
+                    self._push(data[d])
+                else:
+                    data[d] = self._pop()
+                return 2
+            if not store and sub in (4, 5, 6, 7): # LPM, ELPM
+                zaddr = self._reg16(30)
+                if sub >= 6:
+                    zaddr |= data[RAMPZ] << 16
+                data[d] = self.flash[zaddr % len(self.flash)]
+                if sub & 1:
+                    zaddr += 1
+                    self._set_reg16(30, zaddr)
+                    if sub >= 6:
+                        data[RAMPZ] = (zaddr >> 16) & 0xFF
+                return 3
+            if store and sub in (4, 5, 6, 7): # XCH, LAS, LAC, LAT
+                addr = self._reg16(30)
+                old = self.read_data(addr)
+                new = { 4: data[d], 5: old | data[d], 6: old & ~data[d] & 0xFF,
+                            7: old ^ data[d] }[sub]
+                self.write_data(addr, new)
+                data[d] = old
+                return 2
+            if sub in (3, 8, 11):
+                return 1 # reserved
+            addr = self._indirect(opcode)
+            if store:
+                self.write_data(addr, data[d])
+            else:
+                data[d] = self.read_data(addr)
+            return 2
+        if opcode & 0x0E00 == 0x0400: # 1001 010x xxxx xxxx
+            return self._step_94xx(opcode, pc, d, sub)
+        if opcode & 0x0F00 in (0x0600, 0x0700): # ADIW, SBIW
+            dd = 24 + ((opcode >> 3) & 0x06)
+            k = ((opcode >> 2) & 0x30) | (opcode & 0x0F)
+            old = self._reg16(dd)
+            if opcode & 0x0100:
+                res = (old - k) & 0xFFFF
+                carry = res > old
+                ovf = (old & 0x8000) and not res & 0x8000
+            else:
+                res = (old + k) & 0xFFFF
+                carry = res < old
+                ovf = not old & 0x8000 and (res & 0x8000)
+            self._set_reg16(dd, res)
+            self._set_flags(S|V|N|Z|C, (V if ovf else 0) | (N if res & 0x8000 else 0) |
+                                (Z if res == 0 else 0) | (C if carry else 0))
+            return 2
+        if opcode & 0x0C00 == 0x0800: # CBI, SBIC, SBI, SBIS
+            addr = 0x20 + ((opcode >> 3) & 0x1F)
+            mask = 1 << (opcode & 0x07)
+            kind = opcode & 0x0300
+            if kind == 0x0000:
+                self.write_data(addr, self.read_data(addr) & ~mask)
+                return 2
+            if kind == 0x0200:
+                self.write_data(addr, self.read_data(addr) | mask)
+                return 2
+            if bool(self.read_data(addr) & mask) == bool(kind == 0x0300):
+                return 1 + self._skip()
+            return 1
+        # MUL
+        rr = (opcode & 0x0F) | ((opcode >> 5) & 0x10)
+        self._mul(data[d], data[rr])
+        return 2
+
+    def _step_94xx(self, opcode, pc, d, sub):
+        """
+        Instructions 1001 010x xxxx xxxx. Returns the number of cycles, or None if
+        the instruction has not been executed (BREAK).
+        """
+        data = self.data
+        retsize = 3 if self.big_flash else 2
+        if sub in (0x0C, 0x0D, 0x0E, 0x0F): # JMP, CALL
+            target = (((opcode >> 3) & 0x3E) | (opcode & 0x01)) << 16 | self.word(self.pc)
+            if sub >= 0x0E:
+                self._push_pc(pc + 2)
+                self.pc = target
+                return 2 + retsize
+            self.pc = target
+            return 3
+        if sub == 0x08:
+            if opcode & 0x0100 == 0: # BSET, BCLR
+                bit = 1 << ((opcode >> 4) & 0x07)
+                self._set_flags(bit, 0 if opcode & 0x0080 else bit)
+                return 1
+            kind = opcode & 0x00F0
+            if kind in (0x00, 0x10): # RET, RETI
+                self.pc = self._pop_pc()
+                if kind == 0x10:
+                    data[SREG] |= I
+                return 2 + retsize
+            if kind == 0x90: # BREAK
+                self.pc = pc
+                return None
+            if kind in (0xC0, 0xD0): # LPM, ELPM (r0)
+                zaddr = self._reg16(30) | ((data[RAMPZ] << 16) if kind == 0xD0 else 0)
+                data[0] = self.flash[zaddr % len(self.flash)]
+                return 3
+            return 1 # SLEEP, WDR, SPM: no effect
+        if sub == 0x09: # IJMP, EIJMP, ICALL, EICALL
+            target = self._reg16(30) | ((data[EIND] << 16) if opcode & 0x0010 else 0)
+            if opcode & 0x0100:
+                self._push_pc(pc + 1)
+                self.pc = target
+                return 1 + retsize
+            self.pc = target
+            return 2
+        val = data[d]
+        if sub == 0x00: # COM
+            res = ~val & 0xFF
+            self._set_flags(S|V|N|Z|C, self._nz(res) | C)
+        elif sub == 0x01: # NEG
+            res = self._sub(0, val, 0)
+        elif sub == 0x02: # SWAP
+            res = ((val << 4) | (val >> 4)) & 0xFF
+        elif sub == 0x03: # INC
+            res = (val + 1) & 0xFF
+            self._set_flags(S|V|N|Z, self._nz(res) | (V if res == 0x80 else 0))
+        elif sub in (0x05, 0x06, 0x07): # ASR, LSR, ROR
+            if sub == 0x05:
+                res = (val >> 1) | (val & 0x80)
+            elif sub == 0x06:
+                res = val >> 1
+            else:
+                res = (val >> 1) | (0x80 if data[SREG] & C else 0)
+            carry = val & 0x01
+            neg = res & 0x80
+            self._set_flags(S|V|N|Z|C, self._nz(res) | (C if carry else 0) |
+                                (V if bool(neg) != bool(carry) else 0))
+        elif sub == 0x0A: # DEC
+            res = (val - 1) & 0xFF
+            self._set_flags(S|V|N|Z, self._nz(res) | (V if res == 0x7F else 0))
+        else:
+            return 1 # reserved or not supported (DES)
+        data[d] = res
+        return 1
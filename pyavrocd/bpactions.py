@@ -0,0 +1,119 @@
+"""
+This module evaluates the conditions and commands attached to breakpoints.
+"""
+
+# args, logging
+from logging import getLogger
+
+# Errors
+from pyavrocd.errors import AgentExpressionError
+
+# register snapshot
+from pyavrocd.snapshot import RegisterSnapshot
+
+class BreakpointActions():
+    """
+    This class keeps the conditions and commands (agent expressions) of breakpoints
+    and evaluates them when a breakpoint is hit. Memory is read using the optional
+    function read_memory, which accepts addresses in GDB's address space, and output of
+    printf commands is passed to the optional function output.
+    """
+
+    def __init__(self, dbg, read_memory=None, output=None):
+        self.dbg = dbg
+        self.logger = getLogger('pyavrocd.bpactions')
+        self._read_memory = read_memory
+        self._output = output
+        self._cond = {} # conditions of breakpoints
+        self._cmds = {} # commands of breakpoints, e.g., dprintf
+
+    def __contains__(self, addr):
+        return addr in self._cond or addr in self._cmds
+
+    def set(self, addr, conditions=None, commands=None):
+        """
+        Attach the conditions and commands to the breakpoint at addr, replacing
+        those given before
+        """
+        self.discard(addr)
+        if conditions:
+            self._cond[addr] = conditions
+        if commands:
+            self._cmds[addr] = commands
+
+    def discard(self, addr):
+        """
+        Forget the conditions and commands of the breakpoint at addr
+        """
+        self._cond.pop(addr, None)
+        self._cmds.pop(addr, None)
+
+    def clear(self):
+        """
+        Forget all conditions and commands
+        """
+        self._cond = {}
+        self._cmds = {}
+
+    def conditions_true(self, addr):
+        """
+        Evaluate the conditions of the breakpoint at addr. Returns True if there are none,
+        if at least one of them is true, or if one of them cannot be evaluated.
+        """
+        if addr not in self._cond:
+            return True
+        snap = RegisterSnapshot(self.dbg)
+        for cond in self._cond[addr]:
+            try:
+                if cond.evaluate(lambda num: self._read_register(snap, num),
+                                     self._read_target_memory):
+                    return True
+            except AgentExpressionError as e:
+                self.logger.warning("Cannot evaluate condition of BP at 0x%X: %s", addr, e)
+                return True
+        return False
+
+    def run_commands(self, addr):
+        """
+        Execute the commands of the breakpoint at addr. Output of printf commands
+        is sent to GDB. Returns False if there are no commands or if one of the
+        commands could not be executed.
+        """
+        if addr not in self._cmds:
+            return False
+        snap = RegisterSnapshot(self.dbg)
+        for cmd in self._cmds[addr]:
+            try:
+                cmd.evaluate(lambda num: self._read_register(snap, num),
+                                 self._read_target_memory, self._output)
+            except AgentExpressionError as e:
+                self.logger.warning("Cannot execute command of BP at 0x%X: %s", addr, e)
+                return False
+        return True
+
+    @staticmethod
+    def _read_register(snap, num):
+        """
+        Returns the value of GDB register num (0-31: R0-R31, 32: SREG, 33: SP,
+        34: PC as byte address)
+        """
+        if num < 32:
+            return snap.register(num)
+        if num == 32:
+            return snap.status_register()
+        if num == 33:
+            return snap.stack_pointer()
+        if num == 34:
+            return snap.program_counter()
+        raise AgentExpressionError("Unknown register %d" % num)
+
+    def _read_target_memory(self, addr, size):
+        """
+        Reads size bytes at addr, which is an address in GDB's address space
+        (flash starting at 0, SRAM at 0x800000, EEPROM at 0x810000).
+        """
+        if self._read_memory:
+            return self._read_memory(addr, size)
+        if 0x800000 <= addr < 0x810000:
+            return self.dbg.sram_read(addr - 0x800000, size)
+        raise AgentExpressionError("Cannot read memory at 0x%X" % addr)
@@ -0,0 +1,135 @@
+"""
+This module implements the breakpoint table with its index sets.
+"""
+
+# recency heap of the breakpoint table
+import heapq
+
+# allocation of breakpoints
+SWBP = 1
+HWBP = -1
+UNALLOCATED = 0
+
+class Breakpoint():
+    """
+    A record in the breakpoint table. The fields can also be accessed as items,
+    and a record compares equal to a dict with the same fields. The fields 'active'
+    and 'allocated' of a record in a table are changed only by BreakpointTable.set_state,
+    so that the index sets of the table stay up to date.
+    """
+    __slots__ = ('active', 'allocated', 'opcode', 'secondword', 'timestamp')
+    FIELDS = ('active', 'allocated', 'opcode', 'secondword', 'timestamp')
+
+    def __init__(self, active, allocated, opcode, secondword, timestamp):
+        self.active = active
+        self.allocated = allocated
+        self.opcode = opcode
+        self.secondword = secondword
+        self.timestamp = timestamp
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        """
+        Returns the value of field key or default, if there is no such field
+        """
+        if key not in self.FIELDS:
+            return default
+        return getattr(self, key)
+
+    def as_dict(self):
+        """
+        Returns the record as a dict
+        """
+        return { key : getattr(self, key) for key in self.FIELDS }
+
+    def __eq__(self, other):
+        if isinstance(other, Breakpoint):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+
+class BreakpointTable(dict):
+    """
+    The breakpoint table maps byte addresses to Breakpoint records. Besides that, it
+    keeps index sets of inactive BPs and of unallocated BPs, SWBPs, and HWBPs as well as
+    a heap of timestamps, so that the work before execution starts only touches BPs
+    whose state has changed. The index sets are dicts with None values, so that they
+    keep the order in which BPs have entered the respective state.
+    """
+
+    def __init__(self, entries=None):
+        super().__init__()
+        self.inactive = {}
+        self.unallocated = {}
+        self.swbps = {}
+        self.hwbps = {}
+        self._recency = []
+        for addr, entry in (entries or {}).items():
+            self[addr] = entry
+
+    def __setitem__(self, addr, entry):
+        if addr in self:
+            del self[addr]
+        if not isinstance(entry, Breakpoint):
+            entry = Breakpoint(**entry)
+        super().__setitem__(addr, entry)
+        self.index(addr, entry)
+        heapq.heappush(self._recency, (-entry.timestamp, addr))
+
+    def __delitem__(self, addr):
+        entry = self[addr]
+        self.unindex(addr, entry)
+        super().__delitem__(addr)
+
+    def set_state(self, addr, active=None, allocated=None):
+        """
+        Change whether the BP at addr is active and/or how it is allocated
+        (unless the respective argument is None) and update the index sets
+        """
+        entry = self[addr]
+        self.unindex(addr, entry)
+        if active is not None:
+            entry.active = active
+        if allocated is not None:
+            entry.allocated = allocated
+        self.index(addr, entry)
+
+    def _allocation_index(self, entry):
+        """
+        Returns the index set corresponding to the allocation of entry
+        """
+        return { UNALLOCATED : self.unallocated, SWBP : self.swbps, HWBP : self.hwbps }[entry.allocated]
+
+    def index(self, addr, entry):
+        """
+        Enter the BP at addr into the index sets
+        """
+        if not entry.active:
+            self.inactive[addr] = None
+        self._allocation_index(entry)[addr] = None
+
+    def unindex(self, addr, entry):
+        """
+        Remove the BP at addr from the index sets
+        """
+        self.inactive.pop(addr, None)
+        self._allocation_index(entry).pop(addr, None)
+
+    def most_recent(self):
+        """
+        Returns the address of the BP with the highest timestamp (or None if the table is empty).
+        Heap entries of deleted or replaced BPs are dropped on the way.
+        """
+        while self._recency:
+            stamp, addr = self._recency[0]
+            if addr in self and self[addr].timestamp == -stamp:
+                return addr
+            heapq.heappop(self._recency)
+        return None
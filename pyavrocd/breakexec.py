@@ -5,13 +5,25 @@ This module deals with breakpoints and execution.
 # args, logging
 from logging import getLogger
 
-# Errors
-from pyavrocd.errors import FatalError
+# register snapshot
+from pyavrocd.snapshot import RegisterSnapshot
 
+# opcode decoding
+from pyavrocd.opcodes import BREAKCODE, SLEEPCODE, pop_instr, push_instr, retx_instr, callx_instr, two_word_instr
+
+# event trace
+from pyavrocd.tracebuffer import trace, RESUME, STEP, RANGE_STEP, STOP
+
+# breakpoint table, hardware breakpoints, execution history, watchpoints,
+# breakpoint conditions, range analysis, and simulation of single steps
+from pyavrocd.bptable import BreakpointTable, SWBP, HWBP, UNALLOCATED
+from pyavrocd.hardwarebp import HardwareBP
+from pyavrocd.undolog import UndoLog
+from pyavrocd.watchpoints import Watchpoints
+from pyavrocd.bpactions import BreakpointActions
+from pyavrocd.steprange import StepRange
+from pyavrocd.stepsim import StepSimulator
 
-# special opcodes
-BREAKCODE = 0x9598
-SLEEPCODE = 0x9588
 
 # signal codes
 NOSIG   = 0     # no signal
@@ -22,27 +34,29 @@ SIGTRAP = 5     # Trace trap  - stopped on a breakpoint
 SIGABRT = 6     # Abort because of a fatal error or no breakpoint available
 SIGBUS = 10     # Segmentation violation means in our case stack overflow
 
-SWBP = 1
-HWBP = -1
-UNALLOCATED = 0
+# number of (weighted) hits by which a SWBP has to lead before it takes over a HWBP
+REBALANCE_HITS = 10
 
-SREGADDR = 0x5F
-
-class BreakAndExec():
+class BreakAndExec(): #pylint: disable=too-many-instance-attributes
     """
     This class manages breakpoints, supports flashwear minimizing execution, and
     makes interrupt-safe single stepping possible.
     """
 
-    def __init__(self, hwbpnum, mon, dbg, arch, read_flash_word):
+    def __init__(self, hwbpnum, mon, dbg, arch, read_flash_word, *, read_memory=None, output=None,
+                     interrupted=None):
         self.mon = mon
         self.dbg = dbg
-        self._arch = arch
         self.logger = getLogger('pyavrocd.breakexec')
         self._hwbpnum = hwbpnum # This number includes the implicit HWBP used by run_to
-        self._hwbp = HardwareBP(hwbpnum, dbg)
+        self._hwbp = HardwareBP(hwbpnum, dbg, score=self._score)
         self._read_flash_word = read_flash_word
-        self._bp = {}
+        self._interrupted = interrupted
+        self._bp = BreakpointTable() # byte address -> Breakpoint
+        self._actions = BreakpointActions(dbg, read_memory, output) # conditions and commands of BPs
+        self._bphits = {} # number of stops at each breakpoint
+        self._continuing = False # last execution command was a 'continue'
+        self._stop_reason = "" # additional information for the stop reply, e.g., watch:addr
         self._bpactive = 0
         self._bstamp = 0
         # more than 128 kB:
@@ -50,35 +64,49 @@ class BreakAndExec():
         self._big_sram = self.dbg.memory_info.memory_info_by_name('internal_sram')['size'] \
                                    > 64*1024
         self._sram_start = self.dbg.memory_info.memory_info_by_name('internal_sram')['address'] 
-        self._range_start = 0
-        self._range_end = 0
-        self._range_word = []
-        self._range_branch = []
-        self._range_exit = set()
+        self._flash_size = self.dbg.memory_info.memory_info_by_name('flash')['size']
+        self._flash_page_size = self.dbg.memory_info.memory_info_by_name('flash')['page_size']
+        self._swbp_set = [] # SWBPs to be set before execution starts
+        self._swbp_clear = [] # SWBPs to be cleared before execution starts
+        self._range = StepRange() # analysis of the last range of range-stepping
+        self._stepover = None
+        self._run_target = None
+        self._dirty = True # watchpoints or the breakpoint table have been reset
+        self._options = None # breakpoint related options at the last update
+        self._stop_pc = None # PC (byte address) at the last reported stop, if still valid
+        self._undo = UndoLog(dbg, self._sram_start, self._big_flash_mem) # history for reverse execution
+        self._sim = StepSimulator(dbg, arch, self._read_filtered_flash_word, self._big_flash_mem, self._big_sram)
+        self._watch = Watchpoints(mon, dbg, self._read_filtered_flash_word, self._flash_size)
 
     def maxbpnum(self):
         """
         Returns maximum number of explicit breakpoints
         """
         if self.mon.is_onlyhwbps():
-            return self._hwbpnum - int(self.mon.is_safe())
+            return self._hwbpnum - int(self.mon.is_safe()) - self._hwbp.data_allocated()
         return 1024
 
-    def insert_breakpoint(self, address):
+    def insert_breakpoint(self, address, conditions=None, commands=None):
         """
         Generate a new breakpoint at given address, do not allocate flash or hwbp yet
         This method will be called before GDB starts executing or single-stepping.
+        The optional conditions are agent expressions, which are evaluated when the
+        breakpoint is hit after a 'continue'. If none of them is true, execution
+        is resumed without reporting the stop to GDB. The optional commands are agent
+        expressions that are executed when the breakpoint is hit (and the
+        condition is true). Afterward, execution is resumed as well.
         """
         if address % 2 != 0:
             self.logger.error("Breakpoint at odd address: 0x%X", address)
             return
+        self._actions.set(address, conditions, commands)
         if self.mon.is_old_exec():
             self.dbg.software_breakpoint_set(address)
             return
         if address in self._bp: # bp already set, needs to be activated
             self.logger.debug("Already existing BP at 0x%X will be re-activated",address)
             if not self._bp[address]['active']:
-                self._bp[address]['active'] = True
+                self._bp.set_state(address, active=True)
                 self._bpactive += 1
                 self.logger.debug("Set BP at 0x%X to active", address)
             else:
@@ -110,11 +138,62 @@ class BreakAndExec():
         if not (address in self._bp) or not self._bp[address]['active']:
             self.logger.debug("BP at 0x%X was removed before", address)
             return # was already removed before
-        self._bp[address]['active'] = False
+        self._bp.set_state(address, active=False)
         self._bpactive -= 1
         self.logger.debug("BP at 0x%X is now inactive", address)
         self.logger.debug("Only %d BPs are now active", self._bpactive)
 
+    def insert_watchpoint(self, kind, address, length):
+        """
+        Set a watchpoint of the given kind (2=write, 3=read, 4=access) for length bytes
+        starting at address in GDB's address space. Returns None if the watchpoint cannot be
+        handled by the server, False if there are not enough free data breakpoints, and True
+        if successful (see Watchpoints.insert).
+        """
+        self._dirty = True
+        return self._watch.insert(kind, address, length, self._hwbp, self._bp)
+
+    def remove_watchpoint(self, kind, address, length):
+        """
+        Remove the watchpoint of the given kind at address. Returns None if
+        the watchpoint could not have been set by insert_watchpoint, otherwise True.
+        """
+        self._dirty = True
+        return self._watch.remove(kind, address, length, self._hwbp)
+
+    def stop_reason(self):
+        """
+        Returns additional information about the last stop for the stop reply packet,
+        e.g., 'watch:800100;' when a watchpoint has been triggered, or an empty string.
+        """
+        return self._stop_reason
+
+    def sampling_possible(self):
+        """
+        Returns True if execution can be interrupted and resumed behind GDB's back,
+        e.g., for sampling the PC. This is only the case after an ordinary 'continue'
+        (without software watchpoints, which are handled by stepping on the server side).
+        """
+        return self._continuing and not (self._watch and not self._hwbp.data_comparators())
+
+    def is_stop_point(self, addr):
+        """
+        Returns True if a stop at addr (byte address) after a 'continue' would be
+        caused by an active breakpoint or by the target of run_to.
+        """
+        return (addr in self._bp and self._bp[addr]['active']) or \
+          addr == self._hwbp.run_to_address()
+
+    def resume_after_interrupt(self):
+        """
+        Resume execution after the MCU has been stopped by the server
+        (not by GDB), e.g., for sampling the PC.
+        """
+        if self.mon.is_old_exec():
+            self.dbg.run()
+        else:
+            self._hwbp.execute()
+
     def _read_filtered_flash_word(self, address):
         """
         Instead of reading directly from flash memory, we filter out break points.
@@ -123,6 +202,46 @@ class BreakAndExec():
             return self._bp[address]['opcode']
         return self._read_flash_word(address)
 
+    def _score(self, address):
+        """
+        Returns the score of the BP at address used for deciding which BPs get
+        a HWBP. A BP that is hit often saves more if it is a HWBP, since
+        then no BREAK instruction has to be stepped over. This is even more
+        so for two-word instructions, which have to be simulated. Recency
+        is used as a tie-breaker.
+        """
+        bp = self._bp.get(address)
+        if bp is None:
+            return (0, False, 0)
+        twoword = two_word_instr(bp['opcode'])
+        return (self._bphits.get(address, 0)*(2 if twoword else 1), twoword, bp['timestamp'])
+
+    def _bp_options(self):
+        """
+        Returns the current values of the options that influence breakpoint allocation
+        """
+        return (self.mon.is_old_exec(), self.mon.is_onlyhwbps(), self.mon.is_onlyswbps(),
+                    self.mon.is_safe())
+
+    def _needs_update(self):
+        """
+        Returns True if _update_breakpoints has to be called before execution is resumed,
+        i.e., if some BP has been removed or added since the last update (GDB removing and
+        re-inserting the same BP does not count), if watchpoints or the table have been
+        reset, if HWBPs are temporarily allocated, if an option has been changed, or if
+        the hit counts call for reallocating HWBPs (see handle_stop).
+        """
+        return bool(self._dirty or self._bp.inactive or self._bp.unallocated or
+                        self._hwbp.temp_allocated() or self._options != self._bp_options())
+
+    def forget_stop_pc(self):
+        """
+        Called when the PC may have been changed by other means than execution
+        (e.g., by writing registers or by a reset), so that the PC recorded at
+        the last stop is not valid anymore.
+        """
+        self._stop_pc = None
+
     def _update_breakpoints(self, protected_bp, release_temp=True):
         """
         This is called directly before execution is started. It will remove
@@ -144,12 +263,13 @@ class BreakAndExec():
         # check if there are enough software and hardware breakpoints to allocate
         if len(self._bp) > self.maxbpnum(): # too many BPs requested
             self.logger.debug("Not enough (HW)BPs")
+            self._write_software_breakpoints()
             return False
         # if list of BPs is empty, just return 
         if not self._bp:
-            return True
+            return self._write_software_breakpoints()
         # determine most recent HWBP, probably a temporary one!
-        most_recent = max(self._bp, key=lambda key: self._bp[key]['timestamp'])
+        most_recent = self._bp.most_recent()
         # all remaining BPs are active or protected
         # assign HWBP0 to the most recently introduced BP (if we are not range-stepping)
         # and take into account the possibility that hardware breakpoints are not allowed
@@ -157,22 +277,91 @@ class BreakAndExec():
             and not self.mon.is_onlyswbps():
             reassign = self._hwbp.unallocate_hwbp0()
             self._hwbp.set(most_recent)
-            self._bp[most_recent]['allocated'] = HWBP
+            self._bp.set_state(most_recent, allocated=HWBP)
             if reassign:
-                self._bp[reassign]['allocated'] = UNALLOCATED
-        # now assign the remaining BPs
-        for a in self._bp:
+                self._bp.set_state(reassign, allocated=UNALLOCATED)
+        # now assign the remaining BPs, the ones with the highest score first
+        # if there are not enough HWBPs for all of them
+        unallocated = list(self._bp.unallocated)
+        if len(unallocated) > self._hwbp.available():
+            unallocated.sort(key=self._score, reverse=True)
+        for a in unallocated:
             if not self._bp[a]['allocated']:
                 if not self.mon.is_onlyswbps() and self._hwbp.set(a):
-                    self._bp[a]['allocated'] = HWBP
+                    self._bp.set_state(a, allocated=HWBP)
                 else:
                     # we catered for the HWBPs already above
-                    if not self.dbg.software_breakpoint_set(a):
-                        self.logger.debug("Could not allocate SWBP for 0x%X", a)
-                        return False
                     self.logger.debug("BP at 0x%X will now be set as a SWBP", a)
-                    self._bp[a]['allocated'] = SWBP
-        return True
+                    self._swbp_set.append(a)
+                    self._bp.set_state(a, allocated=SWBP)
+        # SWBPs that are hit much more often than BPs with a HWBP take over their HWBPs
+        if not self.mon.is_onlyswbps() and not self._hwbp.temp_allocated():
+            for sw, hw in self._rebalance_pairs(most_recent):
+                self.logger.debug("BP at 0x%X takes over the HWBP of BP at 0x%X", sw, hw)
+                self._hwbp.clear(hw)
+                self._bp.set_state(hw, allocated=SWBP)
+                self._swbp_set.append(hw)
+                self._hwbp.set(sw)
+                self._bp.set_state(sw, allocated=HWBP)
+                if sw in self._swbp_set:
+                    self._swbp_set.remove(sw)
+                else:
+                    self._swbp_clear.append(sw)
+        return self._write_software_breakpoints()
+
+    def _rebalance_pairs(self, most_recent):
+        """
+        Returns pairs of an active SWBP and a BP with a HWBP (other than most_recent),
+        where the SWBP has been hit at least REBALANCE_HITS times more often (weighted
+        as in _score). Swapping them saves stepping over BREAK instructions, but costs
+        reprogramming flash, hence the margin.
+        """
+        swbps = sorted((a for a in self._bp.swbps if self._bp[a]['active']), key=self._score, reverse=True)
+        hwbps = sorted((a for a in self._bp.hwbps if a != most_recent), key=self._score)
+        pairs = []
+        for sw, hw in zip(swbps, hwbps):
+            if self._score(sw)[0] < self._score(hw)[0] + REBALANCE_HITS:
+                break
+            pairs.append((sw, hw))
+        return pairs
+
+    def _write_software_breakpoints(self):
+        """
+        Set and clear the SWBPs collected in _update_breakpoints. They are grouped
+        by flash page and each group is sent to the hardware debugger with one command,
+        so that each page needs to be reprogrammed only once. Returns False if some
+        SWBP could not be set. These BPs are then unallocated again.
+        """
+        success = True
+        for addrs in self._group_by_page(self._swbp_clear):
+            self.logger.debug("Clearing SWBPs at %s", [hex(a) for a in addrs])
+            if len(addrs) == 1:
+                self.dbg.software_breakpoint_clear(addrs[0])
+            else:
+                self.dbg.software_breakpoints_clear(addrs)
+        for addrs in self._group_by_page(self._swbp_set):
+            self.logger.debug("Setting SWBPs at %s", [hex(a) for a in addrs])
+            if len(addrs) == 1:
+                done = self.dbg.software_breakpoint_set(addrs[0])
+            else:
+                done = self.dbg.software_breakpoints_set(addrs)
+            if not done:
+                self.logger.debug("Could not allocate SWBPs at %s", [hex(a) for a in addrs])
+                for a in addrs:
+                    self._bp.set_state(a, allocated=UNALLOCATED)
+                success = False
+        self._swbp_clear = []
+        self._swbp_set = []
+        return success
+
+    def _group_by_page(self, addrs):
+        """
+        Returns the list of addresses as a list of lists of addresses on the same flash page
+        """
+        pages = {}
+        for a in sorted(addrs):
+            pages.setdefault(a // self._flash_page_size, []).append(a)
+        return list(pages.values())
 
     def _remove_inactive_and_deallocate_forbidden_bps(self, protected_bp):
         """
@@ -182,31 +371,33 @@ class BreakAndExec():
         will now be overstepped in a single-step action.
         """
         self.logger.debug("Deallocate forbidden BPs and remove inactive ones")
-        for a in self._bp:
-            if self.mon.is_onlyswbps() and self._bp[a]['allocated'] == HWBP: # only SWBPs allowed
+        if self.mon.is_onlyswbps():
+            for a in list(self._bp.hwbps): # only SWBPs allowed
                 self.logger.debug("Removing HWBP at 0x%X  because only SWBPs allowed.", a)
-                self._bp[a]['allocated'] = UNALLOCATED
+                self._bp.set_state(a, allocated=UNALLOCATED)
                 self._hwbp.clear(a)
-            if self.mon.is_onlyhwbps() and self._bp[a]['allocated'] == SWBP: # only HWBPs allowed
+        if self.mon.is_onlyhwbps():
+            for a in list(self._bp.swbps): # only HWBPs allowed
                 self.logger.debug("Removing SWBP at 0x%X  because only HWBPs allowed", a)
-                self._bp[a]['allocated'] = UNALLOCATED
-                self.dbg.software_breakpoint_clear(a)
+                self._bp.set_state(a, allocated=UNALLOCATED)
+                self._swbp_clear.append(a)
+        for a in list(self._bp.inactive):
             # check for protected BP
             if a == protected_bp and self._bp[a]['allocated'] == SWBP:
                 self.logger.debug("BP at 0x%X is protected", a)
                 continue
-            # delete BP
-            if not self._bp[a]['active']: # delete inactive BP
-                self.logger.debug("BP at 0x%X is not active anymore", a)
-                if self._bp[a]['allocated']  == SWBP:
-                    self.logger.debug("Removed as a SWBP")
-                    self.dbg.software_breakpoint_clear(a)
-                if self._bp[a]['allocated'] == HWBP:
-                    self.logger.debug("Removed as a HWBP")
-                    self._hwbp.clear(a)
-                self.logger.debug("BP at 0x%X will now be deleted", a)
-                self._bp[a] = None
-        self._bp = { k : v for k, v in self._bp.items() if v is not None }
+            # delete inactive BP
+            self.logger.debug("BP at 0x%X is not active anymore", a)
+            if self._bp[a]['allocated']  == SWBP:
+                self.logger.debug("Removed as a SWBP")
+                self._swbp_clear.append(a)
+            if self._bp[a]['allocated'] == HWBP:
+                self.logger.debug("Removed as a HWBP")
+                self._hwbp.clear(a)
+            self.logger.debug("BP at 0x%X will now be deleted", a)
+            del self._bp[a]
+            self._actions.discard(a)
+            self._bphits.pop(a, None)
 
     def cleanup_breakpoints(self):
         """
@@ -215,21 +406,96 @@ class BreakAndExec():
         self.logger.debug("Deleting all breakpoints")
         self._hwbp.clear_all()
         self.dbg.software_breakpoint_clear_all()
-        self._bp = {}
+        self._bp = BreakpointTable()
+        self._actions.clear()
+        self._bphits = {}
+        self._watch.clear()
+        self._bpactive = 0
+        self._dirty = True
+        self._undo.clear()
+
+    def prepare_load(self):
+        """
+        Called before a new executable is loaded (when the chip is not erased beforehand).
+        In contrast to cleanup_breakpoints, the BPs stay in the table (and SWBPs in flash),
+        but become inactive. The original opcodes stay in the table as well. HWBPs become
+        unallocated. Those SWBPs that survive check_load are inserted into the page images
+        when the new executable is written (see fold_breakpoints). When GDB re-inserts them after the load,
+        no further flash reprogramming is necessary.
+        """
+        self._undo.clear()
+        if self.mon.is_old_exec():
+            self.cleanup_breakpoints()
+            return
+        self.logger.debug("Keeping SWBPs for the next load")
+        self._hwbp.clear_all()
+        for a in self._bp:
+            self._bp.set_state(a, active=False)
+        for a in list(self._bp.hwbps):
+            self._bp.set_state(a, allocated=UNALLOCATED)
+        self._actions.clear()
+        self._bphits = {}
+        self._watch.clear()
         self._bpactive = 0
+        self._dirty = True
+        self._range.start = None
+
+    def check_load(self, read_new_word):
+        """
+        Called after the new executable has been received, but before it is written to flash.
+        read_new_word(addr) returns a word of the new executable (or None if the address is not
+        covered). BPs where opcode or second word differ from the new executable
+        are cleared now. The page will then be reprogrammed by the load anyway.
+        """
+        for a in list(self._bp):
+            if read_new_word(a) != self._bp[a]['opcode'] or \
+              read_new_word(a+2) != self._bp[a]['secondword']:
+                self.logger.debug("Code at BP 0x%X has changed, BP will be cleared", a)
+                if self._bp[a]['allocated'] == SWBP:
+                    self._swbp_clear.append(a)
+                del self._bp[a]
+        self._write_software_breakpoints()
+
+    def fold_breakpoints(self, addr, page):
+        """
+        Insert BREAK instructions for all SWBPs into the page image that starts at addr
+        and return the modified page.
+        """
+        for a, bp in self._bp.items():
+            if bp['allocated'] == SWBP and addr <= a < addr + len(page) - 1:
+                self.logger.debug("Folding SWBP at 0x%X into page 0x%X", a, addr)
+                page[a-addr:a-addr+2] = BREAKCODE.to_bytes(2, byteorder='little')
+        return page
 
     def resume_execution(self, addr):
         """
         Start execution at given addr (byte addr). If none given, use the actual PC.
         Update breakpoints. Return SIGABRT if not enough break points.
-        """
-        self._range_start = None
-        if not self._update_breakpoints(None):
-            return SIGABRT
+        If nothing has changed since the last resume and we start where we
+        stopped, only the run (or run_to) command is sent to the hardware debugger.
+        """
+        self._range.start = None
+        self._stepover = None
+        self._run_target = None
+        self._continuing = False
+        self._undo.clear()
+        unchanged = not self._needs_update()
+        if not unchanged:
+            if not self._update_breakpoints(None):
+                return SIGABRT
+            self._dirty = False
+            self._options = self._bp_options()
+        else:
+            self.logger.debug("Breakpoints unchanged since last resume")
+        self._watch.refresh() # GDB may have changed watched values
         if addr:
             self.dbg.program_counter_write(addr>>1)
+        elif self._stop_pc is not None:
+            addr = self._stop_pc
         else:
             addr = self.dbg.program_counter_read() << 1
+        self._stop_pc = None
+        trace.record(RESUME, addr, len(self._bp), unchanged)
         opcode = self._read_filtered_flash_word(addr)
         if opcode == BREAKCODE: # this should not happen at all
             self.logger.debug("Stopping execution in 'continue' because of BREAK instruction")
@@ -241,10 +507,127 @@ class BreakAndExec():
         if self.mon.is_old_exec():
             self.dbg.run()
             return None
+        self._continuing = True
+        if self._watch and not self._hwbp.data_comparators(): # software watchpoints
+            for reassign in self._hwbp.set_temp([ -1 ]): # reserve HWBP 0 for run_to
+                if not self.dbg.software_breakpoint_set(reassign):
+                    self.logger.error("Could not reassign HWBP to SWBP for watching")
+                    return SIGABRT
+                self._bp.set_state(reassign, allocated=SWBP)
+            return self._watch_run()
         self._hwbp.execute()
         return None
 
+    def _watch_run(self):
+        """
+        Execute with software watchpoints. Starting from the current PC, we run to the
+        next instruction that can store something into SRAM (or that can change the control
+        flow) using the implicit HWBP of run_to, single-step this instruction, and check
+        whether one of the watched values has changed. When we have to run to the next
+        such instruction, None is returned and handle_stop will call this method again
+        after the stop. Otherwise, the signal to be reported is returned. Note that stores
+        in interrupt routines are only noticed after the next store outside of them.
+        """
+        steps = 0
+        while True:
+            addr = self.dbg.program_counter_read() << 1
+            target = self._watch.next_stop(addr)
+            if target != addr:
+                self.logger.debug("Watching: run to 0x%X", target)
+                self._run_target = target
+                self.dbg.run_to(target)
+                return None
+            steps += 1
+            if self._interrupted and steps % 256 == 0 and self._interrupted():
+                self.logger.debug("Watching interrupted by GDB")
+                return None
+            store = self._watch.is_store(self._read_filtered_flash_word(addr))
+            sig = self.single_step(None)
+            self._continuing = True
+            if sig != SIGTRAP:
+                return sig
+            if store:
+                self._stop_reason = self._watch.triggered(changed_only=True)
+                if self._stop_reason:
+                    self._continuing = False
+                    return SIGTRAP
+            addr = self.dbg.program_counter_read() << 1
+            if addr in self._bp and self._bp[addr]['active']: # we reached a breakpoint
+                return self.handle_stop(addr)
+
     def single_step(self, addr, fresh=True):
+        """
+        Perform a single step. If recording is enabled, an undo record for the
+        instruction is added to the execution history, otherwise the history is discarded.
+        """
+        trace.record(STEP, addr if addr else -1)
+        if not self.mon.is_recording() or self.mon.is_old_exec():
+            self._undo.clear()
+            return self._single_step(addr, fresh)
+        self._undo.resize(self.mon.recording_depth())
+        pc = addr if addr else self.dbg.program_counter_read() << 1
+        rec = self._undo.record(pc, self._read_filtered_flash_word, interrupts=not self.mon.is_safe())
+        sig = self._single_step(addr, fresh)
+        if sig == SIGTRAP:
+            self._undo.commit(rec)
+        return sig
+
+    def clear_history(self):
+        """
+        Discard the execution history, e.g., after the MCU has been reset or has run freely
+        """
+        self._undo.clear()
+
+    def history_length(self):
+        """
+        Returns the number of instructions that can be executed in reverse
+        """
+        return len(self._undo)
+
+    def reverse_step(self):
+        """
+        Undo the last recorded instruction. If the history is exhausted, the stop
+        reason tells GDB that the beginning of the replay log has been reached.
+        """
+        self._prepare_reverse()
+        pc = self._undo.undo()
+        if pc is None:
+            self._stop_reason = "replaylog:begin;"
+        else:
+            self.logger.debug("Reverse step to 0x%X", pc)
+        return SIGTRAP
+
+    def reverse_continue(self):
+        """
+        Undo recorded instructions until an active breakpoint is reached, the history
+        is exhausted, or GDB interrupts.
+        """
+        self._prepare_reverse()
+        steps = 0
+        while True:
+            pc = self._undo.undo()
+            if pc is None:
+                self._stop_reason = "replaylog:begin;"
+                break
+            steps += 1
+            if pc in self._bp and self._bp[pc]['active']:
+                break
+            if self._interrupted and steps % 256 == 0 and self._interrupted():
+                break
+        self.logger.debug("Reverse continue: %d instructions undone", steps)
+        return SIGTRAP
+
+    def _prepare_reverse(self):
+        """
+        Reset the execution state before executing in reverse
+        """
+        self._range.start = None
+        self._stepover = None
+        self._continuing = False
+        self._stop_pc = None
+        self._stop_reason = ""
+
+    def _single_step(self, addr, fresh=True):
         """
         Perform a single step. If at the current location, there is a software breakpoint,
         we simulate a two-word instruction or ask the hardware debugger to do a single step
@@ -255,7 +638,10 @@ class BreakAndExec():
         For the remaining one, we simulate.
         """
         if fresh:
-            self._range_start = None
+            self._range.start = None
+        self._stepover = None
+        self._continuing = False
+        self._stop_pc = None
         if addr:
             self.dbg.program_counter_write(addr>>1)
         else:
@@ -282,10 +668,10 @@ class BreakAndExec():
         # If there is a SWBP at the place where we want to step,
         # if a two-word instruction, simulate the step
         if addr in self._bp and self._bp[addr]['allocated']:
-            if self._two_word_instr(self._bp[addr]['opcode']):
+            if two_word_instr(self._bp[addr]['opcode']):
             # if there is a two word instruction, simulate
                 self.logger.debug("Two-word instruction at SWBP: simulate")
-                addr = self._sim_two_word_instr(self._bp[addr]['opcode'],
+                addr = self._sim.sim_two_word_instr(self._bp[addr]['opcode'],
                                                 self._bp[addr]['secondword'], addr)
                 self.logger.debug("New PC(byte addr)=0x%X, return SIGTRAP", addr)
                 self.dbg.program_counter_write(addr>>1)
@@ -298,7 +684,7 @@ class BreakAndExec():
         # now we have to check for unsafe instructions, which we simulate;
         # the other instructions will be single-stepped with the I-Bit cleared.
         self.logger.debug("Interrupt-safe stepping begins here")
-        if self._filter_unsafe_instructions(addr, opcode):
+        if self._sim.filter_unsafe_instructions(addr, opcode):
             return SIGTRAP
         # for the remaining instructions,
         # clear I-bit before and set it afterwards (if it was on before)
@@ -321,211 +707,74 @@ class BreakAndExec():
         self.logger.debug("Returning with SIGTRAP")
         return SIGTRAP
 
+    def multi_step(self, count, conditions=(), interrupted=None, record=None):
+        """
+        Single-step up to count instructions on the server side and stop early when
+        one of the conditions is met after a step or when interrupted() returns True.
+        A condition is one of the following tuples:
+        ('pc', start, end) - PC (byte address) leaves the interval start-end,
+        ('reg', num, val) - general purpose register num equals val,
+        ('mem', addr, val) - the SRAM byte at addr equals val,
+        ('sp', val) - SP drops below val,
+        ('bp',) - an active breakpoint has been reached.
+        If record is given, it is called with the register snapshot before the
+        first step and after each step (e.g., for recording a trace).
+        Returns the number of executed steps and the signal of the last step.
+        """
+        self.logger.debug("Multi-stepping %d steps with conditions %s", count, conditions)
+        snap = RegisterSnapshot(self.dbg)
+        steps = 0
+        sig = SIGTRAP
+        if record:
+            record(snap)
+        while steps < count:
+            sig = self.single_step(None)
+            steps += 1
+            snap.invalidate()
+            if record:
+                record(snap)
+            if sig != SIGTRAP:
+                break
+            if any(self._condition_met(cond, snap) for cond in conditions):
+                self.logger.debug("Stop condition met after %d steps", steps)
+                break
+            if interrupted and steps % 256 == 0 and interrupted():
+                self.logger.debug("Multi-stepping interrupted after %d steps", steps)
+                break
+        return steps, sig
+
+    def _condition_met(self, cond, snap):
+        """
+        Checks a stop condition of multi_step against the register snapshot
+        """
+        if cond[0] == 'pc':
+            return not cond[1] <= snap.program_counter() < cond[2]
+        if cond[0] == 'bp':
+            return snap.program_counter() in self._bp and self._bp[snap.program_counter()]['active']
+        if cond[0] == 'reg':
+            return snap.register(cond[1]) == cond[2]
+        if cond[0] == 'mem':
+            return self.dbg.sram_read(cond[1], 1)[0] == cond[2]
+        if cond[0] == 'sp':
+            return snap.stack_pointer() < cond[1]
+        return False
+
     def _stack_pointer_legal(self, opcode):
         """
         Checks whether the next instruction operates on the stack and will mess up I/O
         registers or load data/return addresses from I/O space. If so, False is returned.
         """
-        if self._pop_instr(opcode) or self._retx_instr(opcode):
+        if pop_instr(opcode) or retx_instr(opcode):
             return int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little') >= \
               self._sram_start-1
-        if self._push_instr(opcode):
+        if push_instr(opcode):
             return int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little') >= \
               self._sram_start
-        if self._callx_instr(opcode):
+        if callx_instr(opcode):
             return int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little') >= \
               self._sram_start+1
         return True
 
-    #pylint: disable=too-many-return-statements,too-many-branches
-    #It simply is a large case analysis, would not make sense to break it up
-    def _filter_unsafe_instructions(self, addr, opcode):
-        """
-        Check all intructions for potential I-bit manipulation. If
-        the instruction addresses SREG, it will be simulated and True is returned.
-        """ 
-        # if the opcode is a register only instruction, simply return
-        if opcode < 0x8000: 
-            return False
-        # Architecture too advanced
-        if self._arch != "avr8":
-            # We need to account for LAT / LAC / LAS
-            raise FatalError("Wrong architecture. Disable safe stepping or extend stepping method")
-        # Data space too large
-        if self._big_sram:
-            # One needs to account for RAMPZ / RAMPX / RAMPY / RAMPD registers
-            # when computing target or source address in SRAM
-            raise FatalError("SRAM too large. Disable safe stepping or extend stepping method")
-        # BRIE, BRID
-        if self._branch_on_ibit(opcode): 
-            ibit = bool(self.dbg.status_register_read()[0] & 0x80)
-            destination = self._compute_destination_of_ibranch(opcode, ibit, addr)
-            self.logger.debug("Branching on I-Bit. Destination=0x%X", destination)
-            self.dbg.program_counter_write(destination>>1)
-            return True
-        # LDS and STS 
-        if opcode & 0xFD0F == 0x9000: 
-            secondword = self._read_filtered_flash_word(addr + 2)
-            if secondword != SREGADDR:
-                return False
-            self._load_or_store_reg(opcode, self._is_store_instr)
-            return self._sim_done(addr+2)
-        # LD r,X, ST X,r and LD r,Y, STS Y, r without displacement
-        if opcode & 0xFC00 == 0x9000 and opcode & 0x0003 != 3 and \
-            (opcode & 0x00C0 == 0x00C0 or opcode & 0x0003 != 0):
-            if self._is_x_reg(opcode):
-                base_reg = 26
-            elif self._is_y_reg(opcode):
-                base_reg = 28
-            else:
-                base_reg = 30
-            iaddr = int.from_bytes(self.dbg.read_sram(base_reg, 2), byteorder='little')
-            if self._is_pre_decr(opcode):
-                iaddr -= 1
-            if iaddr != SREGADDR:
-                return False
-            self._load_or_store_reg(opcode, self._is_store_instr)
-            if self._is_post_incr(opcode):
-                iaddr += 1
-            if self._is_change_ix(opcode):
-                self.dbg.sram_write(iaddr.to_bytes(2, byteorder='little'))
-            return self._sim_done(addr)
-        # LD r, Y/Z and ST Y/Z, r with displacement
-        if opcode & 0xD000 == 0x8000:
-            disp = self._extract_displacement(opcode)
-            if self._is_y_reg(opcode):
-                base_reg  = 28
-            iaddr = int.from_bytes(self.dbg.read_sram(base_reg, 2), byteorder='little') + disp
-            if iaddr != SREGADDR:
-                return False
-            self._load_or_store_reg(opcode, self._is_store_instr)
-            return self._sim_done(addr)
-        # IN and OUT
-        if opcode & 0xF000 == 0xD000:
-            if self._extract_io_addr(opcode) == SREGADDR - 0x20:
-                self._load_or_store_reg(opcode, self._is_out_instr)
-                return self._sim_done(addr)
-            return False
-        # BCLR/BSET
-        # 1001 0100 1xxx 1000 BCLR
-        # 1001 0100 0xxx 1000 BSET 
-        if opcode & 0xFF0F == 0x9408:
-            if opcode == 0x94F8: # CLI
-                sreg = self.dbg.status_register_read()[0]
-                sreg |= 0x80
-                self.dbg.status_register_write(bytearray([sreg]))
-                return self._sim_done(addr)
-            if opcode == 0x9478: # SEI
-                sreg = self.dbg.status_register_read()[0]
-                sreg |= 0x80
-                self.dbg.status_register_write(bytearray([sreg]))
-                return self._sim_done(addr)
-            return False
-        # XCH
-        # 1001 001r rrrr 0100
-        if (opcode & 0x9E0F) == 0x9204:
-            if int.from_bytes(self.dbg.read_sram(30, 2), byteorder='little') != SREGADDR:
-                return False
-            reg = self._extract_register(opcode)
-            temp = self.dbg.read_sram(reg, 1)
-            self.dbg.write_sram(reg, self.dbg.read_sram(SREGADDR, 1))
-            self.dbg.write_sram(SREGADDR, temp)
-            return self._sim_done(addr)
-        return False
-
-    def _load_or_store_reg(self, opcode, do_store_check):
-        """
-        Load or stores SREG from/to a register. The do_store_check parameter
-        is a function parameter that checks the rigt bit in the opcode.
-        """
-        reg = self._extract_register(opcode)
-        if do_store_check(opcode):
-            self.dbg.status_register_write(bytearray(self.dbg.sram_read(reg,1)))
-        else:
-            self.dbg.sram_write(reg, self.dbg.status_register_read())
-
-    @staticmethod
-    def _extract_io_addr(opcode):
-        """
-        Extracts the IO address of an IN/OUT opcode
-        """
-        return ((opcode & 0x0600) >> 5) + (opcode & 0x000F)
-
-    @staticmethod
-    def _extract_displacement(opcode):
-        """
-        Extracts the displacement from a load/store instruction with displacements
-        """
-        return ((opcode & 0x2000) >> 8) + ((opcode & 0x0C00) >> 7) + (opcode & 0x0007)
-
-    @staticmethod
-    def _is_out_instr(opcode):
-        """
-        Returns True iff the given IN or OUT opcode is an OUT instruction.
-        """
-        return opcode & 0x0800 != 0
-
-    @staticmethod
-    def _is_post_incr(opcode):
-        """
-        Returns True iff the opcode is a post-increment instruction
-        """
-        return opcode & 3 == 1
-
-    @staticmethod
-    def _is_pre_decr(opcode):
-        """
-        Returns True iff the opcode is a pre-decrement instruction
-        """
-        return opcode & 3 == 2
-
-    @staticmethod
-    def _is_change_ix(opcode):
-        """
-        Returns True iff the index operation is a pre-decr or post-incr instruction.
-        """
-        return opcode & 3 != 0
-        
-    @staticmethod
-    def _is_x_reg(opcode):
-        """
-        Checks whether this is an indirect store/load instruction with
-        X as the index register
-        """
-        return opcode & 0x000C == 0x000C
-
-    @staticmethod
-    def _is_y_reg(opcode):
-        """
-        Checks whether it is the Y or Z register, given that it is a displacement
-        or Y/Z indirect store/load instruction.
-        So, this has to be checked before this method can be applied.
-        """
-        return opcode & 0x0008 == 0x0008 
-    
-    @staticmethod
-    def _extract_register(opcode):
-        """
-        Extracts the register number. The placement of the register bits appears to
-        be universal.
-        """
-        return (opcode & 0x01F0) >> 4
-        
-    @staticmethod
-    def _is_store_instr(opcode):
-        """
-        Checks whether the given opcode LD(S)(D)/ST(S)(D) is a store or load instruction.
-        Returns True iff it is a store instruction.
-        """
-        return opcode & 0x0200 != 0
-    
-    def _sim_done(self, addr):
-        """
-        Increments PC by 2 and then returns True
-        """
-        self.dbg.program_counter_write(addr + 2)
-        return True
-
     def range_step(self, start, end):
         """
         range stepping: Break only if we leave the interval start-end. If we can cover all
@@ -536,10 +785,16 @@ class BreakAndExec():
         Note that we need to return after the first step to allow GDB to set a breakpoint at the
         location where we started.
         """
-        self.logger.debug("Range stepping from 0x%X to 0x%X", start, end)
+        trace.record(RANGE_STEP, start, end)
+        self._stepover = None
+        self._continuing = False
+        self._stop_pc = None
         if not self.mon.is_range() or self.mon.is_old_exec():
             self.logger.warning("Range stepping forbidden")
             return self.single_step(None)
+        if self.mon.is_recording():
+            self.logger.debug("Recording: range stepping is done by single-stepping")
+            return self.single_step(None)
         if start%2 != 0 or end%2 != 0:
             self.logger.error("Range addresses in range stepping are ill-formed")
             return self.single_step(None)
@@ -553,436 +808,132 @@ class BreakAndExec():
         if addr < start or addr >= end: # starting outside of range, should not happen!
             self.logger.error("PC 0x%X outside of range boundary", addr)
             return self.single_step(None)
-        if (addr in self._range_exit or # starting at possible exit point inside range
+        if (addr in self._range.exit or # starting at possible exit point inside range
             self._read_filtered_flash_word(addr) in { BREAKCODE, SLEEPCODE } or # special opcode
             addr in self._bp or # a SWBP at this point
             new_range): # or it is a new range
             return self.single_step(None, fresh=False) # reduce to one step!
         if not self._hwbp.temp_allocated(): # we need to set up the range scaffold
-            available = self._hwbpnum
+            available = self._hwbpnum - self._hwbp.data_allocated()
             if self.mon.is_onlyhwbps():
                 available = self._hwbp.available()
                 if available == 0:
                     self.logger.error("Addtional HWBP needed for range stepping")
                     return SIGABRT
-            if len(self._range_exit) <= available: # allocate enough HWBPs
-                reserve = self._range_exit
+            if len(self._range.exit) <= available and not self._range.call:
+                # allocate enough HWBPs, but only if no call is stepped over,
+                # because a recursive call could otherwise trigger an exit point
+                reserve = self._range.exit
             else:
                 reserve = [ -1 ]
             for reassign in self._hwbp.set_temp(reserve):
                 if not self.dbg.software_breakpoint_set(reassign):
                     self.logger.error("Could not reassgin HWBPs to SWBPs in range-step")
                     return SIGABRT
-                self._bp[reassign]['allocated'] = SWBP
-        if self._hwbp.temp_allocated() == len(self._range_exit): # all exits covered
+                self._bp.set_state(reassign, allocated=SWBP)
+        if self._hwbp.temp_allocated() == len(self._range.exit) and \
+          not self._range.call: # all exits covered
             self._hwbp.execute()
             return None
-        if addr in self._range_branch: # if branch point, single-step
+        if addr in self._range.call: # call that should be stepped over
+            return self._step_over_call(addr)
+        if addr in self._range.branch: # if branch point, single-step
             return self.single_step(None, fresh=False)
-        for b in self._range_branch:   # otherwise search for next branch point and stop there
+        for b in self._range.branch:   # otherwise search for next branch point and stop there
             if addr < b:
+                self._run_target = b
                 self.dbg.run_to(b)
                 return None
         return self.single_step(None, fresh=False)
 
-    def _build_range(self, start, end):
-        """
-        Collect all instructions in the range and analyze them. Find all points, where
-        an instruction possibly leaves the range. This includes the first instruction
-        after the range, provided it is reachable. These points are remembered in
-        self._range_exit. If the number of exits is less than or equal to the number of
-        hardware BPs, then one can check for all them. In case of dW this number is one.
-        However, this is enough for handling _delay_ms(_). In all other cases, we stop at all
-        branching instructions, memorized in self._range_branch, and single-step them.
-        Return False, if the range is already established.
-        """
-        if start == self._range_start and end == self._range_end:
-            return False # previously analyzed
-        self._range_word = []
-        self._range_exit = set()
-        self._range_branch = []
-        self._range_start = start
-        self._range_end = end
-        for a in range(start, end+2, 2):
-            self._range_word += [ self._read_filtered_flash_word(a) ]
-        i = 0
-        while i < len(self._range_word) - 1:
-            dest = []
-            opcode = self._range_word[i]
-            secondword = self._range_word[i+1]
-            if self._branch_instr(opcode):
-                self._range_branch += [ start + (i * 2) ]
-            if self._two_word_instr(opcode):
-                if self._branch_instr(opcode): # JMP and CALL
-                    dest = [ secondword << 1 ]
-                else: # STS and LDS
-                    dest = [ start + (i + 2) * 2 ]
-            else:
-                if not self._branch_instr(opcode): # straight-line ops
-                    dest = [start + (i + 1) * 2]
-                elif self._skip_instr(opcode): # CPSE, SBIC, SBIS, SBRC, SBRS
-                    dest = [start + (i + 1) * 2,
-                               start + (i + 2 + self._two_word_instr(secondword)) * 2]
-                elif self._cond_branch_instr(opcode): # BRBS, BRBC
-                    dest = [start + (i + 1) * 2,
-                                self._compute_possible_destination_of_branch(opcode,
-                                                                                start + (i * 2)) ]
-                elif self._relative_branch_instr(opcode): # RJMP, RCALL
-                    dest = [ self._compute_destination_of_relative_branch(opcode, start + (i * 2)) ]
-                else: # IJMP, EIJMP, RET, ICALL, RETI, EICALL
-                    dest = [ -1 ]
-            self.logger.debug("Dest at 0x%X: %s", start + i*2, [hex(x) for x in dest])
-            if -1 in dest:
-                self._range_exit.add(start + (i * 2))
-            else:
-                self._range_exit = self._range_exit.union([ a for a in dest
-                                                                if a < start or a >= end ])
-            i += 1 + self._two_word_instr(opcode)
-        self._range_branch += [ end ]
-        self.logger.debug("Exit points: %s", {hex(x) for x in self._range_exit})
-        self.logger.debug("Branch points: %s", [hex(x) for x in self._range_branch])
-        return True
-
-    @staticmethod
-    def _branch_instr(opcode):
-        """
-        Returns True iff it is a branch instruction
-        """
-        return (BreakAndExec._skip_instr(opcode) or
-                BreakAndExec._cond_branch_instr(opcode) or
-                BreakAndExec._callx_instr(opcode) or
-                BreakAndExec._jmpx_instr(opcode) or
-                BreakAndExec._retx_instr(opcode))
-
-    @staticmethod
-    def _pop_instr(opcode):
-        """
-        Returns True when opcode is a POP instruction
-        1001 000x xxxx 1111
-        """
-        return (opcode & 0xFE0F) == 0x900F
-
-    @staticmethod
-    def _push_instr(opcode):
-        """
-        Returns True when opcode is PUSH instruction
-        1001 001x xxxx 1111
-        """
-        return (opcode & 0xFE0F) == 0x920F
-
-    @staticmethod
-    def _retx_instr(opcode):
-        """
-        Returns True when opcode is a RET or RETI instruction
-        1001 0101 000x 1000
-        """
-        return (opcode & 0xFFEF) == 0x9508
-
-    @staticmethod
-    def _callx_instr(opcode):
-        """
-        Returns True when the opcode is a (R)(E)(I)CALL instruction:
-        1001 0101 000x 1001 (E)ICALL
-        1001 010x xxxx 111x CALL
-        1101 xxxx xxxx xxxx RCALL
-        """
-        return (((opcode & 0xFFEF) == 0x9509) or # (E)ICALL
-                ((opcode & 0xFE0E) == 0x940E) or # CALL
-                ((opcode & 0xF000) == 0xD000)) # RCALL
-
-    @staticmethod
-    def _jmpx_instr(opcode):
-        """
-        Returns True when the opcode is a (R)(E)(I)JMP instruction:
-        1001 0100 000x 1001 (E)IJMP
-        1001 010x xxxx 110x JMP
-        1100 xxxx xxxx xxxx RJMP
-        """
-        return (((opcode & 0xFFEF) == 0x9409) or # (E)JMP
-                ((opcode & 0xFE0E) == 0x940C) or # JMP
-                ((opcode & 0xF000) == 0xC000)) # RJMP
-    
-    @staticmethod
-    def _relative_branch_instr(opcode):
-        """
-        Returns True iff it is a branch instruction with relative addressing mode
-        1101 xxxx xxxx xxxx RCALL
-        1100 xxxx xxxx xxxx RJMP
-        """
-        if (opcode & 0xE000) == 0xC000: # RJMP, RCALL
-            return True
-        return False
-
-    @staticmethod
-    def _compute_destination_of_relative_branch(opcode, addr):
-        """
-        Computes branch destination for instructions with relative addressing mode
-        """
-        rdist = opcode & 0x0FFF
-        tsc = rdist - int((rdist << 1) & 2**12)
-        return addr + 2 + (tsc*2)
-
-    @staticmethod
-    def _skip_instr(opcode):
-        """
-        Returns True iff instruction is a skip instruction
-        0001 00xx xxxx xxxx CPSE
-        1001 1001 xxxx xxxx SBIC
-        1001 1011 xxxx xxxx SBIS
-        1111 110x xxxx 0xxx SBRC
-        1111 111x xxxx 0xxx SBRS
-        """
-        if (opcode & 0xFC00) == 0x1000: # CPSE
-            return True
-        if (opcode & 0xFD00) == 0x9900: # SBIC, SBIS
-            return True
-        if (opcode & 0xFC08) == 0xFC00: # SBRC, SBRS
-            return True
-        return False
-
-    @staticmethod
-    def _cond_branch_instr(opcode):
-        """
-        Returns True iff instruction is a conditional branch instruction
-        1111 01xx xxxx xxxx BRBC
-        1111 00xx xxxx xxxx BRBS
-        """
-        if (opcode & 0xF800) == 0xF000: # BRBS, BRBC
-            return True
-        return False
-
-    @staticmethod
-    def _branch_on_ibit(opcode):
-        """
-        Returns True iff instruction is a conditional branch instruction on the I-bit
-        1111 01xx xxxx x111 BRID
-        1111 00xx xxxx x111 BRIE
-
-        """
-        return (opcode & 0xF807) == 0xF007 # BRID, BRIE
-
-    @staticmethod
-    def _compute_possible_destination_of_branch(opcode, addr):
-        """
-        Computes branch destination address for conditional branch instructions
-        """
-        rdist = (opcode >> 3) & 0x007F
-        tsc = rdist - int((rdist << 1) & 2**7) # compute twos complement
-        return addr + 2 + (tsc*2)
-
-
-    @staticmethod
-    def _compute_destination_of_ibranch(opcode, ibit, addr):
-        """
-        Interprets BRIE/BRID instructions and computes the target instruction.
-        This is used to simulate the execution of these two instructions.
-        """
-        branch = ibit ^ bool(opcode & 0x0400 != 0)
-        if not branch:
-            return addr + 2
-        return BreakAndExec._compute_possible_destination_of_branch(opcode, addr)
-
-    @staticmethod
-    def _two_word_instr(opcode):
-        """
-        Returns True iff instruction is a two-word instruction
-        1001 000x xxxx 0000 LDS
-        1001 001x xxxx 0000 STS
-        1001 010x xxxx 111x CALL
-        1001 010x xxxx 110x JMP
-        """
-        return(((opcode & ~0x03F0) == 0x9000) or # lds / sts
-               ((opcode & 0x0FE0C) == 0x940C))   # jmp / call
-
-    def _sim_two_word_instr(self, opcode, secondword, addr):
-        """
-        Simulate a two-word instruction with opcode and 2nd word secondword at addr (byte address).
-        Update all registers (except PC) and return the (byte-) address
-        where execution will continue.
-        """
-        newaddr = (secondword << 1) + ((opcode & 1) << 17) # new byte addr, only for branching instructions
-        if (opcode & ~0x1F0) == 0x9000: # lds
-            register = (opcode & 0x1F0) >> 4
-            val = self.dbg.sram_read(secondword, 1)
-            self.dbg.sram_write(register, val)
-            self.logger.debug("Simulating lds")
-            addr += 4
-        elif (opcode & ~0x1F0) == 0x9200: # sts
-            register = (opcode & 0x1F0) >> 4
-            val = self.dbg.sram_read(register, 1)
-            self.dbg.sram_write(secondword, val)
-            self.logger.debug("Simulating sts")
-            addr += 4
-        elif (opcode & 0x0FE0E) == 0x940C: # jmp
-            addr = newaddr
-            self.logger.debug("Simulating jmp 0x%X", addr)
-        elif (opcode & 0x0FE0E) == 0x940E: # call
-            returnaddr = (addr + 4) >> 1 # now word address
-            self.logger.debug("Simulating call to 0x%X", newaddr)
-            self.logger.debug("Pushing return addr on stack: 0x%X", returnaddr << 1)
-            sp = int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little')
-            self.logger.debug("Current stack pointer: 0x%X", sp)
-            sp -= (2 + int(self._big_flash_mem))
-            self.logger.debug("New stack pointer: 0x%X", sp)
-            self.dbg.stack_pointer_write(sp.to_bytes(2,byteorder='little'))
-            if self._big_flash_mem:
-                self.dbg.sram_write(sp+1, returnaddr.to_bytes(3,byteorder='big'))
+    def _step_over_call(self, addr):
+        """
+        Step over the call instruction at addr by running to the return address,
+        using the implicit HWBP of run_to. The current stack pointer is remembered
+        so that handle_stop can recognize a hit of the return address in a
+        recursive invocation of the function we are stepping in.
+        """
+        retaddr = self._range.call[addr]
+        sp = int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little')
+        self.logger.debug("Stepping over call at 0x%X, running to 0x%X with SP=0x%X",
+                              addr, retaddr, sp)
+        self._stepover = (retaddr, sp)
+        self._run_target = retaddr
+        self.dbg.run_to(retaddr)
+
+    def handle_stop(self, addr):
+        """
+        This is called when execution has stopped asynchronously at addr (byte address).
+        It returns the signal that should be reported to GDB, or None when
+        execution has been resumed because the stop should not be reported.
+        This is the case when, while stepping over a call, the return address
+        has been reached in a deeper recursion level, i.e., with a lower stack pointer.
+        It is also the case when, after a 'continue', a breakpoint has been hit, for which
+        none of its conditions is true, or which has commands attached that have now been
+        executed. Then we step over the breakpoint and continue.
+        If the stop cannot be explained by a breakpoint or a stop point of range-stepping,
+        it is checked whether a watchpoint has been triggered, which is then recorded
+        as the stop reason.
+        """
+        trace.record(STOP, addr)
+        self._stop_reason = ""
+        if addr in self._bp and self._bp[addr]['active']:
+            self._bphits[addr] = self._bphits.get(addr, 0) + 1
+            if self._bp[addr]['allocated'] == SWBP and self._rebalance_pairs(self._bp.most_recent()):
+                self._dirty = True # HWBPs will be reallocated before execution is resumed
+        if self._watch and not self._hwbp.data_comparators():
+            if self._continuing and addr == self._run_target and \
+              not (addr in self._bp and self._bp[addr]['active']):
+                return self._watch_run()
+        elif self._watch and not self._explained_stop(addr):
+            self._stop_reason = self._watch.triggered()
+            if self._stop_reason:
+                self._stepover = None
+                return SIGTRAP
+        if self._stepover:
+            retaddr, sp = self._stepover
+            if addr == retaddr and \
+              int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little') < sp:
+                self.logger.debug("Return address 0x%X reached in recursive call, continue",
+                                      retaddr)
+                self.dbg.run_to(retaddr)
+                return None
+            self._stepover = None
+        while self._continuing and self._bp.get(addr, {}).get('active') and \
+          addr in self._actions:
+            if self._actions.conditions_true(addr):
+                if not self._actions.run_commands(addr):
+                    break
+                self.logger.debug("Commands of BP at 0x%X executed, resume execution", addr)
             else:
-                self.dbg.sram_write(sp+1, returnaddr.to_bytes(2,byteorder='big'))
-            addr = newaddr
-        return addr
-
-class HardwareBP():
-    """
-    This class manages the hardware breakpoints with some basic methods (including starting
-    execution with the temporary breakpoint).
-    """
-
-    def __init__(self, numhwbp, dbg):
-        self._numhwbp = numhwbp
-        self.dbg = dbg
-        self._hwbplist = [None]*numhwbp
-        self._tempalloc = None
-        self.logger = getLogger('pyavrocd.hardwarebp')
-
-
-    def execute(self):
-        """
-        Start execution with HWBP 0 (if not None)
-        """
-        if self._hwbplist[0] is not None:
-            self.logger.debug("Run to cursor 0x%X", self._hwbplist[0])
-            self.dbg.run_to(self._hwbplist[0])
-        else:
-            self.logger.debug("Run")
-            self.dbg.run()
-
-    def clear_all(self):
-        """
-        Clear all hardware breakpoints
-        """
-        self._hwbplist = [None]*self._numhwbp
-        for ix in range(self._numhwbp):
-            self.dbg.hardware_breakpoint_clear(ix+1)
-        self.logger.debug("All hardware breakpoints cleared")
-
-    def clear(self, addr):
-        """
-        Clear breakpoint at a given address. If successful return True, otherwise False.
-        """
-        if addr in self._hwbplist:
-            self._free(self._hwbplist.index(addr))
-            return True
-        self.logger.error("Tried to clear hardware breakpoint at 0x%X, but there is none", addr)
-        return False
+                self.logger.debug("Condition of BP at 0x%X is false, resume execution", addr)
+            sig = self.single_step(None)
+            if sig != SIGTRAP:
+                return sig
+            addr = self.dbg.program_counter_read() << 1
+            if addr in self._bp and self._bp[addr]['active']: # stepped onto another BP
+                self._continuing = True
+                continue
+            return self.resume_execution(None)
+        self._stop_pc = addr
+        return SIGTRAP
 
-    def _free(self, ix):
+    def _explained_stop(self, addr):
         """
-        Free a BP at index ix. If unsuccessful, return False, otherwise True.
+        Returns True if a stop at addr can be explained by a breakpoint or by a
+        stop point of range-stepping
         """
-        if 0 <= ix < self._numhwbp and self._hwbplist[ix] is not None:
-            self.logger.debug("HWBP %d at addr 0x%X freed", ix, self._hwbplist[ix])
-            self._hwbplist[ix] = None
-            if ix > 0:
-                self.dbg.hardware_breakpoint_clear(ix)
+        if addr in self._bp and self._bp[addr]['active']:
             return True
-        self.logger.error("Tried to release unallocated hardware breakpoint %d", ix)
-        return False
-
-    def available(self):
-        """
-        Returns the number of hardware breakpoints that are available
-        """
-        return self._numhwbp - len([addr for addr in self._hwbplist if addr is not None])
-
-    def set(self, addr):
-        """
-        Allocates the next free hardware breakpoint (counting up) and returns the index
-        -- provided there is a free hardware breakpoint. Otherwise, None is returned.
-        """
-        self.logger.debug("Trying to allocate HWBP for addr 0x%X", addr)
-        for ix in range(self._numhwbp):
-            if self._hwbplist[ix] is None:
-                self._hwbplist[ix] = addr
-                if ix > 0:
-                    self.dbg.hardware_breakpoint_set(ix, addr)
-                self.logger.debug("Successfully allocated HWBP %d", ix)
-                return ix
-        self.logger.debug("Could not allocate a HWBP")
-        return None
-
-    def unallocate_hwbp0(self):
-        """
-        Unallocates hardware breakpoint 0. It first tries to find a free slot among the
-        hardware breakpoints. If there is no free slot, it will kick out an occupied
-        one and returns the address, so that this BP can become a software breakpoint.
-        If we only have one hardware breakpont, we simply return the address.
-        The result is either None, meaning that we were able to find some empty slot,
-        or it will be an address of a BP that needs to become a software breakpoint.
-        The rationale behind this method is: Sometimes we need this hardware breakpoint
-        (for safe single-stepping). And the best way to handle that is to find another
-        hardware breakpoint slot because HWBP 0 is often assigned to a temporary breakpoint.
-        """
-        if self._hwbplist[0] is None:
-            return None
-        if self.available(): # there are free slots
-            self.set(self._hwbplist[0]) # assign HWBP0 to some other slot
-            self._free(0) # then free HWBP0 slot
-            return None
-        if self._numhwbp < 2: # If there is only one HWBP free it
-            reassign = self._hwbplist[0]
-        else:
-            reassign = self._hwbplist[1] # kick out another HWBP
-            self._hwbplist[1] = self._hwbplist[0] # store HWBP 0 in this slot
-        self._free(0) # unallocate HWBP 0
-        return reassign # this one needs to be reassigned
-
-    def set_temp(self,templist):
-        """
-        Try to set all HWBPs for all addresses in templist. Returns None if impossible or
-        returns a list of addresses that needs to become software breakpoints. This function
-        is used to support range-stepping. In self._tempalloc we remember, which HWBPs 
-        have been allocated temporarily.
-        """
-        self.logger.debug("Trying to allocate %d temp HWBPs", len(templist))
-        reassignlist = []
-        if len(templist) > self._numhwbp:
-            return None
-        # make sure that HWBP 0 is one of our BPs!
-        reassign = self.unallocate_hwbp0()
-        if reassign:
-            reassignlist.append(reassign)
-        self._tempalloc = []
-        allocated = [addr for addr in self._hwbplist if addr is not None]
-        for el in templist:
-            nextix = self.set(el)
-            if nextix is not None:
-                self._tempalloc.append(nextix)
-            else:
-                trytoremove = allocated.pop()
-                reassignlist.append(trytoremove)
-                self.clear(trytoremove)
-                self._tempalloc.append(self.set(el))
-        self.logger.debug("Allocated %d temp HWBPs", len(self._tempalloc))
-        return reassignlist
-
-    def clear_temp(self):
-        """
-        Clears the temporary allocated hardware breakpoints.
-        """
-        if self._tempalloc is None:
-            return
-        for el in self._tempalloc:
-            if el >= 0:
-                self._free(el)
-        self._tempalloc = None
-        self.logger.debug("HWBP temp allocation cleared: %d HWBPs cleared", len(self._tempalloc))
+        if self._range.start is None or self._range.start == self._range.end or \
+          self._continuing:
+            return False
+        return addr == self._run_target or addr in self._range.exit or \
+          not self._range.start <= addr < self._range.end
 
-    def temp_allocated(self):
+    def _build_range(self, start, end):
         """
-        Returns number of HWBPs temporarilly allocated to range-stepping
+        Analyze the range start-end for range-stepping (see StepRange.build).
+        Return False, if the range is already established.
         """
-        if self._tempalloc is None:
-            return 0
-        return len(self._tempalloc)
-
+        return self._range.build(start, end, bool(self.mon.is_stepover()), self._read_filtered_flash_word)
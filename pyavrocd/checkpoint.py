@@ -0,0 +1,207 @@
+"""
+This module implements checkpoints of the complete target state that can be saved and restored.
+"""
+
+# args, logging
+from logging import getLogger
+from collections import OrderedDict
+import os
+import re
+import struct
+
+from pyavrocd.snapshot import RegisterSnapshot
+
+MAGIC = b'AVRCKP\x01\x00'
+DEFAULT_CAPACITY = 8 # number of checkpoints kept in memory
+NO_EEPROM = 0xFFFFFFFF # EEPROM length in a checkpoint file if EEPROM was not captured
+
+class Checkpoint():
+    """
+    The saved state of a stopped MCU: register file, SREG, SP, PC (byte address),
+    the contents of the internal SRAM, and, optionally, the EEPROM contents (or None).
+    """
+    __slots__ = ('regs', 'sreg', 'sp', 'pc', 'sram', 'eeprom')
+
+    def __init__(self, regs, sreg, sp, pc, sram, *, eeprom=None):
+        self.regs = bytes(regs)
+        self.sreg = sreg
+        self.sp = sp
+        self.pc = pc
+        self.sram = bytes(sram)
+        self.eeprom = None if eeprom is None else bytes(eeprom)
+
+    def size(self):
+        """
+        Returns the number of memory bytes in the checkpoint
+        """
+        return len(self.sram) + (len(self.eeprom) if self.eeprom is not None else 0)
+
+    def to_bytes(self):
+        """
+        Serialize the checkpoint for spilling it to disk
+        """
+        return MAGIC + self.regs + struct.pack('<BHI', self.sreg, self.sp, self.pc) + \
+          struct.pack('<I', len(self.sram)) + self.sram + \
+          (struct.pack('<I', NO_EEPROM) if self.eeprom is None else
+               struct.pack('<I', len(self.eeprom)) + self.eeprom)
+
+    @staticmethod
+    def from_bytes(data):
+        """
+        Deserialize a checkpoint written by to_bytes. Raises ValueError
+        if data is not a checkpoint.
+        """
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a checkpoint")
+        try:
+            pos = len(MAGIC)
+            regs = data[pos:pos+32]
+            sreg, sp, pc, sramlen = struct.unpack_from('<BHII', data, pos+32)
+            pos += 32 + 11
+            sram = data[pos:pos+sramlen]
+            pos += sramlen
+            eepromlen = struct.unpack_from('<I', data, pos)[0]
+            eeprom = None if eepromlen == NO_EEPROM else data[pos+4:pos+4+eepromlen]
+        except struct.error as e:
+            raise ValueError("Truncated checkpoint") from e
+        if len(regs) != 32 or len(sram) != sramlen or (eeprom is not None and len(eeprom) != eepromlen):
+            raise ValueError("Truncated checkpoint")
+        return Checkpoint(regs, sreg, sp, pc, sram, eeprom=eeprom)
+
+class CheckpointStore():
+    """
+    Saves and restores checkpoints of the MCU state. The internal SRAM is read
+    and written in as few bulk transfers as possible: only the masked registers
+    (if any of them fall into the SRAM range) split a transfer, and the debugger
+    layer chunks it into the largest packets the probe supports.
+    The most recently used checkpoints are kept in memory. When more than capacity
+    checkpoints exist, the least recently used one is written to the spill
+    directory (if one has been set) or discarded.
+    """
+
+    def __init__(self, dbg, mem, capacity=DEFAULT_CAPACITY):
+        self.dbg = dbg
+        self.mem = mem
+        self.logger = getLogger('pyavrocd.checkpoint')
+        self._capacity = capacity
+        self._spill_dir = None # directory for checkpoints evicted from memory
+        self._checkpoints = OrderedDict() # name -> Checkpoint, least recently used first
+        sram = self.dbg.memory_info.memory_info_by_name('internal_sram')
+        self._sram_start = sram['address']
+        self._sram_size = sram['size']
+        eeprom = self.dbg.memory_info.memory_info_by_name('eeprom')
+        self._eeprom_start = eeprom['address']
+        self._eeprom_size = eeprom['size']
+        self._masked_registers = self.dbg.device_info.get('masked_registers', [])
+
+    def set_spill_dir(self, path):
+        """
+        Set the directory for evicted checkpoints (None disables spilling)
+        """
+        self._spill_dir = path
+
+    def spill_dir(self):
+        """
+        Returns the directory for evicted checkpoints (or None)
+        """
+        return self._spill_dir
+
+    def _spill_path(self, name):
+        """
+        Returns the file name of a spilled checkpoint
+        """
+        return os.path.join(self._spill_dir, re.sub(r'[^\w.-]', '_', name) + '.ckp')
+
+    def names(self):
+        """
+        Returns the names of the checkpoints in memory, most recently used first
+        """
+        return list(reversed(self._checkpoints))
+
+    def save(self, name, eeprom=False):
+        """
+        Capture the current state of the stopped MCU under name and return the checkpoint
+        """
+        snap = RegisterSnapshot(self.dbg)
+        ckp = Checkpoint(snap.registers(), snap.status_register(), snap.stack_pointer(),
+                             snap.program_counter(),
+                             self.mem.sram_masked_read(self._sram_start, self._sram_size),
+                             eeprom=self.mem.eeprom_read(self._eeprom_start, self._eeprom_size)
+                             if eeprom else None)
+        self._checkpoints[name] = ckp
+        self._checkpoints.move_to_end(name)
+        self.logger.info("Checkpoint '%s' saved (%d bytes)", name, ckp.size())
+        self._evict()
+        return ckp
+
+    def _evict(self):
+        """
+        Remove least recently used checkpoints from memory until capacity is reached
+        """
+        while len(self._checkpoints) > self._capacity:
+            name, ckp = self._checkpoints.popitem(last=False)
+            if self._spill_dir is None:
+                self.logger.info("Checkpoint '%s' discarded", name)
+                continue
+            try:
+                os.makedirs(self._spill_dir, exist_ok=True)
+                with open(self._spill_path(name), 'wb') as ckpfile:
+                    ckpfile.write(ckp.to_bytes())
+                self.logger.info("Checkpoint '%s' spilled to disk", name)
+            except OSError as e:
+                self.logger.error("Could not spill checkpoint '%s': %s", name, e)
+
+    def _lookup(self, name):
+        """
+        Returns the checkpoint name from memory or from the spill directory (or None)
+        """
+        if name in self._checkpoints:
+            self._checkpoints.move_to_end(name)
+            return self._checkpoints[name]
+        if self._spill_dir is None:
+            return None
+        try:
+            with open(self._spill_path(name), 'rb') as ckpfile:
+                ckp = Checkpoint.from_bytes(ckpfile.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.error("Could not read checkpoint '%s': %s", name, e)
+            return None
+        self._checkpoints[name] = ckp
+        self._evict()
+        return ckp
+
+    def restore(self, name):
+        """
+        Write back the state saved under name. Returns the checkpoint or None if there is none.
+        """
+        ckp = self._lookup(name)
+        if ckp is None:
+            return None
+        self._sram_write_unmasked(self._sram_start, ckp.sram)
+        if ckp.eeprom is not None:
+            self.mem.eeprom_write(self._eeprom_start, ckp.eeprom)
+        self.dbg.register_file_write(bytearray(ckp.regs))
+        self.dbg.status_register_write(bytearray([ckp.sreg]))
+        self.dbg.stack_pointer_write(ckp.sp.to_bytes(2, byteorder='little'))
+        self.dbg.program_counter_write(ckp.pc >> 1)
+        self.logger.info("Checkpoint '%s' restored", name)
+        return ckp
+
+    def _sram_write_unmasked(self, addr, data):
+        """
+        Write data to SRAM starting at addr in bulk, skipping the masked registers
+        """
+        end = addr + len(data)
+        start = addr
+        for mr in sorted(self._masked_registers):
+            if mr >= end:
+                break
+            if mr < start:
+                continue
+            if start < mr:
+                self.dbg.sram_write(start, data[start-addr:mr-addr])
+            start = mr + 1
+        if start < end:
+            self.dbg.sram_write(start, data[start-addr:])
@@ -0,0 +1,107 @@
+"""
+This module implements a debug console that reads the output of the firmware from an SRAM ring buffer.
+"""
+
+# args, logging
+from logging import getLogger
+import time
+
+DEFAULT_SYMBOL = "pyavrocd_console" # name of the ring buffer in the firmware
+DRAIN_INTERVAL = 0.2 # seconds between drains while the MCU is running
+LIVE_READ_IFACES = { 'updi', 'pdi' } # interfaces that can read SRAM while the MCU is running
+
+class SramConsole():
+    """
+    The firmware writes its output into a ring buffer in SRAM with the layout
+
+        struct { volatile uint8_t head; volatile uint8_t tail; char data[N]; }
+
+    where the firmware advances head after storing a character at data[head] and
+    the server advances tail after having read the characters from tail up to head.
+    Both indices are single bytes so that they are always accessed atomically, which
+    limits N to 255. The buffer is full when (head+1) % N == tail. In this case, the
+    firmware should drop the character (or wait). Draining needs one bulk read of the
+    whole buffer and, if there was new output, one write of the tail index.
+    """
+
+    def __init__(self, dbg):
+        self.dbg = dbg
+        self.logger = getLogger('pyavrocd.console')
+        self._addr = None # SRAM address of the ring buffer, None if not attached
+        self._size = 0 # size of the buffer including the two index bytes
+        self._live = dbg.iface in LIVE_READ_IFACES # drain also while running
+        self._next = 0 # time of next drain while running
+
+    def attach(self, addr, size):
+        """
+        Use the ring buffer at SRAM address addr with size bytes (including the indices).
+        Returns False if the size is not suitable for a ring buffer.
+        """
+        if not 3 <= size <= 257:
+            self.logger.error("Console buffer of %d bytes is unusable", size)
+            return False
+        self._addr = addr
+        self._size = size
+        self._next = 0
+        self.logger.info("Console buffer at 0x%X with %d bytes", addr, size)
+        return True
+
+    def detach(self):
+        """
+        Stop reading the console
+        """
+        self._addr = None
+
+    def active(self):
+        """
+        Returns True iff a ring buffer is attached
+        """
+        return self._addr is not None
+
+    def address(self):
+        """
+        Returns the SRAM address of the ring buffer (or None)
+        """
+        return self._addr
+
+    def live(self):
+        """
+        Returns True iff the console is drained also while the MCU is running
+        """
+        return self.active() and self._live
+
+    def due(self):
+        """
+        Returns True if the console can be drained while running and the next drain is due
+        """
+        return self.live() and time.monotonic() >= self._next
+
+    def drain(self):
+        """
+        Read the new output from the ring buffer, advance the tail index,
+        and return the output as a string (which may be empty).
+        """
+        if not self.active():
+            return ""
+        self._next = time.monotonic() + DRAIN_INTERVAL
+        buf = self.dbg.sram_read(self._addr, self._size)
+        head, tail, data = buf[0], buf[1], buf[2:]
+        if head >= len(data) or tail >= len(data):
+            self.logger.warning("Console buffer indices out of range: head=%d, tail=%d", head, tail)
+            return ""
+        if head == tail:
+            return ""
+        if tail < head:
+            text = data[tail:head]
+        else:
+            text = data[tail:] + data[:head]
+        self.dbg.sram_write(self._addr + 1, bytearray([head]))
+        return bytes(text).decode('utf-8', errors='replace')
+
+    def disable_live(self):
+        """
+        Stop draining while running, e.g., because the debugger refused to read memory
+        """
+        if self._live:
+            self.logger.warning("SRAM cannot be read while running: console is drained only at stops")
+        self._live = False
@@ -0,0 +1,85 @@
+"""
+This module reads the symbol table of an AVR ELF file, so that addresses can be
+mapped to function names and symbols to addresses.
+"""
+
+# args, logging
+from logging import getLogger
+import bisect
+import struct
+
+# Errors
+from pyavrocd.errors import ElfError
+
+SHT_SYMTAB = 2
+STT_OBJECT = 1
+STT_FUNC = 2
+DATA_OFFSET = 0x800000 # where avr-gcc puts SRAM in the ELF address space
+
+class ElfSymbols():
+    """
+    This class extracts the function and object symbols from a (32-bit, little-endian)
+    ELF file. Only the symbol table is read, there is no need for DWARF information.
+    """
+
+    def __init__(self, path):
+        self.logger = getLogger('pyavrocd.elfsymbols')
+        self._functions = [] # sorted list of (address, size, name)
+        self._starts = [] # start addresses of the functions for bisecting
+        self._symbols = {} # name -> (address, size) of functions and objects
+        try:
+            with open(path, 'rb') as elffile:
+                self._parse(elffile.read())
+        except OSError as e:
+            raise ElfError("Cannot read ELF file {}: {}".format(path, e)) from e
+        except struct.error as e:
+            raise ElfError("Truncated ELF file {}".format(path)) from e
+        self.logger.debug("%d functions and %d symbols read from %s",
+                              len(self._functions), len(self._symbols), path)
+
+    def _parse(self, data):
+        """
+        Parse the section headers and the symbol table
+        """
+        if data[:4] != b'\x7fELF' or data[4] != 1 or data[5] != 1:
+            raise ElfError("Not a 32-bit little-endian ELF file")
+        shoff, = struct.unpack_from('<I', data, 0x20)
+        shentsize, shnum = struct.unpack_from('<HH', data, 0x2E)
+        sections = [struct.unpack_from('<IIIIIIIIII', data, shoff + ix*shentsize)
+                        for ix in range(shnum)]
+        for section in sections:
+            if section[1] != SHT_SYMTAB:
+                continue
+            _, _, _, _, offset, size, link, _, _, entsize = section
+            stroff = sections[link][4]
+            for symoff in range(offset, offset + size, entsize):
+                nameix, value, symsize, info = struct.unpack_from('<IIIB', data, symoff)
+                if info & 0x0F not in (STT_FUNC, STT_OBJECT) or nameix == 0:
+                    continue
+                name = data[stroff + nameix:data.index(b'\x00', stroff + nameix)].decode('latin-1')
+                self._symbols[name] = (value, symsize)
+                if info & 0x0F == STT_FUNC:
+                    self._functions.append((value, symsize, name))
+        self._functions.sort()
+        self._starts = [func[0] for func in self._functions]
+
+    def function_at(self, addr):
+        """
+        Returns the name of the function containing the flash byte address addr,
+        or None if there is none.
+        """
+        ix = bisect.bisect_right(self._starts, addr) - 1
+        if ix < 0:
+            return None
+        start, size, name = self._functions[ix]
+        if addr < start + max(size, 2):
+            return name
+        return None
+
+    def address_of(self, name):
+        """
+        Returns the pair (address, size) of the symbol name, or None if there is no such symbol.
+        Addresses of SRAM objects are returned as they appear in the ELF file,
+        i.e., with DATA_OFFSET added.
+        """
+        return self._symbols.get(name)
@@ -11,3 +11,18 @@ class EndOfSession(Exception):
     """Termination of session"""
     def __init__(self, msg=None):
         super().__init__(msg)
+
+class AgentExpressionError(Exception):
+    """Agent expression could not be parsed or evaluated"""
+    def __init__(self, msg=None):
+        super().__init__(msg)
+
+class ElfError(Exception):
+    """ELF file could not be read"""
+    def __init__(self, msg=None):
+        super().__init__(msg)
+
+class ReplayError(Exception):
+    """USB transfer could not be served from a recording"""
+    def __init__(self, msg=None):
+        super().__init__(msg)
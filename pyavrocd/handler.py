@@ -19,15 +19,31 @@ from pyedbglib.protocols.edbgprotocol import EdbgProtocol
 from pymcuprog.pymcuprog_errors import PymcuprogNotSupportedError, PymcuprogError
 
 from pyavrocd.memory import Memory
+from pyavrocd.xavr8target import HWBPNUM
 from pyavrocd.breakexec import BreakAndExec, NOSIG, SIGHUP, SIGINT, SIGILL, SIGTRAP, SIGABRT, SIGBUS
 from pyavrocd.monitor import MonitorCommand
 from pyavrocd.livetests import LiveTests
-from pyavrocd.errors import  EndOfSession, FatalError
+from pyavrocd.profiler import Profiler
+from pyavrocd.checkpoint import CheckpointStore
+from pyavrocd.console import SramConsole
+from pyavrocd.stats import PacketStats
+from pyavrocd.serverprofile import ServerProfiler
+from pyavrocd.toolcommands import ToolCommands
+from pyavrocd.tracebuffer import trace, packet_head, RSP_IN, RSP_OUT
+from pyavrocd.errors import  EndOfSession, FatalError, AgentExpressionError
+from pyavrocd.agentexpr import AgentExpression
 from pyavrocd.deviceinfo.devices.alldevices import dev_name
 
 RECEIVE_BUFFER = 1024
 
-class GdbHandler():
+# time between polls for events (in seconds) when there is no input from GDB
+POLL_INTERVAL = 0.5
+
+# packets that cannot change the PC, so that the PC recorded at the last stop stays valid
+KEEP_STOP_PC = { '?', 'c', 'C', 'g', 'H', 'm', 'p', 'qAttached', 'qOffsets', 'qSupported',
+                     'qfThreadInfo', 'qsThreadInfo', 'qXfer', 's', 'S', 'T', 'vCont', 'z', 'Z' }
+
+class GdbHandler(): #pylint: disable=too-many-instance-attributes
     """
     GDB handler
     Maps between incoming GDB requests and AVR debugging protocols (via pymcuprog)
@@ -39,8 +55,13 @@ class GdbHandler():
         self.dbg = avrdebugger
         self.mon = MonitorCommand(self.dbg.iface, args)
         self.mem = Memory(avrdebugger, self.mon)
-        self.bp = BreakAndExec(1, self.mon, avrdebugger, avrdebugger.architecture,
-                                   self.mem.flash_read_word)
+        self.bp = BreakAndExec(HWBPNUM.get(self.dbg.iface, 1), self.mon, avrdebugger, avrdebugger.architecture,
+                                   self.mem.flash_read_word,
+                                   read_memory=lambda addr, size:
+                                   self.mem.readmem("{:06X}".format(addr), "{:X}".format(size)),
+                                   output=lambda text: self.send_debug_message(text, newline=False),
+                                   interrupted=self.poll_gdb_input)
+        self.mem.breakpoint_overlay = self.bp.fold_breakpoints
         self._comsocket = comsocket
         self._devicename = devicename
         self.last_sigval = 0
@@ -49,9 +70,19 @@ class GdbHandler():
         self._vflashdone = False # set to True after vFlashDone received
         self.critical = None
         self._live_tests = LiveTests(self)
+        self.profiler = Profiler(avrdebugger, self.bp,
+                                     big_flash=avrdebugger.memory_info.memory_info_by_name('flash')['size']
+                                     > 128*1024)
+        self.checkpoints = CheckpointStore(avrdebugger, self.mem)
+        self.console = SramConsole(avrdebugger)
+        self.stats = PacketStats(avrdebugger)
+        self.server_profiler = ServerProfiler(self.stats, args.profile)
+        self.tools = ToolCommands(self) # executes the monitor commands of the tools above
+        self._running = False # execution has been started by 'continue' and not yet reported as stopped
         self.packettypes = {
             '!'           : self._extended_remote_handler,
             '?'           : self._stop_reason_handler,
+            'b'           : self._reverse_handler,
             'c'           : self._continue_handler,
             'C'           : self._continue_with_signal_handler, # signal will be ignored
             'D'           : self._detach_handler,
@@ -101,6 +132,9 @@ class GdbHandler():
             self.logger.debug("Unhandled GDB RSP packet type: %s", cmd)
             self.send_packet("")
             return
+        if cmd not in KEEP_STOP_PC:
+            self.bp.forget_stop_pc()
+        state = self.stats.begin() if self.stats.enabled else None
         try:
             if cmd not in {'X', 'vFlashWrite'}: # no binary data in packet
                 packet = packet.decode('ascii')
@@ -110,6 +144,9 @@ class GdbHandler():
             if not self.critical:
                 self.critical = e
             self.send_signal(SIGABRT)
+        if state:
+            # execution packets are distinguished by their action
+            self.stats.end(cmd + packet[:2] if cmd == 'vCont' else cmd, state)
 
     def _extended_remote_handler(self, _):
         """
@@ -173,8 +210,23 @@ class GdbHandler():
             self.logger.warning("Cannot execute because stack pointer is too low")
         if sig is not None:
             self.send_signal(sig)
+        else:
+            self._running = True
 
 
+    def _reverse_handler(self, packet):
+        """
+        'bs', 'bc': reverse step and reverse continue using the recorded execution history
+        """
+        self.logger.debug("RSP packet: reverse %s", packet)
+        if packet not in ('s', 'c'):
+            self.send_packet("")
+            return
+        if not self.__debugger_is_active():
+            return
+        sig = self.bp.reverse_step() if packet == 's' else self.bp.reverse_continue()
+        self.send_signal(sig, self.bp.stop_reason())
+
     def _continue_handler(self, packet):
         """
         'c': Continue execution, either at current address or at given address
@@ -186,6 +238,9 @@ class GdbHandler():
         if packet:
             newpc = int(packet,16)
             self.logger.debug("Set PC to 0x%X before resuming execution", newpc)
+        if self.mon.stepi_parameters():
+            self.__send_execution_result_signal(self.tools.server_stepping(newpc))
+            return
         self.__send_execution_result_signal(self.bp.resume_execution(newpc))
 
     def _continue_with_signal_handler(self, packet):
@@ -391,6 +446,7 @@ class GdbHandler():
             elif response[0] == 'reset':
                 if self.mon.is_debugger_active():
                     self.dbg.reset()
+                    self.bp.clear_history()
             elif response[0] in [0, 1]:
                 self.dbg.device.avr.protocol.set_byte(Avr8Protocol.AVR8_CTXT_OPTIONS,
                                                     Avr8Protocol.AVR8_OPT_RUN_TIMERS,
@@ -411,6 +467,8 @@ class GdbHandler():
                                                    error_line))
             elif 'live_tests' in response[0]:
                 self._live_tests.run_tests()
+            elif response[0] in self.tools:
+                response = ("", self.tools.execute(*response))
         except AvrIspProtocolError:
             self.logger.critical("ISP programming failed. Wrong connection or wrong MCU?")
             if not self.critical:
@@ -461,8 +519,9 @@ class GdbHandler():
         we will try to establish a connection to the target OCD
         """
         self.logger.debug("RSP packet: qSupported query.")
-        self.logger.debug("Will answer 'PacketSize=%X;qXfer:memory-map:read+'",
-                              self.packet_size)
+        self.logger.debug("Will answer 'PacketSize=%X;qXfer:memory-map:read+;"
+                              "ConditionalBreakpoints+;BreakpointCommands+;"
+                              "ReverseStep+;ReverseContinue+'", self.packet_size)
         # Try to start a debugging session. If we are unsuccessful,
         # one has to use the 'monitor debugwire on' command later on
         # If a fatal error is raised, we will remember that and print it again
@@ -476,7 +535,8 @@ class GdbHandler():
                 self.critical = e
             self.dbg.stop_debugging()
         self.logger.debug("debugger_active=%d",self.mon.is_debugger_active())
-        self.send_packet("PacketSize={0:X};qXfer:memory-map:read+".format(self.packet_size))
+        self.send_packet("PacketSize={0:X};qXfer:memory-map:read+;ConditionalBreakpoints+;"
+                             "BreakpointCommands+;ReverseStep+;ReverseContinue+".format(self.packet_size))
 
     def _first_thread_info_handler(self, _):
         """
@@ -560,6 +620,9 @@ class GdbHandler():
         """
         self.logger.debug("RSP packet: vFlashDone")
         self._vflashdone = True
+        if not self.mon.is_erase_before_load():
+            # SWBPs on code that is going to change are cleared before programming
+            self.bp.check_load(self.mem.cached_flash_word)
         try:
             self.dbg.device.avr.switch_to_progmode()
             self.mem.programming_mode = True
@@ -582,10 +645,13 @@ class GdbHandler():
         """
         self.logger.debug("RSP packet: vFlashErase")
         if self.mon.is_debugger_active():
-            self.bp.cleanup_breakpoints()
             if self.mon.is_erase_before_load():
+                self.bp.cleanup_breakpoints()
                 # if erase is not possible or desired, then it is done before flashing each page (perhaps implicitly)
                 self.dbg.device.erase_chip(self.mem.programming_mode)
+            else:
+                # SWBPs are kept and folded into the page images of the load
+                self.bp.prepare_load()
             if self._vflashdone:
                 self._vflashdone = False
                 self.mem.init_flash() # clear cache
@@ -657,6 +723,7 @@ class GdbHandler():
         self.logger.debug("RSP packet: kill process, will reset MCU")
         if self.mon.is_debugger_active():
             self.dbg.reset()
+            self.bp.clear_history()
         self.send_packet("OK")
         if not self._extended_remote_mode:
             self.logger.debug("Terminating session ...")
@@ -671,6 +738,7 @@ class GdbHandler():
             return
         self.logger.debug("Resetting MCU and wait for start")
         self.dbg.reset()
+        self.bp.clear_history()
         self.send_signal(SIGTRAP)
 
     def _set_binary_memory_handler(self, packet):
@@ -693,15 +761,20 @@ class GdbHandler():
         if int(addr,16) < 0x80000: # writing to flash
             if not self.mem.lazy_loading:
                 self.logger.info("Loading executable")
-                self.bp.cleanup_breakpoints() # cleanup breakpoints before load
                 self.mem.lazy_loading = True
-                self.dbg.device.avr.switch_to_progmode()
-                self.mem.programming_mode = True
-                self.logger.info("Switched to programming mode")
                 if self.mon.is_erase_before_load():
+                    self.bp.cleanup_breakpoints() # cleanup breakpoints before load
+                    self.dbg.device.avr.switch_to_progmode()
+                    self.mem.programming_mode = True
+                    self.logger.info("Switched to programming mode")
                     # If erase before load is requested, we do that here
-                    # otherwise it will done implicitly before each page is programmed
                     self.dbg.device.erase_chip(self.mem.programming_mode)
+                else:
+                    # Keep breakpoints if code does not change. The records are only cached
+                    # and compared with the breakpoints when loading is finalized.
+                    # Pages will be erased implicitly before they are programmed.
+                    self.bp.prepare_load()
+                    self.mem.defer_programming = True
         try:
             reply = self.mem.writemem(addr, bytearray(data))
         except:
@@ -717,6 +790,13 @@ class GdbHandler():
         the X-records.
         """
         self.logger.debug("Finalize binary programming")
+        if self.mem.defer_programming:
+            # SWBPs on code that is going to change are cleared before programming
+            self.bp.check_load(self.mem.cached_flash_word)
+            self.mem.defer_programming = False
+            self.dbg.device.avr.switch_to_progmode()
+            self.mem.programming_mode = True
+            self.logger.info("Programming mode entered")
         self.mem.lazy_loading = False
         self.mem.flash_pages() # program the remaining bytes
         self.dbg.device.avr.switch_to_debmode()
@@ -734,6 +814,13 @@ class GdbHandler():
         if breakpoint_type in {"0", "1"}:
             self.bp.remove_breakpoint(int(addr, 16))
             self.send_packet("OK")
+        elif breakpoint_type in {"2", "3", "4"}:
+            length = packet.split(",")[2]
+            if self.bp.remove_watchpoint(int(breakpoint_type), int(addr, 16),
+                                             int(length, 16)) is None:
+                self.send_packet("")
+            else:
+                self.send_packet("OK")
         else:
             self.logger.debug("Breakpoint type %s not supported", breakpoint_type)
             self.send_packet("")
@@ -743,11 +830,24 @@ class GdbHandler():
         'Z': Set a breakpoint
         """
         breakpoint_type = packet[0]
-        addr = packet.split(",")[1]
+        params = packet.split(";")
+        addr = params[0].split(",")[1]
         self.logger.debug("RSP packet: set BP of type %s at %s", breakpoint_type, addr)
         if breakpoint_type in {"0", "1"}:
-            self.bp.insert_breakpoint(int(addr, 16))
+            try:
+                conditions, commands = AgentExpression.parse_params(params[1:])
+            except AgentExpressionError as e:
+                self.logger.error("Breakpoint condition or command: %s", e)
+                self.send_packet("E01")
+                return
+            self.bp.insert_breakpoint(int(addr, 16), conditions, commands)
             self.send_packet("OK")
+        elif breakpoint_type in {"2", "3", "4"}:
+            length = params[0].split(",")[2]
+            result = self.bp.insert_watchpoint(int(breakpoint_type), int(addr, 16),
+                                                   int(length, 16))
+            # None: no data breakpoints, GDB will use software watchpoints
+            self.send_packet({ None : "", True : "OK", False : "E01" }[result])
         else:
             self.logger.error("Breakpoint type %s not supported", breakpoint_type)
             self.send_packet("")
@@ -762,7 +862,18 @@ class GdbHandler():
         pc = self.dbg.poll_event()
         if pc:
             self.logger.debug("MCU stopped execution")
-            self.send_signal(SIGTRAP)
+            self.send_signal(self.bp.handle_stop(pc << 1), self.bp.stop_reason())
+        elif self._running and self.console.due():
+            self.tools.drain_console(running=True)
+        elif self._running and self.profiler.due() and self.bp.sampling_possible():
+            self.tools.sample_pc()
+
+    def poll_interval(self):
+        """
+        Returns the maximal time the server may wait for GDB input before
+        poll_events is called again
+        """
+        return self.tools.poll_interval(POLL_INTERVAL) if self._running else POLL_INTERVAL
 
     def poll_gdb_input(self):
         """
@@ -775,7 +886,9 @@ class GdbHandler():
         """
         Sends a GDB response packet
         """
-        checksum = sum(packet_data.encode("ascii")) % 256
+        encoded = packet_data.encode("ascii")
+        checksum = sum(encoded) % 256
+        trace.record(RSP_OUT, len(encoded), packet_head(encoded))
         message = "$" + packet_data + "#" + format(checksum, '02x')
         self.rsp_logger.debug("<- %s", message)
         self._lastmessage = packet_data
@@ -788,30 +901,34 @@ class GdbHandler():
         self.send_packet(binascii.hexlify(bytearray((mes+"\n").\
                                                     encode('utf-8'))).decode("ascii").upper())
 
-    def send_debug_message(self, mes):
+    def send_debug_message(self, mes, newline=True):
         """
         Send a packet that always should be displayed in the debug console when the system
         is in 'running' mode.
         """
-        self.send_packet('O' + binascii.hexlify(bytearray((mes+"\n").\
+        if newline:
+            mes += "\n"
+        self.send_packet('O' + binascii.hexlify(bytearray(mes.\
                                                     encode('utf-8'))).decode("ascii").upper())
 
-    def send_signal(self, signal):
+    def send_signal(self, signal, reason=""):
         """
-        Sends signal to GDB
+        Sends signal to GDB, optionally with a stop reason such as 'watch:800100;'
         """
         self.last_sigval = signal
         if signal: # do nothing if None or 0
+            self._running = False
             if signal in [SIGHUP, SIGILL, SIGABRT]:
                 self.send_packet("S{:02X}".format(signal))
                 return
+            self.tools.drain_console()
             sreg = self.dbg.status_register_read()[0]
             spl, sph = self.dbg.stack_pointer_read()
             # get PC as word address and make a byte address
             pc = self.dbg.program_counter_read() << 1
             pcstring = binascii.hexlify(pc.to_bytes(4,byteorder='little')).decode('ascii')
-            stoppacket = "T{:02X}20:{:02X};21:{:02X}{:02X};22:{};thread:1;".\
-              format(signal, sreg, spl, sph, pcstring)
+            stoppacket = "T{:02X}{}20:{:02X};21:{:02X}{:02X};22:{};thread:1;".\
+              format(signal, reason, sreg, spl, sph, pcstring)
             self.send_packet(stoppacket)
 
     def handle_data(self, data):
@@ -861,6 +978,7 @@ class GdbHandler():
                     self._comsocket.sendall(b"-")
                     self.rsp_logger.debug("<- -")
                 else:
+                    trace.record(RSP_IN, len(packet_data), packet_head(packet_data))
                     self._comsocket.sendall(b"+")
                     self.rsp_logger.debug("<- +")
                     # now split into command and data (or parameters) and dispatch
@@ -0,0 +1,237 @@
+"""
+This module manages the hardware breakpoints of the OCD.
+"""
+
+# args, logging
+from logging import getLogger
+
+class HardwareBP():
+    """
+    This class manages the hardware breakpoints with some basic methods (including starting
+    execution with the temporary breakpoint). Up to dbg.data_comparators of the hardware
+    breakpoints other than HWBP 0 can also be used as data breakpoints. These are recorded
+    as tuples ('data', addr, mode) in the list of hardware breakpoints. When a code breakpoint
+    has to be kicked out, the one with the lowest score (as computed by the optional score
+    function) is chosen.
+    """
+
+    def __init__(self, numhwbp, dbg, score=None):
+        self._numhwbp = numhwbp
+        self.dbg = dbg
+        self._numdata = min(numhwbp - 1, dbg.data_comparators)
+        self._score = score or (lambda addr: 0)
+        self._hwbplist = [None]*numhwbp
+        self._tempalloc = None
+        self.logger = getLogger('pyavrocd.hardwarebp')
+
+
+    def execute(self):
+        """
+        Start execution with HWBP 0 (if not None)
+        """
+        if self._hwbplist[0] is not None:
+            self.logger.debug("Run to cursor 0x%X", self._hwbplist[0])
+            self.dbg.run_to(self._hwbplist[0])
+        else:
+            self.logger.debug("Run")
+            self.dbg.run()
+
+    def run_to_address(self):
+        """
+        Returns the address HWBP 0 is assigned to (or None)
+        """
+        return self._hwbplist[0]
+
+    def clear_all(self):
+        """
+        Clear all hardware breakpoints (HWBP 0 is the implicit one of run_to)
+        """
+        self._hwbplist = [None]*self._numhwbp
+        for ix in range(1, self._numhwbp):
+            self.dbg.hardware_breakpoint_clear(ix)
+        self.logger.debug("All hardware breakpoints cleared")
+
+    def clear(self, addr):
+        """
+        Clear breakpoint at a given address. If successful return True, otherwise False.
+        """
+        if addr in self._hwbplist:
+            self._free(self._hwbplist.index(addr))
+            return True
+        self.logger.error("Tried to clear hardware breakpoint at 0x%X, but there is none", addr)
+        return False
+
+    def _free(self, ix):
+        """
+        Free a BP at index ix. If unsuccessful, return False, otherwise True.
+        """
+        if 0 <= ix < self._numhwbp and self._hwbplist[ix] is not None:
+            self.logger.debug("HWBP %d at addr %s freed", ix, self._hwbplist[ix])
+            self._hwbplist[ix] = None
+            if ix > 0:
+                self.dbg.hardware_breakpoint_clear(ix)
+            return True
+        self.logger.error("Tried to release unallocated hardware breakpoint %d", ix)
+        return False
+
+    def available(self):
+        """
+        Returns the number of hardware breakpoints that are available
+        """
+        return self._hwbplist.count(None)
+
+    def data_comparators(self):
+        """
+        Returns the number of hardware breakpoints that can be used as data breakpoints
+        """
+        return self._numdata
+
+    def data_allocated(self):
+        """
+        Returns the number of hardware breakpoints used as data breakpoints
+        """
+        return len([entry for entry in self._hwbplist if isinstance(entry, tuple)])
+
+    def set_data(self, addr, mode, evict=True):
+        """
+        Allocates a hardware breakpoint other than HWBP 0 as a data breakpoint for
+        the SRAM address addr with the given mode. If there is no free slot and evict
+        is True, a code breakpoint that is not temporarily allocated is kicked out.
+        Returns a pair consisting of the index (None if no slot could be found)
+        and the address of the kicked-out code breakpoint (or None), which then
+        needs to be reassigned.
+        """
+        self.logger.debug("Trying to allocate data HWBP for addr 0x%X", addr)
+        reassign = None
+        if self.data_allocated() >= self._numdata:
+            self.logger.debug("All data comparators are in use")
+            return None, None
+        slots = [ix for ix in range(1, self._numhwbp) if self._hwbplist[ix] is None]
+        if not slots and evict:
+            slots = [ix for ix in range(1, self._numhwbp)
+                         if isinstance(self._hwbplist[ix], int) and
+                         ix not in (self._tempalloc or [])]
+            if slots:
+                slots = [self._lowest_score(slots)]
+                reassign = self._hwbplist[slots[0]]
+                self._free(slots[0])
+        if not slots:
+            self.logger.debug("Could not allocate a data HWBP")
+            return None, None
+        self._hwbplist[slots[0]] = ('data', addr, mode)
+        self.dbg.hardware_watchpoint_set(slots[0], addr, mode)
+        self.logger.debug("Successfully allocated HWBP %d as data BP", slots[0])
+        return slots[0], reassign
+
+    def clear_data(self, addr, mode):
+        """
+        Clear the data breakpoint for addr with the given mode. If successful return True,
+        otherwise False.
+        """
+        if ('data', addr, mode) in self._hwbplist:
+            return self._free(self._hwbplist.index(('data', addr, mode)))
+        self.logger.error("Tried to clear data breakpoint at 0x%X, but there is none", addr)
+        return False
+
+    def set(self, addr):
+        """
+        Allocates the next free hardware breakpoint (counting up) and returns the index
+        -- provided there is a free hardware breakpoint. Otherwise, None is returned.
+        """
+        self.logger.debug("Trying to allocate HWBP for addr 0x%X", addr)
+        for ix in range(self._numhwbp):
+            if self._hwbplist[ix] is None:
+                self._hwbplist[ix] = addr
+                if ix > 0:
+                    self.dbg.hardware_breakpoint_set(ix, addr)
+                self.logger.debug("Successfully allocated HWBP %d", ix)
+                return ix
+        self.logger.debug("Could not allocate a HWBP")
+        return None
+
+    def unallocate_hwbp0(self):
+        """
+        Unallocates hardware breakpoint 0. It first tries to find a free slot among the
+        hardware breakpoints. If there is no free slot, it will kick out an occupied
+        one and returns the address, so that this BP can become a software breakpoint.
+        If we only have one hardware breakpont, we simply return the address.
+        The result is either None, meaning that we were able to find some empty slot,
+        or it will be an address of a BP that needs to become a software breakpoint.
+        The rationale behind this method is: Sometimes we need this hardware breakpoint
+        (for safe single-stepping). And the best way to handle that is to find another
+        hardware breakpoint slot because HWBP 0 is often assigned to a temporary breakpoint.
+        """
+        if self._hwbplist[0] is None:
+            return None
+        if self.available(): # there are free slots
+            self.set(self._hwbplist[0]) # assign HWBP0 to some other slot
+            self._free(0) # then free HWBP0 slot
+            return None
+        codeslots = [ix for ix in range(1, self._numhwbp)
+                         if not isinstance(self._hwbplist[ix], tuple)]
+        if not codeslots: # If there is only one HWBP (for code) free it
+            reassign = self._hwbplist[0]
+        else:
+            victim = self._lowest_score(codeslots)
+            reassign = self._hwbplist[victim] # kick out another HWBP
+            self._hwbplist[victim] = self._hwbplist[0] # store HWBP 0 in this slot
+            self.dbg.hardware_breakpoint_set(victim, self._hwbplist[0])
+        self._free(0) # unallocate HWBP 0
+        return reassign # this one needs to be reassigned
+
+    def _lowest_score(self, slots):
+        """
+        Returns the index among slots (holding code breakpoints) with the lowest score.
+        In case of a tie, the first one is returned.
+        """
+        return min(slots, key=lambda ix: self._score(self._hwbplist[ix]))
+
+    def set_temp(self,templist):
+        """
+        Try to set all HWBPs for all addresses in templist. Returns None if impossible or
+        returns a list of addresses that needs to become software breakpoints. This function
+        is used to support range-stepping. In self._tempalloc we remember, which HWBPs 
+        have been allocated temporarily.
+        """
+        self.logger.debug("Trying to allocate %d temp HWBPs", len(templist))
+        reassignlist = []
+        if len(templist) > self._numhwbp - self.data_allocated():
+            return None
+        # make sure that HWBP 0 is one of our BPs!
+        reassign = self.unallocate_hwbp0()
+        if reassign:
+            reassignlist.append(reassign)
+        self._tempalloc = []
+        allocated = [addr for addr in self._hwbplist if isinstance(addr, int)]
+        for el in templist:
+            nextix = self.set(el)
+            if nextix is not None:
+                self._tempalloc.append(nextix)
+            else:
+                trytoremove = min(reversed(allocated), key=self._score)
+                allocated.remove(trytoremove)
+                reassignlist.append(trytoremove)
+                self.clear(trytoremove)
+                self._tempalloc.append(self.set(el))
+        self.logger.debug("Allocated %d temp HWBPs", len(self._tempalloc))
+        return reassignlist
+
+    def clear_temp(self):
+        """
+        Clears the temporary allocated hardware breakpoints.
+        """
+        if self._tempalloc is None:
+            return
+        for el in self._tempalloc:
+            if el >= 0:
+                self._free(el)
+        self.logger.debug("HWBP temp allocation cleared: %d HWBPs cleared", len(self._tempalloc))
+        self._tempalloc = None
+
+    def temp_allocated(self):
+        """
+        Returns number of HWBPs temporarilly allocated to range-stepping
+        """
+        if self._tempalloc is None:
+            return 0
+        return len(self._tempalloc)
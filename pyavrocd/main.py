@@ -34,6 +34,11 @@ from pymcuprog.toolconnection import ToolUsbHidConnection, ToolSerialConnection
 
 from pyavrocd import dwlink
 from pyavrocd.xavrdebugger import XAvrDebugger
+from pyavrocd.simulator import SimDebugger
+from pyavrocd.probemodel import PRESETS
+from pyavrocd.usbreplay import RecordingTransport, ReplayTransport
+from pyavrocd.stats import CountingTransport
+from pyavrocd.tracebuffer import trace, DEFAULT_DUMP
 from pyavrocd.handler import GdbHandler, RECEIVE_BUFFER
 from pyavrocd.errors import  EndOfSession
 from pyavrocd.deviceinfo.devices.alldevices import dev_id, dev_iface
@@ -78,8 +83,10 @@ class RspServer():
             self.connection.setblocking(0)
             self.logger.info('Connection from %s', self.address)
             self.handler = GdbHandler(self.connection, self.avrdebugger, self.devicename, self.args)
+            if self.args.profile:
+                self.handler.server_profiler.start(packets=self.args.profile_packets)
             while not self._terminate:
-                ready = select.select([self.connection], [], [], 0.5)
+                ready = select.select([self.connection], [], [], self.handler.poll_interval())
                 if ready[0]:
                     data = self.connection.recv(RECEIVE_BUFFER)
                     if len(data) > 0:
@@ -99,6 +106,8 @@ class RspServer():
             return 1
         finally:
             self.logger.info("Leaving GDB server")
+            if self.handler and self.handler.server_profiler.active():
+                self.handler.server_profiler.stop()
             if self.avrdebugger and self.avrdebugger.device:
                 if self.avrdebugger.iface == "debugwire" and \
                   self.handler.mon.is_debugger_active() and \
@@ -221,11 +230,43 @@ You can also use monitor command options, e.g., --timer=freeze.
                             default=1000,
                             help="JTAG clock frequency for programming (kHz) (d.: 1000)")
 
+    parser.add_argument("--profile",
+                            metavar="FILE",
+                            dest='profile',
+                            type=str,
+                            help="Profile the GDB server and write the statistics to FILE")
+
+    parser.add_argument("--profile-packets",
+                            action="store_true",
+                            dest='profile_packets',
+                            help="Record also per-packet-type statistics with '--profile'")
+
+    parser.add_argument("--record-usb",
+                            metavar="FILE",
+                            dest='record_usb',
+                            type=str,
+                            help="Record the USB traffic with the hardware debugger in FILE")
+
+    parser.add_argument("--replay-usb",
+                            metavar="FILE",
+                            dest='replay_usb',
+                            type=str,
+                            help="Replay the USB traffic recorded in FILE instead of using hardware")
+
     parser.add_argument('-s', '--start',  dest='prg',
                             help='Start specified program or "noop"')
 
+    probe_choices = list(PRESETS)
+    parser.add_argument("--sim-probe",
+                            metavar="PROBE",
+                            dest='simprobe',
+                            type=str,
+                            default='none',
+                            choices= ['?'] + probe_choices,
+                            help="Probe timing model for '--tool sim', use '?' to list options")
+
     tool_choices = ['atmelice', 'dwlink', 'edbg', 'jtagice3', 'medbg', 'nedbg',
-                        'pickit4', 'powerdebugger', 'snap']
+                        'pickit4', 'powerdebugger', 'sim', 'snap']
     parser.add_argument("-t", "--tool",
                             metavar="TOOL",
                             type=str,
@@ -288,6 +329,11 @@ You can also use monitor command options, e.g., --timer=freeze.
         print("Possible tools (-t) are: ")
         print(', '.join(map(str, tool_choices)))
 
+    if args.simprobe == '?':
+        questionmark = True
+        print("Possible probe timing models (--sim-probe) are: ")
+        print(', '.join(map(str, probe_choices)))
+
     if args.verbose == '?':
         questionmark = True
         args.verbose = 'info'
@@ -474,6 +520,9 @@ def run_server(server, logger):
     except (ValueError, Exception) as e:
         if logger.getEffectiveLevel() != logging.DEBUG:
             logger.critical("Fatal Error: %s",e)
+            # with debug logging, the trace records have been logged already
+            if len(trace):
+                logger.info("Last events before the error:\n%s", "\n".join(trace.render(DEFAULT_DUMP)))
             return 1
         raise
     return 0
@@ -485,6 +534,7 @@ def main():
     """
     no_backend_error = False # will become true when libusb is not found
     no_hw_dbg_error = False # will become true, when no HW debugger is found
+    transport = None
     log_rsp = False
 
     args = options(sys.argv[1:])
@@ -502,7 +552,15 @@ def main():
     if result is not None:
         return result
     #print(args)
-    if args.tool == "dwlink":
+    if args.tool == "sim":
+        logger.info("No hardware debugger used: simulating the MCU")
+    elif args.replay_usb:
+        try:
+            transport = ReplayTransport(args.replay_usb)
+        except (OSError, ValueError) as e:
+            logger.critical("Cannot replay USB traffic: %s", e)
+            return 1
+    elif args.tool == "dwlink":
         dwlink.main(args, intf) # if we return, then there is no HW debugger
         no_hw_dbg_error = True
         logger.critical("No hardware debugger discovered")
@@ -540,6 +598,8 @@ def main():
             transport.connect(serial_number=toolconnection.serialnumber,
                                 product=toolconnection.tool_name)
             logger.info("Connected to %s", transport.hid_device.get_product_string())
+            if args.record_usb:
+                transport = RecordingTransport(transport, args.record_usb)
         elif platform.system() == 'Linux' and no_hw_dbg_error and len(transport.devices) == 0:
             if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
                 path_to_prog, _ = os.path.split((sys._MEIPASS)[:-1]) #pylint: disable=protected-access
@@ -555,7 +615,12 @@ def main():
 
     logger.info("Starting GDB server")
     try:
-        avrdebugger = XAvrDebugger(transport, device, intf, args.manage, args.clkprg, args.clkdeb)
+        if args.tool == "sim":
+            avrdebugger = SimDebugger(device, intf, args.simprobe)
+        else:
+            # USB transfers are counted for 'monitor stats' (only while enabled)
+            avrdebugger = XAvrDebugger(CountingTransport(transport), device, intf,
+                                           args.manage, args.clkprg, args.clkdeb)
         server = RspServer(avrdebugger, device, args)
     except Exception as e:
         if logger.getEffectiveLevel() != logging.DEBUG:
@@ -563,7 +628,11 @@ def main():
             return 1
         raise
     startup_helper_prog(args, logger)
-    return run_server(server, logger)
+    try:
+        return run_server(server, logger)
+    finally:
+        if isinstance(transport, (RecordingTransport, ReplayTransport)):
+            transport.close()
 
 if __name__ == "__main__":
     sys.exit(main())
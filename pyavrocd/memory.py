@@ -3,11 +3,14 @@ Memory module for the AVR GDB server
 """
 
 # args, logging
-from logging import getLogger
+from logging import getLogger, DEBUG
+from zlib import crc32
 
 # debugger modules
 from pyavrocd.errors import  FatalError
 from pyavrocd.deviceinfo.devices.alldevices import dev_name
+from pyavrocd.tracebuffer import trace, STORE_CACHE, FLASH_PAGE, PAGE_SKIPPED, PAGE_ERASED, \
+     PAGE_PROGRAMMED, PAGE_VERIFIED
 
 class Memory():
     """
@@ -41,7 +44,9 @@ class Memory():
         self._eeprom_size = self.dbg.memory_info.memory_info_by_name('eeprom')['size']
         self._flashmem_start_prog = 0
         self.lazy_loading = False
+        self.defer_programming = False # flash_write only fills the cache
         self.programming_mode = False
+        self.breakpoint_overlay = None # function that inserts SWBPs into a page image
 
     def init_flash(self):
         """
@@ -180,6 +185,15 @@ class Memory():
         response = response[addr-baseaddr:addr-baseaddr+size]
         return response
 
+    def cached_flash_word(self, addr):
+        """
+        Returns the word at an even address of the flash cache, i.e., of the
+        executable loaded last, or None if the address is not covered by the cache.
+        """
+        if addr + 2 > len(self._flash):
+            return None
+        return int.from_bytes(self._flash[addr:addr+2], byteorder='little')
+
     def flash_read_word(self, addr):
         """
         Read one word at an even address from flash (LSB first!) and return it as a word value.
@@ -191,24 +205,24 @@ class Memory():
         """
         This writes an arbitrary chunk of data to flash. If addr is lower than len(self._flash),
         the cache is cleared. This should do the right thing when loading is implemented with
-        X-records.
+        X-records. If defer_programming is set, the pages are programmed later by flash_pages.
         """
         if addr < len(self._flash):
             self.init_flash()
         self.store_to_cache(addr, data)
-        self.flash_pages()
+        if not self.defer_programming:
+            self.flash_pages()
         return None
 
     def store_to_cache(self, addr, data):
         """
         Store chunks into the flash cache. Programming will take place later.
         """
-        self.logger.debug("store_to_cache at %X", addr)
         if addr < len(self._flash):
             raise FatalError("Overlapping  flash areas at 0x%X" % addr)
         self._flash.extend(bytearray([0xFF]*(addr - len(self._flash) )))
         self._flash.extend(data)
-        self.logger.debug("%s", self._flash)
+        trace.record(STORE_CACHE, addr, len(data), len(self._flash))
 
     def flash_pages(self):
         """
@@ -217,6 +231,8 @@ class Memory():
         needs to be adjusted. At the end, we may add some 0xFFs.
         If mon.is_read_before_write() is true (read before write), the we will read a page
         before it is written.
+        Before that, the breakpoint overlay function (if set) can insert BREAK instructions
+        for software breakpoints into the page image, so that these need not be written separately.
         If it is nothing new, we skip. Otherwise, when "jtag", we check whether the page is blank.
         If not, the we need to erase this page by temporarily leaving progmode.
         This out of the way, we program.
@@ -233,27 +249,29 @@ class Memory():
         proged = 0
         next_mile_stone = 2000
         self.logger.info("Flashing at 0x%X, length: %u ...", pgaddr, stopaddr-startaddr)
+        debug = self.logger.isEnabledFor(DEBUG)
         while pgaddr < stopaddr:
-            self.logger.debug("Flashing page starting at 0x%X", pgaddr)
             pagetoflash = self._flash[pgaddr:pgaddr + self._multi_page_size]
+            if self.breakpoint_overlay:
+                pagetoflash = self.breakpoint_overlay(pgaddr, pagetoflash)
             currentpage = bytearray([])
             if self.mon.is_read_before_write() and not self.mon.is_erase_before_load():
                 # interestingly, it is faster to read single pages than a multi-page chunk!
                 for p in range(self._multi_buffer):
                     currentpage += self.dbg.flash_read(pgaddr+(p*self._flash_page_size),
                                                            self._flash_page_size, prog_mode=True)
-            self.logger.debug("pagetoflash: %s", pagetoflash.hex())
-            self.logger.debug("currentpage: %s", currentpage.hex())
+            if debug:
+                self.logger.debug("pagetoflash: %s", pagetoflash.hex())
+                self.logger.debug("currentpage: %s", currentpage.hex())
+            flags = 0
             if currentpage[:len(pagetoflash)] == pagetoflash:
-                self.logger.debug("Skip flashing page because already flashed at 0x%X", pgaddr)
+                flags = PAGE_SKIPPED
             else:
                 if not self.mon.is_erase_before_load() and (not currentpage or \
                   not self.dbg.device.avr.is_blank(currentpage)):
                     # will erase if necessary and return True if it did
-                    self.logger.debug("Will now erase ...")
                     if self.dbg.device.erase_page(pgaddr, self.programming_mode):
-                        self.logger.debug("Page at 0x%x erased", pgaddr)
-                self.logger.debug("Flashing now from 0x%X to 0x%X", pgaddr, pgaddr+len(pagetoflash))
+                        flags |= PAGE_ERASED
                 pagetoflash.extend(bytearray([0xFF]*(self._multi_page_size-len(pagetoflash))))
                 flashmemtype = self.dbg.device.avr.memtype_write_from_string('flash')
                 # program flash page only when 'pagetoflash' is not blank
@@ -265,6 +283,7 @@ class Memory():
                                                                 self._flash_page_size,
                                                                 allow_blank_skip=
                                                                 self._multi_buffer == 1)
+                    flags |= PAGE_PROGRAMMED
                 # verify flash programming when verification is requested AND
                 # (the pagetoflash is not blank or memory has not been erased before loading)
                 if self.mon.is_verify() and (not self.dbg.device.avr.is_blank(pagetoflash) or \
@@ -274,10 +293,14 @@ class Memory():
                         readbackpage += self.dbg.flash_read(pgaddr+(p*self._flash_page_size),
                                                                      self._flash_page_size,
                                                                       prog_mode=True)
-                    self.logger.debug("pagetoflash: %s", pagetoflash.hex())
-                    self.logger.debug("readback: %s", readbackpage.hex())
+                    if debug:
+                        self.logger.debug("pagetoflash: %s", pagetoflash.hex())
+                        self.logger.debug("readback: %s", readbackpage.hex())
                     if readbackpage != pagetoflash:
                         raise FatalError("Flash verification error on page 0x{:X}".format(pgaddr))
+                    flags |= PAGE_VERIFIED
+            if trace.enabled:
+                trace.record(FLASH_PAGE, pgaddr, flags, crc32(pagetoflash), crc32(currentpage))
             pgaddr += self._multi_page_size
             proged += self._multi_page_size
             if give_info and proged >= next_mile_stone:
@@ -8,6 +8,18 @@ from logging import getLogger
 # error exceptions
 from pyavrocd.errors import FatalError
 
+# default sampling rate of the profiler
+from pyavrocd.profiler import DEFAULT_RATE
+
+# default name of the console ring buffer
+from pyavrocd.console import DEFAULT_SYMBOL
+
+# default number of records shown by 'trace-dump'
+from pyavrocd.tracebuffer import DEFAULT_DUMP
+
+DEFAULT_TRACE_STEPS = 1000000 # maximal number of instructions traced by 'trace start'
+DEFAULT_RECORDING_DEPTH = 10000 # maximal number of instructions in the execution history
+
 
 # This is a list of monitor commands, of which many also be used as command line options
 # Key: option/monitor command name
@@ -17,16 +29,25 @@ from pyavrocd.errors import FatalError
 monopts = { 'atexit'          : ['cli', 'stayindebugwire', [None, 'stayindebugwire', 'leavedebugwire']],
             'breakpoints'     : ['cli', 'all', [None, 'all', 'software', 'hardware']],
             'caching'         : ['cli', 'enable', [None, 'enable', 'disable']],
+            'checkpoint'      : [None, None, [None, 'save', 'restore', 'spill']],
+            'console'         : [None, None, [None, '*']],
             'debugwire'       : [None, None, [None, 'enable', 'disable']],
             'erasebeforeload' : ['cli', 'enable', [None, 'enable', 'disable']],
             'help'            : [None, None, [None]],
             'info'            : [None, None, [None]],
             'load'            : ['cli', None, [None, 'readbeforewrite', 'writeonly']],
             'onlywhenloaded'  : ['cli', 'enable', [None, 'enable', 'disable']],
-            'rangestepping'   : ['cli', 'enable', [None, 'enable', 'disable']],
+            'profile'         : [None, None, [None, 'start', 'stop']],
+            'profile-server'  : ['full', None, [None, 'on', 'off']],
+            'rangestepping'   : ['cli', 'enable', [None, 'enable', 'disable', 'stepover']],
+            'recording'       : [None, None, [None, 'enable', 'disable']],
             'reset'           : [None, None, [None, '*']],
             'singlestep'      : ['cli', 'safe', [None, 'safe', 'interruptible']],
+            'stats'           : ['full', None, [None, 'enable', 'disable', 'reset']],
+            'stepi'           : ['full', None, [None, '*']],
             'timers'          : ['cli', 'run', [None, 'run', 'freeze']],
+            'trace'           : [None, None, [None, 'start']],
+            'trace-dump'      : ['full', None, [None, '*']],
             'verify'          : ['cli', 'enable', [None, 'enable', 'disable']],
             'version'         : [None, None, [None]],
             'NoXML'           : ['full', None, [None]],
@@ -34,7 +55,7 @@ monopts = { 'atexit'          : ['cli', 'stayindebugwire', [None, 'stayindebugwi
             'Target'          : ['full', None, [None, 'on', 'off', 'query']],
             'LiveTests'       : ['full', None, [None]] }
 
-class MonitorCommand():
+class MonitorCommand(): #pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
     This class implements all the monitor commands
     It manages state variables, gives responses and selects
@@ -60,8 +81,20 @@ class MonitorCommand():
         self._power = None # power state
         self._old_exec = None # use old-style execution (only for tests needed)
         self._range = None # range-stepping is allowed
+        self._stepover = None # range-stepping steps over calls on the server side
         self._erase_before_load = None # erase flash memory before load
         self._args = args # these are all the arguments -- needed to set initial monitor option values
+        self._tokens = [] # the tokens of the current monitor command
+        self._stepi = None # number of steps and stop conditions armed by 'stepi' for the next continue
+        self._profile = (DEFAULT_RATE, False) # sampling rate and recording of callers for 'profile'
+        self._profile_output = (None, None) # output file and ELF file for 'profile stop'
+        self._trace = (None, DEFAULT_TRACE_STEPS) # trace file and maximal number of steps for 'trace'
+        self._checkpoint = (None, False) # name and whether to include EEPROM for 'checkpoint'
+        self._spill_dir = None # spill directory for 'checkpoint spill'
+        self._recording = None # maximal number of recorded instructions, None if not recording
+        self._console = (None, DEFAULT_SYMBOL) # ELF file and symbol of the console ring buffer
+        self._server_profile = (None, False) # output file and per-packet statistics for 'profile-server'
+        self._trace_dump = DEFAULT_DUMP # number of records shown by 'trace-dump'
 
 
         # commands: merge monoopts and jump table (should have the same sets of keys!)
@@ -70,16 +103,25 @@ class MonitorCommand():
             'atexit'          : self._mon_atexit,
             'breakpoints'     : self._mon_breakpoints,
             'caching'         : self._mon_cache,
+            'checkpoint'      : self._mon_checkpoint,
+            'console'         : self._mon_console,
             'debugwire'       : self._mon_debugwire,
             'erasebeforeload' : self._mon_erase_before_load,
             'help'            : self._mon_help,
             'info'            : self._mon_info,
             'load'            : self._mon_load,
             'onlywhenloaded'  : self._mon_noload,
+            'profile'         : self._mon_profile,
+            'profile-server'  : self._mon_profile_server,
             'rangestepping'   : self._mon_range_stepping,
+            'recording'       : self._mon_recording,
             'reset'           : self._mon_reset,
             'singlestep'      : self._mon_singlestep,
+            'stats'           : self._mon_stats,
+            'stepi'           : self._mon_stepi,
             'timers'          : self._mon_timers,
+            'trace'           : self._mon_trace,
+            'trace-dump'      : self._mon_trace_dump,
             'verify'          : self._mon_flash_verify,
             'version'         : self._mon_version,
             'NoXML'           : self._mon_noxml,
@@ -114,6 +156,7 @@ class MonitorCommand():
         self._verify = self._args.verify[0] != 'd'           # default: enable
         self._timersfreeze = self._args.timers[0] == 'f'     # default: run
         self._range = self._args.rangestepping[0] != 'd'     # default: enable
+        self._stepover = self._args.rangestepping[0] == 's'  # default: enable, i.e., no step-over
         self._erase_before_load = self._iface != 'debugwire' and \
           self._args.erasebeforeload[0] != 'd'               # default: enable on non-dw targets, on dw targets
                                                              # it is always false!
@@ -177,6 +220,24 @@ class MonitorCommand():
         """
         return self._range
 
+    def is_stepover(self):
+        """
+        Returns True iff calls inside a stepping range are stepped over by the server.
+        """
+        return self._range and self._stepover
+
+    def is_recording(self):
+        """
+        Returns True iff single steps are recorded for reverse execution
+        """
+        return self._recording is not None
+
+    def recording_depth(self):
+        """
+        Returns the maximal number of instructions kept in the execution history
+        """
+        return self._recording
+
     def is_safe(self):
         """
         Returns True iff interrupt-safe single-stepping is enabled
@@ -219,6 +280,71 @@ class MonitorCommand():
         """
         return self._erase_before_load
 
+    def stepi_parameters(self):
+        """
+        Returns the number of steps and the list of stop conditions armed by
+        the last 'stepi' command for the next continue, or None if not armed
+        """
+        return self._stepi
+
+    def clear_stepi(self):
+        """
+        Disarms 'stepi' after the continue has been executed by single-stepping
+        """
+        self._stepi = None
+
+    def profile_parameters(self):
+        """
+        Returns the sampling rate and whether callers are recorded
+        of the last 'profile start' command
+        """
+        return self._profile
+
+    def profile_output(self):
+        """
+        Returns the name of the output file and of the ELF file (or None)
+        of the last 'profile stop' command
+        """
+        return self._profile_output
+
+    def trace_parameters(self):
+        """
+        Returns the file name and the maximal number of steps of the last 'trace start' command
+        """
+        return self._trace
+
+    def checkpoint_parameters(self):
+        """
+        Returns the name and whether EEPROM is included
+        of the last 'checkpoint save' or 'checkpoint restore' command
+        """
+        return self._checkpoint
+
+    def checkpoint_spill_dir(self):
+        """
+        Returns the directory of the last 'checkpoint spill' command (None means off)
+        """
+        return self._spill_dir
+
+    def server_profile_parameters(self):
+        """
+        Returns the output file (None for the default) and whether per-packet-type
+        statistics are to be recorded of the last 'profile-server on' command
+        """
+        return self._server_profile
+
+    def trace_dump_parameters(self):
+        """
+        Returns the number of trace buffer records of the last 'trace-dump' command
+        """
+        return self._trace_dump
+
+    def console_parameters(self):
+        """
+        Returns the ELF file and the symbol name of the last 'console' command
+        """
+        return self._console
+
     def dispatch(self, tokens):
         """
         Dispatch according to tokens. First element is
@@ -226,11 +352,15 @@ class MonitorCommand():
         """
         if not tokens:
             return self._mon_help(0)
+        self._tokens = tokens
         handler = self._mon_unknown_cmd
         full = False
         opts = None
         name = None
         for cmd in self.moncmds.items():
+            # commands that need to be fully spelled out do not take part in prefix matching
+            if cmd[1][1] == 'full' and cmd[0] != tokens[0]:
+                continue
             if cmd[0].startswith(tokens[0]):
                 if handler == self._mon_unknown_cmd:
                     handler = cmd[1][0]
@@ -314,6 +444,38 @@ class MonitorCommand():
             return("", "Flash memory will not be cached")
         return self._mon_unknown_arg(None)
 
+    def _mon_checkpoint(self, optix):
+        if not self._debugger_active:
+            return("", "Debugger is not enabled")
+        args = self._tokens[2:]
+        if optix == 0:
+            return("checkpoint", "")
+        if optix in (1, 2):
+            if not args or len(args) > 2 or (len(args) == 2 and (optix == 2 or args[1] != 'eeprom')):
+                return("", "Usage: monitor checkpoint save <name> [eeprom]|restore <name>")
+            self._checkpoint = (args[0], len(args) == 2)
+            return(("checkpoint save", "checkpoint restore")[optix-1], "")
+        if len(args) > 1:
+            return self._mon_unknown_arg(None)
+        if args:
+            self._spill_dir = None if args[0] == 'off' else args[0]
+        if self._spill_dir is None:
+            return("checkpoint spill", "Evicted checkpoints are discarded")
+        return("checkpoint spill", "Evicted checkpoints are spilled to " + self._spill_dir)
+
+    def _mon_console(self, _):
+        if not self._debugger_active:
+            return("", "Debugger is not enabled")
+        args = self._tokens[1:]
+        if not args:
+            return("console", "")
+        if args == ['off']:
+            return("console off", "Console is disabled")
+        if len(args) > 2:
+            return self._mon_unknown_arg(None)
+        self._console = (args[0], args[1] if len(args) > 1 else DEFAULT_SYMBOL)
+        return("console on", "")
+
     def _mon_debugwire(self, optix):
         if not self._iface == "debugwire":
             return("reset" if optix != 0 else "", "This is not a debugWIRE target")
@@ -366,6 +528,13 @@ monitor atexit [stayindebugwire|leavedebugwire]
 monitor breakpoints [all|software|hardware]
                                    - allow breakpoints of a certain kind
 monitor caching [enable|disable]   - use loaded executable as cache (default)
+monitor checkpoint [save <name> [eeprom]|restore <name>|spill [<dir>|off]]
+                                   - save/restore registers, SRAM, and optionally
+                                     EEPROM; without argument, list checkpoints
+monitor console [<elf> [<symbol>]|off]
+                                   - show the output the firmware writes into
+                                     the SRAM ring buffer <symbol> (default
+                                     pyavrocd_console) located using <elf>
 monitor debugwire [enable|disable] - activate/deactivate debugWIRE mode,
 monitor erasebeforeload [enable|disable]
                                    - erase flash memory before load (default)
@@ -376,11 +545,39 @@ monitor load [readbeforewrite|writeonly]
                                      for debugWIRE)
 monitor onlywhenloaded [enable|disable]
                                    - execute only with loaded executable
+monitor profile [start [<rate>] [callers]|stop [<file> [<elf>]]]
+                                   - sample the PC <rate> times per second
+                                     while running, optionally also the caller;
+                                     write folded stacks to <file>, symbolized
+                                     using the ELF file <elf>
+monitor profile-server [on [<file>] [packets]|off]
+                                   - profile the GDB server with cProfile, write
+                                     the statistics to <file> when switched off
+                                     or at the end of the session
 monitor singlestep [safe|interruptible]
                                    - single stepping mode; safe is default
-monitor rangestepping [enable|disable]
-                                   - allow range stepping
+monitor rangestepping [enable|disable|stepover]
+                                   - allow range stepping; stepover means that
+                                     calls in the range are stepped over
+monitor recording [enable [<n>]|disable]
+                                   - record up to n single steps (default 10000)
+                                     for reverse-stepi and reverse-continue
+monitor stats [enable|disable|reset]
+                                   - time spent per RSP packet type and probe
+                                     transactions; without argument, show them
+monitor stepi [<n> [<condition> ...]|off]
+                                   - let the next continue single-step up to n
+                                     instructions on the server, stop early at
+                                     a breakpoint or when a condition is met:
+                                     pc outside <start> <end>, r<k> == <val>,
+                                     *<addr> == <val>, sp < <val>
 monitor timers [run|freeze]        - run (default) or freeze timers when stopped
+monitor trace start <file> [<n>]   - single-step up to n instructions on the
+                                     server (until a breakpoint is reached) and
+                                     record the PCs in <file>
+monitor trace-dump [<n>]           - show the last n (default 50) records of the
+                                     internal event trace buffer
+monitor trace-dump enable|disable  - start/stop recording events in this buffer
 monitor verify [enable|disable]    - verify that loading was successful (def.)
 If no parameter is specified, the current setting is returned""")
 
@@ -399,7 +596,8 @@ Load mode:                """ + ("read-before-write" if self._read_before_write
 Erase before load:        """ + ("enabled" if self._erase_before_load else "disabled") + """
 Verify after load:        """ + ("enabled" if self._verify else "disabled") + """
 Caching loaded binary:    """ + ("enabled" if self._cache else "disabled") + """
-Range-stepping:           """ + ("enabled" if self._range else "disabled") + """
+Range-stepping:           """ + (("enabled (stepping over calls)" if self._stepover else "enabled")
+                                     if self._range else "disabled") + """
 Single-stepping:          """ + ("safe" if self._safe else "interruptible")  + """
 Timers:                   """ + ("frozen when stopped"
                                      if self._timersfreeze else "run when stopped") + "{}")
@@ -423,15 +621,78 @@ Timers:                   """ + ("frozen when stopped"
             return("", "Execution is always possible")
         return self._mon_unknown_arg(None)
 
+    def _mon_profile(self, optix):
+        if not self._debugger_active:
+            return("", "Debugger is not enabled")
+        args = self._tokens[2:]
+        if optix == 0:
+            return("profile", "")
+        if optix == 1:
+            rate = DEFAULT_RATE
+            callers = False
+            for arg in args:
+                if arg == 'callers':
+                    callers = True
+                elif arg.isdigit() and 1 <= int(arg) <= 1000:
+                    rate = int(arg)
+                else:
+                    return self._mon_unknown_arg(None)
+            self._profile = (rate, callers)
+            return("profile start", "Profiling with {} samples/sec".format(rate))
+        if optix == 2:
+            if len(args) > 2:
+                return self._mon_unknown_arg(None)
+            self._profile_output = (args[0] if args else "profile.folded",
+                                        args[1] if len(args) > 1 else None)
+            return("profile stop", "")
+        return self._mon_unknown_arg(None)
+
+    def _mon_profile_server(self, optix):
+        args = self._tokens[2:]
+        if optix == 0:
+            return("profile-server", "")
+        if optix == 1:
+            files = [arg for arg in args if arg != 'packets']
+            if len(files) > 1:
+                return self._mon_unknown_arg(None)
+            self._server_profile = (files[0] if files else None, 'packets' in args)
+            return("profile-server on", "Profiling the GDB server")
+        if args:
+            return self._mon_unknown_arg(None)
+        return("profile-server off", "")
+
     def _mon_range_stepping(self, optix):
+        if optix == 3 or (optix == 0 and self._range is True and self._stepover is True):
+            self._range = True
+            self._stepover = True
+            return("",  "Range stepping is enabled, calls are stepped over")
         if optix == 1 or (optix == 0 and self._range is True):
             self._range = True
+            self._stepover = False
             return("",  "Range stepping is enabled")
         if optix == 2 or (optix == 0 and self._range is False):
             self._range = False
             return("", "Range stepping is disabled")
         return self._mon_unknown_arg(None)
 
+    def _mon_recording(self, optix):
+        args = self._tokens[2:]
+        if optix == 1 and len(args) <= 1:
+            depth = DEFAULT_RECORDING_DEPTH
+            if args:
+                if not args[0].isdigit() or int(args[0]) < 1:
+                    return self._mon_unknown_arg(None)
+                depth = int(args[0])
+            self._recording = depth
+        elif optix == 2 and not args:
+            self._recording = None
+        elif optix != 0 or args:
+            return self._mon_unknown_arg(None)
+        if self._recording is None:
+            return("", "Recording is disabled")
+        return("recording", "Recording is enabled: {} of at most " + str(self._recording) +
+                   " instructions recorded")
+
     def _mon_reset(self, _):
         if self._debugger_active:
             return("reset", "MCU has been reset")
@@ -446,6 +707,91 @@ Timers:                   """ + ("frozen when stopped"
             return("", "Single-stepping is interruptible")
         return self._mon_unknown_arg(None)
 
+    def _mon_stats(self, optix):
+        if optix == 1:
+            return("stats enable", "Recording packet statistics")
+        if optix == 2:
+            return("stats disable", "Packet statistics are not recorded")
+        if optix == 3:
+            return("stats reset", "Packet statistics have been reset")
+        return("stats", "")
+
+    def _mon_stepi(self, _):
+        if not self._debugger_active:
+            return("", "Debugger is not enabled")
+        args = self._tokens[1:]
+        if args == ['off']:
+            self._stepi = None
+        if not args or args == ['off']:
+            if self._stepi is None:
+                return("", "Stepping on the server is not armed")
+            return("", "Next 'continue' single-steps up to {} instruction(s) on the server".format(
+                self._stepi[0]))
+        count = 1
+        conditions = []
+        try:
+            if args[0][0].isdigit():
+                count = int(args[0], 0)
+                args = args[1:]
+            while args:
+                if args[0] == 'pc' and len(args) >= 4 and args[1] == 'outside':
+                    conditions.append(('pc', int(args[2], 0), int(args[3], 0)))
+                    args = args[4:]
+                elif args[0] == 'sp' and len(args) >= 3 and args[1] == '<':
+                    conditions.append(('sp', int(args[2], 0)))
+                    args = args[3:]
+                elif args[0][0] == 'r' and len(args) >= 3 and args[1] == '==' and \
+                  0 <= int(args[0][1:]) < 32:
+                    conditions.append(('reg', int(args[0][1:]), int(args[2], 0) & 0xFF))
+                    args = args[3:]
+                elif args[0][0] == '*' and len(args) >= 3 and args[1] == '==':
+                    conditions.append(('mem', int(args[0][1:], 0) & 0xFFFF, int(args[2], 0) & 0xFF))
+                    args = args[3:]
+                else:
+                    return("", "Illegal stop condition in 'stepi': " + " ".join(args))
+        except ValueError:
+            return self._mon_unknown_arg(None)
+        if count < 1:
+            return self._mon_unknown_arg(None)
+        self._stepi = (count, conditions)
+        return("", "Next 'continue' single-steps up to {} instruction(s) on the server".format(count))
+
+    def _mon_trace(self, optix):
+        if not self._debugger_active:
+            return("", "Debugger is not enabled")
+        args = self._tokens[2:]
+        if optix == 0 or not args or len(args) > 2:
+            return("", "Usage: monitor trace start <file> [<max steps>]")
+        count = DEFAULT_TRACE_STEPS
+        if len(args) == 2:
+            try:
+                count = int(args[1], 0)
+            except ValueError:
+                return self._mon_unknown_arg(None)
+            if count < 1:
+                return self._mon_unknown_arg(None)
+        self._trace = (args[0], count)
+        return("trace", "Traced {} instruction(s) into {}, stopped at 0x{:X}{}")
+
+    def _mon_trace_dump(self, _):
+        args = self._tokens[1:]
+        count = DEFAULT_DUMP
+        if len(args) > 1:
+            return self._mon_unknown_arg(None)
+        if args and args[0] == 'enable':
+            return("trace-dump enable", "Recording events in the trace buffer")
+        if args and args[0] == 'disable':
+            return("trace-dump disable", "Events are not recorded in the trace buffer")
+        if args:
+            try:
+                count = int(args[0], 0)
+            except ValueError:
+                return self._mon_unknown_arg(None)
+            if count < 1:
+                return self._mon_unknown_arg(None)
+        self._trace_dump = count
+        return("trace-dump", "")
+
     def _mon_timers(self, optix):
         if optix == 2 or (optix == 0 and self._timersfreeze is True):
             self._timersfreeze = True
@@ -0,0 +1,248 @@
+"""
+This module decodes AVR opcodes. The functions are shared by the
+breakpoint and execution logic and by the undo log.
+"""
+
+# special opcodes
+BREAKCODE = 0x9598
+SLEEPCODE = 0x9588
+
+def extract_io_addr(opcode):
+    """
+    Extracts the IO address of an IN/OUT opcode
+    """
+    return ((opcode & 0x0600) >> 5) + (opcode & 0x000F)
+
+
+def extract_displacement(opcode):
+    """
+    Extracts the displacement from a load/store instruction with displacements
+    """
+    return ((opcode & 0x2000) >> 8) + ((opcode & 0x0C00) >> 7) + (opcode & 0x0007)
+
+
+def is_out_instr(opcode):
+    """
+    Returns True iff the given IN or OUT opcode is an OUT instruction.
+    """
+    return opcode & 0x0800 != 0
+
+
+def is_post_incr(opcode):
+    """
+    Returns True iff the opcode is a post-increment instruction
+    """
+    return opcode & 3 == 1
+
+
+def is_pre_decr(opcode):
+    """
+    Returns True iff the opcode is a pre-decrement instruction
+    """
+    return opcode & 3 == 2
+
+
+def is_change_ix(opcode):
+    """
+    Returns True iff the index operation is a pre-decr or post-incr instruction.
+    """
+    return opcode & 3 != 0
+
+
+def is_x_reg(opcode):
+    """
+    Checks whether this is an indirect store/load instruction with
+    X as the index register
+    """
+    return opcode & 0x000C == 0x000C
+
+
+def is_y_reg(opcode):
+    """
+    Checks whether it is the Y or Z register, given that it is a displacement
+    or Y/Z indirect store/load instruction.
+    So, this has to be checked before this method can be applied.
+    """
+    return opcode & 0x0008 == 0x0008
+
+
+def extract_register(opcode):
+    """
+    Extracts the register number. The placement of the register bits appears to
+    be universal.
+    """
+    return (opcode & 0x01F0) >> 4
+
+
+def is_store_instr(opcode):
+    """
+    Checks whether the given opcode LD(S)(D)/ST(S)(D) is a store or load instruction.
+    Returns True iff it is a store instruction.
+    """
+    return opcode & 0x0200 != 0
+
+
+def branch_instr(opcode):
+    """
+    Returns True iff it is a branch instruction
+    """
+    return (skip_instr(opcode) or
+            cond_branch_instr(opcode) or
+            callx_instr(opcode) or
+            jmpx_instr(opcode) or
+            retx_instr(opcode))
+
+
+def store_instr(opcode, io=False):
+    """
+    Returns True iff the instruction can store into SRAM (if io is True, also
+    instructions that write into I/O registers are considered)
+    1001 001x xxxx xxxx STS, ST, XCH, LAS, LAC, LAT, PUSH
+    10x0 xx1x xxxx xxxx STD
+    (R)(E)(I)CALL (pushing the return address)
+    1011 1xxx xxxx xxxx OUT
+    1001 10x0 xxxx xxxx CBI, SBI
+    """
+    return (((opcode & 0xFE00) == 0x9200) or
+            ((opcode & 0xD200) == 0x8200) or
+            callx_instr(opcode) or
+            (io and (((opcode & 0xF800) == 0xB800) or ((opcode & 0xFD00) == 0x9800))))
+
+
+def pop_instr(opcode):
+    """
+    Returns True when opcode is a POP instruction
+    1001 000x xxxx 1111
+    """
+    return (opcode & 0xFE0F) == 0x900F
+
+
+def push_instr(opcode):
+    """
+    Returns True when opcode is PUSH instruction
+    1001 001x xxxx 1111
+    """
+    return (opcode & 0xFE0F) == 0x920F
+
+
+def retx_instr(opcode):
+    """
+    Returns True when opcode is a RET or RETI instruction
+    1001 0101 000x 1000
+    """
+    return (opcode & 0xFFEF) == 0x9508
+
+
+def callx_instr(opcode):
+    """
+    Returns True when the opcode is a (R)(E)(I)CALL instruction:
+    1001 0101 000x 1001 (E)ICALL
+    1001 010x xxxx 111x CALL
+    1101 xxxx xxxx xxxx RCALL
+    """
+    return (((opcode & 0xFFEF) == 0x9509) or # (E)ICALL
+            ((opcode & 0xFE0E) == 0x940E) or # CALL
+            ((opcode & 0xF000) == 0xD000)) # RCALL
+
+
+def jmpx_instr(opcode):
+    """
+    Returns True when the opcode is a (R)(E)(I)JMP instruction:
+    1001 0100 000x 1001 (E)IJMP
+    1001 010x xxxx 110x JMP
+    1100 xxxx xxxx xxxx RJMP
+    """
+    return (((opcode & 0xFFEF) == 0x9409) or # (E)JMP
+            ((opcode & 0xFE0E) == 0x940C) or # JMP
+            ((opcode & 0xF000) == 0xC000)) # RJMP
+
+
+def relative_branch_instr(opcode):
+    """
+    Returns True iff it is a branch instruction with relative addressing mode
+    1101 xxxx xxxx xxxx RCALL
+    1100 xxxx xxxx xxxx RJMP
+    """
+    if (opcode & 0xE000) == 0xC000: # RJMP, RCALL
+        return True
+    return False
+
+
+def compute_destination_of_relative_branch(opcode, addr):
+    """
+    Computes branch destination for instructions with relative addressing mode
+    """
+    rdist = opcode & 0x0FFF
+    tsc = rdist - int((rdist << 1) & 2**12)
+    return addr + 2 + (tsc*2)
+
+
+def skip_instr(opcode):
+    """
+    Returns True iff instruction is a skip instruction
+    0001 00xx xxxx xxxx CPSE
+    1001 1001 xxxx xxxx SBIC
+    1001 1011 xxxx xxxx SBIS
+    1111 110x xxxx 0xxx SBRC
+    1111 111x xxxx 0xxx SBRS
+    """
+    if (opcode & 0xFC00) == 0x1000: # CPSE
+        return True
+    if (opcode & 0xFD00) == 0x9900: # SBIC, SBIS
+        return True
+    if (opcode & 0xFC08) == 0xFC00: # SBRC, SBRS
+        return True
+    return False
+
+
+def cond_branch_instr(opcode):
+    """
+    Returns True iff instruction is a conditional branch instruction
+    1111 01xx xxxx xxxx BRBC
+    1111 00xx xxxx xxxx BRBS
+    """
+    if (opcode & 0xF800) == 0xF000: # BRBS, BRBC
+        return True
+    return False
+
+
+def branch_on_ibit(opcode):
+    """
+    Returns True iff instruction is a conditional branch instruction on the I-bit
+    1111 01xx xxxx x111 BRID
+    1111 00xx xxxx x111 BRIE
+
+    """
+    return (opcode & 0xF807) == 0xF007 # BRID, BRIE
+
+
+def compute_possible_destination_of_branch(opcode, addr):
+    """
+    Computes branch destination address for conditional branch instructions
+    """
+    rdist = (opcode >> 3) & 0x007F
+    tsc = rdist - int((rdist << 1) & 2**7) # compute twos complement
+    return addr + 2 + (tsc*2)
+
+
+def compute_destination_of_ibranch(opcode, ibit, addr):
+    """
+    Interprets BRIE/BRID instructions and computes the target instruction.
+    This is used to simulate the execution of these two instructions.
+    """
+    branch = ibit ^ bool(opcode & 0x0400 != 0)
+    if not branch:
+        return addr + 2
+    return compute_possible_destination_of_branch(opcode, addr)
+
+
+def two_word_instr(opcode):
+    """
+    Returns True iff instruction is a two-word instruction
+    1001 000x xxxx 0000 LDS
+    1001 001x xxxx 0000 STS
+    1001 010x xxxx 111x CALL
+    1001 010x xxxx 110x JMP
+    """
+    return(((opcode & ~0x03F0) == 0x9000) or # lds / sts
+           ((opcode & 0x0FE0C) == 0x940C))   # jmp / call
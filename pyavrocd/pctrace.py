@@ -0,0 +1,108 @@
+"""
+This module writes and reads instruction traces recorded on the server side.
+"""
+
+# args, logging
+from logging import getLogger
+
+MAGIC = b'AVRTRC\x01\x00'
+CHECKPOINT_INTERVAL = 1000 # number of PCs between two register checkpoints
+
+def zigzag(value):
+    """
+    Map a signed integer to an unsigned one (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...)
+    """
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+def unzigzag(value):
+    """
+    Inverse of zigzag
+    """
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+def encode_varint(value):
+    """
+    Encode an unsigned integer in LEB128 format (7 bits per byte, least significant first)
+    """
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return out
+
+class TraceWriter():
+    """
+    Writes a trace file. After the magic bytes, the file consists of records, each starting
+    with a varint. A value of 0 introduces a register checkpoint: 32 general purpose
+    registers, SREG, SP (2 bytes, little endian), and PC (byte address, 4 bytes, little endian).
+    Any other value v encodes the difference between the PC and the previous one in words
+    as zigzag(delta) + 1, so that straight-line code needs only one byte per instruction.
+    The first record and every CHECKPOINT_INTERVAL-th record is a checkpoint.
+    """
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.logger = getLogger('pyavrocd.pctrace')
+        self._file = open(path, 'wb') #pylint: disable=consider-using-with
+        self._file.write(MAGIC)
+        self._interval = interval
+        self._count = 0
+        self._lastpc = 0
+
+    def record(self, snap):
+        """
+        Record the PC (and periodically all registers) from the RegisterSnapshot snap
+        """
+        pc = snap.program_counter()
+        if self._count % self._interval == 0:
+            self._file.write(b'\x00' + snap.registers() + bytes([snap.status_register()]) +
+                                 snap.stack_pointer().to_bytes(2, byteorder='little') +
+                                 pc.to_bytes(4, byteorder='little'))
+        else:
+            self._file.write(encode_varint(zigzag((pc - self._lastpc) >> 1) + 1))
+        self._lastpc = pc
+        self._count += 1
+
+    def close(self):
+        """
+        Close the trace file and return the number of recorded PCs
+        """
+        self._file.close()
+        self.logger.debug("%d PCs recorded", self._count)
+        return self._count
+
+def read_trace(path):
+    """
+    Generator that reads a trace file and yields the PCs (byte addresses) and checkpoints
+    as pairs ('pc', pc) and ('checkpoint', (registers, sreg, sp, pc)). Each checkpoint
+    is followed by the pair for its PC.
+    """
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("{} is not a trace file".format(path))
+    ix = len(MAGIC)
+    pc = 0
+    while ix < len(data):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[ix]
+            ix += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        if value == 0:
+            regs = data[ix:ix+32]
+            sreg = data[ix+32]
+            sp = int.from_bytes(data[ix+33:ix+35], byteorder='little')
+            pc = int.from_bytes(data[ix+35:ix+39], byteorder='little')
+            ix += 39
+            yield ('checkpoint', (bytes(regs), sreg, sp, pc))
+        else:
+            pc += unzigzag(value - 1) << 1
+        yield ('pc', pc)
@@ -0,0 +1,138 @@
+"""
+This module implements a timing model of hardware debuggers for the simulated backend, so
+that the costs of the communication with a real probe become visible without hardware.
+"""
+
+# args, logging
+from logging import getLogger
+
+# Presets calibrated against the ATmega328P (debugWIRE, 16 MHz) and ATmega324PB (JTAG,
+# programming clock 1 MHz) columns in docs/load-speed.md. For each probe: latency of one
+# transaction, time per byte read and per byte written (excluding the flash programming),
+# time per byte transferred into the flash page buffer, and the page programming and erase times.
+# All times are in seconds.
+PRESETS = {
+    'none':     { 'latency': 0, 'read_byte': 0, 'write_byte': 0, 'flash_byte': 0,
+                      'page_program': 0, 'page_erase': 0, 'packet': 0 },
+    'dwlink':   { 'latency': 0.001, 'read_byte': 0.000242, 'write_byte': 0.000242,
+                      'flash_byte': 0.00158, 'page_program': 0.0045, 'page_erase': 0.0045,
+                      'packet': 0 },
+    'snap':     { 'latency': 0.001, 'read_byte': 0.0000758, 'write_byte': 0.0000758,
+                      'flash_byte': 0.00134, 'page_program': 0.0045, 'page_erase': 0.0045,
+                      'packet': 256 },
+    'pickit4':  { 'latency': 0.001, 'read_byte': 0.000159, 'write_byte': 0.000159,
+                      'flash_byte': 0.00158, 'page_program': 0.0045, 'page_erase': 0.0045,
+                      'packet': 256 },
+    'atmelice': { 'latency': 0.001, 'read_byte': 0.0000636, 'write_byte': 0.0000636,
+                      'flash_byte': 0.000914, 'page_program': 0.0045, 'page_erase': 0.0045,
+                      'packet': 256 },
+    'medbg':    { 'latency': 0.001, 'read_byte': 0.000326, 'write_byte': 0.000326,
+                      'flash_byte': 0.00325, 'page_program': 0.0045, 'page_erase': 0.0045,
+                      'packet': 256 },
+    'jtag':     { 'latency': 0.001, 'read_byte': 0.000092, 'write_byte': 0.000092,
+                      'flash_byte': 0.00004, 'page_program': 0.0045, 'page_erase': 0.0045,
+                      'packet': 256 },
+    }
+
+class ProbeModel():
+    """
+    Charges simulated time for each transaction with the hardware debugger: a fixed
+    latency per transaction and a cost per transferred byte, where transfers larger
+    than packet bytes (if packet is not 0) need more than one transaction. Programming
+    and erasing flash pages add the respective times. The accumulated time and the
+    counts can be queried with statistics and report.
+    """
+    #pylint: disable=too-many-instance-attributes
+    def __init__(self, preset='none'):
+        self.logger = getLogger('pyavrocd.probemodel')
+        if preset not in PRESETS:
+            raise ValueError("Unknown probe model: {}".format(preset))
+        self.name = preset
+        timing = PRESETS[preset]
+        self.latency = timing['latency']
+        self.read_byte = timing['read_byte']
+        self.write_byte = timing['write_byte']
+        self.flash_byte = timing['flash_byte']
+        self.page_program = timing['page_program']
+        self.page_erase = timing['page_erase']
+        self.packet = timing['packet']
+        self.reset()
+
+    def reset(self):
+        """
+        Set the simulated time and all counters to zero
+        """
+        self.elapsed = 0.0
+        self.transactions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.pages_programmed = 0
+        self.pages_erased = 0
+
+    def _transactions(self, nbytes):
+        """
+        Number of transactions for transferring nbytes bytes
+        """
+        if self.packet == 0 or nbytes <= self.packet:
+            return 1
+        return (nbytes + self.packet - 1) // self.packet
+
+    def command(self):
+        """
+        A transaction without payload, e.g., run or stop
+        """
+        self.transactions += 1
+        self.elapsed += self.latency
+
+    def read(self, nbytes):
+        """
+        Reading nbytes bytes from the target
+        """
+        count = self._transactions(nbytes)
+        self.transactions += count
+        self.bytes_read += nbytes
+        self.elapsed += count*self.latency + nbytes*self.read_byte
+
+    def write(self, nbytes):
+        """
+        Writing nbytes bytes to the target (not flash)
+        """
+        count = self._transactions(nbytes)
+        self.transactions += count
+        self.bytes_written += nbytes
+        self.elapsed += count*self.latency + nbytes*self.write_byte
+
+    def program(self, nbytes, page_size):
+        """
+        Programming nbytes bytes into flash pages of page_size bytes
+        """
+        pages = (nbytes + page_size - 1) // page_size
+        self.transactions += pages
+        self.bytes_written += nbytes
+        self.pages_programmed += pages
+        self.elapsed += pages*(self.latency + self.page_program) + nbytes*self.flash_byte
+
+    def erase(self, pages=1):
+        """
+        Erasing flash pages
+        """
+        self.transactions += 1
+        self.pages_erased += pages
+        self.elapsed += self.latency + pages*self.page_erase
+
+    def statistics(self):
+        """
+        Returns the simulated time and the counters as a dict
+        """
+        return { 'probe': self.name, 'elapsed': self.elapsed, 'transactions': self.transactions,
+                     'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                     'pages_programmed': self.pages_programmed, 'pages_erased': self.pages_erased }
+
+    def report(self):
+        """
+        Returns a one-line summary of the simulated probe traffic
+        """
+        return ("Probe '{}': {:.3f} s simulated, {} transactions, {} bytes read, {} bytes written, " +
+                    "{} pages programmed, {} pages erased").format(
+                        self.name, self.elapsed, self.transactions, self.bytes_read,
+                        self.bytes_written, self.pages_programmed, self.pages_erased)
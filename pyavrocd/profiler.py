@@ -0,0 +1,141 @@
+"""
+This module implements a statistical profiler that samples the PC of the running MCU.
+"""
+
+# args, logging
+from logging import getLogger
+from collections import Counter
+import time
+
+DEFAULT_RATE = 50 # samples per second
+
+class Profiler():
+    """
+    While execution is running after a 'continue', the MCU is stopped periodically,
+    the PC (and optionally the return address on the stack) is read, and execution
+    is resumed. The samples are aggregated into a histogram, which can be
+    symbolized using an ElfSymbols instance and exported as folded stacks,
+    the input format of flame graph tools.
+    """
+
+    def __init__(self, dbg, bp, big_flash=False):
+        self.dbg = dbg
+        self.bp = bp
+        self.logger = getLogger('pyavrocd.profiler')
+        self._retsize = 3 if big_flash else 2 # size of return addresses on the stack
+        self._interval = None # time between samples, None if not profiling
+        self._callers = False # record also the return address on the stack
+        self._next = 0 # time of next sample
+        self._samples = Counter() # (return address or None, PC) -> number of samples
+
+    def start(self, rate=DEFAULT_RATE, callers=False):
+        """
+        Start sampling with rate samples per second. If callers is True, the return
+        address on top of the stack is recorded as well. Earlier samples are discarded.
+        """
+        self._interval = 1/rate
+        self._callers = callers
+        self._next = 0
+        self._samples = Counter()
+        self.logger.info("Profiling started with %d samples/sec", rate)
+
+    def stop(self):
+        """
+        Stop sampling and return the number of samples
+        """
+        self._interval = None
+        self.logger.info("Profiling stopped after %d samples", self.sample_count())
+        return self.sample_count()
+
+    def active(self):
+        """
+        Returns True iff profiling is active
+        """
+        return self._interval is not None
+
+    def interval(self):
+        """
+        Returns the time between samples (or None if not profiling)
+        """
+        return self._interval
+
+    def sample_count(self):
+        """
+        Returns the number of samples taken so far
+        """
+        return sum(self._samples.values())
+
+    def due(self):
+        """
+        Returns True if profiling is active and the next sample is due
+        """
+        return self._interval is not None and time.monotonic() >= self._next
+
+    def sample(self):
+        """
+        Stop the MCU, record PC and (optionally) the return address, and resume execution.
+        If the MCU has stopped at a breakpoint (or at the target of run_to) just before,
+        this stop must be reported to GDB. In this case, no sample is recorded, execution
+        is not resumed, and the PC (byte address) is returned. Otherwise, None is returned.
+        """
+        self._next = time.monotonic() + self._interval
+        self.dbg.stop()
+        pc = self.dbg.program_counter_read() << 1
+        if self.bp.is_stop_point(pc):
+            self.logger.debug("Stop at 0x%X while sampling", pc)
+            return pc
+        caller = None
+        if self._callers:
+            sp = int.from_bytes(self.dbg.stack_pointer_read(), byteorder='little')
+            caller = int.from_bytes(self.dbg.sram_read(sp + 1, self._retsize), byteorder='big') << 1
+        self._samples[(caller, pc)] += 1
+        self.bp.resume_after_interrupt()
+        return None
+
+    @staticmethod
+    def _name(addr, symbols):
+        """
+        Returns the function name for addr (or the hex address if it cannot be symbolized)
+        """
+        name = symbols.function_at(addr) if symbols else None
+        return name if name else "0x{:X}".format(addr)
+
+    def histogram(self, symbols=None):
+        """
+        Returns a Counter mapping function names (or PCs, if there are no symbols) to samples
+        """
+        hist = Counter()
+        for (_, pc), count in self._samples.items():
+            hist[self._name(pc, symbols)] += count
+        return hist
+
+    def folded(self, symbols=None):
+        """
+        Returns the samples as folded stacks, i.e., lines of the form
+        'caller;function count', sorted by descending count
+        """
+        stacks = Counter()
+        for (caller, pc), count in self._samples.items():
+            frames = [self._name(pc, symbols)]
+            if caller is not None:
+                frames.insert(0, self._name(caller, symbols))
+            stacks[";".join(frames)] += count
+        return "".join("{} {}\n".format(stack, count) for stack, count in stacks.most_common())
+
+    def write_folded(self, path, symbols=None):
+        """
+        Write the folded stacks to a file
+        """
+        with open(path, 'w', encoding='utf-8') as outfile:
+            outfile.write(self.folded(symbols))
+
+    def summary(self, symbols=None, top=10):
+        """
+        Returns a text with the top functions and their share of the samples
+        """
+        total = self.sample_count()
+        if not total:
+            return "No samples"
+        lines = ["{:6.2f}%  {:6d}  {}".format(100*count/total, count, name)
+                     for name, count in self.histogram(symbols).most_common(top)]
+        return "{} samples\n".format(total) + "\n".join(lines)
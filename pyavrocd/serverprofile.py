@@ -0,0 +1,88 @@
+"""
+This module implements profiling of the Python side of the GDB server with cProfile.
+"""
+
+# args, logging
+from logging import getLogger
+import cProfile
+import io
+import pstats
+
+DEFAULT_FILE = "pyavrocd.prof" # output file if none is given
+TOP_FUNCTIONS = 40 # number of functions in the text summary
+
+class ServerProfiler():
+    """
+    Profiles the serve loop (and everything called from it) with cProfile while active.
+    When stopped, the per-function statistics are written to a file in the binary pstats
+    format (readable with 'python -m pstats' or tools like snakeviz), and a text summary
+    with the functions sorted by cumulative time, optionally followed by the per-packet-type
+    statistics of 'monitor stats', is written to the same file name with '.txt' appended.
+    """
+    def __init__(self, stats, path=None):
+        self.logger = getLogger('pyavrocd.serverprofile')
+        self._stats = stats # PacketStats of the handler
+        self._path = path or DEFAULT_FILE
+        self._profile = None # cProfile.Profile instance while active
+        self._packets = False # record per-packet-type statistics as well
+
+    def active(self):
+        """
+        Returns True if profiling is active
+        """
+        return self._profile is not None
+
+    def path(self):
+        """
+        Returns the output file
+        """
+        return self._path
+
+    def start(self, path=None, packets=False):
+        """
+        Start profiling, writing later to path (if given). If packets is True, per-packet-type
+        statistics are recorded as well.
+        """
+        if self._profile is not None:
+            return
+        if path:
+            self._path = path
+        self._packets = packets
+        if packets:
+            self._stats.reset()
+            self._stats.enable()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self.logger.info("Profiling the GDB server")
+
+    def stop(self):
+        """
+        Stop profiling and write the statistics. Returns the message for the user.
+        """
+        if self._profile is None:
+            return "Server profiling is not active"
+        self._profile.disable()
+        profile = self._profile
+        self._profile = None
+        try:
+            profile.dump_stats(self._path)
+            with open(self._path + ".txt", 'w', encoding='utf-8') as summary:
+                summary.write(self.summary(profile))
+        except OSError as e:
+            self.logger.error("Could not write profile: %s", e)
+            return "Could not write profile: {}".format(e)
+        finally:
+            if self._packets:
+                self._stats.enable(False)
+        self.logger.info("Server profile written to %s", self._path)
+        return "Server profile written to {} and {}.txt".format(self._path, self._path)
+
+    def summary(self, profile):
+        """
+        Returns the text summary of the profile
+        """
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        if self._packets:
+            text.write("\n" + self._stats.report() + "\n")
+        return text.getvalue()
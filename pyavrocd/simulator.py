@@ -0,0 +1,549 @@
+"""
+This module implements an instruction-set simulator for classic AVR cores that can stand in for
+XAvrDebugger, so that the GDB server can be used without hardware (option '--tool sim').
+"""
+
+# args, logging
+from logging import getLogger
+from types import SimpleNamespace
+import threading
+
+# pymcuprog library
+from pymcuprog.deviceinfo import deviceinfo
+from pymcuprog.pymcuprog_errors import PymcuprogToolConfigurationError, PymcuprogNotSupportedError
+
+# hardware breakpoints of the targets
+from pyavrocd.xavr8target import HWBPNUM, XTinyAvrTarget, XTinyXAvrTarget, XMegaAvrJtagTarget
+from pyavrocd.probemodel import ProbeModel
+from pyavrocd.avrcore import AvrCore, BREAKCODE, SREG, SPH, SPL
+
+SLICE = 10000 # instructions executed while holding the lock when running
+
+class _SimAvr():
+    """
+    Stands in for the AVR8 target object (dbg.device.avr)
+    """
+    def __init__(self, sim):
+        self._sim = sim
+        self.protocol = SimpleNamespace(set_byte=lambda *args: None)
+
+    def switch_to_progmode(self):
+        """
+        Enter programming mode (stops the core)
+        """
+        self._sim.stop()
+        self._sim.model.command()
+
+    def switch_to_debmode(self):
+        """
+        Leave programming mode
+        """
+        self._sim.model.command()
+
+    @staticmethod
+    def is_blank(data):
+        """
+        Returns True iff all bytes are erased
+        """
+        return all(b == 0xFF for b in data)
+
+    @staticmethod
+    def memtype_write_from_string(name):
+        """
+        Returns the memory type for writing to the named memory
+        """
+        return name
+
+    #pylint: disable=too-many-positional-arguments,unused-argument
+    def write_memory_section(self, memtype, address, data, write_size, allow_blank_skip=False):
+        """
+        Program flash pages
+        """
+        self._sim.core.flash[address:address+len(data)] = data
+        self._sim.model.program(len(data), write_size)
+
+class _SimNvm():
+    """
+    Stands in for the NVM access provider (dbg.device)
+    """
+    def __init__(self, sim):
+        self._sim = sim
+        self.avr = _SimAvr(sim)
+
+    def _memory(self, meminfo):
+        core = self._sim.core
+        return { 'flash': core.flash, 'eeprom': core.eeprom }.get(meminfo['name'])
+
+    def read(self, meminfo, offset, numbytes, prog_mode=False):
+        """
+        Read from flash or EEPROM
+        """
+        _dummy = prog_mode
+        mem = self._memory(meminfo)
+        if mem is None:
+            raise PymcuprogNotSupportedError("Cannot read {}".format(meminfo['name']))
+        self._sim.model.read(numbytes)
+        return bytearray(mem[offset:offset+numbytes])
+
+    def write(self, meminfo, offset, data, prog_mode=False):
+        """
+        Write to flash or EEPROM
+        """
+        _dummy = prog_mode
+        mem = self._memory(meminfo)
+        if mem is None:
+            raise PymcuprogNotSupportedError("Cannot write {}".format(meminfo['name']))
+        self._sim.model.write(len(data))
+        mem[offset:offset+len(data)] = data
+
+    def erase_page(self, address, prog_mode=False):
+        """
+        Erase the flash page at address
+        """
+        _dummy = prog_mode
+        size = self._sim.memory_info.memory_info_by_name('flash')['page_size']
+        address -= address % size
+        self._sim.core.flash[address:address+size] = bytes([0xFF]*size)
+        self._sim.model.erase()
+        return True
+
+    def erase_chip(self, prog_mode=False):
+        """
+        Erase the entire flash memory
+        """
+        _dummy = prog_mode
+        flash = self._sim.core.flash
+        self._sim.software_breakpoint_clear_all()
+        flash[:] = bytes([0xFF]*len(flash))
+        self._sim.model.erase(len(flash) // self._sim.memory_info.memory_info_by_name('flash')['page_size'])
+
+class SimDebugger():
+    """
+    Implements the part of the XAvrDebugger interface that is used by the GDB server
+    on top of AvrCore. Software breakpoints are BREAK instructions in the simulated
+    flash, as with real OCDs, hardware breakpoint 0 is the target of run_to,
+    and the number of further hardware breakpoints and data breakpoints depends on the
+    debugging interface. While running, the core executes in a background thread.
+    Each call that would be a transaction with a real probe is charged to model
+    (a ProbeModel), except for poll_event, whose frequency depends on the wall clock.
+    """
+    #pylint: disable=too-many-instance-attributes,too-many-public-methods
+    def __init__(self, devicename, iface, probe='none'):
+        self.logger = getLogger('pyavrocd.simulator')
+        self.devicename = devicename
+        self.iface = iface
+        try:
+            self.device_info = deviceinfo.getdeviceinfo("pyavrocd.deviceinfo.devices." + devicename)
+        except ImportError:
+            raise PymcuprogNotSupportedError("No device info for device: {}".format(devicename)) #pylint: disable=raise-missing-from
+        if iface not in self.device_info['interface'].lower():
+            raise PymcuprogToolConfigurationError("Incompatible debugging interface")
+        self.architecture = self.device_info['architecture'].lower()
+        if self.architecture != 'avr8':
+            raise PymcuprogNotSupportedError("The simulator supports only classic AVR devices")
+        self.memory_info = deviceinfo.DeviceMemoryInfo(self.device_info)
+        sram = self.memory_info.memory_info_by_name('internal_sram')
+        self.core = AvrCore(self.memory_info.memory_info_by_name('flash')['size'],
+                                sram['address'], sram['size'],
+                                self.memory_info.memory_info_by_name('eeprom')['size'])
+        self.core.reset()
+        self.transport = SimpleNamespace(device=SimpleNamespace(product_string="Simulator"),
+                                             hid_device=None)
+        self.edbg_protocol = SimpleNamespace(set_byte=lambda *args: None,
+                                                 query=lambda *args: bytearray())
+        self.device = _SimNvm(self)
+        self._fuses = bytearray([0xFF]*max(1, self.device_info.get('fuses_size_bytes', 0)))
+        self._lockbits = bytearray([0xFF]*max(1, self.device_info.get('lockbits_size_bytes', 0)))
+        self.model = ProbeModel(probe)
+        self._numhwbp = HWBPNUM.get(iface, 1) # including the implicit HWBP 0 of run_to
+        # number of hardware breakpoints that can be used as data breakpoints
+        self.data_comparators = { 'debugwire' : XTinyAvrTarget, 'updi' : XTinyXAvrTarget,
+                                      'jtag' : XMegaAvrJtagTarget }[iface].DATA_COMPARATORS
+        self._swbps = {} # byte address -> original opcode
+        self._hwbps = {} # HWBP number -> byte address
+        self._watch_slots = {} # HWBP number -> watched data address
+        self._run_target = None # byte address of the implicit HWBP of run_to
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+        self._thread = None
+        self._event = None # word address of the PC at the last break while running
+
+    def start_debugging(self, flash_data=None, warmstart=False):
+        """
+        Start the debug session
+        """
+        _dummy = (flash_data, warmstart)
+        self.logger.info("Simulating %s", self.devicename)
+        self.model.command()
+        return True
+
+    def prepare_debugging(self, callback=None, recognition=None):
+        """
+        Nothing needs to be prepared in the simulator
+        """
+        _dummy = (callback, recognition)
+
+    def stop_debugging(self, graceful=True):
+        """
+        Stop the debug session
+        """
+        _dummy = graceful
+        self.stop()
+        self.software_breakpoint_clear_all()
+        self.logger.info(self.model.report())
+
+    def dw_disable(self):
+        """
+        There is no debugWIRE to disable
+        """
+        self._halt_thread()
+        self.model.command()
+
+    def reset(self):
+        """
+        Reset the core
+        """
+        self._halt_thread()
+        self.model.command()
+        self.core.reset()
+
+    # execution
+
+    def _stop_point(self, first):
+        """
+        Returns True if execution has to stop before the instruction at PC
+        """
+        addr = self.core.pc << 1
+        if first:
+            return False
+        return addr == self._run_target or addr in self._hwbps.values() or \
+          self.core.word(self.core.pc) == BREAKCODE
+
+    def _execute_one(self, first):
+        """
+        Execute one instruction. At a software breakpoint, the original instruction is
+        executed if this is the first instruction. Returns True if execution has to stop.
+        """
+        if self._stop_point(first):
+            return True
+        addr = self.core.pc << 1
+        opcode = self._swbps.get(addr) if first else None
+        self.core.watch_hit = None
+        if self.core.step(opcode) == 'break':
+            return True
+        return self.core.watch_hit is not None
+
+    def _execute(self):
+        """
+        Thread function: run until a breakpoint is reached or stop is called
+        """
+        first = True
+        while not self._halt.is_set():
+            with self._lock:
+                for _ in range(SLICE):
+                    if self._execute_one(first):
+                        self._event = self.core.pc
+                        self._halt.set()
+                        break
+                    first = False
+
+    def _start(self, target):
+        self._halt_thread()
+        self.model.command()
+        self._run_target = target
+        self._event = None
+        self._halt.clear()
+        self._thread = threading.Thread(target=self._execute, daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """
+        Start execution
+        """
+        self._start(None)
+
+    def run_to(self, address):
+        """
+        Start execution and stop at byte address (using HWBP 0)
+        """
+        self._start(address)
+
+    def stop(self):
+        """
+        Stop execution
+        """
+        self._halt_thread()
+        self.model.command()
+
+    def _halt_thread(self):
+        if self._thread is not None:
+            self._halt.set()
+            self._thread.join()
+            self._thread = None
+
+    def step(self):
+        """
+        Execute one instruction
+        """
+        self._halt_thread()
+        self.model.command()
+        self._execute_one(True)
+
+    def poll_event(self):
+        """
+        Returns the PC (word address) if execution has stopped at a breakpoint since the
+        last call, else None
+        """
+        if self._thread is not None and not self._thread.is_alive():
+            self._thread.join()
+            self._thread = None
+        if self._thread is None and self._event is not None:
+            event, self._event = self._event, None
+            return event
+        return None
+
+    # breakpoints
+
+    def _swbp_set(self, address):
+        if address not in self._swbps:
+            self._swbps[address] = self.core.word(address >> 1)
+            self.core.flash[address:address+2] = BREAKCODE.to_bytes(2, byteorder='little')
+
+    def _swbp_clear(self, address):
+        if address in self._swbps:
+            self.core.flash[address:address+2] = self._swbps.pop(address).to_bytes(2, byteorder='little')
+
+    def software_breakpoint_set(self, address):
+        """
+        Insert a BREAK instruction at byte address
+        """
+        self.model.command()
+        self._swbp_set(address)
+        return True
+
+    def software_breakpoint_clear(self, address):
+        """
+        Restore the original instruction at byte address
+        """
+        self.model.command()
+        self._swbp_clear(address)
+        return True
+
+    def software_breakpoints_set(self, addresses):
+        """
+        Set several software breakpoints
+        """
+        self.model.command()
+        for address in addresses:
+            self._swbp_set(address)
+        return True
+
+    def software_breakpoints_clear(self, addresses):
+        """
+        Clear several software breakpoints
+        """
+        self.model.command()
+        for address in addresses:
+            self._swbp_clear(address)
+        return True
+
+    def software_breakpoint_clear_all(self):
+        """
+        Clear all software breakpoints
+        """
+        self.software_breakpoints_clear(list(self._swbps))
+
+    def _slot_valid(self, ix, what):
+        """
+        As with the real targets, only HWBPs 1 to numhwbp-1 can be addressed explicitly
+        """
+        if 1 <= ix < self._numhwbp:
+            return True
+        self.logger.error("Tried to %s hardware breakpoint %d on %s target", what, ix, self.iface)
+        return False
+
+    def _slot_clear(self, ix):
+        self._hwbps.pop(ix, None)
+        if ix in self._watch_slots:
+            self.core.watch.pop(self._watch_slots.pop(ix), None)
+
+    def hardware_breakpoint_set(self, ix, address):
+        """
+        Set hardware breakpoint ix at byte address
+        """
+        if not self._slot_valid(ix, "set"):
+            return 0
+        self.model.command()
+        self._slot_clear(ix)
+        self._hwbps[ix] = address
+        return True
+
+    def hardware_watchpoint_set(self, ix, address, mode):
+        """
+        Use hardware breakpoint ix as a data breakpoint
+        """
+        if not self._slot_valid(ix, "set"):
+            return 0
+        self.model.command()
+        self._slot_clear(ix)
+        self.core.watch = { addr: m for addr, m in self.core.watch.items() if addr != address }
+        self.core.watch[address] = mode
+        self._watch_slots[ix] = address
+        return True
+
+    def hardware_breakpoint_clear(self, ix):
+        """
+        Clear hardware breakpoint ix (also if it is a data breakpoint)
+        """
+        if not self._slot_valid(ix, "clear"):
+            return 0
+        self.model.command()
+        self._slot_clear(ix)
+        return True
+
+    # registers and memory
+
+    def register_file_read(self):
+        """
+        Returns R0-R31
+        """
+        self.model.read(32)
+        return bytearray(self.core.data[0:32])
+
+    def register_file_write(self, regs):
+        """
+        Writes R0-R31
+        """
+        self.model.write(32)
+        self.core.data[0:32] = regs
+
+    def status_register_read(self):
+        """
+        Returns SREG as a bytearray
+        """
+        self.model.read(1)
+        return bytearray([self.core.data[SREG]])
+
+    def status_register_write(self, data):
+        """
+        Writes SREG
+        """
+        self.model.write(1)
+        self.core.data[SREG] = data[0]
+
+    def stack_pointer_read(self):
+        """
+        Returns SP as 2 bytes little endian
+        """
+        self.model.read(2)
+        return bytearray(self.core.data[SPL:SPH+1])
+
+    def stack_pointer_write(self, data):
+        """
+        Writes SP (2 bytes little endian)
+        """
+        self.model.write(2)
+        self.core.data[SPL:SPH+1] = data
+
+    def program_counter_read(self):
+        """
+        Returns the PC as a word address
+        """
+        self.model.read(4)
+        return self.core.pc
+
+    def program_counter_write(self, pc):
+        """
+        Writes the PC (word address)
+        """
+        self.model.write(4)
+        self.core.pc = pc
+
+    def sram_read(self, address, numbytes):
+        """
+        Read from data space
+        """
+        self.model.read(numbytes)
+        with self._lock:
+            return bytearray(self.core.data[address:address+numbytes])
+
+    def sram_write(self, address, data):
+        """
+        Write into data space
+        """
+        self.model.write(len(data))
+        with self._lock:
+            self.core.data[address:address+len(data)] = data
+
+    def eeprom_read(self, address, numbytes):
+        """
+        Read from EEPROM
+        """
+        self.model.read(numbytes)
+        return bytearray(self.core.eeprom[address:address+numbytes])
+
+    def eeprom_write(self, address, data):
+        """
+        Write into EEPROM
+        """
+        self.model.write(len(data))
+        self.core.eeprom[address:address+len(data)] = data
+
+    def flash_read(self, address, numbytes, prog_mode=False):
+        """
+        Read from flash
+        """
+        self.model.read(numbytes)
+        _dummy = prog_mode
+        return bytearray(self.core.flash[address:address+numbytes])
+
+    def read_sig(self, addr, size):
+        """
+        Returns the signature bytes
+        """
+        self.model.read(size)
+        sig = self.device_info['device_id'].to_bytes(3, byteorder='big')
+        return bytearray((sig + bytes(addr+size))[addr:addr+size])
+
+    def read_fuse(self, addr, size):
+        """
+        Read fuses (they have no effect on the simulation)
+        """
+        self.model.read(size)
+        return bytearray(self._fuses[addr:addr+size])
+
+    def write_fuse(self, addr, data):
+        """
+        Write fuses
+        """
+        self.model.write(len(data))
+        self._fuses[addr:addr+len(data)] = data
+
+    def read_lock(self, addr, size):
+        """
+        Read lock bits (they have no effect on the simulation)
+        """
+        self.model.read(size)
+        return bytearray(self._lockbits[addr:addr+size])
+
+    def write_lock(self, addr, data):
+        """
+        Write lock bits
+        """
+        self.model.write(len(data))
+        self._lockbits[addr:addr+len(data)] = data
+
+    def read_usig(self, addr, size):
+        """
+        There is no user signature on classic AVRs
+        """
+        _dummy = addr
+        self.model.read(size)
+        return bytearray([0xFF]*size)
+
+    def write_usig(self, addr, data):
+        """
+        There is no user signature on classic AVRs
+        """
+        _dummy = (addr, data)
+        self.logger.debug("Ignoring write to user signature")
@@ -0,0 +1,72 @@
+"""
+This module provides a snapshot of the MCU registers that is only valid while execution is stopped.
+"""
+
+# args, logging
+from logging import getLogger
+
+class RegisterSnapshot():
+    """
+    This class caches the register file, SREG, SP, and PC of a stopped MCU.
+    Values are read lazily from the debugger on first access and kept until
+    invalidate is called, which has to happen whenever the MCU has executed
+    code or registers have been changed behind the back of the snapshot.
+    Loops on the server side (e.g., multi-stepping with stop conditions)
+    can thus check several conditions after each step without
+    asking the hardware debugger for the same value more than once.
+    """
+
+    def __init__(self, dbg):
+        self.dbg = dbg
+        self.logger = getLogger('pyavrocd.snapshot')
+        self._regs = None
+        self._sreg = None
+        self._sp = None
+        self._pc = None
+
+    def invalidate(self):
+        """
+        Forget all cached values
+        """
+        self._regs = None
+        self._sreg = None
+        self._sp = None
+        self._pc = None
+
+    def registers(self):
+        """
+        Returns the 32 general purpose registers as a bytearray
+        """
+        if self._regs is None:
+            self._regs = bytearray(self.dbg.register_file_read())
+        return self._regs
+
+    def register(self, num):
+        """
+        Returns the contents of general purpose register num
+        """
+        return self.registers()[num]
+
+    def status_register(self):
+        """
+        Returns SREG as an int
+        """
+        if self._sreg is None:
+            self._sreg = self.dbg.status_register_read()[0]
+        return self._sreg
+
+    def stack_pointer(self):
+        """
+        Returns SP as an int
+        """
+        if self._sp is None:
+            self._sp = int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little')
+        return self._sp
+
+    def program_counter(self):
+        """
+        Returns the PC as a byte address
+        """
+        if self._pc is None:
+            self._pc = self.dbg.program_counter_read() << 1
+        return self._pc
@@ -0,0 +1,207 @@
+"""
+This module implements the accounting of the time spent in handling RSP packets and of
+the transactions with the hardware debugger, which can be queried with 'monitor stats'.
+"""
+
+# args, logging
+from logging import getLogger
+from collections import deque
+import time
+
+WINDOW = 1000 # number of recent samples per packet type used for percentiles and maximum
+
+def probe_counters(dbg):
+    """
+    Returns the number of transactions with the hardware debugger, the number of
+    bytes transferred, and the time spent in these transactions so far. For the
+    simulator, these are the numbers of the probe model (with simulated time).
+    """
+    model = getattr(dbg, 'model', None)
+    if model is not None:
+        return model.transactions, model.bytes_read + model.bytes_written, model.elapsed
+    transport = getattr(dbg, 'transport', None)
+    if isinstance(transport, CountingTransport):
+        return transport.transfers, transport.bytes, transport.elapsed
+    return 0, 0, 0.0
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a non-empty sequence of samples
+    """
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered)*pct//100) - 1))]
+
+class CountingTransport():
+    """
+    Wraps a HID transport and counts the transfers, the bytes sent and received, and
+    the time spent in them. All other attributes are those of the wrapped transport.
+    The transport is wrapped when the debugger is created, because the protocol objects
+    keep references to it, but transfers are only counted while counting is True (set
+    by PacketStats.enable). Otherwise, a transfer costs one extra call and a check of
+    the flag, which is negligible compared to a USB round trip.
+    """
+    def __init__(self, transport):
+        self._transport = transport
+        self.counting = False
+        self.transfers = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+    def _count(self, start, sent, received):
+        self.transfers += 1
+        self.bytes += len(sent) + len(received)
+        self.elapsed += time.perf_counter() - start
+
+    def hid_transfer(self, data_send):
+        """
+        Send HID data and receive the response
+        """
+        if not self.counting:
+            return self._transport.hid_transfer(data_send)
+        start = time.perf_counter()
+        response = self._transport.hid_transfer(data_send)
+        self._count(start, data_send, response or b'')
+        return response
+
+    def hid_write(self, data_send):
+        """
+        Send HID data
+        """
+        if not self.counting:
+            return self._transport.hid_write(data_send)
+        start = time.perf_counter()
+        result = self._transport.hid_write(data_send)
+        self._count(start, data_send, b'')
+        return result
+
+    def hid_read(self):
+        """
+        Read HID data
+        """
+        if not self.counting:
+            return self._transport.hid_read()
+        start = time.perf_counter()
+        response = self._transport.hid_read()
+        self._count(start, b'', response or b'')
+        return response
+
+class _PacketRecord():
+    """
+    Accumulated numbers for one packet type
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.transactions = 0
+        self.bytes = 0
+        self.probe_time = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def add(self, duration):
+        """
+        Count one packet that took duration seconds
+        """
+        self.count += 1
+        self.total += duration
+        self.recent.append(duration)
+
+    def durations(self):
+        """
+        Returns the median, the 95th percentile, and the maximum of the recent durations
+        """
+        return percentile(self.recent, 50), percentile(self.recent, 95), max(self.recent)
+
+class PacketStats():
+    """
+    Records for each packet type how often it was handled, the time spent in handling it
+    (with percentiles and maximum over the last WINDOW packets), and the transactions,
+    bytes, and time of the communication with the hardware debugger. In addition, the
+    time between the end of one packet and the start of the next one is recorded, which is
+    spent in GDB and on the way between GDB and the server. When disabled, the only
+    cost is checking the enabled flag per packet.
+    """
+    def __init__(self, dbg):
+        self.logger = getLogger('pyavrocd.stats')
+        self.dbg = dbg
+        self.enabled = False
+        self._records = {}
+        self._between = _PacketRecord()
+        self._last_end = None
+
+    def enable(self, flag=True):
+        """
+        Start or stop recording
+        """
+        self.enabled = flag
+        self._last_end = None
+        transport = getattr(self.dbg, 'transport', None)
+        if isinstance(transport, CountingTransport):
+            transport.counting = flag
+
+    def reset(self):
+        """
+        Forget everything recorded so far
+        """
+        self._records = {}
+        self._between = _PacketRecord()
+        self._last_end = None
+
+    def begin(self):
+        """
+        Called before a packet is handled. Returns the state to be passed to end.
+        """
+        now = time.perf_counter()
+        if self._last_end is not None:
+            self._between.add(now - self._last_end)
+        return now, probe_counters(self.dbg)
+
+    def end(self, packet_type, state):
+        """
+        Called after a packet of packet_type has been handled
+        """
+        start, (transactions, nbytes, probe_time) = state
+        after = probe_counters(self.dbg)
+        self._last_end = time.perf_counter()
+        rec = self._records.setdefault(packet_type, _PacketRecord())
+        rec.add(self._last_end - start)
+        rec.transactions += after[0] - transactions
+        rec.bytes += after[1] - nbytes
+        rec.probe_time += after[2] - probe_time
+
+    def packet_types(self):
+        """
+        Returns the recorded packet types
+        """
+        return list(self._records)
+
+    def summary(self, packet_type):
+        """
+        Returns the numbers for one packet type as a dict
+        """
+        rec = self._records[packet_type]
+        p50, p95, longest = rec.durations()
+        return { 'count': rec.count, 'total': rec.total, 'p50': p50, 'p95': p95, 'max': longest,
+                     'transactions': rec.transactions, 'bytes': rec.bytes, 'probe_time': rec.probe_time }
+
+    def report(self):
+        """
+        Returns a table of the recorded numbers, sorted by the total time per packet type
+        """
+        if not self._records:
+            return "No packets recorded" + ("" if self.enabled else " (enable with 'monitor stats enable')")
+        lines = ["Packet         count   total s   p50 ms   p95 ms   max ms   trans.     bytes  probe s"]
+        for packet_type in sorted(self._records, key=lambda t: -self._records[t].total):
+            summ = self.summary(packet_type)
+            lines.append("{:<12} {:>7} {:>9.3f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8} {:>9} {:>8.3f}".format(
+                packet_type, summ['count'], summ['total'], summ['p50']*1000, summ['p95']*1000,
+                summ['max']*1000, summ['transactions'], summ['bytes'], summ['probe_time']))
+        if self._between.count:
+            p50, p95, longest = self._between.durations()
+            lines.append("{:<12} {:>7} {:>9.3f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+                "(GDB)", self._between.count, self._between.total, p50*1000, p95*1000, longest*1000))
+        if not self.enabled:
+            lines.append("Recording is disabled")
+        return "\n".join(lines)
@@ -0,0 +1,93 @@
+"""
+This module analyzes the address ranges of range-stepping requests.
+"""
+
+# args, logging
+from logging import getLogger
+
+# opcode decoding
+from pyavrocd.opcodes import branch_instr, callx_instr, two_word_instr, skip_instr, cond_branch_instr, \
+     relative_branch_instr, compute_possible_destination_of_branch, compute_destination_of_relative_branch
+
+class StepRange():
+    """
+    This class holds the analysis of the last range GDB asked to step through: the
+    instructions, the exit points, the branch points, and the calls to be stepped over.
+    Setting start to None makes sure that the next range is analyzed afresh.
+    """
+
+    def __init__(self):
+        self.logger = getLogger('pyavrocd.steprange')
+        self.start = 0
+        self.end = 0
+        self.word = []
+        self.branch = []
+        self.exit = set()
+        self.call = {}
+        self.stepover = False
+
+    def build(self, start, end, stepover, read_word):
+        """
+        Collect all instructions in the range (read by read_word) and analyze them.
+        Find all points, where an instruction possibly leaves the range. This includes
+        the first instruction after the range, provided it is reachable. These points are
+        remembered in self.exit. If the number of exits is less than or equal to the number
+        of hardware BPs, then one can check for all them. In case of dW this number is one.
+        However, this is enough for handling _delay_ms(_). In all other cases, we stop at all
+        branching instructions, memorized in self.branch, and single-step them.
+        If calls are stepped over, the call instructions together with their return addresses
+        are memorized in self.call, and the call destinations are not treated as exits.
+        Return False, if the range is already established.
+        """
+        if start == self.start and end == self.end and \
+          stepover == self.stepover:
+            return False # previously analyzed
+        self.word = []
+        self.exit = set()
+        self.branch = []
+        self.call = {}
+        self.start = start
+        self.end = end
+        self.stepover = stepover
+        for a in range(start, end+2, 2):
+            self.word += [ read_word(a) ]
+        i = 0
+        while i < len(self.word) - 1:
+            dest = []
+            opcode = self.word[i]
+            secondword = self.word[i+1]
+            if branch_instr(opcode):
+                self.branch += [ start + (i * 2) ]
+            if stepover and callx_instr(opcode): # CALL, RCALL, (E)ICALL
+                dest = [ start + (i + 1 + two_word_instr(opcode)) * 2 ]
+                self.call[start + (i * 2)] = dest[0]
+            elif two_word_instr(opcode):
+                if branch_instr(opcode): # JMP and CALL
+                    dest = [ secondword << 1 ]
+                else: # STS and LDS
+                    dest = [ start + (i + 2) * 2 ]
+            else:
+                if not branch_instr(opcode): # straight-line ops
+                    dest = [start + (i + 1) * 2]
+                elif skip_instr(opcode): # CPSE, SBIC, SBIS, SBRC, SBRS
+                    dest = [start + (i + 1) * 2,
+                               start + (i + 2 + two_word_instr(secondword)) * 2]
+                elif cond_branch_instr(opcode): # BRBS, BRBC
+                    dest = [start + (i + 1) * 2,
+                                compute_possible_destination_of_branch(opcode,
+                                                                                start + (i * 2)) ]
+                elif relative_branch_instr(opcode): # RJMP, RCALL
+                    dest = [ compute_destination_of_relative_branch(opcode, start + (i * 2)) ]
+                else: # IJMP, EIJMP, RET, ICALL, RETI, EICALL
+                    dest = [ -1 ]
+            self.logger.debug("Dest at 0x%X: %s", start + i*2, [hex(x) for x in dest])
+            if -1 in dest:
+                self.exit.add(start + (i * 2))
+            else:
+                self.exit = self.exit.union([ a for a in dest
+                                                                if a < start or a >= end ])
+            i += 1 + two_word_instr(opcode)
+        self.branch += [ end ]
+        self.logger.debug("Exit points: %s", {hex(x) for x in self.exit})
+        self.logger.debug("Branch points: %s", [hex(x) for x in self.branch])
+        return True
@@ -0,0 +1,185 @@
+"""
+This module simulates the instructions that cannot be single-stepped by the OCD
+without risking to end up in an interrupt routine or without reprogramming flash.
+"""
+
+# args, logging
+from logging import getLogger
+
+# Errors
+from pyavrocd.errors import FatalError
+
+# opcode decoding
+from pyavrocd.opcodes import extract_io_addr, extract_displacement, is_out_instr, is_post_incr, is_pre_decr, \
+     is_change_ix, is_x_reg, is_y_reg, extract_register, is_store_instr, branch_on_ibit, \
+     compute_destination_of_ibranch
+
+SREGADDR = 0x5F
+
+class StepSimulator():
+    """
+    This class simulates single steps on the MCU. Instructions that manipulate the I-bit
+    or SREG cannot be stepped safely with the I-bit cleared, and two-word instructions
+    at the place of a software breakpoint cannot be stepped without restoring the original
+    instruction in flash. read_word returns a flash word with breakpoints filtered out.
+    """
+
+    def __init__(self, dbg, arch, read_word, big_flash, big_sram):
+        self.dbg = dbg
+        self.logger = getLogger('pyavrocd.stepsim')
+        self._arch = arch
+        self._read_word = read_word
+        self._big_flash = big_flash # return addresses have three bytes
+        self._big_sram = big_sram # RAMP registers would be needed
+
+    #pylint: disable=too-many-return-statements,too-many-branches
+    #It simply is a large case analysis, would not make sense to break it up
+    def filter_unsafe_instructions(self, addr, opcode):
+        """
+        Check all intructions for potential I-bit manipulation. If
+        the instruction addresses SREG, it will be simulated and True is returned.
+        """ 
+        # if the opcode is a register only instruction, simply return
+        if opcode < 0x8000: 
+            return False
+        # Architecture too advanced
+        if self._arch != "avr8":
+            # We need to account for LAT / LAC / LAS
+            raise FatalError("Wrong architecture. Disable safe stepping or extend stepping method")
+        # Data space too large
+        if self._big_sram:
+            # One needs to account for RAMPZ / RAMPX / RAMPY / RAMPD registers
+            # when computing target or source address in SRAM
+            raise FatalError("SRAM too large. Disable safe stepping or extend stepping method")
+        # BRIE, BRID
+        if branch_on_ibit(opcode): 
+            ibit = bool(self.dbg.status_register_read()[0] & 0x80)
+            destination = compute_destination_of_ibranch(opcode, ibit, addr)
+            self.logger.debug("Branching on I-Bit. Destination=0x%X", destination)
+            self.dbg.program_counter_write(destination>>1)
+            return True
+        # LDS and STS 
+        if opcode & 0xFD0F == 0x9000: 
+            secondword = self._read_word(addr + 2)
+            if secondword != SREGADDR:
+                return False
+            self._load_or_store_reg(opcode, is_store_instr)
+            return self._sim_done(addr+2)
+        # LD r,X, ST X,r and LD r,Y, STS Y, r without displacement
+        if opcode & 0xFC00 == 0x9000 and opcode & 0x0003 != 3 and \
+            (opcode & 0x00C0 == 0x00C0 or opcode & 0x0003 != 0):
+            if is_x_reg(opcode):
+                base_reg = 26
+            elif is_y_reg(opcode):
+                base_reg = 28
+            else:
+                base_reg = 30
+            iaddr = int.from_bytes(self.dbg.read_sram(base_reg, 2), byteorder='little')
+            if is_pre_decr(opcode):
+                iaddr -= 1
+            if iaddr != SREGADDR:
+                return False
+            self._load_or_store_reg(opcode, is_store_instr)
+            if is_post_incr(opcode):
+                iaddr += 1
+            if is_change_ix(opcode):
+                self.dbg.sram_write(iaddr.to_bytes(2, byteorder='little'))
+            return self._sim_done(addr)
+        # LD r, Y/Z and ST Y/Z, r with displacement
+        if opcode & 0xD000 == 0x8000:
+            disp = extract_displacement(opcode)
+            if is_y_reg(opcode):
+                base_reg  = 28
+            iaddr = int.from_bytes(self.dbg.read_sram(base_reg, 2), byteorder='little') + disp
+            if iaddr != SREGADDR:
+                return False
+            self._load_or_store_reg(opcode, is_store_instr)
+            return self._sim_done(addr)
+        # IN and OUT
+        if opcode & 0xF000 == 0xD000:
+            if extract_io_addr(opcode) == SREGADDR - 0x20:
+                self._load_or_store_reg(opcode, is_out_instr)
+                return self._sim_done(addr)
+            return False
+        # BCLR/BSET
+        # 1001 0100 1xxx 1000 BCLR
+        # 1001 0100 0xxx 1000 BSET 
+        if opcode & 0xFF0F == 0x9408:
+            if opcode == 0x94F8: # CLI
+                sreg = self.dbg.status_register_read()[0]
+                sreg |= 0x80
+                self.dbg.status_register_write(bytearray([sreg]))
+                return self._sim_done(addr)
+            if opcode == 0x9478: # SEI
+                sreg = self.dbg.status_register_read()[0]
+                sreg |= 0x80
+                self.dbg.status_register_write(bytearray([sreg]))
+                return self._sim_done(addr)
+            return False
+        # XCH
+        # 1001 001r rrrr 0100
+        if (opcode & 0x9E0F) == 0x9204:
+            if int.from_bytes(self.dbg.read_sram(30, 2), byteorder='little') != SREGADDR:
+                return False
+            reg = extract_register(opcode)
+            temp = self.dbg.read_sram(reg, 1)
+            self.dbg.write_sram(reg, self.dbg.read_sram(SREGADDR, 1))
+            self.dbg.write_sram(SREGADDR, temp)
+            return self._sim_done(addr)
+        return False
+
+    def _load_or_store_reg(self, opcode, do_store_check):
+        """
+        Load or stores SREG from/to a register. The do_store_check parameter
+        is a function parameter that checks the rigt bit in the opcode.
+        """
+        reg = extract_register(opcode)
+        if do_store_check(opcode):
+            self.dbg.status_register_write(bytearray(self.dbg.sram_read(reg,1)))
+        else:
+            self.dbg.sram_write(reg, self.dbg.status_register_read())
+
+    def _sim_done(self, addr):
+        """
+        Increments PC by 2 and then returns True
+        """
+        self.dbg.program_counter_write(addr + 2)
+        return True
+
+    def sim_two_word_instr(self, opcode, secondword, addr):
+        """
+        Simulate a two-word instruction with opcode and 2nd word secondword at addr (byte address).
+        Update all registers (except PC) and return the (byte-) address
+        where execution will continue.
+        """
+        newaddr = (secondword << 1) + ((opcode & 1) << 17) # new byte addr, only for branching instructions
+        if (opcode & ~0x1F0) == 0x9000: # lds
+            register = (opcode & 0x1F0) >> 4
+            val = self.dbg.sram_read(secondword, 1)
+            self.dbg.sram_write(register, val)
+            self.logger.debug("Simulating lds")
+            addr += 4
+        elif (opcode & ~0x1F0) == 0x9200: # sts
+            register = (opcode & 0x1F0) >> 4
+            val = self.dbg.sram_read(register, 1)
+            self.dbg.sram_write(secondword, val)
+            self.logger.debug("Simulating sts")
+            addr += 4
+        elif (opcode & 0x0FE0E) == 0x940C: # jmp
+            addr = newaddr
+            self.logger.debug("Simulating jmp 0x%X", addr)
+        elif (opcode & 0x0FE0E) == 0x940E: # call
+            returnaddr = (addr + 4) >> 1 # now word address
+            self.logger.debug("Simulating call to 0x%X", newaddr)
+            self.logger.debug("Pushing return addr on stack: 0x%X", returnaddr << 1)
+            sp = int.from_bytes(self.dbg.stack_pointer_read(),byteorder='little')
+            self.logger.debug("Current stack pointer: 0x%X", sp)
+            sp -= (2 + int(self._big_flash))
+            self.logger.debug("New stack pointer: 0x%X", sp)
+            self.dbg.stack_pointer_write(sp.to_bytes(2,byteorder='little'))
+            if self._big_flash:
+                self.dbg.sram_write(sp+1, returnaddr.to_bytes(3,byteorder='big'))
+            else:
+                self.dbg.sram_write(sp+1, returnaddr.to_bytes(2,byteorder='big'))
+            addr = newaddr
+        return addr
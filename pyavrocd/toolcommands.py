@@ -0,0 +1,251 @@
+"""
+This module executes the monitor commands of the analysis tools.
+"""
+
+# args, logging
+from logging import getLogger
+import time
+
+from pymcuprog.pymcuprog_errors import PymcuprogError
+
+from pyavrocd.breakexec import SIGTRAP
+from pyavrocd.console import DRAIN_INTERVAL
+from pyavrocd.pctrace import TraceWriter
+from pyavrocd.tracebuffer import trace
+from pyavrocd.elfsymbols import ElfSymbols, DATA_OFFSET
+from pyavrocd.errors import ElfError
+
+class ToolCommands():
+    """
+    This class carries out the monitor commands of the analysis tools (reverse execution,
+    tracing, profiling, checkpoints, the SRAM console, packet statistics, server profiling,
+    and the event trace buffer) after they have been parsed by MonitorCommand. The tools
+    are attributes of the GDB handler, which is passed to the constructor.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.logger = getLogger('pyavrocd.toolcommands')
+        self._commands = {
+            'recording'          : self._recording,
+            'trace'              : self._trace,
+            'trace-dump'         : self._trace_dump,
+            'trace-dump enable'  : self._trace_dump,
+            'trace-dump disable' : self._trace_dump,
+            'profile'            : self._profile,
+            'profile start'      : self._profile,
+            'profile stop'       : self._profile,
+            'profile-server'     : self._profile_server,
+            'profile-server on'  : self._profile_server,
+            'profile-server off' : self._profile_server,
+            'checkpoint'         : self._checkpoint,
+            'checkpoint save'    : self._checkpoint,
+            'checkpoint restore' : self._checkpoint,
+            'checkpoint spill'   : self._checkpoint,
+            'console'            : self._console,
+            'console on'         : self._console,
+            'console off'        : self._console,
+            'stats'              : self._stats,
+            'stats enable'       : self._stats,
+            'stats disable'      : self._stats,
+            'stats reset'        : self._stats,
+            }
+
+    def __contains__(self, command):
+        return command in self._commands
+
+    def execute(self, command, message):
+        """
+        Execute command (the first component of the result of MonitorCommand.dispatch)
+        and return the reply for GDB. message is the second component, which is the
+        reply unless the command produces its own.
+        """
+        reply = self._commands[command](command, message)
+        return message if reply is None else reply
+
+    def server_stepping(self, newpc):
+        """
+        Execute a continue armed by 'monitor stepi' by single-stepping on the server
+        until the number of steps is reached, a stop condition is met, a breakpoint is
+        reached, or GDB interrupts. Returns the signal to be reported as for any continue,
+        so that GDB refreshes registers and frames (None when GDB has interrupted, because
+        then the stop is reported when the interrupt is handled).
+        """
+        handler = self.handler
+        count, conditions = handler.mon.stepi_parameters()
+        handler.mon.clear_stepi()
+        if newpc is not None:
+            handler.dbg.program_counter_write(newpc >> 1)
+        steps, sig = handler.bp.multi_step(count, conditions + [('bp',)], handler.poll_gdb_input)
+        handler.send_debug_message("Executed {} instruction(s), stopped at 0x{:X}".format(
+            steps, handler.dbg.program_counter_read() << 1))
+        return None if handler.poll_gdb_input() else sig
+
+    def drain_console(self, running=False):
+        """
+        Forward new output of the firmware as 'O' packets. If the MCU is running
+        and reading fails, the console is only drained at stops from then on.
+        """
+        try:
+            text = self.handler.console.drain()
+        except PymcuprogError as e:
+            if not running:
+                raise
+            self.logger.debug("Reading console while running failed: %s", e)
+            self.handler.console.disable_live()
+            return
+        if text:
+            self.handler.send_debug_message(text, newline=False)
+
+    def sample_pc(self):
+        """
+        Take a PC sample for the profiler. If the MCU has stopped in the meantime,
+        the stop is handled as usual.
+        """
+        handler = self.handler
+        pc = handler.profiler.sample()
+        if pc is not None:
+            self.logger.debug("MCU stopped execution while sampling")
+            handler.send_signal(handler.bp.handle_stop(pc), handler.bp.stop_reason())
+
+    def poll_interval(self, interval):
+        """
+        Returns the time the server may wait for GDB input while the MCU is running,
+        which is at most interval, but shorter if the profiler or the console are active
+        """
+        if self.handler.profiler.active():
+            interval = min(interval, self.handler.profiler.interval())
+        if self.handler.console.live():
+            interval = min(interval, DRAIN_INTERVAL)
+        return interval
+
+    def _recording(self, _, message):
+        return message.format(self.handler.bp.history_length())
+
+    def _trace(self, _, message):
+        """
+        Single-step on the server side and record the PCs in a trace file.
+        """
+        handler = self.handler
+        path, count = handler.mon.trace_parameters()
+        try:
+            writer = TraceWriter(path)
+        except OSError as e:
+            self.logger.error("Could not open trace file: %s", e)
+            return "Could not open trace file: {}".format(e)
+        try:
+            steps, sig = handler.bp.multi_step(count, [('bp',)], handler.poll_gdb_input,
+                                                   record=writer.record)
+        finally:
+            writer.close()
+        handler.last_sigval = sig
+        return message.format(steps, path, handler.dbg.program_counter_read() << 1,
+                                  "" if sig == SIGTRAP else " with signal {}".format(sig))
+
+    def _trace_dump(self, command, _):
+        if command == 'trace-dump':
+            return "\n".join(trace.render(self.handler.mon.trace_dump_parameters())) or \
+              "Trace buffer is empty"
+        trace.enabled = command == 'trace-dump enable'
+        return None
+
+    def _profile(self, command, _):
+        profiler = self.handler.profiler
+        if command == 'profile start':
+            profiler.start(*self.handler.mon.profile_parameters())
+            return None
+        if command == 'profile stop':
+            return self._stop_profiling()
+        if profiler.active():
+            return "Profiling is active ({} samples so far)".format(profiler.sample_count())
+        return "Profiling is not active"
+
+    def _stop_profiling(self):
+        """
+        Stop the profiler and write the folded stacks. Returns the message for the user.
+        """
+        profiler = self.handler.profiler
+        outfile, elffile = self.handler.mon.profile_output()
+        if not profiler.active():
+            return "Profiling is not active"
+        profiler.stop()
+        try:
+            symbols = ElfSymbols(elffile) if elffile else None
+            profiler.write_folded(outfile, symbols)
+        except (ElfError, OSError) as e:
+            self.logger.error("Could not write profile: %s", e)
+            return "Could not write profile: {}".format(e)
+        return profiler.summary(symbols) + "\nFolded stacks written to " + outfile
+
+    def _profile_server(self, command, _):
+        server_profiler = self.handler.server_profiler
+        if command == 'profile-server on':
+            server_profiler.start(*self.handler.mon.server_profile_parameters())
+            return None
+        if command == 'profile-server off':
+            return server_profiler.stop()
+        if server_profiler.active():
+            return "Server profiling is active, output to " + server_profiler.path()
+        return "Server profiling is not active"
+
+    def _checkpoint(self, command, _):
+        """
+        Save or restore a checkpoint, or list the checkpoints.
+        """
+        handler = self.handler
+        handler.checkpoints.set_spill_dir(handler.mon.checkpoint_spill_dir())
+        if command == 'checkpoint spill':
+            return None
+        if command == 'checkpoint':
+            names = handler.checkpoints.names()
+            return "Checkpoints: " + ", ".join(names) if names else "No checkpoints in memory"
+        name, eeprom = handler.mon.checkpoint_parameters()
+        start = time.monotonic()
+        if command == 'checkpoint save':
+            ckp = handler.checkpoints.save(name, eeprom)
+            return "Checkpoint '{}' saved ({} bytes) in {:.2f} s".format(name, ckp.size(),
+                                                                         time.monotonic() - start)
+        if handler.checkpoints.restore(name) is None:
+            return "No checkpoint '{}'".format(name)
+        handler.bp.forget_stop_pc()
+        handler.bp.clear_history()
+        return "Checkpoint '{}' restored in {:.2f} s, PC=0x{:X}".format(
+            name, time.monotonic() - start, handler.dbg.program_counter_read() << 1)
+
+    def _console(self, command, _):
+        """
+        Attach the console to the ring buffer given by the ELF file and symbol, detach it,
+        or report its state.
+        """
+        console = self.handler.console
+        if command == 'console off':
+            console.detach()
+            return None
+        if command == 'console':
+            if not console.active():
+                return "Console is disabled"
+            return "Console buffer at 0x{:X}, drained {}".format(
+                console.address(), "periodically and at stops" if console.live()
+                else "at stops")
+        elffile, symbol = self.handler.mon.console_parameters()
+        try:
+            location = ElfSymbols(elffile).address_of(symbol)
+        except ElfError as e:
+            self.logger.error("Could not read symbols: %s", e)
+            return "Could not read symbols: {}".format(e)
+        if location is None or not DATA_OFFSET <= location[0] < DATA_OFFSET + 0x10000:
+            return "No SRAM object '{}' in {}".format(symbol, elffile)
+        if not console.attach(location[0] - DATA_OFFSET, location[1]):
+            return "Object '{}' has {} bytes, but a console buffer needs 3 to 257 bytes".format(
+                symbol, location[1])
+        return "Console buffer '{}' at 0x{:X}".format(symbol, location[0] - DATA_OFFSET)
+
+    def _stats(self, command, _):
+        stats = self.handler.stats
+        if command == 'stats':
+            return stats.report()
+        if command == 'stats reset':
+            stats.reset()
+        else:
+            stats.enable(command == 'stats enable')
+        return None
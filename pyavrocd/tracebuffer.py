@@ -0,0 +1,122 @@
+"""
+This module implements an always-on ring buffer of fixed-size binary event records
+written in the hot paths, which are rendered to text only on demand.
+"""
+
+# args, logging
+from logging import getLogger, DEBUG
+import struct
+import time
+
+DEFAULT_RECORDS = 4096 # capacity of the ring buffer
+DEFAULT_DUMP = 50 # number of records shown by 'monitor trace-dump' without argument
+
+# event id, timestamp, and four integer arguments
+RECORD = struct.Struct('<Hdqqqq')
+HEAD = 7 # number of leading bytes of a packet that fit into a (signed) argument
+
+# events and how to render their arguments
+RSP_IN = 1
+RSP_OUT = 2
+STORE_CACHE = 3
+FLASH_PAGE = 4
+RESUME = 5
+STEP = 6
+STOP = 7
+RANGE_STEP = 8
+
+# flags of FLASH_PAGE
+PAGE_SKIPPED = 1
+PAGE_ERASED = 2
+PAGE_PROGRAMMED = 4
+PAGE_VERIFIED = 8
+
+def _head(value, length):
+    """
+    Renders the first bytes of a packet stored as an integer
+    """
+    return repr(value.to_bytes(HEAD, byteorder='little')[:min(length, HEAD)])
+
+def _page_flags(flags):
+    return "|".join(name for bit, name in ((PAGE_SKIPPED, "skipped"), (PAGE_ERASED, "erased"),
+                                               (PAGE_PROGRAMMED, "programmed"), (PAGE_VERIFIED, "verified"))
+                        if flags & bit) or "-"
+
+EVENTS = {
+    RSP_IN      : ("rsp in", lambda a, b, c, d: "{} bytes {}".format(a, _head(b, a))),
+    RSP_OUT     : ("rsp out", lambda a, b, c, d: "{} bytes {}".format(a, _head(b, a))),
+    STORE_CACHE : ("store to cache", lambda a, b, c, d: "0x{:X}, {} bytes, cache size {}".format(a, b, c)),
+    FLASH_PAGE  : ("flash page", lambda a, b, c, d: "0x{:X} {}, crc new 0x{:08X}, crc old 0x{:08X}".format(
+        a, _page_flags(b), c, d)),
+    RESUME      : ("resume", lambda a, b, c, d: "pc 0x{:X}, {} breakpoints{}".format(
+        a, b, ", fast path" if c else "")),
+    STEP        : ("single step", lambda a, b, c, d: "pc 0x{:X}".format(a) if a >= 0 else "current pc"),
+    RANGE_STEP  : ("range step", lambda a, b, c, d: "0x{:X} to 0x{:X}".format(a, b)),
+    STOP        : ("stop", lambda a, b, c, d: "pc 0x{:X}".format(a)),
+    }
+
+def packet_head(data):
+    """
+    The first (up to) HEAD bytes of a packet as an integer for RSP_IN and RSP_OUT
+    """
+    return int.from_bytes(data[:HEAD], byteorder='little')
+
+class TraceBuffer():
+    """
+    Stores the events as records of an event id, a timestamp, and up to four integer
+    arguments in a preallocated bytearray, overwriting the oldest records when full.
+    Recording costs packing one record; nothing is formatted. The records are rendered
+    by render and, when debug logging is enabled for 'pyavrocd.trace', also logged
+    when they are recorded. When enabled is False, nothing is recorded, and callers
+    should skip computing expensive arguments.
+    """
+    def __init__(self, capacity=DEFAULT_RECORDS):
+        self.logger = getLogger('pyavrocd.trace')
+        self._capacity = capacity
+        self._buffer = bytearray(capacity*RECORD.size)
+        self._next = 0 # number of records written so far
+        self._start = time.perf_counter()
+        self.enabled = True
+
+    def record(self, event, a=0, b=0, c=0, d=0):
+        """
+        Add an event with up to four integer arguments
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        RECORD.pack_into(self._buffer, (self._next % self._capacity)*RECORD.size, event, now, a, b, c, d)
+        self._next += 1
+        if self.logger.isEnabledFor(DEBUG):
+            self.logger.debug("%s", self._render((event, now, a, b, c, d)))
+
+    def clear(self):
+        """
+        Discard all records
+        """
+        self._next = 0
+
+    def __len__(self):
+        return min(self._next, self._capacity)
+
+    def records(self, last=None):
+        """
+        Returns the last (default: all) records as tuples (event, timestamp, a, b, c, d), oldest first
+        """
+        count = len(self) if last is None else min(last, len(self))
+        return [RECORD.unpack_from(self._buffer, (ix % self._capacity)*RECORD.size)
+                    for ix in range(self._next - count, self._next)]
+
+    def _render(self, rec):
+        event, stamp, a, b, c, d = rec
+        name, args = EVENTS.get(event, ("event {}".format(event), lambda *x: " ".join(map(str, x))))
+        return "{:12.6f} {}: {}".format(stamp - self._start, name, args(a, b, c, d))
+
+    def render(self, last=None):
+        """
+        Returns the last (default: all) records as lines of text
+        """
+        return [self._render(rec) for rec in self.records(last)]
+
+# the trace buffer shared by handler, memory, and breakexec
+trace = TraceBuffer()
@@ -0,0 +1,96 @@
+"""
+Offline analysis of instruction traces recorded with 'monitor trace start':
+basic-block coverage and hot loops.
+
+Usage: python -m pyavrocd.tracetool [--elf <file>] [--top <n>] <trace file>
+"""
+
+import argparse
+import sys
+from collections import Counter
+
+from pyavrocd.pctrace import read_trace
+from pyavrocd.elfsymbols import ElfSymbols
+from pyavrocd.errors import ElfError
+
+def analyze(path):
+    """
+    Expand the trace into basic blocks. Since only PCs are recorded, a block ends
+    whenever the next PC is not the address of the following instruction (or the one
+    after it, since we do not know whether an instruction was a two-word instruction).
+    Returns the number of traced instructions, the set of executed addresses,
+    a Counter of blocks (start, end), and a Counter of backward jumps (from, to),
+    which are the back edges of loops.
+    """
+    steps = 0
+    covered = set()
+    blocks = Counter()
+    backedges = Counter()
+    start = prev = None
+    for kind, pc in read_trace(path):
+        if kind != 'pc':
+            continue
+        steps += 1
+        covered.add(pc)
+        if prev is None:
+            start = pc
+        elif pc - prev not in (2, 4):
+            blocks[(start, prev)] += 1
+            if pc <= prev:
+                backedges[(prev, pc)] += 1
+            start = pc
+        prev = pc
+    if prev is not None:
+        blocks[(start, prev)] += 1
+    return steps, covered, blocks, backedges
+
+def _location(addr, symbols):
+    """
+    Format addr, together with the function name if known
+    """
+    name = symbols.function_at(addr) if symbols else None
+    return "0x{:X}".format(addr) + (" <{}>".format(name) if name else "")
+
+def report(path, symbols=None, top=10):
+    """
+    Returns a text report about coverage and hot loops of the trace in path
+    """
+    steps, covered, blocks, backedges = analyze(path)
+    lines = ["Instructions traced:   {}".format(steps),
+             "Distinct addresses:    {}".format(len(covered)),
+             "Basic blocks:          {}".format(len(blocks))]
+    if symbols:
+        functions = {symbols.function_at(addr) for addr in covered} - {None}
+        lines.append("Functions executed:    {}".format(len(functions)))
+    lines.append("")
+    lines.append("Most executed basic blocks:")
+    for (start, end), count in blocks.most_common(top):
+        lines.append("{:10d}  {} - 0x{:X}".format(count, _location(start, symbols), end))
+    lines.append("")
+    lines.append("Hot loops (back edges):")
+    for (frm, to), count in backedges.most_common(top):
+        lines.append("{:10d}  {} -> {}".format(count, _location(frm, symbols),
+                                                   _location(to, symbols)))
+    return "\n".join(lines)
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(prog="python -m pyavrocd.tracetool",
+                                         description="Analyze a trace recorded by PyAvrOCD")
+    parser.add_argument("trace", help="trace file written by 'monitor trace start'")
+    parser.add_argument("-e", "--elf", help="ELF file for symbolizing addresses")
+    parser.add_argument("-t", "--top", type=int, default=10,
+                            help="number of blocks and loops to show (default: 10)")
+    args = parser.parse_args(argv)
+    try:
+        symbols = ElfSymbols(args.elf) if args.elf else None
+        print(report(args.trace, symbols, args.top))
+    except (ElfError, OSError, ValueError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+This module implements the execution history for reverse execution.
+"""
+
+# args, logging
+from logging import getLogger
+
+# ring buffer of the undo log
+from collections import deque
+
+# opcode decoding
+from pyavrocd.opcodes import is_y_reg, extract_displacement, push_instr, callx_instr
+
+class UndoRecord():
+    """
+    What is needed to undo one instruction: PC (byte address), SREG, and SP before
+    the instruction, the old values of the registers it changed (number -> value),
+    and the old contents of the SRAM it stored into (list of (address, bytes)).
+    """
+    __slots__ = ('pc', 'sreg', 'sp', 'regs', 'mem', '_before')
+
+    def __init__(self, pc, sreg, sp, before, mem):
+        self.pc = pc
+        self.sreg = sreg
+        self.sp = sp
+        self.regs = {}
+        self.mem = mem
+        self._before = before # register file before the instruction, dropped by finish
+
+    def finish(self, after):
+        """
+        Keep only the registers that differ from the register file after the instruction
+        """
+        self.regs = { num: old for num, (old, new) in enumerate(zip(self._before, after))
+                          if old != new }
+        self._before = None
+
+class UndoLog():
+    """
+    A bounded ring buffer of undo records for reverse execution. Before an instruction
+    is single-stepped, record reads PC, SREG, SP, the register file, and the SRAM bytes
+    that the instruction will store into, as determined by decoding the opcode. After the
+    step, commit compares the register file with the old one so that only changed registers
+    are kept. undo writes the values of the most recent record back to the MCU.
+    """
+
+    def __init__(self, dbg, sram_start, big_flash=False, depth=None):
+        self.dbg = dbg
+        self.logger = getLogger('pyavrocd.undolog')
+        self._sram_start = sram_start
+        self._retsize = 3 if big_flash else 2 # size of return addresses on the stack
+        self._log = deque(maxlen=depth)
+
+    def __len__(self):
+        return len(self._log)
+
+    def clear(self):
+        """
+        Forget the recorded history
+        """
+        if self._log:
+            self.logger.debug("Execution history of %d instructions discarded", len(self._log))
+            self._log.clear()
+
+    def resize(self, depth):
+        """
+        Set the maximal number of records, dropping the oldest ones if necessary
+        """
+        if self._log.maxlen != depth:
+            self._log = deque(self._log, maxlen=depth)
+
+    def record(self, pc, read_word, interrupts=False):
+        """
+        Read the state needed to undo the instruction at pc (byte address). read_word
+        returns the flash word at a byte address. If interrupts is True, an interrupt
+        can be taken during the step, so that the return address might be pushed.
+        Returns the record that has to be passed to commit after the step.
+        """
+        regs = bytearray(self.dbg.register_file_read())
+        sreg = self.dbg.status_register_read()[0]
+        sp = int.from_bytes(self.dbg.stack_pointer_read(), byteorder='little')
+        opcode = read_word(pc)
+        mem = []
+        for addr, size in self._stored_locations(opcode, pc, read_word, regs, sp, interrupts=interrupts):
+            if addr >= self._sram_start:
+                mem.append((addr, bytes(self.dbg.sram_read(addr, size))))
+        return UndoRecord(pc, sreg, sp, regs, mem)
+
+    def commit(self, rec):
+        """
+        Complete the record after the instruction has been executed and add it to the log
+        """
+        rec.finish(self.dbg.register_file_read())
+        self._log.append(rec)
+
+    def _stored_locations(self, opcode, pc, read_word, regs, sp, *, interrupts):
+        """
+        Returns a list of (address, size) of SRAM locations the instruction will store into
+        """
+        if push_instr(opcode) or callx_instr(opcode) or interrupts:
+            stack = [(sp - self._retsize + 1, self._retsize)]
+        else:
+            stack = []
+        if (opcode & 0xFE0F) == 0x9200: # STS
+            return stack + [(read_word(pc + 2), 1)]
+        if (opcode & 0xFE00) == 0x9200 and opcode & 0x000F in range(1, 15) and \
+          opcode & 0x000F not in (3, 8, 11): # ST -Z/Z+, XCH, LAS, LAC, LAT, ST -Y/Y+, ST X/X+/-X
+            index = { 0: 30, 1: 30, 2: 28, 3: 26 }[(opcode & 0x000C) >> 2]
+            addr = int.from_bytes(regs[index:index+2], byteorder='little')
+            if opcode & 0x000F in (2, 10, 14): # pre-decrement
+                addr -= 1
+            return stack + [(addr & 0xFFFF, 1)]
+        if (opcode & 0xD200) == 0x8200: # STD Y+q, STD Z+q
+            index = 28 if is_y_reg(opcode) else 30
+            addr = int.from_bytes(regs[index:index+2], byteorder='little') + \
+              extract_displacement(opcode)
+            return stack + [(addr & 0xFFFF, 1)]
+        return stack
+
+    def undo(self):
+        """
+        Restore the state before the most recently recorded instruction. Returns
+        the PC (byte address) of this instruction or None if the log is empty.
+        """
+        if not self._log:
+            return None
+        rec = self._log.pop()
+        for addr, data in reversed(rec.mem):
+            self.dbg.sram_write(addr, data)
+        if rec.regs:
+            regs = bytearray(self.dbg.register_file_read())
+            for num, value in rec.regs.items():
+                regs[num] = value
+            self.dbg.register_file_write(regs)
+        self.dbg.status_register_write(bytearray([rec.sreg]))
+        self.dbg.stack_pointer_write(rec.sp.to_bytes(2, byteorder='little'))
+        self.dbg.program_counter_write(rec.pc >> 1)
+        return rec.pc
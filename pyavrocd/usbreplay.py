@@ -0,0 +1,276 @@
+"""
+This module implements a shim around the HID transport that records the USB traffic of a
+session with a hardware debugger and serves it back later without hardware.
+"""
+
+# args, logging
+from logging import getLogger
+import struct
+import time
+
+from pyavrocd.errors import ReplayError
+
+MAGIC = b'AVRUSB\x01\x00'
+RECORD = '<BddH' # kind, start time, duration, length of the sent data
+
+# kinds of records
+TRANSFER = 0
+WRITE = 1
+READ = 2
+
+# CMSIS-DAP vendor commands used for wrapping the AVR commands (see pyedbglib.protocols.avrcmsisdap)
+AVR_COMMAND = 0x80
+AVR_RESPONSE = 0x81
+AVR_EVENT = 0x82
+JTAGICE3_TOKEN = 0x0E
+
+def _key(data):
+    """
+    The part of a HID packet that has to match in replay: the JTAGICE3 sequence number
+    in the first fragment of an AVR command depends on the number of earlier commands and is masked.
+    """
+    key = bytes(data)
+    if len(key) >= 8 and key[0] == AVR_COMMAND and key[1] >> 4 == 1 and key[4] == JTAGICE3_TOKEN:
+        key = key[:6] + b'\x00\x00' + key[8:]
+    return key
+
+def _is_timing(sent, received):
+    """
+    Returns True for transfers whose number depends on the wall clock: event polls
+    without an event and response polls before the response is ready.
+    """
+    if not sent:
+        return False
+    if sent[0] == AVR_EVENT:
+        return len(received) < 3 or (received[1] << 8 | received[2]) == 0
+    if sent[0] == AVR_RESPONSE:
+        return len(received) < 2 or received[1] == 0
+    return False
+
+def write_header(recfile, report_size, product, serial):
+    """
+    Write the file header with the properties of the recorded tool
+    """
+    recfile.write(MAGIC + struct.pack('<H', report_size))
+    for text in (product, serial):
+        data = (text or "").encode('utf-8')
+        recfile.write(struct.pack('<H', len(data)) + data)
+
+def read_recording(path):
+    """
+    Read a recording. Returns the header as a tuple (report size, product, serial)
+    and the list of records (kind, start, duration, sent, received).
+    Raises ValueError if the file is not a recording.
+    """
+    with open(path, 'rb') as recfile:
+        data = recfile.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a USB recording")
+    try:
+        pos = len(MAGIC)
+        report_size = struct.unpack_from('<H', data, pos)[0]
+        pos += 2
+        texts = []
+        for _ in range(2):
+            size = struct.unpack_from('<H', data, pos)[0]
+            texts.append(data[pos+2:pos+2+size].decode('utf-8'))
+            pos += 2 + size
+        records = []
+        while pos < len(data):
+            kind, start, duration, size = struct.unpack_from(RECORD, data, pos)
+            pos += struct.calcsize(RECORD)
+            sent = data[pos:pos+size]
+            pos += size
+            size = struct.unpack_from('<H', data, pos)[0]
+            received = data[pos+2:pos+2+size]
+            pos += 2 + size
+            if len(received) != size:
+                raise ValueError("Truncated USB recording")
+            records.append((kind, start, duration, sent, received))
+    except struct.error as e:
+        raise ValueError("Truncated USB recording") from e
+    return (report_size, texts[0], texts[1]), records
+
+class RecordingTransport():
+    """
+    Wraps a connected HID transport and writes every HID transfer, write, and read
+    together with its start time and duration to a file. All other attributes are
+    those of the wrapped transport.
+    """
+    def __init__(self, transport, path):
+        self.logger = getLogger('pyavrocd.usbreplay')
+        self._transport = transport
+        self._file = open(path, 'wb') #pylint: disable=consider-using-with
+        write_header(self._file, transport.get_report_size(), transport.device.product_string,
+                         transport.device.serial_number)
+        self._start = time.monotonic()
+        self.records = 0
+        self.logger.info("Recording USB traffic to %s", path)
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+    def _record(self, kind, sent, received, start):
+        now = time.monotonic()
+        self._file.write(struct.pack(RECORD, kind, start - self._start, now - start, len(sent)) +
+                             bytes(sent) + struct.pack('<H', len(received)) + bytes(received))
+        self.records += 1
+
+    def hid_transfer(self, data_send):
+        """
+        Send HID data and receive the response
+        """
+        start = time.monotonic()
+        response = self._transport.hid_transfer(data_send)
+        self._record(TRANSFER, data_send, response, start)
+        return response
+
+    def hid_write(self, data_send):
+        """
+        Send HID data
+        """
+        start = time.monotonic()
+        result = self._transport.hid_write(data_send)
+        self._record(WRITE, data_send, b'', start)
+        return result
+
+    def hid_read(self):
+        """
+        Read HID data
+        """
+        start = time.monotonic()
+        response = self._transport.hid_read()
+        self._record(READ, b'', response, start)
+        return response
+
+    def close(self):
+        """
+        Finish the recording
+        """
+        if not self._file.closed:
+            self._file.close()
+            self.logger.info("%d USB transfers recorded", self.records)
+
+class _ReplayDevice(): #pylint: disable=too-few-public-methods
+    """
+    The properties of the recorded tool
+    """
+    def __init__(self, report_size, product, serial):
+        self.packet_size = report_size
+        self.product_string = product
+        self.serial_number = serial
+
+class ReplayTransport():
+    """
+    Stands in for a connected HID transport and serves the responses of a recording.
+    The sent data is matched against the recorded data in order, ignoring JTAGICE3
+    sequence numbers. Recorded transfers that the server does not issue any longer are
+    skipped, so that a changed command sequence can be replayed as long as it is a
+    subsequence of the recorded one. Event polls are answered with 'no event' unless a
+    recorded event is next, and wall-clock-dependent polls in the recording are skipped
+    silently. A transfer that cannot be matched raises ReplayError.
+    """
+    def __init__(self, path):
+        self.logger = getLogger('pyavrocd.usbreplay')
+        header, self._records = read_recording(path)
+        self.device = _ReplayDevice(*header)
+        self.devices = [self.device]
+        self.hid_device = self.device
+        self.connected = True
+        self._pos = 0
+        self._seq = b'\x00\x00' # sequence number of the last AVR command
+        self.transactions = 0 # transfers served
+        self.skipped = 0 # recorded transfers not issued by the server
+        self.recorded_time = 0.0 # recorded duration of the transfers served
+        self.logger.info("Replaying %d USB transfers from %s", len(self._records), path)
+
+    def get_report_size(self):
+        """
+        Returns the HID report size of the recorded tool
+        """
+        return self.device.packet_size
+
+    def connect(self, serial_number=None, product=None):
+        """
+        There is nothing to connect to
+        """
+        _dummy = (serial_number, product)
+        return True
+
+    def disconnect(self):
+        """
+        There is nothing to disconnect from
+        """
+        self.connected = False
+
+    def _skip_timing(self):
+        while self._pos < len(self._records) and _is_timing(*self._records[self._pos][3:5]):
+            self._pos += 1
+
+    def _serve(self, kind, sent):
+        """
+        Find the next recorded transfer of kind that matches sent and return its response
+        """
+        if kind == TRANSFER and sent and sent[0] == AVR_EVENT:
+            self._skip_timing()
+            rec = self._records[self._pos] if self._pos < len(self._records) else None
+            if rec is None or rec[0] != TRANSFER or not rec[3] or rec[3][0] != AVR_EVENT:
+                return bytearray([AVR_EVENT, 0, 0])
+            return self._consume(self._pos)
+        self._skip_timing()
+        key = _key(sent)
+        for ix in range(self._pos, len(self._records)):
+            rec = self._records[ix]
+            if rec[0] == kind and _key(rec[3]) == key:
+                if kind == TRANSFER and key[:1] == bytes([AVR_COMMAND]) and key[1] >> 4 == 1:
+                    self._seq = bytes(sent[6:8])
+                self.skipped += sum(1 for r in self._records[self._pos:ix] if not _is_timing(*r[3:5]))
+                return self._consume(ix)
+        raise ReplayError("Transfer {} not found in the recording".format(bytes(sent[:16]).hex()))
+
+    def _consume(self, ix):
+        _kind, _start, duration, _sent, received = self._records[ix]
+        self._pos = ix + 1
+        self.transactions += 1
+        self.recorded_time += duration
+        response = bytearray(received)
+        if len(response) >= 7 and response[0] == AVR_RESPONSE and response[4] == JTAGICE3_TOKEN:
+            # the response echoes the sequence number big endian
+            response[5:7] = bytes([self._seq[1], self._seq[0]])
+        return response
+
+    def hid_transfer(self, data_send):
+        """
+        Returns the recorded response to data_send
+        """
+        return self._serve(TRANSFER, bytes(data_send))
+
+    def hid_write(self, data_send):
+        """
+        Accepts data_send if it matches the recording
+        """
+        self._serve(WRITE, bytes(data_send))
+        return len(data_send)
+
+    def hid_read(self):
+        """
+        Returns the next recorded data read
+        """
+        return self._serve(READ, b'')
+
+    def statistics(self):
+        """
+        Returns the counters of the replay as a dict
+        """
+        return { 'transactions': self.transactions, 'skipped': self.skipped,
+                     'remaining': sum(1 for r in self._records[self._pos:] if not _is_timing(*r[3:5])),
+                     'recorded_time': self.recorded_time }
+
+    def close(self):
+        """
+        Log a summary of the replay
+        """
+        stats = self.statistics()
+        self.logger.info("USB replay: %d transfers served, %d skipped, %d remaining, %.3f s recorded",
+                             stats['transactions'], stats['skipped'], stats['remaining'],
+                             stats['recorded_time'])
@@ -0,0 +1,186 @@
+"""
+This module manages the watchpoints set by GDB.
+"""
+
+# args, logging
+from logging import getLogger
+
+# opcode decoding
+from pyavrocd.opcodes import BREAKCODE, SLEEPCODE, branch_instr, store_instr, two_word_instr
+
+# modes of data breakpoints
+from pyavrocd.xavr8target import HWBP_DATA_READ, HWBP_DATA_WRITE, HWBP_DATA_ACCESS
+
+# allocation of breakpoints
+from pyavrocd.bptable import UNALLOCATED
+
+# watchpoint types of Z/z packets: data breakpoint modes and names in stop replies
+WATCHMODE = { 2 : HWBP_DATA_WRITE, 3 : HWBP_DATA_READ, 4 : HWBP_DATA_ACCESS }
+WATCHNAME = { 2 : 'watch', 3 : 'rwatch', 4 : 'awatch' }
+
+class Watchpoints():
+    """
+    This class keeps the watchpoints as a dict that maps (type, addr) to the length and the
+    last known value of the watched bytes. If the OCD has data breakpoints, one of them is used
+    per watched byte. Otherwise (debugWIRE), write watchpoints are software watchpoints:
+    BreakAndExec runs to the next instruction that can store something (see next_stop),
+    single-steps it, and checks whether one of the watched values has changed.
+    """
+
+    def __init__(self, mon, dbg, read_word, flash_size):
+        self.mon = mon
+        self.dbg = dbg
+        self.logger = getLogger('pyavrocd.watchpoints')
+        self._read_word = read_word # reads a flash word with breakpoints filtered out
+        self._flash_size = flash_size
+        self._wp = {} # watchpoints: (type, addr) -> length and last known value
+        self._next = {} # software watchpoints: next instruction that can store
+        self._io = False # software watchpoints: I/O registers are watched
+
+    def __len__(self):
+        return len(self._wp)
+
+    def clear(self):
+        """
+        Forget all watchpoints
+        """
+        self._wp = {}
+        self._next = {}
+        self._io = False
+
+    def insert(self, kind, address, length, hwbp, bps):
+        """
+        Set a watchpoint of the given kind (2=write, 3=read, 4=access) for length bytes
+        starting at address in GDB's address space, using one data breakpoint
+        comparator of the OCD per byte (managed by hwbp). Code breakpoints occupying a
+        comparator are turned into software breakpoints in the breakpoint table bps,
+        because watchpoints cannot be implemented in another way on the server side.
+        Returns None if the watchpoint cannot be handled by the server (so that GDB uses
+        its own software watchpoints), False if there are not enough free data breakpoints,
+        and True if successful.
+        If there are no data breakpoints at all (debugWIRE), write watchpoints are implemented
+        as software watchpoints on the server side.
+        """
+        if not hwbp.data_comparators():
+            return self._insert_software(kind, address, length)
+        if kind not in WATCHMODE or length < 1 or \
+          address < 0x800000 or address + length > 0x810000:
+            self.logger.error("Cannot watch %d byte(s) at 0x%X", length, address)
+            return False
+        if (kind, address) in self._wp:
+            self.logger.debug("Watchpoint at 0x%X already set", address)
+            return True
+        sramaddr = address - 0x800000
+        for offset in range(length):
+            ix, reassign = hwbp.set_data(sramaddr + offset, WATCHMODE[kind],
+                                             evict=not self.mon.is_onlyhwbps())
+            if reassign is not None and reassign in bps:
+                self.logger.debug("BP at 0x%X lost its HWBP to a watchpoint", reassign)
+                bps.set_state(reassign, allocated=UNALLOCATED)
+            if ix is None:
+                self.logger.debug("Not enough data breakpoints for watchpoint at 0x%X", address)
+                for done in range(offset):
+                    hwbp.clear_data(sramaddr + done, WATCHMODE[kind])
+                return False
+        self._wp[(kind, address)] = { 'length' : length,
+                                          'value' : self.dbg.sram_read(sramaddr, length) }
+        self.logger.debug("Watchpoint of type %d set at 0x%X for %d byte(s)",
+                              kind, address, length)
+        return True
+
+    def _insert_software(self, kind, address, length):
+        """
+        Set a software watchpoint, which is only possible for write watchpoints
+        on SRAM and I/O addresses. Returns None if impossible, True otherwise.
+        """
+        if kind != 2 or self.mon.is_old_exec() or self.mon.is_onlyhwbps() or length < 1 or \
+          address < 0x800020 or address + length > 0x810000:
+            self.logger.debug("Software watchpoint of type %d at 0x%X not possible",
+                                  kind, address)
+            return None
+        if address < 0x800060 and not self._io: # OUT, SBI, CBI need to be considered
+            self._io = True
+            self._next = {}
+        self._wp[(kind, address)] = { 'length' : length,
+                                          'value' : self.dbg.sram_read(address - 0x800000, length) }
+        self.logger.debug("Software watchpoint set at 0x%X for %d byte(s)", address, length)
+        return True
+
+    def remove(self, kind, address, length, hwbp):
+        """
+        Remove the watchpoint of the given kind at address. Returns None if
+        the watchpoint could not have been set by insert, otherwise True.
+        """
+        entry = self._wp.pop((kind, address), None)
+        if entry is None:
+            self.logger.debug("There is no watchpoint of type %d at 0x%X", kind, address)
+            return None if not hwbp.data_comparators() and kind != 2 else True
+        if not hwbp.data_comparators():
+            self.logger.debug("Software watchpoint at 0x%X removed", address)
+            return True
+        for offset in range(entry['length']):
+            hwbp.clear_data(address - 0x800000 + offset, WATCHMODE[kind])
+        self.logger.debug("Watchpoint of type %d at 0x%X (%d byte(s)) removed",
+                              kind, address, length)
+        return True
+
+    def refresh(self):
+        """
+        Read the current values of the watched bytes of write watchpoints
+        (GDB may have changed them while execution was stopped)
+        """
+        for (kind, address), entry in self._wp.items():
+            if kind == 2:
+                entry['value'] = self.dbg.sram_read(address - 0x800000, entry['length'])
+
+    def triggered(self, changed_only=False):
+        """
+        Find out which watchpoint has most probably been triggered, and return the
+        corresponding stop reason. Since the OCD does not tell us which data breakpoint
+        has fired, we prefer write watchpoints whose value has changed, then read and access
+        watchpoints, and finally write watchpoints where the same value has been written.
+        If changed_only is True, only write watchpoints with changed values are considered.
+        """
+        changed = []
+        accessed = []
+        written = []
+        for (kind, address), entry in self._wp.items():
+            if kind == 2:
+                value = self.dbg.sram_read(address - 0x800000, entry['length'])
+                if value != entry['value']:
+                    changed.append((kind, address))
+                    entry['value'] = value
+                else:
+                    written.append((kind, address))
+            else:
+                accessed.append((kind, address))
+        if changed_only:
+            accessed = written = []
+        for kind, address in changed + accessed + written:
+            self.logger.debug("Stop caused by %s at 0x%X", WATCHNAME[kind], address)
+            return "{}:{:X};".format(WATCHNAME[kind], address)
+        return ""
+
+    def is_store(self, opcode):
+        """
+        Returns True if the instruction can change a value watched by a software watchpoint
+        """
+        return store_instr(opcode, self._io)
+
+    def next_stop(self, addr):
+        """
+        Returns the address of the first instruction starting at addr that can store into
+        SRAM or that might change the control flow. The result is determined by a static
+        analysis of the flash contents and is cached.
+        """
+        if addr in self._next:
+            return self._next[addr]
+        start = addr
+        while addr < self._flash_size:
+            opcode = self._read_word(addr)
+            if self.is_store(opcode) or branch_instr(opcode) or \
+              opcode in { BREAKCODE, SLEEPCODE }:
+                break
+            addr += 2 + 2*two_word_instr(opcode)
+        self._next[start] = addr
+        return addr
@@ -13,12 +13,20 @@ from pymcuprog.deviceinfo.deviceinfokeys import DeviceInfoKeysAvr, DeviceMemoryI
 from pymcuprog.avr8target import TinyXAvrTarget, TinyAvrTarget,\
      MegaAvrJtagTarget, XmegaAvrTarget, AvrDevice
 
+# modes of data breakpoints (watchpoints) in the HW_BREAK_SET command
+HWBP_DATA_READ = 0
+HWBP_DATA_WRITE = 1
+HWBP_DATA_ACCESS = 2
+
+# number of hardware breakpoints (including the one used by run_to) of the debugging interfaces
+HWBPNUM = { 'debugwire' : 1, 'updi' : 2, 'jtag' : 4 }
 
 
 class XTinyXAvrTarget(TinyXAvrTarget):
     """
     Class handling sessions with TinyX AVR targets using the AVR8 generic protocol
     """
+    DATA_COMPARATORS = 1 # hardware breakpoints that can be used as data breakpoints
     def __init__(self, transport):
         super().__init__(transport)
         self.logger_loc = getLogger('pyavrocd.tinyxtarget')
@@ -101,11 +109,32 @@ class XTinyXAvrTarget(TinyXAvrTarget):
         return self.protocol.check_response(resp)
 
 
+    def hardware_watchpoint_set(self, num, address, mode):
+        """
+        Sets hardware breakpoint <num> as a data breakpoint
+
+        :param num: number of breakpoint (only 1)
+        :param address: SRAM address to watch
+        :type address: int
+        :param mode: HWBP_DATA_READ, HWBP_DATA_WRITE, or HWBP_DATA_ACCESS
+        :type mode: int
+        """
+        if num < 1 or num > 1:
+            self.logger.error("Tried to set hardware watchpoint %d at 0x%X on UPDI target",
+                                num, address)
+            return 0
+        resp = self.protocol.jtagice3_command_response(
+            bytearray([Avr8Protocol.CMD_AVR8_HW_BREAK_SET, Avr8Protocol.CMD_VERSION0, 2, num]) +
+            binary.pack_le32(address) +
+            bytearray([mode]))
+        return self.protocol.check_response(resp)
+
 
 class XTinyAvrTarget(TinyAvrTarget):
     """
     Implements Tiny AVR (debugWIRE) functionality of the AVR8 protocol
     """
+    DATA_COMPARATORS = 0 # hardware breakpoints that can be used as data breakpoints
 
     def __init__(self, transport):
         super().__init__(transport)
@@ -323,6 +352,21 @@ class XTinyAvrTarget(TinyAvrTarget):
         return 0
 
 
+    def hardware_watchpoint_set(self, num, address, mode):
+        """
+        Sets hardware breakpoint <num> as a data breakpoint, which is impossible on debugWIRE
+
+        :param num: number of breakpoint
+        :param address: SRAM address to watch
+        :type address: int
+        :param mode: HWBP_DATA_READ, HWBP_DATA_WRITE, or HWBP_DATA_ACCESS
+        :type mode: int
+        """
+        self.logger.error("Tried to set hardware watchpoint %d at 0x%X (mode %d) on debugWIRE target",
+                              num, address, mode)
+        return 0
+
+
     def breakpoint_clear(self):
         """
         Is needed in stop_debugging - should not be there!
@@ -334,6 +378,7 @@ class XMegaAvrJtagTarget(MegaAvrJtagTarget):
     """
     Implements Mega AVR (JTAG) functionality of the AVR8 protocol
     """
+    DATA_COMPARATORS = 2 # hardware breakpoints that can be used as data breakpoints (PDMSB and PDSB)
 
     def __init__(self, transport):
         super().__init__(transport)
@@ -581,6 +626,26 @@ class XMegaAvrJtagTarget(MegaAvrJtagTarget):
             bytearray([Avr8Protocol.CMD_AVR8_HW_BREAK_CLEAR, Avr8Protocol.CMD_VERSION0, num]))
         return self.protocol.check_response(resp)
 
+    def hardware_watchpoint_set(self, num, address, mode):
+        """
+        Sets hardware breakpoint <num> as a data breakpoint
+
+        :param num: number of breakpoint 1-3
+        :param address: SRAM address to watch
+        :type address: int
+        :param mode: HWBP_DATA_READ, HWBP_DATA_WRITE, or HWBP_DATA_ACCESS
+        :type mode: int
+        """
+        if num < 1 or num > 3:
+            self.logger.error("Tried to set hardware watchpoint %d at 0x%X on JTAG target",
+                                num, address)
+            return 0
+        resp = self.protocol.jtagice3_command_response(
+            bytearray([Avr8Protocol.CMD_AVR8_HW_BREAK_SET, Avr8Protocol.CMD_VERSION0, 2, num]) +
+            binary.pack_le32(address) +
+            bytearray([mode]))
+        return self.protocol.check_response(resp)
+
     def breakpoint_clear(self):
         """
         Is needed in stop_debugging and will clear all hardware breakpoints
@@ -594,6 +659,7 @@ class XXmegaAvrTarget(XmegaAvrTarget):
     """
     Implements XMEGA (PDI) functionality of the AVR8 protocol
     """
+    DATA_COMPARATORS = 0 # hardware breakpoints that can be used as data breakpoints
 
     def __init__(self, transport):
         super().__init__(transport)
@@ -11,6 +11,7 @@ from pyedbglib.protocols.avr8protocol import Avr8Protocol
 from pyedbglib.protocols.avrispprotocol import AvrIspProtocol #pylint: disable=unused-import
 from pyedbglib.protocols.edbgprotocol import EdbgProtocol
 from pyedbglib.protocols import housekeepingprotocol
+from pyedbglib.util import binary
 
 # pymcuorig library
 from pymcuprog.avrdebugger import AvrDebugger
@@ -27,7 +28,7 @@ from pyavrocd.xnvmupdi import XNvmAccessProviderCmsisDapUpdi
 from pyavrocd.errors import FatalError
 from pyavrocd.deviceinfo.devices.alldevices import dev_name
 
-class XAvrDebugger(AvrDebugger):
+class XAvrDebugger(AvrDebugger): #pylint: disable=too-many-public-methods
     """
     AVR debugger wrapper
 
@@ -87,6 +88,8 @@ class XAvrDebugger(AvrDebugger):
         elif self.iface == "jtag" and self.architecture =="avr8":
             self.device = XNvmAccessProviderCmsisDapMegaAvrJtag(self.transport, self.device_info, manage=manage)
         self.logger.debug("Nvm instance created")
+        # number of hardware breakpoints that can be used as data breakpoints
+        self.data_comparators = self.device.avr.DATA_COMPARATORS if self.device else 0
 
 
     def start_debugging(self, flash_data=None, warmstart=False):
@@ -610,6 +613,37 @@ class XAvrDebugger(AvrDebugger):
             return False
         return True
 
+    def software_breakpoints_set(self, addresses):
+        """
+        Sets software breakpoints at all given addresses with just one command,
+        so that the hardware debugger can reprogram a flash page only once.
+        Catches exceptions.
+        """
+        return self._software_breakpoints_command(Avr8Protocol.CMD_AVR8_SW_BREAK_SET, addresses)
+
+    def software_breakpoints_clear(self, addresses):
+        """
+        Clears the software breakpoints at all given addresses with just one command.
+        Catches exceptions.
+        """
+        return self._software_breakpoints_command(Avr8Protocol.CMD_AVR8_SW_BREAK_CLEAR, addresses)
+
+    def _software_breakpoints_command(self, command, addresses):
+        """
+        Sends the SW_BREAK_SET or SW_BREAK_CLEAR command with a list of addresses
+        """
+        self.logger.debug("Sending SWBP command 0x%X for %s", command,
+                              [hex(a) for a in addresses])
+        protocol = self.device.avr.protocol
+        try:
+            protocol.check_response(protocol.jtagice3_command_response(
+                bytearray([command, Avr8Protocol.CMD_VERSION0]) +
+                b''.join([binary.pack_le32(a) for a in addresses])))
+        except Exception as e:
+            self.logger.error("Could not set or clear software breakpoints: %s", str(e))
+            return False
+        return True
+
     #pylint: disable=arguments-differ
     #we actually need two arguments when more than one HWBP is there
     def hardware_breakpoint_set(self, ix, address):
@@ -618,6 +652,13 @@ class XAvrDebugger(AvrDebugger):
         """
         return self.device.avr.hardware_breakpoint_set(ix, address)
 
+    def hardware_watchpoint_set(self, ix, address, mode):
+        """
+        Use the ix-th hardware breakpoint as a data breakpoint for the SRAM address
+        (read, write, or access mode as defined in xavr8target)
+        """
+        return self.device.avr.hardware_watchpoint_set(ix, address, mode)
+
     #pylint: disable=arguments-differ
     #we actually need the extra argument when more than one HWBP is there
     def hardware_breakpoint_clear(self, ix):
@@ -0,0 +1,297 @@
+"""
+Common infrastructure for the benchmarks: a GdbHandler driven over a TCP loopback
+connection by a minimal RSP client, with a simulated or replayed probe below it.
+"""
+#pylint: disable=consider-using-f-string
+import importlib.metadata
+import json
+import glob
+import os
+import random
+import socket
+import struct
+import time
+
+from pyavrocd.main import options
+from pyavrocd.handler import GdbHandler
+from pyavrocd.simulator import SimDebugger
+from pyavrocd.usbreplay import ReplayTransport
+from pyavrocd.xavrdebugger import XAvrDebugger
+from pyavrocd.elfsymbols import DATA_OFFSET
+from pyavrocd.deviceinfo.devices.alldevices import dev_id, dev_iface
+
+PT_LOAD = 1
+
+def interface_of(device):
+    """
+    Returns the debugging interface of a device (the first one if there are several)
+    """
+    ifaces = dev_iface[dev_id[device]].lower().split('+')
+    return [x for x in ['debugwire', 'jtag', 'pdi', 'updi'] if x in ifaces][0]
+
+def flash_image(path):
+    """
+    Returns the flash contents of the loadable segments of an ELF file as a bytearray
+    """
+    with open(path, 'rb') as elffile:
+        data = elffile.read()
+    if data[:4] != b'\x7fELF' or data[4] != 1 or data[5] != 1:
+        raise ValueError("{} is not a 32-bit little-endian ELF file".format(path))
+    phoff, = struct.unpack_from('<I', data, 0x1C)
+    phentsize, phnum = struct.unpack_from('<HH', data, 0x2A)
+    image = bytearray()
+    for ix in range(phnum):
+        ptype, offset, _, paddr, filesz, _, _, _ = struct.unpack_from('<IIIIIIII', data,
+                                                                        phoff + ix*phentsize)
+        if ptype != PT_LOAD or paddr >= DATA_OFFSET or filesz == 0:
+            continue
+        if len(image) < paddr + filesz:
+            image.extend(b'\xFF'*(paddr + filesz - len(image)))
+        image[paddr:paddr+filesz] = data[offset:offset+filesz]
+    return image
+
+def synthetic_image(size, seed=0):
+    """
+    Returns a reproducible pseudo-random image of size bytes
+    """
+    rnd = random.Random(seed)
+    return bytearray(rnd.getrandbits(8) for _ in range(size))
+
+def sketch_images(paths, size):
+    """
+    Returns a list of (name, image) pairs for the ELF files in paths, or the ELF
+    files below tests/sketches if paths is empty, or a synthetic image of size
+    bytes if there are none.
+    """
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'sketches', '**', '*.elf'),
+                                     recursive=True))
+    if not paths:
+        return [("synthetic-{}".format(size), synthetic_image(size))]
+    return [(os.path.basename(path), flash_image(path)) for path in paths]
+
+def escape(data):
+    """
+    Escape binary data for an RSP packet
+    """
+    return GdbHandler.escape(data)
+
+def chunks(image, packet_size, header_size):
+    """
+    Split the image into (address, data) pieces that fit into RSP packets
+    of packet_size bytes after escaping, as GDB does
+    """
+    addr = 0
+    while addr < len(image):
+        size = 0
+        escaped = 0
+        while addr + size < len(image):
+            extra = 2 if image[addr+size] in b'#$}*' else 1
+            if header_size + escaped + extra > packet_size:
+                break
+            escaped += extra
+            size += 1
+        yield addr, image[addr:addr+size]
+        addr += size
+
+def load(session, image, protocol):
+    """
+    Send the image as GDB's load command does, either with vFlash packets or with X-records
+    """
+    if protocol == 'vflash':
+        session.expect('vFlashErase:0,{:x}'.format(len(image)))
+        for addr, data in chunks(image, session.packet_size, len('vFlashWrite:ffffff:') + 4):
+            session.expect('vFlashWrite:{:x}:'.format(addr).encode('ascii') + escape(data))
+        session.expect('vFlashDone')
+    else:
+        for addr, data in chunks(image, session.packet_size, len('Xffffff,ffff:') + 4):
+            session.expect('X{:x},{:x}:'.format(addr, len(data)).encode('ascii') + escape(data))
+        # the server finishes loading X-records when no further packet arrives
+        session.poll()
+
+class LoopbackSession():
+    """
+    A GdbHandler connected to a minimal RSP client via a TCP loopback connection.
+    Each request is handled synchronously, and the replies are collected.
+    """
+    def __init__(self, dbg, device, argv=()):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        self.client = socket.create_connection(listener.getsockname())
+        self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server, _ = listener.accept()
+        listener.close()
+        self.dbg = dbg
+        self.handler = GdbHandler(self.server, dbg, device, options(['-d', device] + list(argv)))
+        self.packets = 0
+        self.packet_size = None
+
+    def close(self):
+        """
+        Close the connection
+        """
+        self.client.close()
+        self.server.close()
+
+    def _deliver(self, frame):
+        self.client.sendall(frame)
+        data = b''
+        while b'#' not in data or len(data) < data.index(b'#') + 3:
+            data += self.server.recv(65536)
+        self.handler.handle_data(data)
+
+    def _replies(self, wait=True):
+        """
+        Collect what the handler has sent, acknowledge the packets, and return the
+        payloads (without console output packets). If wait is True, wait for a reply.
+        """
+        data = b''
+        replies = []
+        while True:
+            self.client.setblocking(False)
+            try:
+                while True:
+                    data += self.client.recv(65536)
+            except BlockingIOError:
+                pass
+            finally:
+                self.client.setblocking(True)
+            data = data.lstrip(b'+-') # acknowledgments
+            while b'$' in data and b'#' in data[data.index(b'$'):] and \
+              len(data) >= data.index(b'#', data.index(b'$')) + 3:
+                start = data.index(b'$')
+                end = data.index(b'#', start)
+                payload = data[start+1:end]
+                data = data[end+3:]
+                self.handler.handle_data(b'+')
+                if not payload.startswith(b'O') or payload == b'OK':
+                    replies.append(payload)
+                data = data.lstrip(b'+-')
+            if (replies or not wait) and not data:
+                return replies
+            data += self.client.recv(65536)
+
+    def request(self, payload, wait=True):
+        """
+        Send one packet and return the last reply (or b'' if there was none)
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('ascii')
+        self._deliver(b'$' + payload + b'#' + ('%02x' % (sum(payload) & 0xFF)).encode('ascii'))
+        self.packets += 1
+        replies = self._replies(wait)
+        return replies[-1] if replies else b''
+
+    def resume(self, payload, timeout=10):
+        """
+        Send an execution packet and return the stop reply, polling for it as the server
+        loop does if execution continues after the packet has been handled
+        """
+        reply = self.request(payload, wait=False)
+        deadline = time.monotonic() + timeout
+        while reply[:1] not in (b'S', b'T'):
+            if time.monotonic() > deadline:
+                raise RuntimeError("No stop reply to {!r}".format(payload))
+            replies = self.poll()
+            reply = replies[-1] if replies else b''
+        return reply
+
+    def interrupt(self):
+        """
+        Send CTRL-C and return the stop reply
+        """
+        self.client.sendall(b'\x03')
+        self.handler.handle_data(self.server.recv(1))
+        replies = self._replies()
+        return replies[-1] if replies else b''
+
+    def poll(self):
+        """
+        What the server loop does when there was no packet: handle the timeout and poll events.
+        Returns the replies sent.
+        """
+        self.handler.handle_data(None)
+        self.handler.poll_events()
+        return self._replies(wait=False)
+
+    def connect(self):
+        """
+        Start the session as GDB does
+        """
+        reply = self.request('qSupported:multiprocess+;swbreak+;hwbreak+')
+        self.packet_size = int(reply.split(b'PacketSize=')[1].split(b';')[0], 16)
+        return reply
+
+    def monitor(self, command):
+        """
+        Execute a monitor command and return its output
+        """
+        reply = self.request('qRcmd,' + command.encode('ascii').hex())
+        return bytes.fromhex(reply.decode('ascii')).decode('utf-8') if reply not in (b'', b'OK') else ""
+
+    def expect(self, payload, reply=b'OK'):
+        """
+        Send a packet and raise a RuntimeError if the reply is not the expected one
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('ascii')
+        got = self.request(payload)
+        if got != reply:
+            raise RuntimeError("Unexpected reply {!r} to {!r}".format(got[:40], payload[:40]))
+
+def make_debugger(device, probe='none', replay=None):
+    """
+    Returns the debugger object: a simulator with the given probe model, or an
+    XAvrDebugger on top of a replayed USB recording
+    """
+    if replay:
+        return XAvrDebugger(ReplayTransport(replay), device, interface_of(device), [], 1000, 200)
+    return SimDebugger(device, interface_of(device), probe)
+
+def probe_counters(dbg):
+    """
+    Returns the probe time (simulated or recorded) and the number of probe transactions so far
+    """
+    if isinstance(dbg, SimDebugger):
+        return dbg.model.elapsed, dbg.model.transactions
+    stats = dbg.transport.statistics()
+    return stats['recorded_time'], stats['transactions']
+
+def server_version():
+    """
+    Returns the version of PyAvrOCD, or 'unknown' if it is not installed
+    """
+    try:
+        return importlib.metadata.version("pyavrocd")
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+def write_results(results, path=None):
+    """
+    Write the results as JSON to path or stdout
+    """
+    text = json.dumps(results, indent=1, sort_keys=True)
+    if path:
+        with open(path, 'w', encoding='utf-8') as outfile:
+            outfile.write(text + "\n")
+    else:
+        print(text)
+
+def compare_results(old_path, results, key_fields, value_fields):
+    """
+    Print the relative change of value_fields for the configurations
+    (identified by key_fields) that are in both the old results and the new ones
+    """
+    with open(old_path, encoding='utf-8') as oldfile:
+        old = { tuple(r[k] for k in key_fields): r for r in json.load(oldfile)['results'] }
+    for res in results['results']:
+        key = tuple(res[k] for k in key_fields)
+        if key not in old:
+            continue
+        changes = []
+        for field in value_fields:
+            before, after = old[key][field], res[field]
+            delta = (after - before)/before*100 if before else 0.0
+            changes.append("{} {:.4g} -> {:.4g} ({:+.1f}%)".format(field, before, after, delta))
+        print("{}: {}".format("/".join(str(k) for k in key), ", ".join(changes)))
@@ -0,0 +1,222 @@
+"""
+Interactive-latency benchmark: replays the RSP packet sequences of typical GDB commands
+(stepi, next over a loop, finish, backtrace, continue to a breakpoint, info registers)
+through GdbHandler against a simulated (or replayed) probe, and reports RSP packets,
+probe transactions, and latency percentiles per command pattern as JSON.
+
+Usage: python -m tests.latency_benchmark [-d <mcu>] [-p <probe>] [--pattern <name>] [-n <repetitions>]
+"""
+#pylint: disable=consider-using-f-string,too-many-locals,too-many-arguments,too-many-positional-arguments
+import argparse
+import logging
+import sys
+import time
+
+from pyavrocd.probemodel import PRESETS
+from pyavrocd.stats import percentile
+from tests.benchmark import LoopbackSession, make_debugger, probe_counters, interface_of, \
+     load, write_results, compare_results, server_version
+
+DW_PROBES = ['dwlink', 'snap', 'pickit4', 'atmelice', 'medbg']
+KEY_FIELDS = ('device', 'probe', 'pattern')
+
+# GDB register numbers
+SP_REG = 0x21
+PC_REG = 0x22
+DEPTH = 10 # depth of the recursion for the backtrace
+
+# The benchmark program (word addresses):
+#  0: ldi r24,DEPTH   main: recurse DEPTH levels deep
+#  1: rcall rec
+#  2: ldi r16,0
+#  3: ldi r17,50
+#  4: add r16,r17     LOOP: the body of a loop executed 50 times
+#  5: dec r17
+#  6: brne LOOP
+#  7: rjmp main
+#  8: dec r24         rec: r24 counts down
+#  9: breq BOTTOM
+# 10: rcall rec
+# 11: ret             BOTTOM
+PROGRAM = [0xE080 | ((DEPTH & 0xF0) << 4) | (DEPTH & 0x0F), 0xD000 | 6,
+               0xE000, 0xE312, 0x0F01, 0x951A, 0xF7E9, 0xC000 | (-8 & 0xFFF),
+               0x958A, 0xF009, 0xD000 | (-3 & 0xFFF), 0x9508]
+MAIN = 0
+AFTER_CALL = 4 # byte addresses
+LOOP = 8
+LOOP_END = 14
+REC = 16
+BOTTOM = 22
+
+def program_image():
+    """
+    Returns the benchmark program as a flash image
+    """
+    return b''.join(w.to_bytes(2, byteorder='little') for w in PROGRAM)
+
+def restart(session, sp, address=MAIN):
+    """
+    Set the SP and the PC (a byte address)
+    """
+    session.expect('P{:x}={}'.format(SP_REG, sp.to_bytes(2, byteorder='little').hex()))
+    session.expect('P{:x}={}'.format(PC_REG, address.to_bytes(4, byteorder='little').hex()))
+
+def run_to(session, address):
+    """
+    Continue to a breakpoint at address as GDB's tbreak plus continue does
+    """
+    session.expect('Z0,{:x},2'.format(address))
+    session.resume('vCont;c')
+    session.expect('z0,{:x},2'.format(address))
+
+def registers(session):
+    """
+    Read all registers and return SP and PC (as byte address)
+    """
+    regs = bytes.fromhex(session.request('g').decode('ascii'))
+    return int.from_bytes(regs[33:35], byteorder='little'), int.from_bytes(regs[35:39], byteorder='little')
+
+def stop_inspection(session):
+    """
+    What GDB reads after each stop for identifying the frame
+    """
+    _, pc = registers(session)
+    session.request('m{:x},2'.format(pc))
+
+# Each pattern is a pair of functions: a setup that brings the target into the initial
+# state (not measured), and one GDB command with the packets it causes.
+
+def stepi_setup(session, sp):
+    restart(session, sp)
+
+def stepi(session):
+    session.resume('vCont;s:1')
+    stop_inspection(session)
+
+def next_setup(session, sp):
+    restart(session, sp)
+    run_to(session, LOOP)
+
+def next_over_loop(session):
+    # with range stepping, GDB hands the whole line to the server
+    session.resume('vCont;r{:x},{:x}:1'.format(LOOP, LOOP_END))
+    stop_inspection(session)
+
+def finish_setup(session, sp):
+    restart(session, sp)
+    run_to(session, REC)
+
+def finish(session):
+    sp, _ = registers(session)
+    ret = int.from_bytes(bytes.fromhex(session.request('m{:x},2'.format(0x800000 + sp + 1)).decode('ascii')),
+                             byteorder='big') << 1
+    run_to(session, ret)
+    stop_inspection(session)
+
+def backtrace_setup(session, sp):
+    restart(session, sp)
+    run_to(session, BOTTOM)
+
+def backtrace(session):
+    sp, pc = registers(session)
+    for frame in range(DEPTH):
+        # prologue analysis of the function and the return address on the stack
+        session.request('m{:x},{:x}'.format(REC if pc >= REC else MAIN, 0x10))
+        reply = session.request('m{:x},2'.format(0x800000 + sp + 1 + 2*frame))
+        pc = int.from_bytes(bytes.fromhex(reply.decode('ascii')), byteorder='big') << 1
+
+def continue_setup(session, sp):
+    restart(session, sp, LOOP)
+
+def continue_to_breakpoint(session):
+    # GDB steps over the breakpoint at the PC, inserts the breakpoints, continues, and removes them
+    session.resume('vCont;s:1')
+    session.expect('Z0,{:x},2'.format(LOOP))
+    session.resume('vCont;c')
+    session.expect('z0,{:x},2'.format(LOOP))
+    stop_inspection(session)
+
+def info_registers(session):
+    registers(session)
+
+PATTERNS = {
+    'stepi': (stepi_setup, stepi, False),
+    'next': (next_setup, next_over_loop, True),
+    'finish': (finish_setup, finish, True),
+    'backtrace': (backtrace_setup, backtrace, True),
+    'continue': (continue_setup, continue_to_breakpoint, False),
+    'info-registers': (stepi_setup, info_registers, False),
+    }
+
+def run_pattern(device, probe, pattern, repetitions, replay=None):
+    """
+    Execute the pattern repetitions times and return the result record
+    """
+    setup, command, setup_each = PATTERNS[pattern]
+    dbg = make_debugger(device, probe, replay)
+    session = LoopbackSession(dbg, device)
+    latencies = []
+    server = []
+    try:
+        session.connect()
+        load(session, program_image(), 'vflash')
+        initial_sp, _ = registers(session)
+        packets = 0
+        transactions = 0
+        for rep in range(repetitions):
+            if rep == 0 or setup_each:
+                setup(session, initial_sp)
+            probe_time, trans = probe_counters(dbg)
+            count = session.packets
+            start = time.perf_counter()
+            command(session)
+            wall = time.perf_counter() - start
+            probe_time = probe_counters(dbg)[0] - probe_time
+            transactions += probe_counters(dbg)[1] - trans
+            packets += session.packets - count
+            server.append(wall)
+            latencies.append(wall + probe_time)
+    finally:
+        session.close()
+    return { 'device': device, 'probe': probe if replay is None else 'replay', 'pattern': pattern,
+                 'commands': repetitions, 'packets': packets, 'transactions': transactions,
+                 'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                 'max': max(latencies), 'server_p50': percentile(server, 50),
+                 'server_p95': percentile(server, 95), 'server_max': max(server) }
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(prog="python -m tests.latency_benchmark",
+                                         description="Measure the latency of interactive GDB commands")
+    parser.add_argument("-d", "--device", default='atmega328p', help="MCU (default: atmega328p)")
+    parser.add_argument("-p", "--probe", action='append', choices=list(PRESETS),
+                            help="probe model (repeatable, default: all matching the interface)")
+    parser.add_argument("--pattern", action='append', choices=list(PATTERNS),
+                            help="command pattern (repeatable, default: all)")
+    parser.add_argument("-n", "--repetitions", type=int, default=100,
+                            help="number of commands per pattern (default: 100)")
+    parser.add_argument("--replay", metavar="FILE",
+                            help="replay a USB recording of one pattern instead of simulating")
+    parser.add_argument("-o", "--output", help="write JSON results to file instead of stdout")
+    parser.add_argument("-c", "--compare", metavar="JSON",
+                            help="print changes relative to earlier results")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    iface = interface_of(args.device)
+    probes = ['replay'] if args.replay else \
+      args.probe or (DW_PROBES if iface == 'debugwire' else ['jtag'])
+    results = { 'benchmark': 'latency', 'version': server_version(), 'results': [] }
+    for probe in probes:
+        for pattern in args.pattern or list(PATTERNS):
+            results['results'].append(run_pattern(args.device, probe, pattern, args.repetitions,
+                                                      args.replay))
+    write_results(results, args.output)
+    if args.compare:
+        compare_results(args.compare, results, KEY_FIELDS, ('packets', 'transactions', 'p50', 'p95'))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
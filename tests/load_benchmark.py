@@ -0,0 +1,109 @@
+"""
+Load-throughput benchmark: loads executables through GdbHandler into a simulated
+(or replayed) probe in all load modes, with and without verification, in the best
+and the worst case, as in docs/load-speed.md, and reports kB/s per configuration as JSON.
+
+Usage: python -m tests.load_benchmark [-d <mcu>] [-p <probe>] [--replay <file>] [<elf> ...]
+"""
+#pylint: disable=consider-using-f-string,too-many-locals,too-many-arguments,too-many-positional-arguments
+import argparse
+import logging
+import sys
+import time
+
+from pyavrocd.probemodel import PRESETS
+from tests.benchmark import LoopbackSession, make_debugger, probe_counters, interface_of, \
+     sketch_images, load, write_results, compare_results, server_version
+
+DW_PROBES = ['dwlink', 'snap', 'pickit4', 'atmelice', 'medbg']
+KEY_FIELDS = ('image', 'device', 'probe', 'protocol', 'mode', 'verify', 'case')
+
+def run_one(device, image, probe, protocol, mode, verify, case, replay=None):
+    """
+    Measure one configuration and return the result record
+    """
+    dbg = make_debugger(device, probe, replay)
+    session = LoopbackSession(dbg, device)
+    try:
+        session.connect()
+        session.monitor('load ' + mode)
+        session.monitor('verify ' + verify)
+        if interface_of(device) != 'debugwire':
+            session.monitor('erasebeforeload disable')
+        if replay is None:
+            if case == 'best':
+                load(session, image, protocol)
+            else:
+                dbg.core.flash[:len(image)] = bytes(b ^ 0xFF for b in image)
+        probe_time, transactions = probe_counters(dbg)
+        packets = session.packets
+        start = time.perf_counter()
+        load(session, image, protocol)
+        wall = time.perf_counter() - start
+        probe_time = probe_counters(dbg)[0] - probe_time
+        transactions = probe_counters(dbg)[1] - transactions
+        if replay is None and dbg.core.flash[:len(image)] != image:
+            raise RuntimeError("Flash contents differ from the image")
+    finally:
+        session.close()
+    return { 'device': device, 'probe': probe if replay is None else 'replay', 'protocol': protocol,
+                 'mode': mode, 'verify': verify, 'case': case, 'bytes': len(image),
+                 'probe_time': probe_time, 'transactions': transactions, 'wall_time': wall,
+                 'packets': session.packets - packets,
+                 'kB_per_s': len(image)/1000/probe_time if probe_time else None,
+                 'server_kB_per_s': len(image)/1000/wall if wall else None }
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(prog="python -m tests.load_benchmark",
+                                         description="Measure load throughput with a simulated probe")
+    parser.add_argument("elf", nargs='*', help="ELF files to load (default: tests/sketches/**/*.elf)")
+    parser.add_argument("-d", "--device", default='atmega328p', help="MCU (default: atmega328p)")
+    parser.add_argument("-p", "--probe", action='append', choices=list(PRESETS),
+                            help="probe model (repeatable, default: all matching the interface)")
+    parser.add_argument("--protocol", action='append', choices=['vflash', 'x'],
+                            help="load protocol (repeatable, default: both)")
+    parser.add_argument("--mode", action='append', choices=['writeonly', 'readbeforewrite'],
+                            help="load mode (repeatable, default: both)")
+    parser.add_argument("--verify", action='append', choices=['disable', 'enable'],
+                            help="verification (repeatable, default: both)")
+    parser.add_argument("--case", action='append', choices=['worst', 'best'],
+                            help="contents of flash before loading (repeatable, default: both)")
+    parser.add_argument("--replay", metavar="FILE",
+                            help="replay a USB recording of one configuration instead of simulating")
+    parser.add_argument("--size", type=int, default=16384,
+                            help="size of the synthetic image if there are no ELF files (default: 16384)")
+    parser.add_argument("-o", "--output", help="write JSON results to file instead of stdout")
+    parser.add_argument("-c", "--compare", metavar="JSON",
+                            help="print changes relative to earlier results")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    iface = interface_of(args.device)
+    probes = args.probe or (DW_PROBES if iface == 'debugwire' else ['jtag'])
+    if args.replay:
+        probes = ['replay']
+        cases = ['recorded']
+    else:
+        cases = args.case or ['worst', 'best']
+    results = { 'benchmark': 'load', 'version': server_version(),
+                    'results': [] }
+    for name, image in sketch_images(args.elf, args.size):
+        for probe in probes:
+            for protocol in args.protocol or ['vflash', 'x']:
+                for mode in args.mode or ['writeonly', 'readbeforewrite']:
+                    for verify in args.verify or ['disable', 'enable']:
+                        for case in cases:
+                            res = run_one(args.device, image, probe, protocol, mode, verify, case,
+                                              args.replay)
+                            res['image'] = name
+                            results['results'].append(res)
+    write_results(results, args.output)
+    if args.compare:
+        compare_results(args.compare, results, KEY_FIELDS, ('kB_per_s', 'transactions'))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
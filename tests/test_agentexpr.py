@@ -0,0 +1,83 @@
+"""
+The test suit for the AgentExpression class
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+from unittest import TestCase
+from pyavrocd.agentexpr import AgentExpression
+from pyavrocd.errors import AgentExpressionError
+
+logging.basicConfig(level=logging.CRITICAL)
+
+def regs(num):
+    return num + 1
+
+def mem(addr, size):
+    if addr == 0x800100:
+        return bytes([0x34, 0x12, 0xFF, 0xFF][:size])
+    return bytes(size)
+
+class TestAgentExpression(TestCase):
+
+    def evaluate(self, code):
+        return AgentExpression(bytes(code)).evaluate(regs, mem)
+
+    def test_parse_list(self):
+        exprs = AgentExpression.parse_list("X2,2227X3,230102")
+        self.assertEqual([e.code for e in exprs], [b'\x22\x27', b'\x23\x01\x02'])
+        with self.assertRaises(AgentExpressionError):
+            AgentExpression.parse_list("X3,2227")
+        with self.assertRaises(AgentExpressionError):
+            AgentExpression.parse_list("Y3,222700")
+
+    def test_constants_and_arithmetic(self):
+        self.assertEqual(self.evaluate([0x22, 0x05, 0x22, 0x03, 0x03, 0x27]), 2)
+        self.assertEqual(self.evaluate([0x23, 0x01, 0x00, 0x22, 0x02, 0x04, 0x27]), 0x200)
+        self.assertEqual(self.evaluate([0x22, 0x03, 0x22, 0x05, 0x03, 0x27]), 2**64 - 2)
+        self.assertEqual(self.evaluate([0x22, 0x07, 0x22, 0x02, 0x06, 0x27]), 3)
+
+    def test_signed_operations(self):
+        # -7 / 2 = -3 (truncation toward zero)
+        self.assertEqual(self.evaluate([0x22, 0xF9, 0x16, 0x08, 0x22, 0x02, 0x05, 0x27]), 2**64 - 3)
+        self.assertEqual(self.evaluate([0x22, 0xF9, 0x16, 0x08, 0x22, 0x02, 0x14, 0x27]), 1)
+        self.assertEqual(self.evaluate([0x22, 0xF9, 0x16, 0x08, 0x22, 0x02, 0x15, 0x27]), 0)
+
+    def test_registers_and_memory(self):
+        self.assertEqual(self.evaluate([0x26, 0x00, 0x18, 0x27]), 25)
+        self.assertEqual(self.evaluate([0x24, 0x00, 0x80, 0x01, 0x00, 0x18, 0x27]), 0x1234)
+        self.assertEqual(self.evaluate([0x24, 0x00, 0x80, 0x01, 0x00, 0x17, 0x27]), 0x34)
+        self.assertEqual(self.evaluate([0x24, 0x00, 0x80, 0x01, 0x00, 0x19, 0x16, 0x20, 0x27]), 2**64 - 0xEDCC)
+
+    def test_branches(self):
+        # if (1) goto 7 else push 9; end at 7 with 5
+        self.assertEqual(self.evaluate([0x22, 0x01, 0x20, 0x00, 0x08, 0x22, 0x09, 0x27, 0x22, 0x05, 0x27]), 5)
+        self.assertEqual(self.evaluate([0x22, 0x00, 0x20, 0x00, 0x08, 0x22, 0x09, 0x27, 0x22, 0x05, 0x27]), 9)
+
+    def test_stack_operations(self):
+        self.assertEqual(self.evaluate([0x22, 0x01, 0x22, 0x02, 0x2B, 0x27]), 1)
+        self.assertEqual(self.evaluate([0x22, 0x01, 0x22, 0x02, 0x32, 0x01, 0x27]), 1)
+        self.assertEqual(self.evaluate([0x22, 0x01, 0x22, 0x02, 0x22, 0x03, 0x33, 0x27]), 2)
+        self.assertEqual(self.evaluate([0x22, 0x01, 0x28, 0x13, 0x27]), 1)
+
+    def test_errors(self):
+        with self.assertRaises(AgentExpressionError):
+            self.evaluate([0x29, 0x27])
+        with self.assertRaises(AgentExpressionError):
+            self.evaluate([0x01, 0x27])
+        with self.assertRaises(AgentExpressionError):
+            self.evaluate([0x22, 0x01, 0x22, 0x00, 0x06, 0x27])
+        with self.assertRaises(AgentExpressionError):
+            self.evaluate([0x21, 0x00, 0x00])
+
+    def test_printf(self):
+        out = []
+        fmt = b'%s: %x %c\\n\x00'
+        code = [0x22, 0x41, 0x23, 0x12, 0x34, 0x23, 0x01, 0x00, 0x22, 0x00, 0x22, 0x00, 0x34, 0x03, 0x00, len(fmt)] + list(fmt) + [0x27]
+        AgentExpression(bytes(code)).evaluate(regs, lambda addr, size: b'ok\x00'[addr-0x800100:addr-0x800100+size], out.append)
+        self.assertEqual(out, ["ok: 1234 A\n"])
+
+    def test_format(self):
+        self.assertEqual(AgentExpression.format("%d %u %ld %hhx %5.1f%%", [2**64-1, 2**64-1, 2**64-2, 0x1ff], None)[:17],
+                             "-1 65535 -2 ff %5")
+        with self.assertRaises(AgentExpressionError):
+            AgentExpression.format("%d %d", [1], None)
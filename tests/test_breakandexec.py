@@ -7,8 +7,15 @@ from unittest.mock import Mock, call, create_autospec
 from unittest import TestCase
 from pyavrocd.xavrdebugger import XAvrDebugger
 from pyavrocd.monitor import MonitorCommand
-from pyavrocd.breakexec import BreakAndExec, SIGTRAP, SIGABRT, SIGILL, BREAKCODE, \
-     SLEEPCODE, SWBP, HWBP, UNALLOCATED
+from pyavrocd.breakexec import BreakAndExec, SIGTRAP, SIGABRT, SIGILL, BREAKCODE, SLEEPCODE, REBALANCE_HITS
+from pyavrocd.bptable import BreakpointTable, SWBP, HWBP, UNALLOCATED
+from pyavrocd.hardwarebp import HardwareBP
+from pyavrocd.undolog import UndoLog, UndoRecord
+from pyavrocd.opcodes import branch_instr, cond_branch_instr, relative_branch_instr, skip_instr, store_instr, \
+     two_word_instr, branch_on_ibit, compute_destination_of_relative_branch, compute_possible_destination_of_branch, \
+     compute_destination_of_ibranch
+from pyavrocd.xavr8target import HWBP_DATA_READ, HWBP_DATA_WRITE
+from pyavrocd.agentexpr import AgentExpression
 from .util.instr import instrmap
 
 logging.basicConfig(level=logging.CRITICAL)
@@ -19,10 +26,12 @@ class TestBreakAndExec(TestCase):
         mock_mon = create_autospec(MonitorCommand, specSet=True, instance=True)
         mock_dbg = create_autospec(XAvrDebugger, spec_set=False, instance=True)
         mock_dbg.memory_info = Mock()
-        mock_dbg.memory_info.memory_info_by_name.return_value = {'size' : 100,'address' : 0x60 } 
+        mock_dbg.memory_info.memory_info_by_name.return_value = {'size' : 100,'address' : 0x60, 'page_size' : 64 }
+        mock_dbg.data_comparators = 2
         self.bp = BreakAndExec(1, mock_mon, mock_dbg, 'avr8', Mock())
         self.bp.mon.is_old_exec.return_value = False
         self.bp.mon.is_safe.return_value = True
+        self.bp.mon.is_recording.return_value = False
 
     def test_insert_breakpoint_old_exec(self):
         self.bp.mon.is_old_exec.return_value = True
@@ -54,10 +63,10 @@ class TestBreakAndExec(TestCase):
 
     def test_remove_breakpoints_regular_idempotent(self):
         self.bp.mon.is_onlyhwbps.return_value = False
-        self.bp._bp = {100: { 'active': True, 'allocated' : UNALLOCATED,
-                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 1 },
-                       200:  { 'active': True, 'allocated': UNALLOCATED, 
-                                  'opcode': 0x2222, 'secondword' : 0x3333, 'timestamp' : 2 }}
+        self.bp._bp = BreakpointTable({100: { 'active': True, 'allocated' : UNALLOCATED,
+                                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 1 },
+                                       200:  { 'active': True, 'allocated': UNALLOCATED, 
+                                                  'opcode': 0x2222, 'secondword' : 0x3333, 'timestamp' : 2 }})
         self.bp._bpactive = 2
         self.bp.remove_breakpoint(100)
         self.assertEqual(self.bp._bpactive, 1)
@@ -80,14 +89,14 @@ class TestBreakAndExec(TestCase):
         self.bp.mon.is_onlyswbps.return_value = False
         self.bp._bstamp = 6
         self.bp._hwbp._hwbplist = [ 200 ]
-        self.bp._bp = {100: { 'active': True, 'allocated' : UNALLOCATED, # will get swbp
-                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 2 },
-                       200:  { 'active': False, 'allocated' : SWBP, # will remove swbp
-                                  'opcode': 0x2221, 'secondword' : 0x3331, 'timestamp' : 5 },
-                       300:  { 'active': False, 'allocated': HWBP, # will remove hwbp
-                                  'opcode': 0x2222, 'secondword' : 0x3332, 'timestamp' : 1 },
-                       400:  { 'active': True, 'allocated': UNALLOCATED, # gets an hwbp
-                                  'opcode': 0x2223, 'secondword' : 0x3333, 'timestamp' : 3 }}
+        self.bp._bp = BreakpointTable({100: { 'active': True, 'allocated' : UNALLOCATED, # will get swbp
+                                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 2 },
+                                       200:  { 'active': False, 'allocated' : SWBP, # will remove swbp
+                                                  'opcode': 0x2221, 'secondword' : 0x3331, 'timestamp' : 5 },
+                                       300:  { 'active': False, 'allocated': HWBP, # will remove hwbp
+                                                  'opcode': 0x2222, 'secondword' : 0x3332, 'timestamp' : 1 },
+                                       400:  { 'active': True, 'allocated': UNALLOCATED, # gets an hwbp
+                                                  'opcode': 0x2223, 'secondword' : 0x3333, 'timestamp' : 3 }})
         self.bp._update_breakpoints(-1)
         self.assertEqual(self.bp._bp, {100: { 'active': True, 'allocated': SWBP,
                                     'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 2 },
@@ -103,14 +112,14 @@ class TestBreakAndExec(TestCase):
         self.bp.mon.is_onlyswbps.return_value = False
         self.bp._bstamp = 6
         self.bp._hwbp._hwbplist = [ 300 ]  
-        self.bp._bp = {100: { 'active': True, 'allocated': UNALLOCATED, # will get swbp
-                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 2 },
-                       200:  { 'active': False, 'allocated': SWBP, # will remove swbp
-                                  'opcode': 0x2221, 'secondword' : 0x3331, 'timestamp' : 5 },
-                       300:  { 'active': False, 'allocated': HWBP, # will remove hwbp
-                                  'opcode': 0x2222, 'secondword' : 0x3332, 'timestamp' : 1 },
-                       400:  { 'active': True, 'allocated': UNALLOCATED, # gets an hwbp
-                                  'opcode': 0x2223, 'secondword' : 0x3333, 'timestamp' : 3 }}
+        self.bp._bp = BreakpointTable({100: { 'active': True, 'allocated': UNALLOCATED, # will get swbp
+                                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 2 },
+                                       200:  { 'active': False, 'allocated': SWBP, # will remove swbp
+                                                  'opcode': 0x2221, 'secondword' : 0x3331, 'timestamp' : 5 },
+                                       300:  { 'active': False, 'allocated': HWBP, # will remove hwbp
+                                                  'opcode': 0x2222, 'secondword' : 0x3332, 'timestamp' : 1 },
+                                       400:  { 'active': True, 'allocated': UNALLOCATED, # gets an hwbp
+                                                  'opcode': 0x2223, 'secondword' : 0x3333, 'timestamp' : 3 }})
         self.bp._update_breakpoints(300)
         self.assertEqual(self.bp._bp, {100: { 'active': True, 'allocated' : SWBP,
                                         'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 2 },
@@ -120,6 +129,163 @@ class TestBreakAndExec(TestCase):
         self.bp.dbg.software_breakpoint_clear.assert_called_with(200)
         self.bp.dbg.software_breakpoint_set.assert_has_calls([call(100), call(400)], any_order=True)
 
+    def test_update_breakpoints_prefers_frequently_hit_bps(self):
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._hwbp = HardwareBP(2, self.bp.dbg, score=self.bp._score)
+        self.bp._bp = BreakpointTable({200: { 'active': True, 'allocated' : UNALLOCATED,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 2 },
+                                       100: { 'active': True, 'allocated' : UNALLOCATED,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 },
+                                       300: { 'active': True, 'allocated' : UNALLOCATED,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 3 }})
+        self.assertTrue(self.bp._update_breakpoints(None))
+        self.assertEqual(self.bp._hwbp._hwbplist, [300, 200])
+        self.bp.dbg.software_breakpoint_set.assert_called_once_with(100)
+        self.bp._dirty = False
+        for _ in range(REBALANCE_HITS - 1):
+            self.bp.handle_stop(100)
+        self.assertFalse(self.bp._dirty)
+        self.bp.handle_stop(100)
+        self.assertEqual(self.bp._bphits, {100: REBALANCE_HITS})
+        self.assertTrue(self.bp._dirty)
+        self.assertTrue(self.bp._update_breakpoints(None))
+        self.assertEqual(self.bp._hwbp._hwbplist, [300, 100])
+        self.assertEqual(self.bp._bp[200]['allocated'], SWBP)
+        self.assertEqual(self.bp._bp[100]['allocated'], HWBP)
+        self.bp.dbg.software_breakpoint_clear.assert_called_once_with(100)
+        self.bp.dbg.software_breakpoint_set.assert_called_with(200)
+
+    def test_score_two_word_instruction(self):
+        self.bp._bp = BreakpointTable({100: { 'active': True, 'allocated' : HWBP,
+                                                  'opcode': 0x940E, 'secondword' : 0x0000, 'timestamp' : 1 },
+                                       200: { 'active': True, 'allocated' : HWBP,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 2 }})
+        self.bp._bphits = {100: 2, 200: 3}
+        self.assertGreater(self.bp._score(100), self.bp._score(200))
+        self.assertEqual(self.bp._score(300), (0, False, 0))
+
+    def test_breakpoint_table_indices(self):
+        table = BreakpointTable({100: { 'active': True, 'allocated' : UNALLOCATED,
+                                           'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 3 },
+                                 200: { 'active': False, 'allocated' : SWBP,
+                                           'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 5 }})
+        self.assertEqual(list(table.inactive), [200])
+        self.assertEqual(list(table.unallocated), [100])
+        self.assertEqual(list(table.swbps), [200])
+        self.assertEqual(table.most_recent(), 200)
+        table.set_state(100, active=False, allocated=HWBP)
+        self.assertEqual(list(table.hwbps), [100])
+        self.assertEqual(list(table.unallocated), [])
+        self.assertEqual(list(table.inactive), [200, 100])
+        del table[200]
+        self.assertEqual(list(table.inactive), [100])
+        self.assertEqual(list(table.swbps), [])
+        self.assertEqual(table.most_recent(), 100)
+        self.assertEqual(table[100], { 'active': False, 'allocated' : HWBP,
+                                           'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 3 })
+        with self.assertRaises(AttributeError):
+            table[100].color = 'red'
+        with self.assertRaises(TypeError):
+            table[100]['active'] = True
+
+    def test_update_breakpoints_only_touches_changed_bps(self):
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._hwbp._hwbplist = [ 100 ]
+        self.bp._bp = BreakpointTable({100: { 'active': True, 'allocated' : HWBP,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 }})
+        for a in range(200, 400, 2):
+            self.bp._bp[a] = { 'active': True, 'allocated' : SWBP,
+                                   'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 }
+        self.bp._bp.set_state(300, active=False)
+        self.assertTrue(self.bp._update_breakpoints(None))
+        self.assertNotIn(300, self.bp._bp)
+        self.assertEqual(list(self.bp._bp.inactive), [])
+        self.bp.dbg.software_breakpoint_clear.assert_called_once_with(300)
+        self.bp.dbg.software_breakpoint_set.assert_not_called()
+
+    def test_update_breakpoints_batch_per_page(self):
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = True
+        self.bp._bp = BreakpointTable({0x100: { 'active': True, 'allocated' : UNALLOCATED,
+                                                 'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 },
+                                       0x104:  { 'active': True, 'allocated' : UNALLOCATED,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 2 },
+                                       0x13E:  { 'active': True, 'allocated' : UNALLOCATED,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 3 },
+                                       0x140:  { 'active': True, 'allocated' : UNALLOCATED,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 4 },
+                                       0x142:  { 'active': False, 'allocated' : SWBP,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 5 },
+                                       0x146:  { 'active': False, 'allocated' : SWBP,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 6 }})
+        self.bp.dbg.software_breakpoints_set.return_value = True
+        self.bp.dbg.software_breakpoint_set.return_value = True
+        self.assertTrue(self.bp._update_breakpoints(None))
+        self.bp.dbg.software_breakpoints_set.assert_called_once_with([0x100, 0x104, 0x13E])
+        self.bp.dbg.software_breakpoint_set.assert_called_once_with(0x140)
+        self.bp.dbg.software_breakpoints_clear.assert_called_once_with([0x142, 0x146])
+        self.bp.dbg.software_breakpoint_clear.assert_not_called()
+        self.assertEqual(self.bp._swbp_set, [])
+
+    def test_update_breakpoints_batch_fails(self):
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = True
+        self.bp._bp = BreakpointTable({0x100: { 'active': True, 'allocated' : UNALLOCATED,
+                                                 'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 },
+                                       0x104:  { 'active': True, 'allocated' : UNALLOCATED,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 2 }})
+        self.bp.dbg.software_breakpoints_set.return_value = False
+        self.assertFalse(self.bp._update_breakpoints(None))
+        self.assertEqual(self.bp._bp[0x100]['allocated'], UNALLOCATED)
+        self.assertEqual(self.bp._bp[0x104]['allocated'], UNALLOCATED)
+
+    def test_prepare_and_check_load(self):
+        self.bp.mon.is_old_exec.return_value = False
+        self.bp._bp = BreakpointTable({0x100: { 'active': True, 'allocated' : SWBP,
+                                                 'opcode': 0x1111, 'secondword' : 0x2222, 'timestamp' : 1 },
+                                       0x104:  { 'active': True, 'allocated' : SWBP,
+                                                  'opcode': 0x3333, 'secondword' : 0x4444, 'timestamp' : 2 },
+                                       0x108:  { 'active': True, 'allocated' : HWBP,
+                                                  'opcode': 0x5555, 'secondword' : 0x6666, 'timestamp' : 3 }})
+        self.bp._bpactive = 3
+        self.bp.prepare_load()
+        self.bp.dbg.software_breakpoint_clear_all.assert_not_called()
+        self.assertEqual(sorted(self.bp._bp), [0x100, 0x104, 0x108])
+        self.assertEqual(self.bp._bp[0x108]['allocated'], UNALLOCATED)
+        self.assertFalse(self.bp._bp[0x100]['active'])
+        self.assertEqual(self.bp._bpactive, 0)
+        image = {0x100: 0x1111, 0x102: 0x2222, 0x104: 0x3333, 0x106: 0x4445}
+        self.bp.check_load(image.get)
+        self.assertEqual(list(self.bp._bp), [0x100])
+        self.bp.dbg.software_breakpoint_clear.assert_called_once_with(0x104)
+
+    def test_fold_breakpoints(self):
+        self.bp._bp = BreakpointTable({0x100: { 'active': False, 'allocated' : SWBP,
+                                                 'opcode': 0x1111, 'secondword' : 0x2222, 'timestamp' : 1 },
+                                       0x13E:  { 'active': False, 'allocated' : SWBP,
+                                                  'opcode': 0x3333, 'secondword' : 0x4444, 'timestamp' : 2 },
+                                       0x140:  { 'active': False, 'allocated' : SWBP,
+                                                  'opcode': 0x3333, 'secondword' : 0x4444, 'timestamp' : 2 }})
+        page = bytearray(0x40)
+        result = self.bp.fold_breakpoints(0x100, page)
+        self.assertEqual(result[0:2], bytearray([0x98, 0x95]))
+        self.assertEqual(result[0x3E:0x40], bytearray([0x98, 0x95]))
+        self.assertEqual(result[2:0x3E], bytearray(0x3C))
+
+    def test_reinsert_after_load_does_not_write_flash(self):
+        self.bp.mon.is_old_exec.return_value = False
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = True
+        self.bp._bp = BreakpointTable({0x100: { 'active': True, 'allocated' : SWBP,
+                                                 'opcode': 0x1111, 'secondword' : 0x2222, 'timestamp' : 1 }})
+        self.bp.prepare_load()
+        self.bp.insert_breakpoint(0x100)
+        self.assertTrue(self.bp._update_breakpoints(None))
+        self.bp.dbg.software_breakpoint_set.assert_not_called()
+        self.bp.dbg.software_breakpoint_clear.assert_not_called()
+
     def test_update_breakpoints_update_remove_stealhwbp(self):
         self.maxDiff = None
         self.bp.mon.is_onlyhwbps.return_value = False
@@ -127,16 +293,16 @@ class TestBreakAndExec(TestCase):
         self.bp._bstamp = 6
         self.bp._bpactive = 3
         self.bp._hwbp._hwbplist = [ 100 ]
-        self.bp._bp = {100: { 'active': True, 'allocated' : HWBP, # will have to give up hwbp
-                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 1 },
-                       200:  { 'active': False, 'allocated' : SWBP, # will remove swbp
-                                  'opcode': 0x2221, 'secondword' : 0x3331, 'timestamp' : 2 },
-                       300:  { 'active': False, 'allocated': SWBP, # will remove swbp
-                                  'opcode': 0x2222, 'secondword' : 0x3332, 'timestamp' : 3 },
-                       400:  { 'active': True, 'allocated' : UNALLOCATED, # will become swbp
-                                  'opcode': 0x2223, 'secondword' : 0x3333, 'timestamp' : 4 },
-                       500:  { 'active': True, 'allocated' : UNALLOCATED, # gets hwbp
-                                  'opcode': 0x2224, 'secondword' : 0x3334, 'timestamp' : 5 }}
+        self.bp._bp = BreakpointTable({100: { 'active': True, 'allocated' : HWBP, # will have to give up hwbp
+                                                 'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 1 },
+                                       200:  { 'active': False, 'allocated' : SWBP, # will remove swbp
+                                                  'opcode': 0x2221, 'secondword' : 0x3331, 'timestamp' : 2 },
+                                       300:  { 'active': False, 'allocated': SWBP, # will remove swbp
+                                                  'opcode': 0x2222, 'secondword' : 0x3332, 'timestamp' : 3 },
+                                       400:  { 'active': True, 'allocated' : UNALLOCATED, # will become swbp
+                                                  'opcode': 0x2223, 'secondword' : 0x3333, 'timestamp' : 4 },
+                                       500:  { 'active': True, 'allocated' : UNALLOCATED, # gets hwbp
+                                                  'opcode': 0x2224, 'secondword' : 0x3334, 'timestamp' : 5 }})
         self.bp._update_breakpoints(-1)
         self.assertEqual(self.bp._bp, {100: { 'active': True, 'allocated' : SWBP,
                                     'opcode': BREAKCODE, 'secondword' : 0x1111, 'timestamp' : 1 },
@@ -151,7 +317,8 @@ class TestBreakAndExec(TestCase):
 
     def test_cleanup_breakpoints(self):
         self.bp._hwbp._hwbplist = [ 1 ]
-        self.bp._bp = { 1: 1}
+        self.bp._bp = BreakpointTable({ 2: { 'active': True, 'allocated' : HWBP,
+                                               'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 }})
         self.bp._bpactive = 1
         self.bp.cleanup_breakpoints()
         self.assertEqual(self.bp._hwbp._hwbplist, [None])
@@ -197,6 +364,41 @@ class TestBreakAndExec(TestCase):
         self.bp.dbg.program_counter_read.assert_called_once()
         self.bp.dbg.run.assert_called_once()
 
+    def test_resume_execution_fast_path(self):
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_old_exec.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.dbg.program_counter_read.return_value = 0x40
+        self.bp.insert_breakpoint(0x100)
+        self.assertIsNone(self.bp.resume_execution(None))
+        self.bp.dbg.run_to.assert_called_with(0x100)
+        self.assertEqual(self.bp.handle_stop(0x100), SIGTRAP)
+        self.bp.remove_breakpoint(0x100)
+        self.bp.insert_breakpoint(0x100)
+        self.bp.dbg.reset_mock()
+        self.bp._read_flash_word.reset_mock()
+        self.assertIsNone(self.bp.resume_execution(None))
+        self.assertEqual(self.bp.dbg.method_calls, [call.run_to(0x100)])
+        self.bp._read_flash_word.assert_not_called()
+
+    def test_resume_execution_after_pc_change(self):
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_old_exec.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.dbg.program_counter_read.return_value = 0x40
+        self.bp.insert_breakpoint(0x100)
+        self.bp.resume_execution(None)
+        self.bp.handle_stop(0x100)
+        self.bp.forget_stop_pc()
+        self.bp.mon.is_safe.return_value = not self.bp.mon.is_safe()
+        self.bp.dbg.reset_mock()
+        self.assertTrue(self.bp._needs_update())
+        self.bp.resume_execution(None)
+        self.bp.dbg.program_counter_read.assert_called_once()
+        self.assertFalse(self.bp._needs_update())
+
     def test_resume_execution_at_break_one_word_with_hwbp(self):
         self.bp._bstamp = 3
         self.bp.mon.is_onlyswbps.return_value = False
@@ -273,8 +475,8 @@ class TestBreakAndExec(TestCase):
         self.bp.mon.is_onlyswbps.return_value = False
         self.bp.dbg.program_counter_read.return_value = 22
         self.bp._read_flash_word.side_effect = [ 0x8FF4, 0x8FF4, 0x8FFF ]
-        self.assertFalse(self.bp._two_word_instr(0x8FF4))
-        self.assertFalse(self.bp._branch_instr(0x8FF4))
+        self.assertFalse(two_word_instr(0x8FF4))
+        self.assertFalse(branch_instr(0x8FF4))
         self.assertEqual(self.bp.single_step(None), None)
         self.bp._read_flash_word.assert_has_calls([call(44), call(44)], any_order=True )
         self.bp.dbg.step.assert_not_called()
@@ -284,8 +486,8 @@ class TestBreakAndExec(TestCase):
         self.bp.mon.is_onlyswbps.return_value = False
         self.bp.dbg.program_counter_read.return_value = 22
         self.bp._read_flash_word.side_effect = [ 0x9000, 0x9000, 0x88FF ]
-        self.assertTrue(self.bp._two_word_instr(0x9000))
-        self.assertFalse(self.bp._branch_instr(0x9000))
+        self.assertTrue(two_word_instr(0x9000))
+        self.assertFalse(branch_instr(0x9000))
         self.assertEqual(self.bp.single_step(None), None)
         self.bp.dbg.step.assert_not_called()
         self.bp.dbg.run_to.assert_called_with(48)
@@ -294,8 +496,8 @@ class TestBreakAndExec(TestCase):
         self.bp.mon.is_onlyswbps.return_value = False
         self.bp.dbg.program_counter_read.return_value = 22
         self.bp._read_flash_word.side_effect = [ 0x9518, 0x9518, 0x8FFF ]
-        self.assertFalse(self.bp._two_word_instr(0x9518))
-        self.assertTrue(self.bp._branch_instr(0x9518))
+        self.assertFalse(two_word_instr(0x9518))
+        self.assertTrue(branch_instr(0x9518))
         self.bp.dbg.status_register_read.side_effect = [ bytearray([0x88]), bytearray([0x07]) ]
         self.assertEqual(self.bp.single_step(None), SIGTRAP)
         self.bp._read_flash_word.assert_has_calls([call(44), call(44)], any_order=True)
@@ -308,8 +510,8 @@ class TestBreakAndExec(TestCase):
         self.bp.mon.is_onlyswbps.return_value = False
         self.bp.dbg.program_counter_read.return_value = 22
         self.bp._read_flash_word.side_effect = [ 0x950C, 0x950C, 0x8FFF ]
-        self.assertTrue(self.bp._two_word_instr(0x950C))
-        self.assertTrue(self.bp._branch_instr(0x950C))
+        self.assertTrue(two_word_instr(0x950C))
+        self.assertTrue(branch_instr(0x950C))
         self.bp.dbg.status_register_read.side_effect = [ bytearray([0x88]), bytearray([0x07]) ]
         self.assertEqual(self.bp.single_step(None), 5)
         self.bp._read_flash_word.assert_has_calls([call(44), call(44)], any_order=True)
@@ -322,7 +524,7 @@ class TestBreakAndExec(TestCase):
         self.bp.mon.is_onlyswbps.return_value = False
         self.bp.dbg.program_counter_read.return_value = 22
         self.bp._read_flash_word.side_effect = [ 0xF017, 0xF017 ]
-        self.assertTrue(self.bp._branch_on_ibit(0xF017)) # BRIE .+2
+        self.assertTrue(branch_on_ibit(0xF017)) # BRIE .+2
         self.bp.dbg.status_register_read.side_effect = [ bytearray([0x88]) ]
         self.assertEqual(self.bp.single_step(None), None)
         self.bp._read_flash_word.assert_has_calls([call(44), call(44)], any_order=True)
@@ -330,6 +532,133 @@ class TestBreakAndExec(TestCase):
         self.bp.dbg.step.assert_not_called()
         self.bp.dbg.run_to.assert_called_with(50)
 
+    def test_multi_step_count(self):
+        self.bp.mon.is_safe.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.dbg.program_counter_read.return_value = 0x100
+        self.assertEqual(self.bp.multi_step(5), (5, SIGTRAP))
+        self.assertEqual(self.bp.dbg.step.call_count, 5)
+
+    def test_multi_step_conditions(self):
+        self.bp.mon.is_safe.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.dbg.program_counter_read.side_effect = [ 0x80, 0x80, 0x81, 0x81, 0x82, 0x82, 0x90, 0x90 ]
+        self.bp.dbg.register_file_read.return_value = bytearray(32)
+        self.assertEqual(self.bp.multi_step(100, [('reg', 24, 1), ('pc', 0x100, 0x110)]), (4, SIGTRAP))
+        self.assertEqual(self.bp.dbg.step.call_count, 4)
+        self.assertEqual(self.bp.dbg.register_file_read.call_count, 4)
+
+    def test_multi_step_sp_and_mem(self):
+        self.bp.mon.is_safe.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.dbg.program_counter_read.return_value = 0x100
+        self.bp.dbg.sram_read.return_value = bytearray([0x00])
+        self.bp.dbg.stack_pointer_read.side_effect = [ bytearray([0xFF, 0x08]), bytearray([0xFD, 0x08]) ]
+        self.assertEqual(self.bp.multi_step(100, [('mem', 0x100, 1), ('sp', 0x8FF)]), (2, SIGTRAP))
+
+    def test_multi_step_record_and_bp(self):
+        self.bp.mon.is_safe.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp._bp = BreakpointTable({0x104: { 'active': True, 'allocated' : SWBP,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 }})
+        self.bp.dbg.program_counter_read.side_effect = [ 0x80, 0x80, 0x81, 0x81, 0x82, 0x82 ]
+        recorded = []
+        self.assertEqual(self.bp.multi_step(100, [('bp',)],
+                                                record=lambda snap: recorded.append(snap.program_counter())),
+                             (2, SIGTRAP))
+        self.assertEqual(recorded, [0x100, 0x102, 0x104])
+
+    def test_recording_and_reverse_step(self):
+        self.bp.mon.is_recording.return_value = True
+        self.bp.mon.recording_depth.return_value = 10
+        self.bp.mon.is_safe.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x930D # ST X+, r16
+        before = bytearray(32)
+        before[16] = 0x42
+        before[26:28] = [0x00, 0x01]
+        after = bytearray(before)
+        after[26] = 0x01
+        self.bp.dbg.register_file_read.side_effect = [ before, after, after ]
+        self.bp.dbg.status_register_read.return_value = bytearray([0x82])
+        self.bp.dbg.stack_pointer_read.return_value = bytearray([0xFF, 0x08])
+        self.bp.dbg.sram_read.side_effect = lambda addr, size: bytearray([addr & 0xFF]*size)
+        self.bp.dbg.program_counter_read.return_value = 0x80
+        self.assertEqual(self.bp.single_step(None), SIGTRAP)
+        self.bp.dbg.step.assert_called_once()
+        self.assertEqual(self.bp.history_length(), 1)
+        self.assertEqual(self.bp._undo._log[0].regs, {26: 0x00})
+        self.assertEqual(self.bp.reverse_step(), SIGTRAP)
+        self.assertEqual(self.bp.stop_reason(), "")
+        self.assertEqual(self.bp.dbg.sram_write.call_args_list,
+                             [call(0x100, bytes([0x00])), call(0x8FE, bytes([0xFE, 0xFE]))])
+        self.bp.dbg.register_file_write.assert_called_once_with(before)
+        self.bp.dbg.status_register_write.assert_called_once_with(bytearray([0x82]))
+        self.bp.dbg.stack_pointer_write.assert_called_once_with(bytes([0xFF, 0x08]))
+        self.bp.dbg.program_counter_write.assert_called_once_with(0x80)
+        self.assertEqual(self.bp.reverse_step(), SIGTRAP)
+        self.assertEqual(self.bp.stop_reason(), "replaylog:begin;")
+
+    def test_not_recording_clears_history(self):
+        self.bp._undo._log.append(UndoRecord(0x100, 0, 0x8FF, bytes(32), []))
+        self.bp.mon.is_safe.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.single_step(None)
+        self.assertEqual(self.bp.history_length(), 0)
+        self.bp.dbg.register_file_read.assert_not_called()
+
+    def test_reverse_continue(self):
+        for pc in (0x100, 0x102, 0x104):
+            rec = UndoRecord(pc, 0, 0x8FF, bytes(32), [])
+            rec.finish(bytes(32))
+            self.bp._undo._log.append(rec)
+        self.bp._bp = BreakpointTable({0x102: { 'active': True, 'allocated' : SWBP,
+                                                  'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 }})
+        self.assertEqual(self.bp.reverse_continue(), SIGTRAP)
+        self.assertEqual(self.bp.stop_reason(), "")
+        self.assertEqual(self.bp.dbg.program_counter_write.call_args_list, [call(0x82), call(0x81)])
+        self.bp.dbg.register_file_write.assert_not_called()
+        self.assertEqual(self.bp.history_length(), 1)
+        self.assertEqual(self.bp.reverse_continue(), SIGTRAP)
+        self.assertEqual(self.bp.stop_reason(), "replaylog:begin;")
+        self.bp.dbg.program_counter_write.assert_called_with(0x80)
+
+    def test_undo_stored_locations(self):
+        undo = UndoLog(self.bp.dbg, 0x100)
+        regs = bytearray(32)
+        regs[26:32] = [0x00, 0x02, 0x10, 0x02, 0x20, 0x02]
+        read_word = lambda addr: 0x0123
+        self.assertEqual(undo._stored_locations(0x9300, 0x200, read_word, regs, 0x8FF, interrupts=False), [(0x0123, 1)])
+        self.assertEqual(undo._stored_locations(0x820D, 0x200, read_word, regs, 0x8FF, interrupts=False), [(0x215, 1)])
+        self.assertEqual(undo._stored_locations(0x9202, 0x200, read_word, regs, 0x8FF, interrupts=False), [(0x21F, 1)])
+        self.assertEqual(undo._stored_locations(0x9206, 0x200, read_word, regs, 0x8FF, interrupts=False), [(0x220, 1)])
+        self.assertEqual(undo._stored_locations(0x920E, 0x200, read_word, regs, 0x8FF, interrupts=False), [(0x1FF, 1)])
+        self.assertEqual(undo._stored_locations(0x920F, 0x200, read_word, regs, 0x8FF, interrupts=False), [(0x8FE, 2)])
+        self.assertEqual(undo._stored_locations(0x940E, 0x200, read_word, regs, 0x8FF, interrupts=False), [(0x8FE, 2)])
+        self.assertEqual(undo._stored_locations(0x0C00, 0x200, read_word, regs, 0x8FF, interrupts=False), [])
+        self.assertEqual(undo._stored_locations(0x0C00, 0x200, read_word, regs, 0x8FF, interrupts=True), [(0x8FE, 2)])
+
+    def test_range_step_recording(self):
+        self.bp.mon.is_range.return_value = True
+        self.bp.mon.is_recording.return_value = True
+        self.bp.mon.recording_depth.return_value = 10
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp.mon.is_safe.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.dbg.register_file_read.return_value = bytearray(32)
+        self.bp.dbg.status_register_read.return_value = bytearray([0x00])
+        self.bp.dbg.stack_pointer_read.return_value = bytearray([0xFF, 0x08])
+        self.bp.dbg.program_counter_read.return_value = 0x80
+        self.assertEqual(self.bp.range_step(0x100, 0x120), SIGTRAP)
+        self.bp.dbg.step.assert_called_once()
+        self.bp.dbg.run_to.assert_not_called()
+        self.assertEqual(self.bp.history_length(), 1)
+
     def test_range_step_impossible_mon(self):
         self.bp.mon.is_old_exec.return_value = True
         self.bp.mon.is_range.return_value = False
@@ -424,11 +753,11 @@ class TestBreakAndExec(TestCase):
         start = 0x0364
         end = 0x0376
         self.bp._build_range(start, end)
-        self.assertEqual(start, self.bp._range_start)
-        self.assertEqual(end, self.bp._range_end)
-        self.assertEqual(code, self.bp._range_word)
-        self.assertEqual(set([0x376]), self.bp._range_exit)
-        self.assertEqual([ 0x370, 0x372, 0x376], self.bp._range_branch)
+        self.assertEqual(start, self.bp._range.start)
+        self.assertEqual(end, self.bp._range.end)
+        self.assertEqual(code, self.bp._range.word)
+        self.assertEqual(set([0x376]), self.bp._range.exit)
+        self.assertEqual([ 0x370, 0x372, 0x376], self.bp._range.branch)
 
     def test_build_range_two_exits(self):
         # while (++i) { if ( i < 0 ) return(i); }
@@ -437,87 +766,319 @@ class TestBreakAndExec(TestCase):
         start = 0x033a
         end = 0x0344
         self.bp._build_range(start, end)
-        self.assertEqual(start, self.bp._range_start)
-        self.assertEqual(end, self.bp._range_end)
-        self.assertEqual(code, self.bp._range_word)
-        self.assertEqual(set([0x342, 0x344]), self.bp._range_exit)
-        self.assertEqual([ 0x33e, 0x340, 0x342, 0x344], self.bp._range_branch)
+        self.assertEqual(start, self.bp._range.start)
+        self.assertEqual(end, self.bp._range.end)
+        self.assertEqual(code, self.bp._range.word)
+        self.assertEqual(set([0x342, 0x344]), self.bp._range.exit)
+        self.assertEqual([ 0x33e, 0x340, 0x342, 0x344], self.bp._range.branch)
+
+    def test_build_range_calls_without_stepover(self):
+        self.bp.mon.is_stepover.return_value = False
+        # mov; rcall .+20; subi; call 0x400
+        code = [ 0x2f98, 0xd00a, 0x5f8f, 0x940e, 0x0200, 0x2f98 ]
+        self.bp._read_flash_word.side_effect = code
+        self.bp._build_range(0x100, 0x10a)
+        self.assertEqual(set([0x118, 0x400]), self.bp._range.exit)
+        self.assertEqual({}, self.bp._range.call)
+
+    def test_build_range_calls_with_stepover(self):
+        self.bp.mon.is_stepover.return_value = True
+        # mov; rcall .+20; subi; call 0x400
+        code = [ 0x2f98, 0xd00a, 0x5f8f, 0x940e, 0x0200, 0x2f98 ]
+        self.bp._read_flash_word.side_effect = code
+        self.bp._build_range(0x100, 0x10a)
+        self.assertEqual(set([0x10a]), self.bp._range.exit)
+        self.assertEqual({0x102: 0x104, 0x106: 0x10a}, self.bp._range.call)
+        self.assertEqual([ 0x102, 0x106, 0x10a], self.bp._range.branch)
+
+    def test_range_step_over_call(self):
+        self.bp.mon.is_range.return_value = True
+        self.bp.mon.is_stepover.return_value = True
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        code = [ 0x2f98, 0xd00a, 0x5f8f, 0x940e, 0x0200, 0x2f98 ]
+        self.bp._read_flash_word.side_effect = code
+        self.bp._build_range(0x100, 0x10a)
+        self.bp._read_flash_word.side_effect = None
+        self.bp._read_flash_word.return_value = 0xd00a
+        self.bp.dbg.program_counter_read.return_value = 0x102 >> 1
+        self.bp.dbg.stack_pointer_read.return_value = bytearray([0x00, 0x08])
+        self.assertEqual(self.bp.range_step(0x100, 0x10a), None)
+        self.bp.dbg.run_to.assert_called_with(0x104)
+        self.bp.dbg.step.assert_not_called()
+        self.assertEqual(self.bp._stepover, (0x104, 0x800))
+
+    def test_insert_watchpoint_without_data_breakpoints(self):
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.assertEqual(self.bp.insert_watchpoint(3, 0x800100, 1), None)
+        self.assertEqual(self.bp.remove_watchpoint(3, 0x800100, 1), None)
+        self.bp.dbg.hardware_watchpoint_set.assert_not_called()
+
+    def test_insert_software_watchpoint(self):
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.dbg.sram_read.return_value = bytearray([7])
+        self.assertTrue(self.bp.insert_watchpoint(2, 0x800100, 1))
+        self.assertFalse(self.bp._watch._io)
+        self.assertEqual(self.bp.insert_watchpoint(2, 0x800010, 1), None)
+        self.assertTrue(self.bp.insert_watchpoint(2, 0x800025, 1))
+        self.assertTrue(self.bp._watch._io)
+        self.assertTrue(self.bp.remove_watchpoint(2, 0x800100, 1))
+        self.assertEqual(list(self.bp._watch._wp), [(2, 0x800025)])
+        self.bp.dbg.hardware_watchpoint_set.assert_not_called()
+
+    def test_store_instr(self):
+        for opcode in [0x9300, 0x920F, 0x9204, 0x8208, 0xAE0F, 0x8200, 0x920C, 0x940E, 0xD123, 0x9509]:
+            self.assertTrue(store_instr(opcode), hex(opcode))
+        for opcode in [0x9100, 0x900F, 0x8008, 0x0000, 0xB80F, 0x9A00, 0x9409]:
+            self.assertFalse(store_instr(opcode), hex(opcode))
+        self.assertTrue(store_instr(0xB80F, io=True))
+        self.assertTrue(store_instr(0x9A00, io=True))
+        self.assertFalse(store_instr(0x9900, io=True))
+
+    def test_next_watch_stop(self):
+        self.bp._watch._flash_size = 0x100
+        # LDI, LDS (2 words), ADD, STS
+        self.bp._read_flash_word.side_effect = [ 0xE000, 0x9100, 0x0C00, 0x9300 ]
+        self.assertEqual(self.bp._watch.next_stop(0x10), 0x18)
+        self.assertEqual(self.bp._watch.next_stop(0x10), 0x18)
+        self.assertEqual(self.bp._read_flash_word.call_count, 4)
+
+    def test_resume_execution_with_software_watchpoint(self):
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp.mon.is_safe.return_value = False
+        self.bp.dbg.sram_read.return_value = bytearray([7])
+        self.bp.insert_watchpoint(2, 0x800100, 1)
+        self.bp._watch._flash_size = 0x1000
+        # NOP, NOP, STS 0x100
+        self.bp._read_flash_word.side_effect = lambda addr: {0x100: 0x0000, 0x102: 0x0000,
+                                                                  0x104: 0x9300, 0x106: 0x0100}.get(addr, 0)
+        self.bp.dbg.program_counter_read.return_value = 0x80
+        self.assertEqual(self.bp.resume_execution(None), None)
+        self.bp.dbg.run_to.assert_called_with(0x104)
+        self.bp.dbg.run.assert_not_called()
+        # stop at STS: single-step it, value has changed
+        self.bp.dbg.program_counter_read.return_value = 0x82
+        self.bp.dbg.sram_read.return_value = bytearray([8])
+        self.bp.dbg.program_counter_read.side_effect = [ 0x82, 0x82, 0x84 ]
+        self.assertEqual(self.bp.handle_stop(0x104), SIGTRAP)
+        self.bp.dbg.step.assert_called_once()
+        self.assertEqual(self.bp.stop_reason(), "watch:800100;")
+
+    def test_hwbp_evicts_lowest_score(self):
+        hwbp = HardwareBP(3, self.bp.dbg, score={0x10: 5, 0x20: 1, 0x30: 0}.get)
+        hwbp._hwbplist = [0x30, 0x10, 0x20]
+        self.assertEqual(hwbp.unallocate_hwbp0(), 0x20)
+        self.assertEqual(hwbp._hwbplist, [None, 0x10, 0x30])
+        self.bp.dbg.hardware_breakpoint_set.assert_called_with(2, 0x30)
+
+    def test_hwbp_clear_all(self):
+        hwbp = HardwareBP(4, self.bp.dbg)
+        hwbp._hwbplist = [0x10, 0x20, None, 0x30]
+        hwbp.clear_all()
+        self.assertEqual(self.bp.dbg.hardware_breakpoint_clear.call_args_list, [call(1), call(2), call(3)])
+        self.assertEqual(hwbp._hwbplist, [None]*4)
+        self.bp.dbg.hardware_breakpoint_clear.reset_mock()
+        HardwareBP(1, self.bp.dbg).clear_all()
+        self.bp.dbg.hardware_breakpoint_clear.assert_not_called()
+
+    def test_insert_and_remove_watchpoint(self):
+        self.bp._hwbp = HardwareBP(4, self.bp.dbg)
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.dbg.sram_read.return_value = bytearray([1, 2])
+        self.assertTrue(self.bp.insert_watchpoint(2, 0x800100, 2))
+        self.bp.dbg.hardware_watchpoint_set.assert_has_calls([call(1, 0x100, HWBP_DATA_WRITE),
+                                                                  call(2, 0x101, HWBP_DATA_WRITE)])
+        self.assertEqual(self.bp._hwbp.data_allocated(), 2)
+        self.assertTrue(self.bp.insert_watchpoint(2, 0x800100, 2))
+        self.assertEqual(self.bp._hwbp.data_allocated(), 2)
+        self.assertTrue(self.bp.remove_watchpoint(2, 0x800100, 2))
+        self.bp.dbg.hardware_breakpoint_clear.assert_has_calls([call(1), call(2)])
+        self.assertEqual(self.bp._hwbp.data_allocated(), 0)
+
+    def test_insert_watchpoint_evicts_code_breakpoint(self):
+        self.bp._hwbp = HardwareBP(2, self.bp.dbg)
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp._bp = BreakpointTable({0x200: { 'active': True, 'allocated' : HWBP,
+                                                    'opcode': 0x0000, 'secondword' : 0x0000, 'timestamp' : 1 }})
+        self.bp._hwbp._hwbplist = [ None, 0x200 ]
+        self.assertTrue(self.bp.insert_watchpoint(3, 0x800100, 1))
+        self.assertEqual(self.bp._bp[0x200]['allocated'], UNALLOCATED)
+        self.bp.dbg.hardware_watchpoint_set.assert_called_with(1, 0x100, HWBP_DATA_READ)
+
+    def test_insert_watchpoint_exhausted(self):
+        self.bp._hwbp = HardwareBP(2, self.bp.dbg)
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.assertFalse(self.bp.insert_watchpoint(2, 0x800100, 2))
+        self.bp.dbg.hardware_breakpoint_clear.assert_called_with(1)
+        self.assertEqual(self.bp._hwbp.data_allocated(), 0)
+        self.assertFalse(self.bp.insert_watchpoint(2, 0x100, 1))
+
+    def test_handle_stop_watchpoint(self):
+        self.bp._hwbp = HardwareBP(4, self.bp.dbg)
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.dbg.sram_read.return_value = bytearray([1])
+        self.bp.insert_watchpoint(4, 0x800200, 1)
+        self.bp.insert_watchpoint(2, 0x800100, 1)
+        self.bp.dbg.sram_read.return_value = bytearray([2])
+        self.assertEqual(self.bp.handle_stop(0x300), SIGTRAP)
+        self.assertEqual(self.bp.stop_reason(), "watch:800100;")
+        self.assertEqual(self.bp.handle_stop(0x300), SIGTRAP)
+        self.assertEqual(self.bp.stop_reason(), "awatch:800200;")
+
+    def test_handle_stop_watchpoint_at_breakpoint(self):
+        self.bp._hwbp = HardwareBP(4, self.bp.dbg)
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.insert_watchpoint(3, 0x800100, 1)
+        self.bp.insert_breakpoint(0x300)
+        self.assertEqual(self.bp.handle_stop(0x300), SIGTRAP)
+        self.assertEqual(self.bp.stop_reason(), "")
+
+    def test_handle_stop_recursive_stepover(self):
+        self.bp._stepover = (0x104, 0x800)
+        self.bp.dbg.stack_pointer_read.return_value = bytearray([0xF0, 0x07])
+        self.assertEqual(self.bp.handle_stop(0x104), None)
+        self.bp.dbg.run_to.assert_called_with(0x104)
+        self.bp.dbg.stack_pointer_read.return_value = bytearray([0x00, 0x08])
+        self.assertEqual(self.bp.handle_stop(0x104), SIGTRAP)
+        self.assertEqual(self.bp._stepover, None)
+
+    def test_handle_stop_condition_true(self):
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        # reg 24 == 5
+        self.bp.insert_breakpoint(0x100, [ AgentExpression(bytes([0x26, 0x00, 0x18, 0x22, 0x05, 0x13, 0x27])) ])
+        self.bp._continuing = True
+        self.bp.dbg.register_file_read.return_value = bytearray([5]*32)
+        self.assertEqual(self.bp.handle_stop(0x100), SIGTRAP)
+        self.bp.dbg.step.assert_not_called()
+
+    def test_handle_stop_condition_false(self):
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_safe.return_value = False
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.insert_breakpoint(0x100, [ AgentExpression(bytes([0x26, 0x00, 0x18, 0x22, 0x05, 0x13, 0x27])) ])
+        self.bp._continuing = True
+        self.bp.dbg.register_file_read.return_value = bytearray([4]*32)
+        self.bp.dbg.program_counter_read.side_effect = [ 0x80, 0x81, 0x81 ]
+        self.assertEqual(self.bp.handle_stop(0x100), None)
+        self.bp.dbg.step.assert_called_once()
+        self.bp.dbg.run_to.assert_called_with(0x100)
+        self.assertTrue(self.bp._continuing)
+
+    def test_handle_stop_condition_not_checked_when_stepping(self):
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.insert_breakpoint(0x100, [ AgentExpression(bytes([0x22, 0x00, 0x27])) ])
+        self.bp._continuing = False
+        self.assertEqual(self.bp.handle_stop(0x100), SIGTRAP)
+        self.bp.dbg.register_file_read.assert_not_called()
+
+    def test_handle_stop_condition_error(self):
+        self.bp._read_flash_word.return_value = 0x0000
+        self.bp.insert_breakpoint(0x100, [ AgentExpression(bytes([0x29, 0x27])) ])
+        self.bp._continuing = True
+        self.assertEqual(self.bp.handle_stop(0x100), SIGTRAP)
+
+    def test_handle_stop_dprintf(self):
+        self.bp.mon.is_onlyswbps.return_value = False
+        self.bp.mon.is_onlyhwbps.return_value = False
+        self.bp.mon.is_safe.return_value = False
+        self.bp._actions._output = Mock()
+        self.bp._read_flash_word.return_value = 0x0000
+        fmt = b'r24=%d\n\x00'
+        # printf("r24=%d\n", r24)
+        cmd = bytes([0x26, 0x00, 0x18, 0x22, 0x00, 0x22, 0x00, 0x34, 0x01, 0x00, len(fmt)]) + fmt + bytes([0x27])
+        self.bp.insert_breakpoint(0x100, None, [ AgentExpression(cmd) ])
+        self.bp._continuing = True
+        self.bp.dbg.register_file_read.return_value = bytearray([7]*32)
+        self.bp.dbg.program_counter_read.side_effect = [ 0x80, 0x81, 0x81 ]
+        self.assertEqual(self.bp.handle_stop(0x100), None)
+        self.bp._actions._output.assert_called_with("r24=7\n")
+        self.bp.dbg.run_to.assert_called_with(0x100)
+
+    def test_handle_stop_elsewhere(self):
+        self.bp._stepover = (0x104, 0x800)
+        self.assertEqual(self.bp.handle_stop(0x400), SIGTRAP)
+        self.bp.dbg.run_to.assert_not_called()
+        self.assertEqual(self.bp._stepover, None)
 
 
     def test_branch_instr(self):
         for instr in range(0x10000):
-            self.assertEqual(self.bp._branch_instr(instr),
+            self.assertEqual(branch_instr(instr),
                                  instrmap.get(instr,(None, None, None))[2] in ['branch', 'cond', 'icond'],
                                  "Failed at 0x%04X" % instr)
 
     def test_relative_branch_instr(self):
         for instr in range(0x10000):
-            self.assertEqual(self.bp._relative_branch_instr(instr), instrmap.get(instr,(None, None, None))[0] in ['rcall', 'rjmp'])
+            self.assertEqual(relative_branch_instr(instr), instrmap.get(instr,(None, None, None))[0] in ['rcall', 'rjmp'])
 
     def test_compute_destination_of_relative_branch(self):
-        self.assertEqual(self.bp._compute_destination_of_relative_branch(0xD100, 0x2000), 0x2202)
-        self.assertEqual(self.bp._compute_destination_of_relative_branch(0xCFFF, 0x2000), 0x2000)
+        self.assertEqual(compute_destination_of_relative_branch(0xD100, 0x2000), 0x2202)
+        self.assertEqual(compute_destination_of_relative_branch(0xCFFF, 0x2000), 0x2000)
 
     def test_skip_instr(self):
         for instr in range(0x10000):
-            self.assertEqual(self.bp._skip_instr(instr),
+            self.assertEqual(skip_instr(instr),
                                  instrmap.get(instr,(None, None, None))[0] in ['cpse', 'sbic', 'sbis', 'sbrc', 'sbrs'],
                                  "Failed at 0x%04X" % instr)
 
     def test_cond_branch_instr(self):
         for instr in range(0x10000):
-            self.assertEqual(self.bp._cond_branch_instr(instr),
+            self.assertEqual(cond_branch_instr(instr),
                                  instrmap.get(instr,('None', None, None))[0][:2] == 'br' and \
                                  instrmap.get(instr,(None, None, None))[2] in ['cond', 'icond'],
                                  "Failed at 0x%04X" % instr)
 
     def test_branch_on_ibit(self):
         for instr in range(0x10000):
-            self.assertEqual(self.bp._branch_on_ibit(instr),
+            self.assertEqual(branch_on_ibit(instr),
                                  instrmap.get(instr,(None, None, None))[2] in ['icond'],
                                  "Failed at 0x%04X" % instr)
 
     def test_compute_possible_destination_of_branch(self):
-        self.assertEqual(self.bp._compute_possible_destination_of_branch(0xF02F, 20), 32)
-        self.assertEqual(self.bp._compute_possible_destination_of_branch(0xF7FF, 20), 20)
+        self.assertEqual(compute_possible_destination_of_branch(0xF02F, 20), 32)
+        self.assertEqual(compute_possible_destination_of_branch(0xF7FF, 20), 20)
 
 
     def test_computeDestinationOfBranch(self):
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF02F, 1, 20), 32)
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF3FF, 1, 20), 20)
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF02F, 0, 20), 22)
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF3FF, 0, 20), 22)
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF42F, 0, 20), 32)
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF7FF, 0, 20), 20)
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF42F, 1, 20), 22)
-        self.assertEqual(self.bp._compute_destination_of_ibranch(0xF7FF, 1, 20), 22)
+        self.assertEqual(compute_destination_of_ibranch(0xF02F, 1, 20), 32)
+        self.assertEqual(compute_destination_of_ibranch(0xF3FF, 1, 20), 20)
+        self.assertEqual(compute_destination_of_ibranch(0xF02F, 0, 20), 22)
+        self.assertEqual(compute_destination_of_ibranch(0xF3FF, 0, 20), 22)
+        self.assertEqual(compute_destination_of_ibranch(0xF42F, 0, 20), 32)
+        self.assertEqual(compute_destination_of_ibranch(0xF7FF, 0, 20), 20)
+        self.assertEqual(compute_destination_of_ibranch(0xF42F, 1, 20), 22)
+        self.assertEqual(compute_destination_of_ibranch(0xF7FF, 1, 20), 22)
 
     def test_two_word_instr(self):
         for instr in range(0x10000):
-            self.assertEqual(self.bp._two_word_instr(instr),
+            self.assertEqual(two_word_instr(instr),
                                  instrmap.get(instr,(None, None, None))[1] == 2,
                                  "Failed at 0x%04X" % instr)
 
     def test_sim_two_word_instr_lds(self):
         self.bp.dbg.sram_read.return_value = bytearray(0x55)
-        self.assertTrue(self.bp._two_word_instr(0x90F0))
-        self.assertEqual(self.bp._sim_two_word_instr(0x90F0, 0x1000, 0x2002), 0x2006)
+        self.assertTrue(two_word_instr(0x90F0))
+        self.assertEqual(self.bp._sim.sim_two_word_instr(0x90F0, 0x1000, 0x2002), 0x2006)
         self.bp.dbg.sram_read.assert_called_with(0x1000,1)
         self.bp.dbg.sram_write.assert_called_with(15,bytearray(0x55))
 
     def test_sim_two_word_instr_sts(self):
         self.bp.dbg.sram_read.return_value = bytearray(0x44)
-        self.assertTrue(self.bp._two_word_instr(0x92E0))
-        self.assertEqual(self.bp._sim_two_word_instr(0x92E0, 0x1000, 0x2002), 0x2006)
+        self.assertTrue(two_word_instr(0x92E0))
+        self.assertEqual(self.bp._sim.sim_two_word_instr(0x92E0, 0x1000, 0x2002), 0x2006)
         self.bp.dbg.sram_read.assert_called_with(14,1)
         self.bp.dbg.sram_write.assert_called_with(0x1000,bytearray(0x44))
 
     def test_sim_two_word_instr_jmp_small(self):
-        self.assertTrue(self.bp._two_word_instr(0x940C))
-        self.assertEqual(self.bp._sim_two_word_instr(0x940C, 0x2244, 0x2002), 0x4488)
+        self.assertTrue(two_word_instr(0x940C))
+        self.assertEqual(self.bp._sim.sim_two_word_instr(0x940C, 0x2244, 0x2002), 0x4488)
 
     def test_sim_two_word_instr_call_small(self):
         self.bp.dbg.stack_pointer_read.return_value = bytearray([0x02, 0x01])
-        self.assertEqual(self.bp._sim_two_word_instr(0x940E, 0x2244, 0x2002), 0x4488)
+        self.assertEqual(self.bp._sim.sim_two_word_instr(0x940E, 0x2244, 0x2002), 0x4488)
         self.bp.dbg.stack_pointer_write.assert_called_with(bytearray([0x00, 0x01]))
         self.bp.dbg.sram_write.assert_called_with(0x101, bytearray([0x10, 0x03]))
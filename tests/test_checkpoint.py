@@ -0,0 +1,94 @@
+"""
+The test suit for the checkpoint store
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+import os
+import shutil
+import tempfile
+from unittest.mock import create_autospec, MagicMock, call
+from unittest import TestCase
+from pyavrocd.xavrdebugger import XAvrDebugger
+from pyavrocd.memory import Memory
+from pyavrocd.checkpoint import Checkpoint, CheckpointStore
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class TestCheckpoint(TestCase):
+
+    def setUp(self):
+        mock_dbg = create_autospec(XAvrDebugger, spec_set=False, instance=True)
+        mock_dbg.memory_info = MagicMock()
+        mock_dbg.memory_info.memory_info_by_name.side_effect = lambda name: \
+          {'internal_sram': {'address': 0x100, 'size': 0x800},
+           'eeprom': {'address': 0x810000, 'size': 0x400}}[name]
+        mock_dbg.device_info = {'masked_registers': [0x4e, 0x51, 0xc6]}
+        mock_dbg.register_file_read.return_value = bytearray(range(32))
+        mock_dbg.status_register_read.return_value = bytearray([0x82])
+        mock_dbg.stack_pointer_read.return_value = bytearray([0xF0, 0x08])
+        mock_dbg.program_counter_read.return_value = 0x80
+        mock_mem = create_autospec(Memory, spec_set=True, instance=True)
+        mock_mem.sram_masked_read.return_value = bytearray([0x55]*0x800)
+        mock_mem.eeprom_read.return_value = bytearray([0xAA]*0x400)
+        self.store = CheckpointStore(mock_dbg, mock_mem, capacity=2)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_serialization(self):
+        ckp = Checkpoint(range(32), 0x82, 0x8F0, 0x100, b'\x01\x02', eeprom=b'\x03')
+        copy = Checkpoint.from_bytes(ckp.to_bytes())
+        self.assertEqual((copy.regs, copy.sreg, copy.sp, copy.pc, copy.sram, copy.eeprom),
+                             (bytes(range(32)), 0x82, 0x8F0, 0x100, b'\x01\x02', b'\x03'))
+        self.assertIsNone(Checkpoint.from_bytes(Checkpoint(range(32), 0, 0, 0, b'').to_bytes()).eeprom)
+        with self.assertRaises(ValueError):
+            Checkpoint.from_bytes(b'garbage')
+        with self.assertRaises(ValueError):
+            Checkpoint.from_bytes(ckp.to_bytes()[:-2])
+
+    def test_save(self):
+        ckp = self.store.save('a')
+        self.store.mem.sram_masked_read.assert_called_once_with(0x100, 0x800)
+        self.store.mem.eeprom_read.assert_not_called()
+        self.assertEqual((ckp.sreg, ckp.sp, ckp.pc, ckp.size()), (0x82, 0x8F0, 0x100, 0x800))
+        ckp = self.store.save('b', eeprom=True)
+        self.store.mem.eeprom_read.assert_called_once_with(0x810000, 0x400)
+        self.assertEqual(ckp.size(), 0xC00)
+        self.assertEqual(self.store.names(), ['b', 'a'])
+
+    def test_restore(self):
+        self.store.save('a', eeprom=True)
+        self.assertIsNone(self.store.restore('b'))
+        self.assertIsNotNone(self.store.restore('a'))
+        self.store.dbg.sram_write.assert_called_once_with(0x100, bytes([0x55]*0x800))
+        self.store.mem.eeprom_write.assert_called_once_with(0x810000, bytes([0xAA]*0x400))
+        self.store.dbg.register_file_write.assert_called_once_with(bytearray(range(32)))
+        self.store.dbg.status_register_write.assert_called_once_with(bytearray([0x82]))
+        self.store.dbg.stack_pointer_write.assert_called_once_with(bytes([0xF0, 0x08]))
+        self.store.dbg.program_counter_write.assert_called_once_with(0x80)
+
+    def test_write_around_masked_registers(self):
+        self.store._sram_write_unmasked(0x40, bytes(range(0x20)))
+        self.assertEqual(self.store.dbg.sram_write.call_args_list,
+                             [call(0x40, bytes(range(0x0E))), call(0x4F, bytes([0x0F, 0x10])),
+                              call(0x52, bytes(range(0x12, 0x20)))])
+
+    def test_lru_eviction(self):
+        self.store.save('a')
+        self.store.save('b')
+        self.store.restore('a')
+        self.store.save('c')
+        self.assertEqual(self.store.names(), ['c', 'a'])
+        self.assertIsNone(self.store.restore('b'))
+
+    def test_spill(self):
+        self.store.set_spill_dir(os.path.join(self.tmpdir, 'ckp'))
+        self.store.save('a/1')
+        self.store.save('b')
+        self.store.save('c')
+        self.assertEqual(self.store.names(), ['c', 'b'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'ckp', 'a_1.ckp')))
+        ckp = self.store.restore('a/1')
+        self.assertEqual((ckp.pc, ckp.sram), (0x100, bytes([0x55]*0x800)))
+        self.assertEqual(self.store.names(), ['a/1', 'c'])
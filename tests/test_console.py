@@ -0,0 +1,60 @@
+"""
+The test suit for the SRAM ring-buffer console
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+from unittest.mock import create_autospec
+from unittest import TestCase
+from pyavrocd.xavrdebugger import XAvrDebugger
+from pyavrocd.console import SramConsole
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class TestConsole(TestCase):
+
+    def setUp(self):
+        mock_dbg = create_autospec(XAvrDebugger, spec_set=False, instance=True)
+        mock_dbg.iface = 'debugwire'
+        self.con = SramConsole(mock_dbg)
+
+    def test_attach(self):
+        self.assertFalse(self.con.active())
+        self.assertEqual(self.con.drain(), "")
+        self.assertFalse(self.con.attach(0x100, 2))
+        self.assertFalse(self.con.attach(0x100, 258))
+        self.assertTrue(self.con.attach(0x100, 18))
+        self.assertTrue(self.con.active())
+        self.assertFalse(self.con.live())
+        self.assertFalse(self.con.due())
+        self.con.detach()
+        self.assertFalse(self.con.active())
+
+    def test_live(self):
+        self.con.dbg.iface = 'updi'
+        con = SramConsole(self.con.dbg)
+        con.attach(0x100, 18)
+        self.assertTrue(con.live())
+        self.assertTrue(con.due())
+        con.disable_live()
+        self.assertFalse(con.due())
+
+    def test_drain(self):
+        self.con.attach(0x100, 10)
+        self.con.dbg.sram_read.return_value = bytearray([5, 1]) + b'xHelloxx'
+        self.assertEqual(self.con.drain(), "Hell")
+        self.con.dbg.sram_read.assert_called_once_with(0x100, 10)
+        self.con.dbg.sram_write.assert_called_once_with(0x101, bytearray([5]))
+
+    def test_drain_wrap_around(self):
+        self.con.attach(0x100, 10)
+        self.con.dbg.sram_read.return_value = bytearray([2, 6]) + b'lo\x00\x00\x00\x00Hel'
+        self.assertEqual(self.con.drain(), "Hello")
+        self.con.dbg.sram_write.assert_called_once_with(0x101, bytearray([2]))
+
+    def test_drain_empty_or_corrupted(self):
+        self.con.attach(0x100, 10)
+        self.con.dbg.sram_read.return_value = bytearray([3, 3]) + bytes(8)
+        self.assertEqual(self.con.drain(), "")
+        self.con.dbg.sram_read.return_value = bytearray([9, 3]) + bytes(8)
+        self.assertEqual(self.con.drain(), "")
+        self.con.dbg.sram_write.assert_not_called()
@@ -0,0 +1,63 @@
+"""
+The test suit for the ElfSymbols class
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+import os
+import struct
+import tempfile
+from unittest import TestCase
+from pyavrocd.elfsymbols import ElfSymbols
+from pyavrocd.errors import ElfError
+
+logging.basicConfig(level=logging.CRITICAL)
+
+def make_elf(symbols):
+    """
+    Build a minimal ELF file with a symbol table. symbols is a list of (name, value, size, type).
+    """
+    strtab = b'\x00'
+    symtab = bytes(16)
+    for name, value, size, symtype in symbols:
+        symtab += struct.pack('<IIIBBH', len(strtab), value, size, 0x10 | symtype, 0, 1)
+        strtab += name.encode() + b'\x00'
+    shoff = 52 + len(symtab) + len(strtab)
+    header = b'\x7fELF' + bytes([1, 1, 1]) + bytes(9) + \
+      struct.pack('<HHIIIIIHHHHHH', 2, 0x53, 1, 0, 0, shoff, 0, 52, 0, 0, 40, 3, 2)
+    sections = bytes(40) + \
+      struct.pack('<IIIIIIIIII', 0, 2, 0, 0, 52, len(symtab), 2, 1, 4, 16) + \
+      struct.pack('<IIIIIIIIII', 0, 3, 0, 0, 52 + len(symtab), len(strtab), 0, 0, 1, 0)
+    return header + symtab + strtab + sections
+
+class TestElfSymbols(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.elf')
+        with os.fdopen(fd, 'wb') as elffile:
+            elffile.write(make_elf([('main', 0x100, 0x20, 2), ('loop', 0x80, 0x10, 2),
+                                        ('counter', 0x800100, 2, 1), ('section', 0x0, 0, 3)]))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_function_at(self):
+        syms = ElfSymbols(self.path)
+        self.assertEqual(syms.function_at(0x100), 'main')
+        self.assertEqual(syms.function_at(0x11E), 'main')
+        self.assertIsNone(syms.function_at(0x120))
+        self.assertEqual(syms.function_at(0x8E), 'loop')
+        self.assertIsNone(syms.function_at(0x10))
+
+    def test_address_of(self):
+        syms = ElfSymbols(self.path)
+        self.assertEqual(syms.address_of('counter'), (0x800100, 2))
+        self.assertEqual(syms.address_of('main'), (0x100, 0x20))
+        self.assertIsNone(syms.address_of('section'))
+
+    def test_no_elf(self):
+        with open(self.path, 'wb') as elffile:
+            elffile.write(b'not an ELF file')
+        with self.assertRaises(ElfError):
+            ElfSymbols(self.path)
+        with self.assertRaises(ElfError):
+            ElfSymbols(self.path + '.missing')
@@ -6,12 +6,17 @@ import logging
 from unittest.mock import Mock, MagicMock, patch, call, create_autospec
 from unittest import TestCase
 import socket
+import binascii
 from pyavrocd.xavrdebugger import XAvrDebugger
-from pyavrocd.handler import GdbHandler, SIGINT, SIGHUP
+from pyavrocd.handler import GdbHandler, SIGINT, SIGHUP, SIGTRAP
 from pyavrocd.errors import EndOfSession
 from pyavrocd.memory import Memory
 from pyavrocd.monitor import MonitorCommand
 from pyavrocd.breakexec import BreakAndExec
+from pyavrocd.profiler import Profiler
+from pyavrocd.serverprofile import ServerProfiler
+from pyavrocd.checkpoint import CheckpointStore
+from pyavrocd.tracebuffer import trace, RSP_OUT
 from pyavrocd.main import options
 
 logging.basicConfig(level=logging.CRITICAL)
@@ -33,10 +38,12 @@ class TestGdbHandler(TestCase):
         mock_dbg.device = Mock()
         mock_dbg.device.avr = Mock()
         mock_dbg.iface = 'debugwire'
+        mock_dbg.data_comparators = 0
         mock_dbg.memory_info.memory_info_by_name('flash')['size'].__gt__ = lambda self, compare: False
         # setting up the GbdHandler instance we want to test
         self.gh = GdbHandler(mock_socket, mock_dbg, "atmega328p", options(['-f', 'foo']))
         self.gh.mon = create_autospec(MonitorCommand, specSet=True, instance=True)
+        self.gh.mon.stepi_parameters.return_value = None
         self.gh.mem = create_autospec(Memory, specSet=True, instance=True)
         self.gh.mem.programming_mode = False
         self.gh.bp = create_autospec(BreakAndExec, specSet=True, instance=True)
@@ -95,6 +102,35 @@ class TestGdbHandler(TestCase):
         self.gh.bp.resume_execution.assert_called_with(None)
         self.gh._comsocket.sendall.assert_not_called()
 
+    def test_continue_armed_by_stepi(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.mem.is_flash_empty.return_value = False
+        self.gh.mon.stepi_parameters.return_value = (100, [('pc', 0, 8)])
+        self.gh.bp.multi_step.return_value = (7, SIGTRAP)
+        self.gh.dbg.program_counter_read.return_value = 0x10
+        self.gh.dbg.status_register_read.return_value = [0x00]
+        self.gh.dbg.stack_pointer_read.return_value = bytearray([0x00, 0x08])
+        self.gh.poll_gdb_input = Mock(return_value=False)
+        self.gh.dispatch('c', b'')
+        self.gh.bp.resume_execution.assert_not_called()
+        self.gh.mon.clear_stepi.assert_called_once()
+        self.gh.bp.multi_step.assert_called_with(100, [('pc', 0, 8), ('bp',)], self.gh.poll_gdb_input)
+        self.gh._comsocket.sendall.assert_has_calls([
+            call(rsp('O' + binascii.hexlify(b"Executed 7 instruction(s), stopped at 0x20\n").decode('ascii').upper())),
+            call(rsp("T0520:00;21:0008;22:20000000;thread:1;"))])
+
+    def test_continue_armed_by_stepi_interrupted(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.mem.is_flash_empty.return_value = False
+        self.gh.mon.stepi_parameters.return_value = (100, [])
+        self.gh.bp.multi_step.return_value = (256, SIGTRAP)
+        self.gh.dbg.program_counter_read.return_value = 0x10
+        self.gh.poll_gdb_input = Mock(return_value=True)
+        self.gh.dispatch('vCont', b';c')
+        # the stop is reported when the interrupt is handled
+        self.assertEqual(len(self.gh._comsocket.sendall.call_args_list), 1)
+        self.assertTrue(self.gh._running)
+
     def test_continue_with_signal_handler(self):
         self.gh._continue_handler = Mock()
         self.gh.dispatch('C',b'09;2244')
@@ -261,7 +297,7 @@ class TestGdbHandler(TestCase):
     def test_supported_handler(self):
         self.gh.dbg.start_debugging.return_value = True
         self.gh.dispatch('qSupported', b'')
-        self.gh._comsocket.sendall.assert_called_with(rsp("PacketSize={0:X};qXfer:memory-map:read+".format(self.gh.packet_size)))
+        self.gh._comsocket.sendall.assert_called_with(rsp("PacketSize={0:X};qXfer:memory-map:read+;ConditionalBreakpoints+;BreakpointCommands+;ReverseStep+;ReverseContinue+".format(self.gh.packet_size)))
         self.gh.mon.set_debug_mode_active.assert_called_once()
 
     def test_first_thread_info_handler(self):
@@ -327,6 +363,20 @@ class TestGdbHandler(TestCase):
         self.gh.mem.flash_pages.assert_called_once()
         self.gh._comsocket.sendall.assert_called_with(rsp("OK"))
 
+    def test_flashDoneHandler_checks_breakpoints(self):
+        self.gh.mon.is_erase_before_load.return_value = False
+        self.gh.dispatch('vFlashDone', b'')
+        self.gh.bp.check_load.assert_called_once_with(self.gh.mem.cached_flash_word)
+        self.gh.mem.flash_pages.assert_called_once()
+
+    def test_flashEraseHandler_keeps_breakpoints(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.mon.is_erase_before_load.return_value = False
+        self.gh.dispatch('vFlashErase', b':100,10')
+        self.gh.bp.prepare_load.assert_called_once()
+        self.gh.bp.cleanup_breakpoints.assert_not_called()
+        self.gh._comsocket.sendall.assert_called_with(rsp("OK"))
+
     def test_flashEraseHandler_impossible(self):
         self.gh.mon.is_debugger_active.return_value = False
         self.gh.dispatch('vFlashErase', b':100,10')
@@ -392,6 +442,46 @@ class TestGdbHandler(TestCase):
         self.gh.mem.writemem.assert_called_with("800100", bytearray([0x7D]))
         self.gh._comsocket.sendall.assert_called_with(rsp('OK'))
 
+    def test_set_binary_memory_handler_keeps_breakpoints(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.mon.is_erase_before_load.return_value = False
+        self.gh.mem.lazy_loading = False
+        self.gh.mem.defer_programming = False
+        self.gh.mem.writemem.return_value = "OK"
+        self.gh.dispatch('X', b'100,2:AB')
+        self.gh.bp.prepare_load.assert_called_once()
+        self.gh.bp.cleanup_breakpoints.assert_not_called()
+        self.assertTrue(self.gh.mem.defer_programming)
+        self.gh.dbg.device.avr.switch_to_progmode.assert_not_called()
+        self.gh.mem.writemem.assert_called_with("100", bytearray(b'AB'))
+        self.gh._comsocket.sendall.assert_called_with(rsp('OK'))
+
+    def test_set_binary_memory_handler_finalize_checks_breakpoints(self):
+        self.gh.mem.lazy_loading = True
+        self.gh.mem.defer_programming = True
+        self.gh.dispatch(None, None)
+        self.gh.bp.check_load.assert_called_once_with(self.gh.mem.cached_flash_word)
+        self.gh.dbg.device.avr.switch_to_progmode.assert_called_once()
+        self.gh.mem.flash_pages.assert_called_once()
+        self.gh.dbg.device.avr.switch_to_debmode.assert_called_once()
+        self.assertFalse(self.gh.mem.defer_programming)
+        self.assertFalse(self.gh.mem.lazy_loading)
+
+    def test_set_binary_memory_handler_finalize_after_erase(self):
+        self.gh.mem.lazy_loading = True
+        self.gh.mem.defer_programming = False
+        self.gh.dispatch(None, None)
+        self.gh.bp.check_load.assert_not_called()
+        self.gh.mem.flash_pages.assert_called_once()
+        self.gh.dbg.device.avr.switch_to_debmode.assert_called_once()
+
+    def test_dispatch_forgets_stop_pc(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.dispatch('H', b'g0')
+        self.gh.bp.forget_stop_pc.assert_not_called()
+        self.gh.dispatch('P', b'22=00010000')
+        self.gh.bp.forget_stop_pc.assert_called_once()
+
     def test_remove_breakpoint_handler_impossible(self):
         # even when debugger is not active, success is returned
         self.gh.mon.is_debugger_active.return_value = False
@@ -400,9 +490,17 @@ class TestGdbHandler(TestCase):
 
     def test_remove_breakpoint_handler_wrong_type(self):
         self.gh.mon.is_debugger_active.return_value = True
+        self.gh.bp.remove_watchpoint.return_value = None
         self.gh.dispatch('z',b'2,111,2')
         self.gh._comsocket.sendall.assert_called_with(rsp(''))
 
+    def test_remove_watchpoint_handler(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.bp.remove_watchpoint.return_value = True
+        self.gh.dispatch('z',b'3,800111,2')
+        self.gh.bp.remove_watchpoint.assert_called_with(3, 0x800111, 2)
+        self.gh._comsocket.sendall.assert_called_with(rsp('OK'))
+
     def test_remove_breakpoint_handler(self):
         self.gh.mon.is_debugger_active.return_value = True
         self.gh.dispatch('z',b'0,222,2')
@@ -418,16 +516,56 @@ class TestGdbHandler(TestCase):
 
     def test_add_breakpoint_handler_wrong_type(self):
         self.gh.mon.is_debugger_active.return_value = True
+        self.gh.bp.insert_watchpoint.return_value = None
         self.gh.dispatch('Z',b'2,111,2')
         self.gh._comsocket.sendall.assert_called_with(rsp(''))
 
+    def test_add_watchpoint_handler(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.bp.insert_watchpoint.return_value = True
+        self.gh.dispatch('Z',b'2,800100,1')
+        self.gh.bp.insert_watchpoint.assert_called_with(2, 0x800100, 1)
+        self.gh._comsocket.sendall.assert_called_with(rsp('OK'))
+
+    def test_add_watchpoint_handler_exhausted(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.bp.insert_watchpoint.return_value = False
+        self.gh.dispatch('Z',b'4,800100,4')
+        self.gh._comsocket.sendall.assert_called_with(rsp('E01'))
+
     def test_add_breakpoint_handler_new(self):
         self.gh.mon.is_debugger_active.return_value = True
         self.gh.dispatch('Z',b'0,222,2')
         # note: for  breakpoints, it is always the byte address!
-        self.gh.bp.insert_breakpoint.assert_called_with(0x222)
+        self.gh.bp.insert_breakpoint.assert_called_with(0x222, [], [])
+        self.gh._comsocket.sendall.assert_called_with(rsp('OK'))
+
+    def test_add_breakpoint_handler_with_conditions(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.dispatch('Z',b'0,222,2;X3,220527X2,2727')
+        args = self.gh.bp.insert_breakpoint.call_args[0]
+        self.assertEqual(args[0], 0x222)
+        self.assertEqual([cond.code for cond in args[1]], [b'\x22\x05\x27', b'\x27\x27'])
+        self.gh._comsocket.sendall.assert_called_with(rsp('OK'))
+
+    def test_add_breakpoint_handler_with_commands(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.dispatch('Z',b'0,222,2;X2,2201;cmds:0,X3,220527X1,27')
+        args = self.gh.bp.insert_breakpoint.call_args[0]
+        self.assertEqual([cond.code for cond in args[1]], [b'\x22\x01'])
+        self.assertEqual([cmd.code for cmd in args[2]], [b'\x22\x05\x27', b'\x27'])
         self.gh._comsocket.sendall.assert_called_with(rsp('OK'))
 
+    def test_send_debug_message_without_newline(self):
+        self.gh.send_debug_message("Hi", newline=False)
+        self.gh._comsocket.sendall.assert_called_with(rsp("O4869"))
+
+    def test_add_breakpoint_handler_with_illegal_condition(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.dispatch('Z',b'0,222,2;X3,2205')
+        self.gh.bp.insert_breakpoint.assert_not_called()
+        self.gh._comsocket.sendall.assert_called_with(rsp('E01'))
+
     def test_poll_events_impossible(self):
         self.gh.mon.is_debugger_active.return_value = False
         self.gh.poll_events()
@@ -440,10 +578,196 @@ class TestGdbHandler(TestCase):
         self.gh.dbg.program_counter_read.return_value = 0x00000101
         self.gh.dbg.stack_pointer_read.return_value = bytearray([0x34, 0x12])
         self.gh.dbg.status_register_read.return_value = [0x88]
+        self.gh.bp.handle_stop.return_value = 5
+        self.gh.bp.stop_reason.return_value = ""
         self.gh.poll_events()
         self.gh.dbg.poll_event.assert_called_once()
+        self.gh.bp.handle_stop.assert_called_with(0x202)
         self.gh._comsocket.sendall.assert_called_with(rsp("T0520:88;21:3412;22:02020000;thread:1;"))
 
+    def test_poll_events_sampling(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.dbg.poll_event.return_value = None
+        self.gh.profiler = create_autospec(Profiler, spec_set=True, instance=True)
+        self.gh.profiler.due.return_value = True
+        self.gh.profiler.sample.return_value = None
+        self.gh.bp.sampling_possible.return_value = True
+        self.gh.poll_events()
+        self.gh.profiler.sample.assert_not_called()
+        self.gh._running = True
+        self.gh.poll_events()
+        self.gh.profiler.sample.assert_called_once()
+        self.gh.bp.handle_stop.assert_not_called()
+        self.gh._comsocket.sendall.assert_not_called()
+
+    def test_poll_events_sampling_at_breakpoint(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.dbg.poll_event.return_value = None
+        self.gh.dbg.program_counter_read.return_value = 0x00000101
+        self.gh.dbg.stack_pointer_read.return_value = bytearray([0x34, 0x12])
+        self.gh.dbg.status_register_read.return_value = [0x88]
+        self.gh.profiler = create_autospec(Profiler, spec_set=True, instance=True)
+        self.gh.profiler.due.return_value = True
+        self.gh.profiler.sample.return_value = 0x202
+        self.gh.bp.sampling_possible.return_value = True
+        self.gh.bp.handle_stop.return_value = 5
+        self.gh.bp.stop_reason.return_value = ""
+        self.gh._running = True
+        self.gh.poll_events()
+        self.gh.bp.handle_stop.assert_called_with(0x202)
+        self.gh._comsocket.sendall.assert_called_with(rsp("T0520:88;21:3412;22:02020000;thread:1;"))
+        self.assertFalse(self.gh._running)
+
+    def test_poll_interval(self):
+        self.gh.profiler = create_autospec(Profiler, spec_set=True, instance=True)
+        self.gh.profiler.active.return_value = True
+        self.gh.profiler.interval.return_value = 0.01
+        self.assertEqual(self.gh.poll_interval(), 0.5)
+        self.gh._running = True
+        self.assertEqual(self.gh.poll_interval(), 0.01)
+
+    def test_monitor_profile_stop(self):
+        self.gh.mon.dispatch.return_value = ("profile stop", "")
+        self.gh.mon.profile_output.return_value = ("out.folded", "missing.elf")
+        self.gh.profiler = create_autospec(Profiler, spec_set=True, instance=True)
+        self.gh.profiler.active.return_value = True
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"profile stop out.folded missing.elf"))
+        self.gh.profiler.stop.assert_called_once()
+        self.gh.profiler.write_folded.assert_not_called()
+
+    def test_monitor_profile_server(self):
+        self.gh.server_profiler = create_autospec(ServerProfiler, spec_set=True, instance=True)
+        self.gh.mon.dispatch.return_value = ("profile-server on", "Profiling the GDB server")
+        self.gh.mon.server_profile_parameters.return_value = ("x.prof", True)
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"profile-server on x.prof packets"))
+        self.gh.server_profiler.start.assert_called_with("x.prof", True)
+        self.gh.mon.dispatch.return_value = ("profile-server off", "")
+        self.gh.server_profiler.stop.return_value = "Server profile written to x.prof and x.prof.txt"
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"profile-server off"))
+        self.gh._comsocket.sendall.assert_called_with(
+            rsp(binascii.hexlify(b"Server profile written to x.prof and x.prof.txt\n").decode('ascii').upper()))
+
+    def test_monitor_stats(self):
+        self.gh.mon.dispatch.return_value = ("stats enable", "Recording packet statistics")
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"stats enable"))
+        self.assertTrue(self.gh.stats.enabled)
+        self.gh.dispatch('H', b'g0')
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.bp.single_step.return_value = None
+        self.gh.dispatch('vCont', b';s:1')
+        self.assertEqual(sorted(self.gh.stats.packet_types()), ['H', 'vCont;s'])
+        self.gh.mon.dispatch.return_value = ("stats", "")
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"stats"))
+        report = binascii.unhexlify(self.gh._comsocket.sendall.call_args[0][0][1:-3]).decode('utf-8')
+        self.assertIn("vCont;s", report)
+        self.gh.mon.dispatch.return_value = ("stats reset", "Packet statistics have been reset")
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"stats reset"))
+        self.assertEqual(self.gh.stats.packet_types(), ['qRcmd'])
+
+    def test_monitor_trace_dump(self):
+        trace.clear()
+        self.gh.mon.dispatch.return_value = ("trace-dump", "")
+        self.gh.mon.trace_dump_parameters.return_value = 50
+        self.gh.handle_data(b'$qRcmd,' + binascii.hexlify(b"trace-dump") + b'#' +
+                                '{:02x}'.format(sum(b'qRcmd,' + binascii.hexlify(b"trace-dump")) % 256).encode())
+        dump = binascii.unhexlify(self.gh._comsocket.sendall.call_args[0][0][1:-3]).decode('utf-8')
+        self.assertIn("rsp in: 26 bytes b'qRcmd,7'", dump)
+        self.assertEqual(trace.records()[-1][0], RSP_OUT)
+        self.gh.mon.dispatch.return_value = ("trace-dump disable", "Events are not recorded in the trace buffer")
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"trace-dump disable"))
+        self.assertFalse(trace.enabled)
+        self.gh.mon.dispatch.return_value = ("trace-dump enable", "Recording events in the trace buffer")
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"trace-dump enable"))
+        self.assertTrue(trace.enabled)
+
+    def test_monitor_trace(self):
+        self.gh.mon.dispatch.return_value = ("trace", "Traced {} instruction(s) into {}, stopped at 0x{:X}{}")
+        self.gh.mon.trace_parameters.return_value = ("out.trc", 10)
+        self.gh.bp.multi_step.return_value = (3, 5)
+        self.gh.dbg.program_counter_read.return_value = 0x80
+        with patch('pyavrocd.toolcommands.TraceWriter') as writer:
+            self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"trace start out.trc 10"))
+            writer.assert_called_once_with("out.trc")
+            writer.return_value.close.assert_called_once()
+        self.gh.bp.multi_step.assert_called_once()
+        self.assertEqual(self.gh.bp.multi_step.call_args[0][:2], (10, [('bp',)]))
+        self.gh._comsocket.sendall.assert_called_with(
+            rsp(binascii.hexlify(b"Traced 3 instruction(s) into out.trc, stopped at 0x100\n").decode('ascii').upper()))
+
+    def test_reverse_step(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.mem.is_flash_empty.return_value = False
+        self.gh.bp.reverse_step.return_value = SIGTRAP
+        self.gh.bp.stop_reason.return_value = "replaylog:begin;"
+        self.gh.dbg.status_register_read.return_value = [0x00]
+        self.gh.dbg.stack_pointer_read.return_value = bytearray([0xFF, 0x08])
+        self.gh.dbg.program_counter_read.return_value = 0x80
+        self.gh.dispatch('b', b's')
+        self.gh.bp.reverse_step.assert_called_once()
+        self.gh._comsocket.sendall.assert_called_with(rsp("T05replaylog:begin;20:00;21:FF08;22:00010000;thread:1;"))
+        self.gh.dispatch('b', b'x')
+        self.gh._comsocket.sendall.assert_called_with(rsp(""))
+        self.gh.bp.reverse_continue.assert_not_called()
+
+    def test_monitor_console(self):
+        self.gh.mon.dispatch.return_value = ("console on", "")
+        self.gh.mon.console_parameters.return_value = ("fw.elf", "pyavrocd_console")
+        with patch('pyavrocd.toolcommands.ElfSymbols') as symbols:
+            symbols.return_value.address_of.return_value = (0x800200, 18)
+            self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"console fw.elf"))
+            symbols.assert_called_once_with("fw.elf")
+        self.assertEqual(self.gh.console.address(), 0x200)
+        self.gh._comsocket.sendall.assert_called_with(
+            rsp(binascii.hexlify(b"Console buffer 'pyavrocd_console' at 0x200\n").decode('ascii').upper()))
+        with patch('pyavrocd.toolcommands.ElfSymbols') as symbols:
+            symbols.return_value.address_of.return_value = (0x100, 18)
+            self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"console fw.elf"))
+        self.gh._comsocket.sendall.assert_called_with(
+            rsp(binascii.hexlify(b"No SRAM object 'pyavrocd_console' in fw.elf\n").decode('ascii').upper()))
+
+    def test_console_drained_at_stop(self):
+        self.gh.console.attach(0x200, 10)
+        self.gh.dbg.sram_read.return_value = bytearray([3, 0]) + b'Hi\n' + bytes(5)
+        self.gh.dbg.status_register_read.return_value = [0x00]
+        self.gh.dbg.stack_pointer_read.return_value = bytearray([0xFF, 0x08])
+        self.gh.dbg.program_counter_read.return_value = 0x80
+        self.gh.send_signal(SIGTRAP)
+        self.assertEqual(self.gh._comsocket.sendall.call_args_list[0],
+                             call(rsp("O" + binascii.hexlify(b"Hi\n").decode('ascii').upper())))
+        self.gh._comsocket.sendall.assert_called_with(rsp("T0520:00;21:FF08;22:00010000;thread:1;"))
+
+    def test_monitor_checkpoint(self):
+        self.gh.checkpoints = create_autospec(CheckpointStore, specSet=True, instance=True)
+        self.gh.mon.checkpoint_spill_dir.return_value = None
+        self.gh.mon.checkpoint_parameters.return_value = ("a", False)
+        self.gh.mon.dispatch.return_value = ("checkpoint restore", "")
+        self.gh.checkpoints.restore.return_value = None
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"checkpoint restore a"))
+        self.gh._comsocket.sendall.assert_called_with(
+            rsp(binascii.hexlify(b"No checkpoint 'a'\n").decode('ascii').upper()))
+        self.gh.checkpoints.restore.return_value = Mock()
+        self.gh.dbg.program_counter_read.return_value = 0x80
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"checkpoint restore a"))
+        self.gh.checkpoints.restore.assert_called_with("a")
+        self.gh.bp.forget_stop_pc.assert_called()
+        self.gh.checkpoints.set_spill_dir.assert_called_with(None)
+        self.gh.mon.dispatch.return_value = ("checkpoint", "")
+        self.gh.checkpoints.names.return_value = ["b", "a"]
+        self.gh.dispatch('qRcmd', b',' + binascii.hexlify(b"checkpoint"))
+        self.gh._comsocket.sendall.assert_called_with(
+            rsp(binascii.hexlify(b"Checkpoints: b, a\n").decode('ascii').upper()))
+
+    def test_poll_events_watchpoint(self):
+        self.gh.mon.is_debugger_active.return_value = True
+        self.gh.dbg.poll_event.return_value = 0x101
+        self.gh.dbg.program_counter_read.return_value = 0x00000101
+        self.gh.dbg.stack_pointer_read.return_value = bytearray([0x34, 0x12])
+        self.gh.dbg.status_register_read.return_value = [0x88]
+        self.gh.bp.handle_stop.return_value = 5
+        self.gh.bp.stop_reason.return_value = "watch:800100;"
+        self.gh.poll_events()
+        self.gh._comsocket.sendall.assert_called_with(rsp("T05watch:800100;20:88;21:3412;22:02020000;thread:1;"))
+
     @patch('pyavrocd.main.select.select', Mock(return_value=[None, None, None]))
     def test_poll_gdb_input_false(self):
         self.assertFalse(self.gh.poll_gdb_input())
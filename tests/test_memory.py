@@ -130,6 +130,32 @@ class TestMemory(TestCase):
         self.mem.dbg.device.avr.write_memory_section.assert_called_with(fmt, 0, bytearray([0,1,2,3,0xFF,0xFF]),
                                                                             2, allow_blank_skip=False)
 
+    def test_flash_pages_with_breakpoint_overlay(self):
+        self.mem.dbg.device.avr.write_memory_section = Mock()
+        self.mem._flash = bytearray(range(4))
+        self.mem.mon.is_read_before_write.return_value = True
+        self.mem.mon.is_erase_before_load.return_value = False
+        self.mem.breakpoint_overlay = Mock(side_effect=lambda addr, page: page[:2] + bytearray([0x98, 0x95]) + page[4:])
+        self.mem.dbg.flash_read.side_effect = [bytearray([0,1]), bytearray([0x98,0x95]), bytearray([0xFF,0xFF])]
+        self.mem.flash_pages()
+        self.mem.breakpoint_overlay.assert_called_once_with(0, bytearray(range(4)))
+        self.mem.dbg.device.avr.write_memory_section.assert_not_called()
+        self.assertEqual(self.mem._flash, bytearray(range(4)))
+
+    def test_cached_flash_word(self):
+        self.mem._flash = bytearray(range(4))
+        self.assertEqual(self.mem.cached_flash_word(2), 0x0302)
+        self.assertEqual(self.mem.cached_flash_word(4), None)
+
+    def test_flash_write_deferred(self):
+        self.mem.dbg.device.avr.write_memory_section = Mock()
+        self.mem.defer_programming = True
+        self.mem.flash_write(0, bytearray(range(4)))
+        self.mem.flash_write(4, bytearray(range(2)))
+        self.assertEqual(self.mem._flash, bytearray([0, 1, 2, 3, 0, 1]))
+        self.mem.dbg.flash_read.assert_not_called()
+        self.mem.dbg.device.avr.write_memory_section.assert_not_called()
+
     def test_flash_pages_error(self):
         self.mem.mon.is_verify.return_value = True
         self.mem.mon.is_read_before_write.return_value = False
@@ -118,6 +118,12 @@ class TestMonitorCommand(TestCase):
         self.assertEqual(self.mo.dispatch(['range']), ("", "Range stepping is disabled"))
         self.assertEqual(self.mo.dispatch(['rangestepping', 'enable']), ("", "Range stepping is enabled"))
         self.assertTrue(self.mo._range)
+        self.assertFalse(self.mo.is_stepover())
+        self.assertEqual(self.mo.dispatch(['rangestepping', 'stepover']), ("", "Range stepping is enabled, calls are stepped over"))
+        self.assertTrue(self.mo.is_stepover())
+        self.assertEqual(self.mo.dispatch(['range']), ("", "Range stepping is enabled, calls are stepped over"))
+        self.assertEqual(self.mo.dispatch(['range', 'e']), ("", "Range stepping is enabled"))
+        self.assertFalse(self.mo.is_stepover())
 
 
     def test_dispatch_reset(self):
@@ -134,6 +140,132 @@ class TestMonitorCommand(TestCase):
         self.assertEqual(self.mo.dispatch(['s', 's']), ("", "Single-stepping is interrupt-safe"))
         self.assertTrue(self.mo._safe)
 
+    def test_dispatch_profile_server(self):
+        self.assertEqual(self.mo.dispatch(['profile-server']), ("profile-server", ""))
+        self.assertEqual(self.mo.dispatch(['profile-server', 'on']), ("profile-server on", "Profiling the GDB server"))
+        self.assertEqual(self.mo.server_profile_parameters(), (None, False))
+        self.assertEqual(self.mo.dispatch(['profile-server', 'on', 'packets', 'x.prof'])[0], "profile-server on")
+        self.assertEqual(self.mo.server_profile_parameters(), ("x.prof", True))
+        self.assertEqual(self.mo.dispatch(['profile-server', 'on', 'a', 'b']), ("", "Unknown argument in 'monitor' command"))
+        self.assertEqual(self.mo.dispatch(['profile-server', 'off']), ("profile-server off", ""))
+        # 'profile' is not ambiguous, since 'profile-server' needs to be spelled out
+        self.mo._debugger_active = True
+        self.assertEqual(self.mo.dispatch(['profile']), ("profile", ""))
+
+    def test_dispatch_stats(self):
+        self.assertEqual(self.mo.dispatch(['stats']), ("stats", ""))
+        self.assertEqual(self.mo.dispatch(['stats', 'e']), ("stats enable", "Recording packet statistics"))
+        self.assertEqual(self.mo.dispatch(['stats', 'disable']), ("stats disable", "Packet statistics are not recorded"))
+        self.assertEqual(self.mo.dispatch(['stats', 'reset']), ("stats reset", "Packet statistics have been reset"))
+        self.assertEqual(self.mo.dispatch(['stat']), ("", "Unknown 'monitor' command"))
+
+    def test_dispatch_trace_dump(self):
+        self.assertEqual(self.mo.dispatch(['trace-dump']), ("trace-dump", ""))
+        self.assertEqual(self.mo.trace_dump_parameters(), 50)
+        self.assertEqual(self.mo.dispatch(['trace-dump', '0x10']), ("trace-dump", ""))
+        self.assertEqual(self.mo.trace_dump_parameters(), 16)
+        self.assertEqual(self.mo.dispatch(['trace-dump', 'disable']),
+                             ("trace-dump disable", "Events are not recorded in the trace buffer"))
+        self.assertEqual(self.mo.dispatch(['trace-dump', 'enable']),
+                             ("trace-dump enable", "Recording events in the trace buffer"))
+        self.assertEqual(self.mo.dispatch(['trace-dump', '0']), ("", "Unknown argument in 'monitor' command"))
+        self.assertEqual(self.mo.dispatch(['trace-dump', '1', '2']), ("", "Unknown argument in 'monitor' command"))
+        # 'trace' is not ambiguous, since 'trace-dump' needs to be spelled out
+        self.assertEqual(self.mo.dispatch(['trace-d']), ("", "Unknown 'monitor' command"))
+
+    def test_dispatch_stepi(self):
+        self.mo._debugger_active = False
+        self.assertEqual(self.mo.dispatch(['stepi']), ("", "Debugger is not enabled"))
+        self.mo._debugger_active = True
+        self.assertEqual(self.mo.dispatch(['step']), ("", "Unknown 'monitor' command"))
+        self.assertEqual(self.mo.dispatch(['stepi']), ("", "Stepping on the server is not armed"))
+        self.assertIsNone(self.mo.stepi_parameters())
+        self.assertEqual(self.mo.dispatch(['stepi', '1000', 'pc', 'outside', '0x100', '0x120',
+                                               'r24', '==', '3', '*0x800100', '==', '0xFF',
+                                               'sp', '<', '0x8F0']),
+                             ("", "Next 'continue' single-steps up to 1000 instruction(s) on the server"))
+        self.assertEqual(self.mo.dispatch(['stepi'])[1],
+                             "Next 'continue' single-steps up to 1000 instruction(s) on the server")
+        self.assertEqual(self.mo.stepi_parameters(), (1000, [('pc', 0x100, 0x120), ('reg', 24, 3),
+                                                              ('mem', 0x100, 0xFF), ('sp', 0x8F0)]))
+        self.assertEqual(self.mo.dispatch(['stepi', '10', 'r24', '<', '3']),
+                             ("", "Illegal stop condition in 'stepi': r24 < 3"))
+        self.assertEqual(self.mo.dispatch(['stepi', '0x1g']), ("", "Unknown argument in 'monitor' command"))
+        self.assertEqual(self.mo.dispatch(['stepi', 'off']), ("", "Stepping on the server is not armed"))
+        self.assertIsNone(self.mo.stepi_parameters())
+        self.mo.dispatch(['stepi', 'pc', 'outside', '0', '8'])
+        self.assertEqual(self.mo.stepi_parameters(), (1, [('pc', 0, 8)]))
+        self.mo.clear_stepi()
+        self.assertIsNone(self.mo.stepi_parameters())
+
+    def test_dispatch_profile(self):
+        self.mo._debugger_active = False
+        self.assertEqual(self.mo.dispatch(['profile', 'start']), ("", "Debugger is not enabled"))
+        self.mo._debugger_active = True
+        self.assertEqual(self.mo.dispatch(['profile']), ("profile", ""))
+        self.assertEqual(self.mo.dispatch(['prof', 'start']), ("profile start", "Profiling with 50 samples/sec"))
+        self.assertEqual(self.mo.profile_parameters(), (50, False))
+        self.assertEqual(self.mo.dispatch(['profile', 'start', '200', 'callers'])[0], "profile start")
+        self.assertEqual(self.mo.profile_parameters(), (200, True))
+        self.assertEqual(self.mo.dispatch(['profile', 'start', '0']), ("", "Unknown argument in 'monitor' command"))
+        self.assertEqual(self.mo.dispatch(['profile', 'stop']), ("profile stop", ""))
+        self.assertEqual(self.mo.profile_output(), ("profile.folded", None))
+        self.assertEqual(self.mo.dispatch(['profile', 'stop', 'out.txt', 'prog.elf'])[0], "profile stop")
+        self.assertEqual(self.mo.profile_output(), ("out.txt", "prog.elf"))
+        self.assertEqual(self.mo.dispatch(['profile', 'stop', 'a', 'b', 'c']), ("", "Unknown argument in 'monitor' command"))
+
+    def test_dispatch_trace(self):
+        self.mo._debugger_active = True
+        self.assertEqual(self.mo.dispatch(['trace']), ("", "Usage: monitor trace start <file> [<max steps>]"))
+        self.assertEqual(self.mo.dispatch(['trace', 'start']), ("", "Usage: monitor trace start <file> [<max steps>]"))
+        self.assertEqual(self.mo.dispatch(['trace', 'start', 'out.trc'])[0], "trace")
+        self.assertEqual(self.mo.trace_parameters(), ("out.trc", 1000000))
+        self.assertEqual(self.mo.dispatch(['tr', 'st', 'out.trc', '0x100'])[0], "trace")
+        self.assertEqual(self.mo.trace_parameters(), ("out.trc", 256))
+        self.assertEqual(self.mo.dispatch(['trace', 'start', 'out.trc', 'many']), ("", "Unknown argument in 'monitor' command"))
+
+    def test_dispatch_checkpoint(self):
+        self.assertEqual(self.mo.dispatch(['checkpoint', 'save', 'a']), ("", "Debugger is not enabled"))
+        self.mo._debugger_active = True
+        self.assertEqual(self.mo.dispatch(['checkpoint']), ("checkpoint", ""))
+        self.assertEqual(self.mo.dispatch(['checkpoint', 'save', 'a']), ("checkpoint save", ""))
+        self.assertEqual(self.mo.checkpoint_parameters(), ("a", False))
+        self.assertEqual(self.mo.dispatch(['che', 'sa', 'b', 'eeprom']), ("checkpoint save", ""))
+        self.assertEqual(self.mo.checkpoint_parameters(), ("b", True))
+        self.assertEqual(self.mo.dispatch(['checkpoint', 'restore', 'a']), ("checkpoint restore", ""))
+        self.assertEqual(self.mo.checkpoint_parameters(), ("a", False))
+        self.assertEqual(self.mo.dispatch(['checkpoint', 'restore', 'a', 'eeprom'])[0], "")
+        self.assertEqual(self.mo.dispatch(['checkpoint', 'save'])[0], "")
+        self.assertEqual(self.mo.dispatch(['checkpoint', 'spill']), ("checkpoint spill", "Evicted checkpoints are discarded"))
+        self.assertEqual(self.mo.dispatch(['checkpoint', 'spill', '/tmp/ckp']),
+                             ("checkpoint spill", "Evicted checkpoints are spilled to /tmp/ckp"))
+        self.assertEqual(self.mo.checkpoint_spill_dir(), "/tmp/ckp")
+        self.mo.dispatch(['checkpoint', 'spill', 'off'])
+        self.assertIsNone(self.mo.checkpoint_spill_dir())
+
+    def test_dispatch_recording(self):
+        self.assertFalse(self.mo.is_recording())
+        self.assertEqual(self.mo.dispatch(['recording']), ("", "Recording is disabled"))
+        self.assertEqual(self.mo.dispatch(['rec', 'enable'])[0], "recording")
+        self.assertTrue(self.mo.is_recording())
+        self.assertEqual(self.mo.recording_depth(), 10000)
+        self.assertEqual(self.mo.dispatch(['recording', 'enable', '500']),
+                             ("recording", "Recording is enabled: {} of at most 500 instructions recorded"))
+        self.assertEqual(self.mo.recording_depth(), 500)
+        self.assertEqual(self.mo.dispatch(['recording', 'enable', '0']), ("", "Unknown argument in 'monitor' command"))
+        self.assertEqual(self.mo.dispatch(['recording', 'disable']), ("", "Recording is disabled"))
+        self.assertFalse(self.mo.is_recording())
+
+    def test_dispatch_console(self):
+        self.mo._debugger_active = True
+        self.assertEqual(self.mo.dispatch(['console']), ("console", ""))
+        self.assertEqual(self.mo.dispatch(['con', 'fw.elf']), ("console on", ""))
+        self.assertEqual(self.mo.console_parameters(), ("fw.elf", "pyavrocd_console"))
+        self.assertEqual(self.mo.dispatch(['console', 'fw.elf', 'logbuf']), ("console on", ""))
+        self.assertEqual(self.mo.console_parameters(), ("fw.elf", "logbuf"))
+        self.assertEqual(self.mo.dispatch(['console', 'off']), ("console off", "Console is disabled"))
+        self.assertEqual(self.mo.dispatch(['console', 'a', 'b', 'c']), ("", "Unknown argument in 'monitor' command"))
+
     def test_dispatch_timers(self):
         self.assertFalse(self.mo._timersfreeze)
         self.assertEqual(self.mo.dispatch(['timers', 'run']), (1, "Timers will run when execution is stopped"))
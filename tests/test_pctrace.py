@@ -0,0 +1,73 @@
+"""
+The test suit for the trace writer/reader and the offline trace tool
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+import os
+import tempfile
+from unittest.mock import create_autospec
+from unittest import TestCase
+from pyavrocd.snapshot import RegisterSnapshot
+from pyavrocd.pctrace import TraceWriter, read_trace, zigzag, unzigzag, encode_varint
+from pyavrocd.tracetool import analyze, report, main
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class TestTrace(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.trc')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, pcs, interval=1000):
+        snap = create_autospec(RegisterSnapshot, spec_set=True, instance=True)
+        snap.registers.return_value = bytearray(range(32))
+        snap.status_register.return_value = 0x80
+        snap.stack_pointer.return_value = 0x8FF
+        writer = TraceWriter(self.path, interval)
+        for pc in pcs:
+            snap.program_counter.return_value = pc
+            writer.record(snap)
+        return writer.close()
+
+    def test_encoding(self):
+        self.assertEqual([zigzag(v) for v in (0, -1, 1, -2, 2)], [0, 1, 2, 3, 4])
+        self.assertEqual([unzigzag(zigzag(v)) for v in (0, -1, 1, -200, 300)], [0, -1, 1, -200, 300])
+        self.assertEqual(encode_varint(1), bytearray([1]))
+        self.assertEqual(encode_varint(300), bytearray([0xAC, 0x02]))
+
+    def test_roundtrip(self):
+        pcs = [0x100, 0x102, 0x104, 0x108, 0x100, 0x102, 0x4000, 0x102]
+        self.assertEqual(self.write(pcs, interval=5), len(pcs))
+        records = list(read_trace(self.path))
+        self.assertEqual([pc for kind, pc in records if kind == 'pc'], pcs)
+        checkpoints = [cp for kind, cp in records if kind == 'checkpoint']
+        self.assertEqual(checkpoints, [(bytes(range(32)), 0x80, 0x8FF, 0x100),
+                                       (bytes(range(32)), 0x80, 0x8FF, 0x102)])
+        # straight-line code needs one byte per instruction
+        self.assertEqual(os.path.getsize(self.path), 8 + 2*40 + 4 + 2*2)
+
+    def test_not_a_trace(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        with self.assertRaises(ValueError):
+            list(read_trace(self.path))
+
+    def test_analyze(self):
+        self.write([0x100, 0x102, 0x104, 0x100, 0x102, 0x104, 0x100, 0x102, 0x104, 0x106])
+        steps, covered, blocks, backedges = analyze(self.path)
+        self.assertEqual(steps, 10)
+        self.assertEqual(covered, {0x100, 0x102, 0x104, 0x106})
+        self.assertEqual(blocks, {(0x100, 0x104): 2, (0x100, 0x106): 1})
+        self.assertEqual(backedges, {(0x104, 0x100): 2})
+        text = report(self.path, top=1)
+        self.assertIn("Instructions traced:   10", text)
+        self.assertIn("2  0x104 -> 0x100", text)
+
+    def test_main(self):
+        self.write([0x100, 0x102])
+        self.assertEqual(main([self.path]), 0)
+        self.assertEqual(main([self.path, '--elf', self.path + '.missing']), 1)
@@ -0,0 +1,52 @@
+"""
+The test suit for the probe timing model
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+from unittest import TestCase
+from pyavrocd.probemodel import ProbeModel, PRESETS
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class TestProbeModel(TestCase):
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            ProbeModel('foo')
+
+    def test_none(self):
+        model = ProbeModel()
+        model.read(1000)
+        model.program(256, 128)
+        self.assertEqual(model.elapsed, 0)
+        self.assertEqual(model.transactions, 3)
+        self.assertEqual(model.pages_programmed, 2)
+
+    def test_packets(self):
+        model = ProbeModel('atmelice')
+        model.read(256)
+        self.assertEqual(model.transactions, 1)
+        model.write(257)
+        self.assertEqual(model.transactions, 3)
+        self.assertEqual((model.bytes_read, model.bytes_written), (256, 257))
+        model.reset()
+        self.assertEqual(model.statistics()['transactions'], 0)
+
+    def test_calibration(self):
+        # loading a 128-byte page with debugWIRE (erase + program) and reading it back,
+        # compared with the kB/s figures in docs/load-speed.md
+        for preset, load, read in (('dwlink', 0.6, 4), ('snap', 0.7, 12), ('pickit4', 0.6, 6),
+                                       ('atmelice', 1.0, 14), ('medbg', 0.3, 3), ('jtag', 8, 10)):
+            model = ProbeModel(preset)
+            model.erase()
+            model.program(128, 128)
+            self.assertAlmostEqual(0.128/model.elapsed, load, delta=load*0.05, msg=preset)
+            model.reset()
+            model.read(128)
+            self.assertAlmostEqual(0.128/model.elapsed, read, delta=read*0.05, msg=preset)
+
+    def test_report(self):
+        model = ProbeModel('snap')
+        model.command()
+        self.assertIn("Probe 'snap': 0.001 s simulated, 1 transactions", model.report())
+        self.assertEqual(set(PRESETS['snap']), set(PRESETS['none']))
@@ -0,0 +1,68 @@
+"""
+The test suit for the Profiler class
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+from unittest.mock import create_autospec
+from unittest import TestCase
+from pyavrocd.xavrdebugger import XAvrDebugger
+from pyavrocd.breakexec import BreakAndExec
+from pyavrocd.elfsymbols import ElfSymbols
+from pyavrocd.profiler import Profiler
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        mock_dbg = create_autospec(XAvrDebugger, spec_set=False, instance=True)
+        mock_bp = create_autospec(BreakAndExec, spec_set=True, instance=True)
+        mock_bp.is_stop_point.return_value = False
+        self.prof = Profiler(mock_dbg, mock_bp)
+
+    def test_start_stop(self):
+        self.assertFalse(self.prof.active())
+        self.assertFalse(self.prof.due())
+        self.prof.start(100)
+        self.assertTrue(self.prof.active())
+        self.assertEqual(self.prof.interval(), 0.01)
+        self.assertTrue(self.prof.due())
+        self.assertEqual(self.prof.stop(), 0)
+        self.assertFalse(self.prof.active())
+
+    def test_sample(self):
+        self.prof.start(10)
+        self.prof.dbg.program_counter_read.return_value = 0x80
+        self.assertIsNone(self.prof.sample())
+        self.prof.dbg.stop.assert_called_once()
+        self.prof.bp.resume_after_interrupt.assert_called_once()
+        self.assertFalse(self.prof.due())
+        self.assertEqual(self.prof._samples, {(None, 0x100): 1})
+
+    def test_sample_with_callers(self):
+        self.prof.start(10, callers=True)
+        self.prof.dbg.program_counter_read.return_value = 0x80
+        self.prof.dbg.stack_pointer_read.return_value = bytearray([0xF0, 0x08])
+        self.prof.dbg.sram_read.return_value = bytearray([0x00, 0x21])
+        self.prof.sample()
+        self.prof.dbg.sram_read.assert_called_with(0x8F1, 2)
+        self.assertEqual(self.prof._samples, {(0x42, 0x100): 1})
+
+    def test_sample_at_breakpoint(self):
+        self.prof.start(10)
+        self.prof.dbg.program_counter_read.return_value = 0x80
+        self.prof.bp.is_stop_point.return_value = True
+        self.assertEqual(self.prof.sample(), 0x100)
+        self.prof.bp.resume_after_interrupt.assert_not_called()
+        self.assertEqual(self.prof.sample_count(), 0)
+
+    def test_folded_and_summary(self):
+        symbols = create_autospec(ElfSymbols, spec_set=True, instance=True)
+        symbols.function_at.side_effect = lambda addr: {0x100: 'loop', 0x42: 'main'}.get(addr)
+        self.prof._samples.update({(0x42, 0x100): 3, (None, 0x200): 1})
+        self.assertEqual(self.prof.folded(symbols), "main;loop 3\n0x200 1\n")
+        self.assertEqual(self.prof.folded(), "0x42;0x100 3\n0x200 1\n")
+        self.assertEqual(self.prof.summary(symbols),
+                             "4 samples\n 75.00%       3  loop\n 25.00%       1  0x200")
+        self.prof._samples.clear()
+        self.assertEqual(self.prof.summary(), "No samples")
@@ -0,0 +1,60 @@
+"""
+The test suit for profiling the GDB server
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+import os
+import pstats
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+from pyavrocd.serverprofile import ServerProfiler
+from pyavrocd.stats import PacketStats
+
+logging.basicConfig(level=logging.CRITICAL)
+
+def busy(n):
+    return sum(i*i for i in range(n))
+
+class TestServerProfiler(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory() #pylint: disable=consider-using-with
+        self.path = os.path.join(self.dir.name, "server.prof")
+        self.stats = PacketStats(SimpleNamespace())
+        self.prof = ServerProfiler(self.stats, self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_profile(self):
+        self.assertFalse(self.prof.active())
+        self.assertEqual(self.prof.stop(), "Server profiling is not active")
+        self.prof.start()
+        self.assertTrue(self.prof.active())
+        busy(1000)
+        self.assertEqual(self.prof.stop(), "Server profile written to {} and {}.txt".format(self.path, self.path))
+        self.assertFalse(self.prof.active())
+        names = [func[2] for func in pstats.Stats(self.path).stats]
+        self.assertIn('busy', names)
+        with open(self.path + ".txt", encoding='utf-8') as f:
+            text = f.read()
+        self.assertIn('busy', text)
+        self.assertNotIn('Packet', text)
+
+    def test_profile_packets(self):
+        path = os.path.join(self.dir.name, "other.prof")
+        self.prof.start(path, packets=True)
+        self.assertTrue(self.stats.enabled)
+        self.stats.end('m', self.stats.begin())
+        self.assertEqual(self.prof.path(), path)
+        self.prof.stop()
+        self.assertFalse(self.stats.enabled)
+        with open(path + ".txt", encoding='utf-8') as f:
+            text = f.read()
+        self.assertIn('Packet', text)
+        self.assertNotIn('Recording is disabled', text)
+
+    def test_unwritable(self):
+        self.prof.start(os.path.join(self.dir.name, "missing", "x.prof"))
+        self.assertTrue(self.prof.stop().startswith("Could not write profile"))
@@ -0,0 +1,240 @@
+"""
+The test suit for the AVR instruction-set simulator
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+import time
+from unittest import TestCase
+from pyavrocd.simulator import SimDebugger
+from pyavrocd.avrcore import AvrCore, BREAKCODE, SREG, C, Z, N, V, S, H
+from pyavrocd.xavr8target import HWBP_DATA_WRITE
+
+logging.basicConfig(level=logging.CRITICAL)
+
+# a few instruction encoders
+def ldi(d, k):
+    return 0xE000 | ((k & 0xF0) << 4) | ((d - 16) << 4) | (k & 0x0F)
+
+def rr_op(base, d, r):
+    return base | ((r & 0x10) << 5) | (d << 4) | (r & 0x0F)
+
+def add(d, r):
+    return rr_op(0x0C00, d, r)
+
+def sub(d, r):
+    return rr_op(0x1800, d, r)
+
+def sbc(d, r):
+    return rr_op(0x0800, d, r)
+
+def cpse(d, r):
+    return rr_op(0x1000, d, r)
+
+def mul(d, r):
+    return rr_op(0x9C00, d, r)
+
+def sts(addr, r):
+    return [0x9200 | (r << 4), addr]
+
+def lds(r, addr):
+    return [0x9000 | (r << 4), addr]
+
+def push(r):
+    return 0x920F | (r << 4)
+
+def pop(r):
+    return 0x900F | (r << 4)
+
+def rjmp(k):
+    return 0xC000 | (k & 0x0FFF)
+
+def rcall(k):
+    return 0xD000 | (k & 0x0FFF)
+
+RET = 0x9508
+NOP = 0x0000
+
+def program(core, words, start=0):
+    flat = []
+    for w in words:
+        flat.extend(w if isinstance(w, list) else [w])
+    for i, w in enumerate(flat):
+        core.flash[(start+i)*2:(start+i)*2+2] = w.to_bytes(2, byteorder='little')
+    return len(flat)
+
+def wait_for_event(sim):
+    for _ in range(200):
+        event = sim.poll_event()
+        if event is not None:
+            return event
+        time.sleep(0.01)
+    return None
+
+class TestAvrCore(TestCase):
+
+    def setUp(self):
+        self.core = AvrCore(0x8000, 0x100, 0x800, 0x400)
+        self.core.reset()
+
+    def run_steps(self, n):
+        for _ in range(n):
+            self.assertIsNone(self.core.step())
+
+    def test_reset(self):
+        self.assertEqual(self.core.sp(), 0x8FF)
+        self.assertEqual(self.core.pc, 0)
+
+    def test_add_flags(self):
+        program(self.core, [ldi(16, 0x7F), ldi(17, 0x01), add(16, 17)])
+        self.run_steps(3)
+        self.assertEqual(self.core.data[16], 0x80)
+        self.assertEqual(self.core.data[SREG], H|V|N)
+        self.assertEqual(self.core.cycles, 3)
+
+    def test_sub_with_carry(self):
+        program(self.core, [ldi(16, 0x00), ldi(17, 0x01), ldi(18, 0x01), ldi(19, 0x00),
+                                sub(16, 18), sbc(17, 19)])
+        self.run_steps(6)
+        self.assertEqual((self.core.data[16], self.core.data[17]), (0xFF, 0x00))
+        # Z is only kept by SBC, never set
+        self.assertEqual(self.core.data[SREG] & (Z|C), 0)
+
+    def test_memory_and_stack(self):
+        program(self.core, [ldi(16, 0x42), sts(0x200, 16), lds(20, 0x200), push(20), pop(21)])
+        self.run_steps(5)
+        self.assertEqual(self.core.data[0x200], 0x42)
+        self.assertEqual(self.core.data[21], 0x42)
+        self.assertEqual(self.core.sp(), 0x8FF)
+        self.assertEqual(self.core.pc, 7)
+
+    def test_call_and_return(self):
+        program(self.core, [rcall(2), NOP, NOP, RET])
+        self.run_steps(1)
+        self.assertEqual(self.core.pc, 3)
+        self.assertEqual(self.core.data[0x8FF], 1)
+        self.run_steps(1)
+        self.assertEqual(self.core.pc, 1)
+        self.assertEqual(self.core.cycles, 7)
+
+    def test_skip_two_word(self):
+        program(self.core, [cpse(0, 1), sts(0x200, 16), NOP])
+        self.run_steps(1)
+        self.assertEqual(self.core.pc, 3)
+        self.assertEqual(self.core.cycles, 3)
+
+    def test_mul_adiw(self):
+        program(self.core, [ldi(16, 200), ldi(17, 3), mul(16, 17), 0x9601]) # ADIW r24,1
+        self.core.data[24:26] = bytes([0xFF, 0x7F])
+        self.run_steps(4)
+        self.assertEqual(self.core.data[0] | (self.core.data[1] << 8), 600)
+        self.assertEqual(self.core.data[24:26], bytes([0x00, 0x80]))
+        self.assertEqual(self.core.data[SREG] & (V|N|S), V|N)
+
+    def test_break(self):
+        program(self.core, [BREAKCODE])
+        self.assertEqual(self.core.step(), 'break')
+        self.assertEqual(self.core.pc, 0)
+        self.assertIsNone(self.core.step(NOP))
+        self.assertEqual(self.core.pc, 1)
+
+    def test_watch(self):
+        program(self.core, [sts(0x200, 16), lds(16, 0x200)])
+        self.core.watch = { 0x200: HWBP_DATA_WRITE }
+        self.run_steps(1)
+        self.assertEqual(self.core.watch_hit, 0x200)
+        self.core.watch_hit = None
+        self.run_steps(1)
+        self.assertIsNone(self.core.watch_hit)
+
+class TestSimDebugger(TestCase):
+
+    def setUp(self):
+        self.sim = SimDebugger('atmega328p', 'debugwire')
+        self.loop = program(self.sim.core, [ldi(16, 1), add(17, 16), sts(0x100, 17), rjmp(-4)])
+
+    def tearDown(self):
+        self.sim.stop()
+
+    def test_registers(self):
+        self.sim.register_file_write(bytearray(range(32)))
+        self.assertEqual(self.sim.register_file_read(), bytearray(range(32)))
+        self.sim.stack_pointer_write(bytearray([0x00, 0x08]))
+        self.assertEqual(self.sim.stack_pointer_read(), bytearray([0x00, 0x08]))
+        self.sim.program_counter_write(0x10)
+        self.assertEqual(self.sim.program_counter_read(), 0x10)
+        self.assertEqual(self.sim.read_sig(0, 3), bytearray([0x1E, 0x95, 0x0F]))
+
+    def test_step(self):
+        self.sim.step()
+        self.sim.step()
+        self.assertEqual(self.sim.register_file_read()[17], 1)
+        self.assertEqual(self.sim.program_counter_read(), 2)
+
+    def test_software_breakpoint(self):
+        self.sim.software_breakpoint_set(4)
+        self.assertEqual(self.sim.flash_read(4, 2), BREAKCODE.to_bytes(2, byteorder='little'))
+        self.sim.run()
+        self.assertEqual(wait_for_event(self.sim), 2)
+        self.assertIsNone(self.sim.poll_event())
+        # the original instruction is executed when continuing from the breakpoint
+        self.sim.run()
+        self.assertEqual(wait_for_event(self.sim), 2)
+        self.assertEqual(self.sim.sram_read(0x100, 1), bytearray([1]))
+        self.assertEqual(self.sim.register_file_read()[17], 2)
+        self.sim.software_breakpoint_clear_all()
+        self.assertEqual(self.sim.flash_read(4, 2), sts(0x100, 17)[0].to_bytes(2, byteorder='little'))
+
+    def test_run_to_and_stop(self):
+        self.sim.run_to(0x100)
+        time.sleep(0.05)
+        self.assertIsNone(self.sim.poll_event())
+        self.sim.stop()
+        self.assertIsNone(self.sim.poll_event())
+        self.sim.program_counter_write(0)
+        self.sim.run_to(8)
+        self.assertEqual(wait_for_event(self.sim), 4)
+
+    def test_watchpoint(self):
+        sim = SimDebugger('atmega1284p', 'jtag')
+        program(sim.core, [ldi(16, 1), add(17, 16), sts(0x100, 17), rjmp(-4)])
+        try:
+            sim.hardware_watchpoint_set(1, 0x100, HWBP_DATA_WRITE)
+            sim.run()
+            self.assertEqual(wait_for_event(sim), 4)
+            sim.hardware_breakpoint_clear(1)
+            self.assertEqual(sim.core.watch, {})
+        finally:
+            sim.stop()
+
+    def test_hardware_breakpoint_slots(self):
+        # debugWIRE has only the implicit HWBP 0 of run_to
+        with self.assertLogs('pyavrocd.simulator', level='ERROR'):
+            self.assertFalse(self.sim.hardware_breakpoint_set(1, 0x10))
+            self.assertFalse(self.sim.hardware_watchpoint_set(1, 0x100, HWBP_DATA_WRITE))
+            self.assertFalse(self.sim.hardware_breakpoint_clear(1))
+        sim = SimDebugger('atmega1284p', 'jtag')
+        self.assertTrue(sim.hardware_breakpoint_set(3, 0x10))
+        self.assertTrue(sim.hardware_breakpoint_clear(3))
+        with self.assertLogs('pyavrocd.simulator', level='ERROR'):
+            self.assertFalse(sim.hardware_breakpoint_clear(0))
+            self.assertFalse(sim.hardware_breakpoint_clear(4))
+
+    def test_programming(self):
+        avr = self.sim.device.avr
+        flash = self.sim.memory_info.memory_info_by_name('flash')
+        avr.write_memory_section(avr.memtype_write_from_string('flash'), 0x80, bytearray([1]*0x80), 0x80)
+        self.assertEqual(self.sim.flash_read(0x80, 2), bytearray([1, 1]))
+        self.sim.device.erase_page(0x82)
+        self.assertTrue(avr.is_blank(self.sim.device.read(flash, 0x80, 0x80)))
+        self.assertEqual((self.sim.model.pages_programmed, self.sim.model.pages_erased), (1, 1))
+        eeprom = self.sim.memory_info.memory_info_by_name('eeprom')
+        self.sim.device.write(eeprom, 0x10, bytearray([5, 6]))
+        self.assertEqual(self.sim.device.read(eeprom, 0x10, 2), bytearray([5, 6]))
+
+    def test_probe_model(self):
+        sim = SimDebugger('atmega328p', 'debugwire', 'dwlink')
+        sim.register_file_read()
+        sim.software_breakpoints_set([0, 4])
+        self.assertEqual(sim.model.transactions, 2)
+        self.assertEqual(sim.model.bytes_read, 32)
+        self.assertAlmostEqual(sim.model.elapsed, 0.002 + 32*0.000242)
@@ -0,0 +1,41 @@
+"""
+The test suit for the RegisterSnapshot class
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+from unittest.mock import create_autospec
+from unittest import TestCase
+from pyavrocd.xavrdebugger import XAvrDebugger
+from pyavrocd.snapshot import RegisterSnapshot
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class TestRegisterSnapshot(TestCase):
+
+    def setUp(self):
+        mock_dbg = create_autospec(XAvrDebugger, spec_set=False, instance=True)
+        self.snap = RegisterSnapshot(mock_dbg)
+
+    def test_registers_read_once(self):
+        self.snap.dbg.register_file_read.return_value = bytearray(range(32))
+        self.assertEqual(self.snap.register(24), 24)
+        self.assertEqual(self.snap.register(25), 25)
+        self.snap.dbg.register_file_read.assert_called_once()
+
+    def test_special_registers(self):
+        self.snap.dbg.status_register_read.return_value = bytearray([0x82])
+        self.snap.dbg.stack_pointer_read.return_value = bytearray([0xFF, 0x08])
+        self.snap.dbg.program_counter_read.return_value = 0x101
+        self.assertEqual(self.snap.status_register(), 0x82)
+        self.assertEqual(self.snap.stack_pointer(), 0x8FF)
+        self.assertEqual(self.snap.program_counter(), 0x202)
+        self.snap.program_counter()
+        self.snap.dbg.program_counter_read.assert_called_once()
+
+    def test_invalidate(self):
+        self.snap.dbg.program_counter_read.return_value = 0x101
+        self.snap.program_counter()
+        self.snap.invalidate()
+        self.snap.dbg.program_counter_read.return_value = 0x102
+        self.assertEqual(self.snap.program_counter(), 0x204)
+        self.assertEqual(self.snap.dbg.program_counter_read.call_count, 2)
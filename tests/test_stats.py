@@ -0,0 +1,74 @@
+"""
+The test suit for the packet statistics
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+from types import SimpleNamespace
+from unittest import TestCase
+from pyavrocd.stats import PacketStats, CountingTransport, probe_counters, percentile
+from pyavrocd.probemodel import ProbeModel
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class FakeTransport():
+    def __init__(self):
+        self.device = SimpleNamespace(product_string="Fake-ICE")
+
+    @staticmethod
+    def hid_transfer(data):
+        return bytearray(len(data) + 1)
+
+    @staticmethod
+    def hid_write(data):
+        return len(data)
+
+    @staticmethod
+    def hid_read():
+        return bytearray(3)
+
+class TestStats(TestCase):
+
+    def test_percentile(self):
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_counting_transport(self):
+        transport = CountingTransport(FakeTransport())
+        self.assertEqual(transport.device.product_string, "Fake-ICE")
+        self.assertEqual(transport.hid_transfer(bytearray(4)), bytearray(5))
+        self.assertEqual(transport.transfers, 0)
+        PacketStats(SimpleNamespace(transport=transport)).enable()
+        self.assertTrue(transport.counting)
+        transport.hid_transfer(bytearray(4))
+        transport.hid_write(bytearray(2))
+        transport.hid_read()
+        self.assertEqual((transport.transfers, transport.bytes), (3, 4 + 5 + 2 + 3))
+        dbg = SimpleNamespace(transport=transport)
+        self.assertEqual(probe_counters(dbg)[:2], (3, 14))
+        self.assertEqual(probe_counters(SimpleNamespace(transport=FakeTransport())), (0, 0, 0.0))
+
+    def test_packet_stats(self):
+        model = ProbeModel('dwlink')
+        stats = PacketStats(SimpleNamespace(model=model))
+        self.assertEqual(stats.report(), "No packets recorded (enable with 'monitor stats enable')")
+        stats.enable()
+        for _ in range(3):
+            state = stats.begin()
+            model.read(4)
+            stats.end('m', state)
+        state = stats.begin()
+        model.command()
+        stats.end('vCont;c', state)
+        self.assertEqual(sorted(stats.packet_types()), ['m', 'vCont;c'])
+        summ = stats.summary('m')
+        self.assertEqual((summ['count'], summ['transactions'], summ['bytes']), (3, 3, 12))
+        self.assertAlmostEqual(summ['probe_time'], 3*(0.001 + 4*0.000242))
+        self.assertLessEqual(summ['p50'], summ['max'])
+        report = stats.report()
+        self.assertIn("(GDB)", report)
+        self.assertEqual(len(report.splitlines()), 4)
+        stats.enable(False)
+        self.assertTrue(stats.report().endswith("Recording is disabled"))
+        stats.reset()
+        self.assertEqual(stats.packet_types(), [])
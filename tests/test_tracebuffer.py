@@ -0,0 +1,69 @@
+"""
+The test suit for the trace ring buffer
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+from unittest import TestCase
+from pyavrocd.tracebuffer import TraceBuffer, packet_head, RSP_IN, STORE_CACHE, FLASH_PAGE, STEP, \
+     PAGE_ERASED, PAGE_PROGRAMMED
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class TestTraceBuffer(TestCase):
+
+    def setUp(self):
+        self.tb = TraceBuffer(4)
+
+    def test_empty(self):
+        self.assertEqual(len(self.tb), 0)
+        self.assertEqual(self.tb.records(), [])
+        self.assertEqual(self.tb.render(), [])
+
+    def test_record(self):
+        self.tb.record(STORE_CACHE, 0x100, 16, 0x110)
+        self.assertEqual(len(self.tb), 1)
+        rec = self.tb.records()[0]
+        self.assertEqual(rec[0], STORE_CACHE)
+        self.assertEqual(rec[2:], (0x100, 16, 0x110, 0))
+        self.assertTrue(self.tb.render()[0].endswith("store to cache: 0x100, 16 bytes, cache size 272"))
+
+    def test_wrap_around(self):
+        for i in range(10):
+            self.tb.record(STEP, i)
+        self.assertEqual(len(self.tb), 4)
+        self.assertEqual([rec[2] for rec in self.tb.records()], [6, 7, 8, 9])
+        self.assertEqual([rec[2] for rec in self.tb.records(2)], [8, 9])
+        self.assertEqual([rec[2] for rec in self.tb.records(100)], [6, 7, 8, 9])
+        stamps = [rec[1] for rec in self.tb.records()]
+        self.assertEqual(stamps, sorted(stamps))
+        self.tb.clear()
+        self.assertEqual(self.tb.records(), [])
+
+    def test_render(self):
+        self.tb = TraceBuffer()
+        self.tb.record(RSP_IN, 6, packet_head(b'm100,2'))
+        self.tb.record(RSP_IN, 10, packet_head(b'\xff'*10))
+        self.tb.record(RSP_IN, 13, packet_head(b'qSupported:x\xff'))
+        self.tb.record(FLASH_PAGE, 0x80, PAGE_ERASED|PAGE_PROGRAMMED, 0x1234, 0xFFFFFFFF)
+        self.tb.record(STEP, -1)
+        lines = self.tb.render()
+        self.assertTrue(lines[0].endswith("rsp in: 6 bytes b'm100,2'"))
+        self.assertTrue(lines[1].endswith("rsp in: 10 bytes b'\\xff\\xff\\xff\\xff\\xff\\xff\\xff'"))
+        self.assertTrue(lines[2].endswith("rsp in: 13 bytes b'qSuppor'"))
+        self.assertTrue(lines[3].endswith("flash page: 0x80 erased|programmed, crc new 0x00001234, crc old 0xFFFFFFFF"))
+        self.assertTrue(lines[4].endswith("single step: current pc"))
+        self.tb.record(99, 1, 2)
+        self.assertTrue(self.tb.render(1)[0].endswith("event 99: 1 2 0 0"))
+
+    def test_disabled(self):
+        self.tb.enabled = False
+        self.tb.record(STEP, 0x20)
+        self.assertEqual(len(self.tb), 0)
+        self.tb.enabled = True
+        self.tb.record(STEP, 0x20)
+        self.assertEqual(len(self.tb), 1)
+
+    def test_logging(self):
+        with self.assertLogs('pyavrocd.trace', level='DEBUG') as log:
+            self.tb.record(STEP, 0x20)
+        self.assertTrue(log.output[0].endswith("single step: pc 0x20"))
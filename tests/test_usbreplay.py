@@ -0,0 +1,100 @@
+"""
+The test suit for recording and replaying USB traffic
+"""
+#pylint: disable=protected-access,missing-function-docstring,consider-using-f-string,invalid-name,line-too-long,missing-class-docstring,too-many-public-methods
+import logging
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+from pyedbglib.protocols.jtagice3protocol import Jtagice3Protocol
+from pyavrocd.usbreplay import RecordingTransport, ReplayTransport, read_recording
+from pyavrocd.errors import ReplayError
+
+logging.basicConfig(level=logging.CRITICAL)
+
+class FakeTransport():
+    """
+    Answers AVR commands wrapped in CMSIS-DAP like a debugger: the response
+    to a JTAGICE3 command echoes the sequence number and returns the payload
+    plus one, and the first response poll after a command is 'not ready'.
+    """
+    def __init__(self):
+        self.device = SimpleNamespace(product_string="Fake-ICE", serial_number="42")
+        self.hid_device = object()
+        self._last = None
+        self._ready = False
+        self.transfers = 0
+
+    @staticmethod
+    def get_report_size():
+        return 64
+
+    def hid_transfer(self, data):
+        self.transfers += 1
+        if data[0] == 0x80:
+            self._last = data[4:4+(data[2] << 8 | data[3])]
+            self._ready = False
+            return bytearray([0x80, 0x01])
+        if data[0] == 0x81:
+            if not self._ready:
+                self._ready = True
+                return bytearray([0x81, 0x00, 0x00, 0x00])
+            payload = bytearray([0x0E, self._last[3], self._last[2], self._last[4]]) + \
+              bytearray(b + 1 for b in self._last[5:])
+            return bytearray([0x81, 0x11, 0x00, len(payload)]) + payload
+        return bytearray([0x82, 0x00, 0x00])
+
+class TestUsbReplay(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.usb')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def record(self, commands):
+        rec = RecordingTransport(FakeTransport(), self.path)
+        protocol = Jtagice3Protocol(rec, Jtagice3Protocol.HANDLER_AVR8_GENERIC)
+        protocol.AVR_RETRY_DELAY_MS = 1
+        responses = []
+        for cmd in commands:
+            responses.append(protocol.jtagice3_command_response(bytearray(cmd)))
+            protocol.poll_events()
+        rec.close()
+        self.assertEqual(rec.device.product_string, "Fake-ICE")
+        return responses
+
+    def test_file(self):
+        self.record([[1, 2]])
+        header, records = read_recording(self.path)
+        self.assertEqual(header, (64, "Fake-ICE", "42"))
+        # command, 'not ready', response, event poll
+        self.assertEqual(len(records), 4)
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        with self.assertRaises(ValueError):
+            read_recording(self.path)
+
+    def test_replay(self):
+        recorded = self.record([[1, 2], [3, 4], [5]])
+        replay = ReplayTransport(self.path)
+        protocol = Jtagice3Protocol(replay, Jtagice3Protocol.HANDLER_AVR8_GENERIC)
+        replayed = [protocol.jtagice3_command_response(bytearray(cmd)) for cmd in ([1, 2], [3, 4], [5])]
+        self.assertEqual(replayed, recorded)
+        # event polls without event and 'not ready' polls are not counted
+        self.assertEqual(replay.statistics(), { 'transactions': 6, 'skipped': 0, 'remaining': 0,
+                                                    'recorded_time': replay.recorded_time })
+        self.assertEqual(replay.get_report_size(), 64)
+
+    def test_replay_fewer_commands(self):
+        recorded = self.record([[1, 2], [3, 4], [5]])
+        replay = ReplayTransport(self.path)
+        protocol = Jtagice3Protocol(replay, Jtagice3Protocol.HANDLER_AVR8_GENERIC)
+        # the sequence numbers differ from the recording, but the responses are patched
+        self.assertEqual(protocol.jtagice3_command_response(bytearray([3, 4])), recorded[1])
+        self.assertEqual(protocol.poll_events(), None)
+        self.assertEqual(replay.skipped, 2)
+        with self.assertRaises(ReplayError):
+            protocol.jtagice3_command_response(bytearray([1, 2]))
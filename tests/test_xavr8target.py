@@ -8,7 +8,8 @@ from unittest import TestCase
 
 from pyedbglib.protocols.avr8protocol import Avr8Protocol
 
-from pyavrocd.xavr8target import XTinyAvrTarget
+from pyavrocd.xavr8target import XTinyAvrTarget, XTinyXAvrTarget, XMegaAvrJtagTarget, \
+     HWBP_DATA_READ, HWBP_DATA_WRITE, HWBP_DATA_ACCESS
 from pyavrocd.deviceinfo.devices.attiny85 import DEVICE_INFO
 
 logging.basicConfig(level=logging.ERROR)
@@ -19,6 +20,35 @@ class TestXAvr8Target(TestCase):
         self.xa = XTinyAvrTarget(MagicMock())
         self.xa.protocol = create_autospec(Avr8Protocol)
 
+    def test_hardware_watchpoint_set(self):
+        self.assertEqual(self.xa.hardware_watchpoint_set(1, 0x100, 1), 0)
+        self.xa.protocol.jtagice3_command_response.assert_not_called()
+
+    def test_hardware_watchpoint_set_jtag(self):
+        xa = XMegaAvrJtagTarget(MagicMock())
+        xa.protocol = create_autospec(Avr8Protocol)
+        for num, mode in ((1, HWBP_DATA_READ), (2, HWBP_DATA_WRITE), (3, HWBP_DATA_ACCESS)):
+            xa.hardware_watchpoint_set(num, 0x123, mode)
+            xa.protocol.jtagice3_command_response.assert_called_with(
+                bytearray([Avr8Protocol.CMD_AVR8_HW_BREAK_SET, Avr8Protocol.CMD_VERSION0, 2, num,
+                               0x23, 0x01, 0x00, 0x00, mode]))
+        xa.protocol.jtagice3_command_response.reset_mock()
+        self.assertEqual(xa.hardware_watchpoint_set(0, 0x123, HWBP_DATA_READ), 0)
+        self.assertEqual(xa.hardware_watchpoint_set(4, 0x123, HWBP_DATA_READ), 0)
+        xa.protocol.jtagice3_command_response.assert_not_called()
+
+    def test_hardware_watchpoint_set_updi(self):
+        xa = XTinyXAvrTarget(MagicMock())
+        xa.protocol = create_autospec(Avr8Protocol)
+        xa.hardware_watchpoint_set(1, 0x3F12, HWBP_DATA_WRITE)
+        xa.protocol.jtagice3_command_response.assert_called_once_with(
+            bytearray([Avr8Protocol.CMD_AVR8_HW_BREAK_SET, Avr8Protocol.CMD_VERSION0, 2, 1,
+                           0x12, 0x3F, 0x00, 0x00, HWBP_DATA_WRITE]))
+        xa.protocol.jtagice3_command_response.reset_mock()
+        self.assertEqual(xa.hardware_watchpoint_set(0, 0x3F12, HWBP_DATA_WRITE), 0)
+        self.assertEqual(xa.hardware_watchpoint_set(2, 0x3F12, HWBP_DATA_WRITE), 0)
+        xa.protocol.jtagice3_command_response.assert_not_called()
+
     def test_memtype_write_from_string(self):
         self.assertEqual(self.xa.memtype_write_from_string('flash'), Avr8Protocol.AVR8_MEMTYPE_FLASH_PAGE)
         self.assertEqual(self.xa.memtype_write_from_string('eeprom'), Avr8Protocol.AVR8_MEMTYPE_EEPROM)
@@ -140,3 +140,15 @@ class TestXAvrDebugger(TestCase):
         self.xa.device.avr.regfile_read.return_value=rfile
         self.assertEqual(self.xa.register_file_read(),rfile)
         self.xa.device.avr.regfile_read.assert_called_once()
+
+    def test_software_breakpoints_set(self):
+        self.xa.device.avr.protocol.jtagice3_command_response.return_value = bytearray([0x80, 0])
+        self.assertTrue(self.xa.software_breakpoints_set([0x100, 0x10004]))
+        self.xa.device.avr.protocol.jtagice3_command_response.assert_called_with(
+            bytearray([0x43, 0, 0x00, 0x01, 0, 0, 0x04, 0x00, 0x01, 0x00]))
+
+    def test_software_breakpoints_clear_fails(self):
+        self.xa.device.avr.protocol.check_response.side_effect = Exception("failed")
+        self.assertFalse(self.xa.software_breakpoints_clear([0x100]))
+        self.xa.device.avr.protocol.jtagice3_command_response.assert_called_with(
+            bytearray([0x44, 0, 0x00, 0x01, 0, 0]))